@@ -1,9 +1,11 @@
 from operator import ge
 import sqlite3
 import os
+import sys
 from pathlib import Path
-from typing import List, Dict, Union
+from typing import List, Dict, Tuple, Union
 import json
+import math
 import datetime
 import re 
 from EloSystem import WEAPON_ELO_MULTIPLIER, AIRCRAFT_ELO_MULTIPLIER
@@ -19,6 +21,33 @@ ELO_TYPE = {
     "BFM": "current_elo_BFM",
     "PVE": "current_elo_PVE",
 }
+# Elo 汇总桶，从粗到细：(bucket, 桶长度秒数)
+ELO_ROLLUP_BUCKETS = [
+    ("week", 7 * 24 * 3600),
+    ("day", 24 * 3600),
+]
+# replays.played_at 的格式（ezServer 用 UTC 时间生成，例如 20251115_203000）
+PLAYED_AT_FORMAT = "%Y%m%d_%H%M%S"
+
+
+def played_at_to_epoch(played_at: str) -> Union[int, None]:
+    """
+    把 replays.played_at 转成 UTC 时间戳，兼容 %Y%m%d_%H%M%S 和 ISO 格式（不带时区的按 UTC 处理）
+    :return: 秒级时间戳，无法解析时返回 None
+    """
+    if not played_at:
+        return None
+    try:
+        parsed = datetime.datetime.strptime(played_at, PLAYED_AT_FORMAT)
+    except ValueError:
+        try:
+            parsed = datetime.datetime.fromisoformat(played_at)
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return int(parsed.timestamp())
+
 class flightlogDB:
     def __init__(self, db_path: Union[Path, str] = DB_PATH):
         self.db_path = db_path
@@ -74,13 +103,14 @@ class flightlogDB:
             is_archived INTEGER NOT NULL DEFAULT 0
         );
 
-        -- 玩家历史昵称
+        -- 玩家历史昵称（每个昵称一行）
         CREATE TABLE IF NOT EXISTS player_names (
             id            INTEGER PRIMARY KEY AUTOINCREMENT,
             player_id     INTEGER NOT NULL,
             name          TEXT NOT NULL,
             first_seen_at TEXT,
             last_seen_at  TEXT,
+            name_casefold TEXT,                     -- name.casefold()，用于索引查找
             FOREIGN KEY (player_id) REFERENCES players(id)
         );
 
@@ -89,7 +119,9 @@ class flightlogDB:
             id          INTEGER PRIMARY KEY AUTOINCREMENT,
             file_name   TEXT NOT NULL,
             map_name    TEXT NOT NULL,
-            played_at   TEXT NOT NULL,              -- ISO 字符串，比如 2025-11-15T20:30:00
+            map_type    TEXT,                       -- BVR / BFM / PVE
+            played_at   TEXT NOT NULL,              -- ezServer 写入的 %Y%m%d_%H%M%S（UTC）
+            played_at_epoch INTEGER,                -- played_at 对应的 UTC 时间戳，用于按时间范围查询
             meta_blob   BLOB,                       -- 或者你之后改成 meta_path TEXT
             created_at  TEXT DEFAULT (datetime('now'))
         );
@@ -141,78 +173,709 @@ class flightlogDB:
             FOREIGN KEY (event_id) REFERENCES events(id),
             FOREIGN KEY (replay_id) REFERENCES replays(id)
         );
+
+        -- 玩家统计（按 map_type 汇总，每局结束时增量更新）
+        CREATE TABLE IF NOT EXISTS player_stats (
+            player_id   INTEGER NOT NULL,
+            map_type    TEXT NOT NULL,              -- BVR / BFM / PVE
+            kills       INTEGER NOT NULL DEFAULT 0,
+            deaths      INTEGER NOT NULL DEFAULT 0,
+            matches     INTEGER NOT NULL DEFAULT 0,
+            last_played TEXT,
+            best_elo    REAL,
+
+            PRIMARY KEY (player_id, map_type),
+            FOREIGN KEY (player_id) REFERENCES players(id)
+        );
+
+        -- 玩家武器击杀统计
+        CREATE TABLE IF NOT EXISTS player_weapon_stats (
+            player_id   INTEGER NOT NULL,
+            map_type    TEXT NOT NULL,
+            weapon      TEXT NOT NULL,
+            kills       INTEGER NOT NULL DEFAULT 0,
+
+            PRIMARY KEY (player_id, map_type, weapon),
+            FOREIGN KEY (player_id) REFERENCES players(id)
+        );
+
+        -- Elo 按天 / 按周汇总（K 线式：open/close/min/max），用于长时间范围的趋势图
+        CREATE TABLE IF NOT EXISTS player_elo_rollup (
+            player_id    INTEGER NOT NULL,
+            map_type     TEXT NOT NULL,
+            bucket       TEXT NOT NULL,             -- day / week
+            bucket_start TEXT NOT NULL,             -- YYYY-MM-DD（week 为当周周一，UTC）
+            open_elo     REAL NOT NULL,
+            close_elo    REAL NOT NULL,
+            min_elo      REAL NOT NULL,
+            max_elo      REAL NOT NULL,
+            kills        INTEGER NOT NULL DEFAULT 0,
+            deaths       INTEGER NOT NULL DEFAULT 0,
+            first_at     TEXT NOT NULL,             -- 桶内第一条/最后一条记录的时间，用于合并 open/close
+            last_at      TEXT NOT NULL,
+
+            PRIMARY KEY (player_id, map_type, bucket, bucket_start),
+            FOREIGN KEY (player_id) REFERENCES players(id)
+        );
+
+        -- 地图人气统计（按地图和一周中的小时汇总，由 MapSelector 每晚全量重建）
+        CREATE TABLE IF NOT EXISTS map_population_stats (
+            map_name     TEXT NOT NULL,             -- replays.map_name（FSM_MAPS 的 mapname）
+            hour_of_week INTEGER NOT NULL,          -- 0..167（周一 0 点 UTC 起算），-1 为该地图所有时段
+            matches      INTEGER NOT NULL,
+            avg_players  REAL NOT NULL,             -- 每局平均参战人数
+            retention    REAL NOT NULL,             -- 留到下一局的玩家比例
+            computed_at  INTEGER NOT NULL,          -- 统计时间（UTC 时间戳）
+
+            PRIMARY KEY (map_name, hour_of_week)
+        );
+
+        -- 元数据（key/value），generation 在每次写入比赛数据时 +1，供 Bot 判断缓存是否过期
+        CREATE TABLE IF NOT EXISTS db_meta (
+            key         TEXT PRIMARY KEY,
+            value       INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO db_meta (key, value) VALUES ('generation', 0);
         """
     )
+        self._migrate(cur)
+        cur.executescript(
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_player_names_player_name ON player_names(player_id, name);
+        CREATE INDEX IF NOT EXISTS idx_player_names_casefold ON player_names(name_casefold);
+        CREATE INDEX IF NOT EXISTS idx_players_elo_BVR ON players(current_elo_BVR);
+        CREATE INDEX IF NOT EXISTS idx_players_elo_BFM ON players(current_elo_BFM);
+        CREATE INDEX IF NOT EXISTS idx_players_elo_PVE ON players(current_elo_PVE);
+        CREATE INDEX IF NOT EXISTS idx_player_elo_history_player ON player_elo_history(player_id, at_time);
+        CREATE INDEX IF NOT EXISTS idx_player_elo_history_event ON player_elo_history(event_id, player_id);
+        CREATE INDEX IF NOT EXISTS idx_events_replay ON events(replay_id);
+        CREATE INDEX IF NOT EXISTS idx_player_events_event ON player_events(event_id, role);
+        DROP INDEX IF EXISTS idx_replays_map_type;
+        CREATE INDEX IF NOT EXISTS idx_replays_map_type_epoch ON replays(map_type, played_at_epoch);
+        CREATE INDEX IF NOT EXISTS idx_replays_played_at_epoch ON replays(played_at_epoch);
+        """
+    )
+        self.name_search_enabled = self._init_name_search(cur)
         conn.commit()
         conn.close()
 
+    def _bump_generation(self, cur):
+        """数据代数 +1，和本次写入放在同一个事务里提交"""
+        cur.execute("UPDATE db_meta SET value = value + 1 WHERE key = 'generation'")
+
+    def get_generation(self, conn: sqlite3.Connection = None) -> int:
+        """
+        读取当前数据代数（主键查询，开销很小）
+        :param conn: 可选，复用调用方的连接（例如 Bot 的只读连接）
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = self.get_conn()
+        try:
+            row = conn.execute("SELECT value FROM db_meta WHERE key = 'generation'").fetchone()
+            return row[0] if row else 0
+        finally:
+            if own_conn:
+                conn.close()
+
+    def _init_name_search(self, cur) -> bool:
+        """
+        创建玩家昵称 / Steam 名称的 FTS5 trigram 全文索引，并用触发器保持同步
+        rowid 规则：昵称 = player_names.id * 2，Steam 名称 = players.id * 2 + 1
+        SQLite 不支持 FTS5 trigram（< 3.34 或编译时没开 FTS5）时返回 False，搜索会退回到普通索引
+        """
+        existed = cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'player_name_search'"
+        ).fetchone() is not None
+        try:
+            cur.executescript(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS player_name_search USING fts5(
+                name,
+                player_id UNINDEXED,
+                source UNINDEXED,                   -- alias / steam
+                tokenize = 'trigram'
+            );
+
+            CREATE TRIGGER IF NOT EXISTS trg_player_names_search_ai AFTER INSERT ON player_names BEGIN
+                INSERT INTO player_name_search (rowid, name, player_id, source)
+                VALUES (new.id * 2, new.name, new.player_id, 'alias');
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_player_names_search_ad AFTER DELETE ON player_names BEGIN
+                DELETE FROM player_name_search WHERE rowid = old.id * 2;
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_players_search_ai AFTER INSERT ON players BEGIN
+                INSERT INTO player_name_search (rowid, name, player_id, source)
+                VALUES (new.id * 2 + 1, new.steam_name, new.id, 'steam');
+            END;
+            CREATE TRIGGER IF NOT EXISTS trg_players_search_au AFTER UPDATE OF steam_name ON players BEGIN
+                DELETE FROM player_name_search WHERE rowid = old.id * 2 + 1;
+                INSERT INTO player_name_search (rowid, name, player_id, source)
+                VALUES (new.id * 2 + 1, new.steam_name, new.id, 'steam');
+            END;
+            """
+            )
+        except sqlite3.OperationalError as e:
+            print(f"[WARNING] FTS5 trigram index unavailable, falling back to plain name index: {e}")
+            return False
+
+        if not existed:
+            # 第一次建索引：把已有数据灌进去
+            cur.execute(
+                """
+                INSERT INTO player_name_search (rowid, name, player_id, source)
+                SELECT id * 2, name, player_id, 'alias' FROM player_names
+                """
+            )
+            cur.execute(
+                """
+                INSERT INTO player_name_search (rowid, name, player_id, source)
+                SELECT id * 2 + 1, steam_name, id, 'steam' FROM players
+                """
+            )
+        return True
+
+    def _table_columns(self, cur, table: str) -> List[str]:
+        return [row[1] for row in cur.execute(f"PRAGMA table_info({table})").fetchall()]
+
+    def _migrate(self, cur):
+        """
+        按 PRAGMA user_version 依次执行迁移，已经执行过的不会重复执行
+        """
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        migrations = [
+            self._migrate_player_names_to_rows,
+            self._rebuild_player_stats,
+            self._rebuild_elo_rollups,
+            self._backfill_replay_map_type,
+            self._backfill_played_at_epoch,
+        ]
+        for target, migration in enumerate(migrations, 1):
+            if version >= target:
+                continue
+            if DEBUG: print(f"[DEBUG] Running migration {target}: {migration.__name__}")
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {target}")
+
+    def _migrate_player_names_to_rows(self, cur):
+        """
+        迁移 1：player_names.name 以前存的是 JSON 数组（每个玩家一行），
+        拆成每个昵称一行，并补上 name_casefold / first_seen_at / last_seen_at
+        """
+        if "name_casefold" not in self._table_columns(cur, "player_names"):
+            cur.execute("ALTER TABLE player_names ADD COLUMN name_casefold TEXT")
+
+        rows = cur.execute(
+            """
+            SELECT pn.player_id, pn.name, pn.first_seen_at, pn.last_seen_at, p.created_at
+            FROM player_names pn
+            LEFT JOIN players p ON p.id = pn.player_id
+            ORDER BY pn.id
+            """
+        ).fetchall()
+
+        # key = (player_id, name), value = [first_seen_at, last_seen_at]
+        aliases: Dict[tuple, list] = {}
+        for player_id, raw_name, first_seen, last_seen, created_at in rows:
+            try:
+                names = json.loads(raw_name)
+            except (TypeError, ValueError):
+                names = raw_name
+            if not isinstance(names, list):
+                names = [raw_name]
+            first_seen = first_seen or created_at
+            last_seen = last_seen or first_seen
+            for name in names:
+                name = str(name)
+                if not name:
+                    continue
+                seen = aliases.setdefault((player_id, name), [first_seen, last_seen])
+                if first_seen and (seen[0] is None or first_seen < seen[0]):
+                    seen[0] = first_seen
+                if last_seen and (seen[1] is None or last_seen > seen[1]):
+                    seen[1] = last_seen
+
+        cur.execute("DELETE FROM player_names")
+        cur.executemany(
+            """
+            INSERT INTO player_names (player_id, name, name_casefold, first_seen_at, last_seen_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [
+                (player_id, name, name.casefold(), first_seen, last_seen)
+                for (player_id, name), (first_seen, last_seen) in aliases.items()
+            ]
+        )
+        print(f"[Database] Migrated player_names: {len(rows)} rows -> {len(aliases)} aliases")
+
+    def _backfill_replay_map_type(self, cur):
+        """
+        迁移 4：replays 增加 map_type 列，旧数据按该局事件的 event_type 前缀回填（BVR_KILL -> BVR）
+        """
+        if "map_type" not in self._table_columns(cur, "replays"):
+            cur.execute("ALTER TABLE replays ADD COLUMN map_type TEXT")
+        cur.execute(
+            """
+            UPDATE replays SET map_type = (
+                SELECT substr(e.event_type, 1, instr(e.event_type, '_') - 1)
+                FROM events e
+                WHERE e.replay_id = replays.id AND instr(e.event_type, '_') > 1
+                LIMIT 1
+            )
+            WHERE map_type IS NULL
+            """
+        )
+        print(f"[Database] Backfilled replays.map_type: {cur.rowcount} rows")
+
+    def _backfill_played_at_epoch(self, cur):
+        """
+        迁移 5：replays 增加 played_at_epoch 列，由 played_at 文本解析回填
+        played_at 是 %Y%m%d_%H%M%S，和其他地方的 ISO 时间不能直接比较，按时间范围查询统一用这一列
+        """
+        if "played_at_epoch" not in self._table_columns(cur, "replays"):
+            cur.execute("ALTER TABLE replays ADD COLUMN played_at_epoch INTEGER")
+        rows = cur.execute("SELECT id, played_at FROM replays WHERE played_at_epoch IS NULL").fetchall()
+        updates = [(played_at_to_epoch(played_at), replay_id) for replay_id, played_at in rows]
+        cur.executemany("UPDATE replays SET played_at_epoch = ? WHERE id = ?", updates)
+        failed = sum(1 for epoch, _ in updates if epoch is None)
+        print(f"[Database] Backfilled replays.played_at_epoch: {len(updates) - failed} rows ({failed} unparsable)")
+
     def get_player_by_steam_id(self, steam_id: str, steam_name: str, playername: str) -> Union[dict, None]:
         conn = self.get_conn()
         conn.row_factory = sqlite3.Row  # dict-like row
         cur = conn.cursor()
+        try:
+            result, changed = self._upsert_player(cur, steam_id, steam_name, playername)
+            # 老玩家用老昵称重新进服不影响任何统计结果，不必让 Bot 的缓存失效
+            if changed:
+                self._bump_generation(cur)
+            conn.commit()
+            return result
+        finally:
+            conn.close()
 
-        # check if player exists
+    def _upsert_player(self, cur, steam_id: str, steam_name: str, playername: str) -> Tuple[dict, bool]:
+        """
+        在给定的 cursor 上查找/创建玩家，并记录本次使用的昵称
+        调用方负责 commit，这样可以和其他写操作放在同一个事务里
+        :return: (玩家信息 + name_history（按首次出现时间排序）, 是否新建了玩家或记录了新昵称)
+        """
         cur.execute("SELECT * FROM players WHERE steam_id = ?", (steam_id,))
         row = cur.fetchone()
+        changed = row is None
 
-        # if player exists, return player info
-        if row is not None:
-            player_id = row["id"]
+        # if player does not exist, create new player
+        if row is None:
+            cur.execute(
+                "INSERT INTO players (steam_id, steam_name) VALUES (?, ?)",
+                (steam_id, steam_name)
+            )
+            cur.execute("SELECT * FROM players WHERE steam_id = ?", (steam_id,))
+            row = cur.fetchone()
+        player_id = row["id"]
 
-            # get player_names
-            name_row = cur.execute(
-                "SELECT * FROM player_names WHERE player_id = ?",
-                (player_id,)
-            ).fetchone()
+        # upsert alias: new name -> new row, known name -> only bump last_seen_at
+        if playername:
+            if not changed:
+                changed = cur.execute(
+                    "SELECT 1 FROM player_names WHERE player_id = ? AND name = ?", (player_id, playername)
+                ).fetchone() is None
+            cur.execute(
+                """
+                INSERT INTO player_names (player_id, name, name_casefold, first_seen_at, last_seen_at)
+                VALUES (?, ?, ?, datetime('now'), datetime('now'))
+                ON CONFLICT(player_id, name) DO UPDATE SET last_seen_at = excluded.last_seen_at
+                """,
+                (player_id, playername, playername.casefold())
+            )
 
-            if name_row:
-                name_list = json.loads(name_row["name"])
-            else:
-                # create new record
-                name_list = []
+        name_rows = cur.execute(
+            "SELECT name FROM player_names WHERE player_id = ? ORDER BY first_seen_at, id",
+            (player_id,)
+        ).fetchall()
 
-            # if new name is not in the list, add it
-            if playername not in name_list:
-                name_list.append(playername)
-                cur.execute(
-                    "UPDATE player_names SET name = ? WHERE player_id = ?",
-                    (json.dumps(name_list), player_id)
-                )
-                conn.commit()
+        # return player info + history names
+        result = dict(row)
+        result["name_history"] = [name_row[0] for name_row in name_rows]
+        return result, changed
 
-            # return player info + history names
-            result = dict(row)
-            result["name_history"] = name_list
 
+    def rebuild_player_stats(self):
+        """
+        从 events / player_events / player_elo_history 全量重建 player_stats 和 player_weapon_stats
+        平时由 save_global_event_history 增量维护，这个用于回填或修复
+        """
+        conn = self.get_conn()
+        cur = conn.cursor()
+        try:
+            self._rebuild_player_stats(cur)
+            self._bump_generation(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
             conn.close()
-            return result
 
-        # if player does not exist, create new player
+    def _rebuild_player_stats(self, cur):
+        # map_type 取自 event_type 的前缀，例如 BVR_KILL -> BVR
+        map_type_expr = "substr(e.event_type, 1, instr(e.event_type, '_') - 1)"
+        cur.execute("DELETE FROM player_stats")
+        cur.execute("DELETE FROM player_weapon_stats")
         cur.execute(
-            "INSERT INTO players (steam_id, steam_name) VALUES (?, ?)",
-            (steam_id, steam_name)
+            f"""
+            INSERT INTO player_stats (player_id, map_type, kills, deaths, matches, last_played, best_elo)
+            SELECT
+                pe.player_id,
+                {map_type_expr} AS map_type,
+                SUM(pe.role = 'killer'),
+                SUM(pe.role = 'victim'),
+                COUNT(DISTINCT e.replay_id),
+                MAX(r.played_at),
+                MAX(MAX(eh.elo_after), COALESCE(MAX(eh.elo_before), MAX(eh.elo_after)))
+            FROM player_events pe
+            JOIN events e ON e.id = pe.event_id
+            JOIN replays r ON r.id = e.replay_id
+            LEFT JOIN player_elo_history eh ON eh.event_id = e.id AND eh.player_id = pe.player_id
+            WHERE instr(e.event_type, '_') > 0
+            GROUP BY pe.player_id, map_type
+            """
         )
-        conn.commit()
+        cur.execute(
+            f"""
+            INSERT INTO player_weapon_stats (player_id, map_type, weapon, kills)
+            SELECT pe.player_id, {map_type_expr} AS map_type, e.weapon, COUNT(*)
+            FROM player_events pe
+            JOIN events e ON e.id = pe.event_id
+            WHERE pe.role = 'killer' AND e.weapon IS NOT NULL AND e.weapon != ''
+              AND instr(e.event_type, '_') > 0
+            GROUP BY pe.player_id, map_type, e.weapon
+            """
+        )
+        print(f"[Database] Rebuilt player_stats: {cur.execute('SELECT COUNT(*) FROM player_stats').fetchone()[0]} rows")
 
-        # get new player
-        cur.execute("SELECT * FROM players WHERE steam_id = ?", (steam_id,))
-        new_row = cur.fetchone()
-        player_id = new_row["id"]
+    def _apply_match_stats(self, cur, map_type: str, played_at: str, match_stats: dict):
+        """
+        把一局的统计增量写进 player_stats / player_weapon_stats（调用方负责事务）
+        :param match_stats: key = player_id, value = {"kills", "deaths", "best_elo", "weapons": {weapon: kills}}
+        """
+        cur.executemany(
+            """
+            INSERT INTO player_stats (player_id, map_type, kills, deaths, matches, last_played, best_elo)
+            VALUES (?, ?, ?, ?, 1, ?, ?)
+            ON CONFLICT(player_id, map_type) DO UPDATE SET
+                kills       = kills + excluded.kills,
+                deaths      = deaths + excluded.deaths,
+                matches     = matches + 1,
+                last_played = MAX(COALESCE(last_played, ''), excluded.last_played),
+                best_elo    = MAX(COALESCE(best_elo, excluded.best_elo), excluded.best_elo)
+            """,
+            [
+                (pid, map_type, stats["kills"], stats["deaths"], played_at, stats["best_elo"])
+                for pid, stats in match_stats.items()
+            ]
+        )
+        cur.executemany(
+            """
+            INSERT INTO player_weapon_stats (player_id, map_type, weapon, kills)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(player_id, map_type, weapon) DO UPDATE SET kills = kills + excluded.kills
+            """,
+            [
+                (pid, map_type, weapon, kills)
+                for pid, stats in match_stats.items()
+                for weapon, kills in stats["weapons"].items()
+            ]
+        )
 
-        # initialize name history
-        name_list = [playername]
-        cur.execute(
-            "INSERT INTO player_names (player_id, name) VALUES (?, ?)",
-            (player_id, json.dumps(name_list))
+    def rebuild_elo_rollups(self):
+        """从 player_elo_history 全量重建 player_elo_rollup（回填或修复用）"""
+        conn = self.get_conn()
+        cur = conn.cursor()
+        try:
+            self._rebuild_elo_rollups(cur)
+            self._bump_generation(cur)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _rebuild_elo_rollups(self, cur):
+        cur.execute("DELETE FROM player_elo_rollup")
+        points = cur.execute(
+            """
+            SELECT
+                eh.player_id,
+                substr(e.event_type, 1, instr(e.event_type, '_') - 1) AS map_type,
+                eh.at_time,
+                eh.elo_before,
+                eh.elo_after,
+                (SELECT pe.role FROM player_events pe
+                 WHERE pe.event_id = eh.event_id AND pe.player_id = eh.player_id
+                 LIMIT 1) AS role
+            FROM player_elo_history eh
+            JOIN events e ON e.id = eh.event_id
+            WHERE instr(e.event_type, '_') > 0
+            ORDER BY eh.at_time, eh.id
+            """
+        ).fetchall()
+        self._apply_elo_rollups(cur, points)
+        print(f"[Database] Rebuilt player_elo_rollup: {cur.execute('SELECT COUNT(*) FROM player_elo_rollup').fetchone()[0]} rows")
+
+    def _apply_elo_rollups(self, cur, points: list):
+        """
+        把一批 Elo 变化合并进 player_elo_rollup（调用方负责事务）
+        :param points: [(player_id, map_type, at_time, elo_before, elo_after, role), ...]，按时间排序
+        """
+        rollups: Dict[tuple, dict] = {}
+        for player_id, map_type, at_time, elo_before, elo_after, role in points:
+            try:
+                day = datetime.date.fromisoformat(str(at_time)[:10])
+            except ValueError:
+                if DEBUG: print(f"[DEBUG] Skip Elo point with bad time: {at_time}")
+                continue
+            open_elo = elo_after if elo_before is None else elo_before
+            for bucket in ("day", "week"):
+                key = (player_id, map_type, bucket, self.elo_bucket_start(day, bucket).isoformat())
+                rollup = rollups.get(key)
+                if rollup is None:
+                    rollup = rollups[key] = {
+                        "open": open_elo, "close": elo_after,
+                        "min": min(open_elo, elo_after), "max": max(open_elo, elo_after),
+                        "kills": 0, "deaths": 0, "first_at": at_time, "last_at": at_time,
+                    }
+                else:
+                    rollup["close"] = elo_after
+                    rollup["last_at"] = at_time
+                    rollup["min"] = min(rollup["min"], open_elo, elo_after)
+                    rollup["max"] = max(rollup["max"], open_elo, elo_after)
+                if role == "killer":
+                    rollup["kills"] += 1
+                elif role == "victim":
+                    rollup["deaths"] += 1
+
+        cur.executemany(
+            """
+            INSERT INTO player_elo_rollup
+            (player_id, map_type, bucket, bucket_start, open_elo, close_elo, min_elo, max_elo,
+             kills, deaths, first_at, last_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(player_id, map_type, bucket, bucket_start) DO UPDATE SET
+                open_elo  = CASE WHEN excluded.first_at < first_at THEN excluded.open_elo ELSE open_elo END,
+                first_at  = MIN(first_at, excluded.first_at),
+                close_elo = CASE WHEN excluded.last_at >= last_at THEN excluded.close_elo ELSE close_elo END,
+                last_at   = MAX(last_at, excluded.last_at),
+                min_elo   = MIN(min_elo, excluded.min_elo),
+                max_elo   = MAX(max_elo, excluded.max_elo),
+                kills     = kills + excluded.kills,
+                deaths    = deaths + excluded.deaths
+            """,
+            [
+                (*key, r["open"], r["close"], r["min"], r["max"], r["kills"], r["deaths"], r["first_at"], r["last_at"])
+                for key, r in rollups.items()
+            ]
         )
-        conn.commit()
 
-        result = dict(new_row)
-        result["name_history"] = name_list
+    @staticmethod
+    def elo_bucket_start(day: datetime.date, bucket: str) -> datetime.date:
+        """日期所在汇总桶的起始日（week 为当周周一）"""
+        if bucket == "week":
+            return day - datetime.timedelta(days=day.weekday())
+        return day
 
-        conn.close()
-        return result
+    @staticmethod
+    def pick_elo_bucket(resolution_seconds: Union[int, float, None]) -> Union[str, None]:
+        """
+        选出不比 resolution 更粗的最粗汇总桶
+        :return: "week" / "day"，如果要求的精度小于一天则返回 None（直接读原始记录）
+        """
+        if resolution_seconds is None:
+            return ELO_ROLLUP_BUCKETS[-1][0]
+        for bucket, seconds in ELO_ROLLUP_BUCKETS:
+            if resolution_seconds >= seconds:
+                return bucket
+        return None
+
+    def get_elo_trend(self, player_id: int, map_type: str, start: str = None, end: str = None,
+                      resolution_seconds: Union[int, float, None] = None, max_points: int = 200) -> List[dict]:
+        """
+        获取玩家的 Elo 趋势，自动选择能满足精度要求的最粗的数据源
+        :param player_id: 玩家ID
+        :param map_type: BVR / BFM / PVE
+        :param start: 起始时间（含），'YYYY-MM-DD[ HH:MM:SS]'，None 表示不限
+        :param end: 结束时间（不含），格式同上
+        :param resolution_seconds: 需要的时间精度（秒）；None 时按 start/end 跨度和 max_points 推算
+        :param max_points: 推算精度时希望的最大点数
+        :return: [{bucket_start, open_elo, close_elo, min_elo, max_elo, kills, deaths}, ...]，按时间升序
+        """
+        if resolution_seconds is None and start and end:
+            span = (
+                datetime.datetime.fromisoformat(end) - datetime.datetime.fromisoformat(start)
+            ).total_seconds()
+            resolution_seconds = span / max(max_points, 1)
+        bucket = self.pick_elo_bucket(resolution_seconds)
+
+        conn = self.get_conn()
+        conn.row_factory = sqlite3.Row
+        try:
+            if bucket is None:
+                # 精度要求小于一天：读原始记录
+                time_col = "eh.at_time"
+                sql = """
+                    SELECT
+                        eh.at_time AS bucket_start,
+                        COALESCE(eh.elo_before, eh.elo_after) AS open_elo,
+                        eh.elo_after AS close_elo,
+                        MIN(COALESCE(eh.elo_before, eh.elo_after), eh.elo_after) AS min_elo,
+                        MAX(COALESCE(eh.elo_before, eh.elo_after), eh.elo_after) AS max_elo,
+                        EXISTS (SELECT 1 FROM player_events pe WHERE pe.event_id = eh.event_id
+                                AND pe.player_id = eh.player_id AND pe.role = 'killer') AS kills,
+                        EXISTS (SELECT 1 FROM player_events pe WHERE pe.event_id = eh.event_id
+                                AND pe.player_id = eh.player_id AND pe.role = 'victim') AS deaths
+                    FROM player_elo_history eh
+                    JOIN events e ON e.id = eh.event_id
+                    WHERE eh.player_id = ? AND e.event_type = ? || '_KILL'
+                """
+                params: list = [player_id, map_type]
+            else:
+                time_col = "bucket_start"
+                sql = """
+                    SELECT bucket_start, open_elo, close_elo, min_elo, max_elo, kills, deaths
+                    FROM player_elo_rollup
+                    WHERE player_id = ? AND map_type = ? AND bucket = ?
+                """
+                params = [player_id, map_type, bucket]
+            if bucket:
+                # 汇总桶按起始日比较：start 向下取整到桶的起始日（第一个不完整的桶也要），
+                # end 之前只要还有时间落在某一天里，这一天的桶就要
+                if start:
+                    start_day = datetime.datetime.fromisoformat(start).date()
+                    start = self.elo_bucket_start(start_day, bucket).isoformat()
+                if end:
+                    end_time = datetime.datetime.fromisoformat(end)
+                    end_day = end_time.date()
+                    if end_time.time() != datetime.time():
+                        end_day += datetime.timedelta(days=1)
+                    end = end_day.isoformat()
+            if start:
+                sql += f" AND {time_col} >= ?"
+                params.append(start)
+            if end:
+                sql += f" AND {time_col} < ?"
+                params.append(end)
+            sql += f" ORDER BY {time_col}"
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+        finally:
+            conn.close()
+
+    def search_players(self, query: str, limit: int = 10, conn: sqlite3.Connection = None) -> List[dict]:
+        """
+        按昵称 / Steam 名称搜索玩家，结果按 完全匹配 > 前缀匹配 > trigram 相似度 > 最近出现时间 排序
+        每个玩家只返回一条（取匹配度最高的名字）
+        :param query: 搜索关键字（忽略大小写）
+        :param limit: 最多返回的玩家数
+        :param conn: 复用已有连接（例如 bot 的只读连接池），None 时自己开一个
+        :return: [{player_id, steam_id, steam_name, matched_name, match, last_seen_at}, ...]
+        """
+        folded = query.strip().casefold()
+        if not folded:
+            return []
+
+        own_conn = conn is None
+        if own_conn:
+            conn = self.get_conn()
+        cur = conn.cursor()
+        try:
+            # key = player_id, value = (tier, fts_rank, matched_name)
+            best: Dict[int, tuple] = {}
+
+            def offer(player_id: int, name: str, fts_rank: float = 0.0):
+                name_folded = name.casefold()
+                if name_folded == folded:
+                    tier = 0
+                elif name_folded.startswith(folded):
+                    tier = 1
+                else:
+                    tier = 2
+                candidate = (tier, fts_rank, name)
+                if player_id not in best or candidate < best[player_id]:
+                    best[player_id] = candidate
+
+            # 完全匹配 + 前缀匹配：走 idx_player_names_casefold 的范围查询
+            for player_id, name in cur.execute(
+                """
+                SELECT player_id, name FROM player_names
+                WHERE name_casefold >= ? AND name_casefold < ?
+                LIMIT 200
+                """,
+                (folded, folded + "\U0010ffff")
+            ):
+                offer(player_id, name)
+
+            if self.name_search_enabled and len(folded) >= 3:
+                # trigram 子串匹配，rank 为 bm25（越小越相关）
+                fts_query = '"' + folded.replace('"', '""') + '"'
+                for player_id, name, rank in cur.execute(
+                    """
+                    SELECT player_id, name, rank FROM player_name_search
+                    WHERE player_name_search MATCH ?
+                    ORDER BY rank
+                    LIMIT 200
+                    """,
+                    (fts_query,)
+                ):
+                    offer(player_id, name, rank)
+            elif len(best) < limit:
+                # 短关键字（trigram 至少要 3 个字符）或没有 FTS5：退回子串扫描
+                for player_id, name in cur.execute(
+                    "SELECT player_id, name FROM player_names WHERE name_casefold LIKE ? LIMIT 200",
+                    (f"%{folded}%",)
+                ):
+                    offer(player_id, name)
+                for player_id, name in cur.execute(
+                    "SELECT id, steam_name FROM players WHERE steam_name LIKE ? LIMIT 200",
+                    (f"%{folded}%",)
+                ):
+                    offer(player_id, name)
+
+            if not best:
+                return []
 
+            placeholders = ",".join("?" * len(best))
+            players = {
+                row[0]: row[1:]
+                for row in cur.execute(
+                    f"""
+                    SELECT p.id, p.steam_id, p.steam_name,
+                           (SELECT MAX(pn.last_seen_at) FROM player_names pn WHERE pn.player_id = p.id)
+                    FROM players p
+                    WHERE p.id IN ({placeholders})
+                    """,
+                    list(best)
+                )
+            }
+
+            results = [
+                {
+                    "player_id": player_id,
+                    "steam_id": players[player_id][0],
+                    "steam_name": players[player_id][1],
+                    "matched_name": name,
+                    "match": ("exact", "prefix", "fuzzy")[tier],
+                    "last_seen_at": players[player_id][2],
+                }
+                for player_id, (tier, fts_rank, name) in best.items()
+                if player_id in players
+            ]
+            # 先按最近出现时间排，再用稳定排序按匹配度排
+            results.sort(key=lambda r: r["last_seen_at"] or "", reverse=True)
+            results.sort(key=lambda r: best[r["player_id"]][:2])
+            return results[:limit]
+        finally:
+            if own_conn:
+                conn.close()
 
     def player_join(self, steam_id: str, steam_name: str,playername: str) -> dict:
         #Add more things here if needed
@@ -230,6 +893,7 @@ class flightlogDB:
         try:
             if DEBUG: print(f"[DEBUG] Saving global event history: {global_event} \n\treplay_info: {replay_info} \n\tflightlog: {flightlog}")
             conn = self.get_conn()
+            conn.row_factory = sqlite3.Row
             cur = conn.cursor()
             elo_type = ELO_TYPE.get(replay_info.get("map_type"), "Unknown")
             if elo_type == "Unknown":
@@ -238,6 +902,21 @@ class flightlogDB:
             
             # ====== 本局 Elo 缓存：key = player_id, value = 当前这局内的 Elo ======
             current_elo_cache: dict = {}
+            # ====== 本局统计：key = player_id，结束时增量写入 player_stats ======
+            match_stats: dict = {}
+            # ====== 本局 Elo 变化点，结束时合并进 player_elo_rollup ======
+            elo_points: list = []
+
+            def get_match_stats(pid: int) -> dict:
+                if pid not in match_stats:
+                    match_stats[pid] = {"kills": 0, "deaths": 0, "best_elo": None, "weapons": {}}
+                return match_stats[pid]
+
+            def track_elo(pid: int, *elos: float):
+                stats = get_match_stats(pid)
+                for elo in elos:
+                    if elo is not None and (stats["best_elo"] is None or elo > stats["best_elo"]):
+                        stats["best_elo"] = elo
             
             # 工具函数：在"这一局"里获取玩家的 elo_before
             def get_elo_before_in_match(player: dict) -> float:
@@ -258,13 +937,15 @@ class flightlogDB:
             # 先存储replay信息
             cur.execute(
                 """
-                INSERT INTO replays (file_name, map_name, played_at, meta_blob) 
-                VALUES (?, ?, ?, ?)
+                INSERT INTO replays (file_name, map_name, map_type, played_at, played_at_epoch, meta_blob) 
+                VALUES (?, ?, ?, ?, ?, ?)
                 """,
                 (
                     replay_info.get("file_name", ""),
                     replay_info.get("map_name", ""),
+                    replay_info.get("map_type"),
                     replay_info.get("played_at", ""),
+                    played_at_to_epoch(replay_info.get("played_at", "")),
                     replay_info.get("meta_blob", "")
                 )
             )
@@ -297,7 +978,8 @@ class flightlogDB:
                 
                 # 处理 player_events - killer
                 if event.get("killer_id"):
-                    killer_player = self.get_player_by_steam_id(
+                    killer_player, _ = self._upsert_player(
+                        cur,
                         event.get("killer_id", ""),
                         event.get("killer_name", ""),
                         event.get("killer_name", "")
@@ -310,10 +992,16 @@ class flightlogDB:
                             """,
                             (killer_player["id"], event_id, "killer")
                         )
+                        killer_stats = get_match_stats(killer_player["id"])
+                        killer_stats["kills"] += 1
+                        weapon = event.get("weapon", "")
+                        if weapon:
+                            killer_stats["weapons"][weapon] = killer_stats["weapons"].get(weapon, 0) + 1
                 
                 # 处理 player_events - victim
                 if event.get("victim_id"):
-                    victim_player = self.get_player_by_steam_id(
+                    victim_player, _ = self._upsert_player(
+                        cur,
                         event.get("victim_id", ""),
                         event.get("victim_name", ""),
                         event.get("victim_name", "")
@@ -326,6 +1014,7 @@ class flightlogDB:
                             """,
                             (victim_player["id"], event_id, "victim")
                         )
+                        get_match_stats(victim_player["id"])["deaths"] += 1
                 
                 # 插入 event_details
                 cur.execute(
@@ -356,6 +1045,8 @@ class flightlogDB:
                     
                     # 更新本局 Elo：下次这个玩家出现时，用这次的 elo_after
                     current_elo_cache[pid] = elo_after
+                    track_elo(pid, elo_before, elo_after)
+                    elo_points.append((pid, replay_info.get("map_type"), event.get("datetime", ""), elo_before, elo_after, "killer"))
                 
                 # 处理 player_elo_history - victim
                 if event.get("victim_id") and victim_player:
@@ -374,6 +1065,18 @@ class flightlogDB:
                     
                     # 更新本局 Elo
                     current_elo_cache[pid] = elo_after
+                    track_elo(pid, elo_before, elo_after)
+                    elo_points.append((pid, replay_info.get("map_type"), event.get("datetime", ""), elo_before, elo_after, "victim"))
+            
+            # 同一个事务里更新 player_stats
+            self._apply_match_stats(
+                cur,
+                replay_info.get("map_type"),
+                replay_info.get("played_at", ""),
+                match_stats
+            )
+            self._apply_elo_rollups(cur, elo_points)
+            self._bump_generation(cur)
             
             conn.commit()
             conn.close()
@@ -393,53 +1096,117 @@ class flightlogDB:
         kill_type = "General"
         return kill_type
 
-    def update_player_elo(self, online_players: list, map_type:str):
+    def update_player_elo(self, online_players: list, map_type:str) -> dict:
         """
         Update player Elo based on the online players list
+        All players are read in one query, validated together and written with a single
+        compare-and-swap executemany in one transaction: either every player is applied or none.
         :param online_players: list of online players
         :param map_type: string of map type (BVR, BFM, PVE)
+        :return: {"success": bool, "players": [{steam_id, playername, status, in_game_elo, db_elo, delta, new_elo}, ...]}
+                 status: updated / unchanged / mismatch / missing / conflict
         """
-        conn = self.get_conn()
-        cur = conn.cursor()
         elo_type = ELO_TYPE.get(map_type)
+        if elo_type is None:
+            raise ValueError(f"Unknown map type: {map_type}")
+
+        results = []
         for player in online_players:
-            steam_id = player.get("steam_id")
-            player_name = player.get("playername")
-            player_elo = player.get("in_game_elo")
-            player_elo_history = sum(player.get("ingame_elo_history"))
-            if DEBUG: print(f"[DEBUG] Player {player_name} (ID: {steam_id}) Elo: {player_elo} + {player_elo_history}")
+            results.append({
+                "steam_id": str(player.get("steam_id")),
+                "playername": player.get("playername"),
+                "status": None,
+                "in_game_elo": player.get("in_game_elo"),
+                "db_elo": None,
+                "delta": sum(player.get("ingame_elo_history") or []),
+                "new_elo": None,
+            })
+        if not results:
+            return {"success": True, "players": results}
+
+        conn = self.get_conn()
+        cur = conn.cursor()
+        try:
+            # 写锁在读之前拿到，保证读到的值在本事务内不会被别人改掉
+            cur.execute("BEGIN IMMEDIATE")
+            placeholders = ",".join("?" * len(results))
             cur.execute(
-                f"""
-                SELECT {elo_type} FROM players WHERE steam_id = ?
-                """,
-                (steam_id,)
+                f"SELECT steam_id, {elo_type} FROM players WHERE steam_id IN ({placeholders})",
+                [r["steam_id"] for r in results]
             )
-            db_elo = cur.fetchone()
-            if db_elo[0] != player_elo: #god damn type diff......
-                print(f"[ERROR] Player {player_name} (ID: {steam_id}) Elo is not correct: {player_elo} != {db_elo[0]}")
-                print("[Database] Database contains wrong Elo value")
+            db_elos = {str(steam_id): elo for steam_id, elo in cur.fetchall()}
+
+            updates = []
+            for r in results:
+                if DEBUG: print(f"[DEBUG] Player {r['playername']} (ID: {r['steam_id']}) Elo: {r['in_game_elo']} + {r['delta']}")
+                if r["steam_id"] not in db_elos:
+                    r["status"] = "missing"
+                    continue
+                r["db_elo"] = db_elos[r["steam_id"]]
+                if r["in_game_elo"] is None or not math.isclose(r["db_elo"], r["in_game_elo"], abs_tol=1e-6):
+                    r["status"] = "mismatch"
+                    continue
+                r["new_elo"] = r["db_elo"] + r["delta"]
+                if r["delta"] == 0:
+                    r["status"] = "unchanged"
+                    continue
+                r["status"] = "updated"
+                # compare-and-swap：只有库里仍是读到的旧值时才更新
+                updates.append((r["new_elo"], r["steam_id"], r["db_elo"]))
+
+            failed = [r for r in results if r["status"] in ("missing", "mismatch")]
+            if failed:
+                for r in failed:
+                    print(f"[ERROR] Player {r['playername']} (ID: {r['steam_id']}) Elo is not correct: "
+                          f"{r['in_game_elo']} != {r['db_elo']} ({r['status']})")
+                print("[Database] Database contains wrong Elo value, no player Elo was updated")
                 conn.rollback()
-                conn.close()
-                raise ValueError(f"Player {player_name} (ID: {steam_id}) Elo is not correct: {player_elo} != {db_elo[0]}")
-            else:
-                cur.execute(
-                    f"""
-                    UPDATE players SET {elo_type} = ? WHERE steam_id = ?
-                    """,
-                    (player_elo_history + db_elo[0], steam_id)
-                )
-                conn.commit()
-                print(f"[Database] Player {player_name} (ID: {steam_id}) Elo updated to {player_elo_history + db_elo}")
-        
-        conn.close()
-        return True
-            
+                return {"success": False, "players": results}
 
+            cur.executemany(
+                f"UPDATE players SET {elo_type} = ? WHERE steam_id = ? AND {elo_type} = ?",
+                updates
+            )
+            if cur.rowcount != len(updates):
+                print(f"[ERROR] Elo compare-and-swap failed: {cur.rowcount}/{len(updates)} rows matched")
+                conn.rollback()
+                for r in results:
+                    if r["status"] == "updated":
+                        r["status"] = "conflict"
+                return {"success": False, "players": results}
+
+            if updates:
+                self._bump_generation(cur)
+            conn.commit()
+            for r in results:
+                if r["status"] == "updated":
+                    print(f"[Database] Player {r['playername']} (ID: {r['steam_id']}) Elo updated to {r['new_elo']}")
+            return {"success": True, "players": results}
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
 
 
 db_flightlog = flightlogDB()
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="flightlog 数据库工具")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        default="init",
+        choices=["init", "rebuild-stats"],
+        help="init: 初始化/迁移数据库（默认）; rebuild-stats: 全量重建 player_stats 和 Elo 汇总"
+    )
+    args = parser.parse_args()
+    if args.command == "rebuild-stats":
+        db_flightlog.rebuild_player_stats()
+        db_flightlog.rebuild_elo_rollups()
+        print(f"player_stats / player_elo_rollup 重建完成：{DB_PATH}")
+        sys.exit(0)
     db_flightlog.init_db()
     conn = db_flightlog.get_conn()
     cur = conn.cursor()
@@ -0,0 +1,136 @@
+"""
+异步数据库访问层
+bot 的查询都放到独立的只读连接线程池里执行，避免同步 SQLite 调用卡住 discord.py 的事件循环
+"""
+
+import asyncio
+import sqlite3
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, List, Optional
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+from DB import FLIGHTLOG_DB_PATH
+
+
+CANCEL_CHECK_STEPS = 100  # 每执行这么多条虚拟机指令检查一次查询是否已被取消
+
+_current = threading.local()  # 工作线程正在执行的 _Job
+
+
+class QueryTimeout(Exception):
+    """查询超过时限，已被中断"""
+
+
+def job_cancelled() -> bool:
+    """
+    当前工作线程上的查询是否已被取消（超时或调用方放弃）；不在 AsyncDB 的工作线程里时总是 False
+    读连接的进度回调就是它，返回 True 时 SQLite 中止正在执行的语句
+    """
+    job = getattr(_current, "job", None)
+    return job is not None and job.cancelled
+
+
+def install_cancel_handler(conn: sqlite3.Connection) -> None:
+    """
+    给连接装上取消检查的进度回调
+    连接上只能有一个进度回调，临时换成别的回调（例如 RAGExecutor 的执行时限）之后要调用这个装回来
+    """
+    conn.set_progress_handler(job_cancelled, CANCEL_CHECK_STEPS)
+
+
+class _Job:
+    """
+    一次查询在工作线程里的状态，用于超时/取消时中断 SQL
+    interrupt() 只能中断当时正在执行的那条语句；查询函数里后面的语句靠读连接的进度回调检查 cancelled，一开始执行就失败
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.cancelled = False
+
+    def interrupt(self):
+        with self.lock:
+            self.cancelled = True
+            if self.conn is not None:
+                self.conn.interrupt()
+
+
+class AsyncDB:
+    """
+    只读连接池 + 有界线程池
+    每个工作线程持有一个 mode=ro 的 SQLite 连接，查询函数以 conn= 关键字参数拿到连接
+    """
+
+    def __init__(self, db_path=FLIGHTLOG_DB_PATH, max_workers: int = 4, timeout: float = 10.0):
+        """
+        :param db_path: 数据库路径
+        :param max_workers: 读连接（线程）数量
+        :param timeout: 默认查询超时（秒）
+        """
+        self.db_path = db_path
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+
+    def _get_reader(self) -> sqlite3.Connection:
+        """获取当前工作线程的只读连接（第一次调用时创建）"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            install_cancel_handler(conn)
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _run_job(self, job: _Job, func: Callable, args: tuple, kwargs: dict) -> Any:
+        conn = self._get_reader()
+        with job.lock:
+            if job.cancelled:
+                raise QueryTimeout("查询在开始前已被取消")
+            job.conn = conn
+        _current.job = job
+        try:
+            return func(*args, conn=conn, **kwargs)
+        finally:
+            _current.job = None
+            with job.lock:
+                job.conn = None
+
+    async def run(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        在读连接线程里执行 func(*args, conn=conn, **kwargs)
+        超时或调用方被取消时会中断正在执行的 SQL
+        :param func: 同步查询函数，必须接受 conn 关键字参数
+        :param timeout: 本次查询的超时（秒），None 使用默认值
+        :return: func 的返回值
+        """
+        loop = asyncio.get_running_loop()
+        job = _Job()
+        future = loop.run_in_executor(self._executor, self._run_job, job, func, args, kwargs)
+        try:
+            return await asyncio.wait_for(future, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            job.interrupt()
+            raise QueryTimeout(f"{getattr(func, '__name__', func)} 超过 {timeout or self.timeout}s 未完成")
+        except asyncio.CancelledError:
+            job.interrupt()
+            raise
+
+    def close(self):
+        """关闭线程池和所有读连接"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                conn.interrupt()
+                conn.close()
+            self._connections.clear()
@@ -0,0 +1,95 @@
+"""
+意图识别基准
+对比旧的逐关键词子串查找和 Aho–Corasick 加权匹配的准确率与吞吐量。
+准确率分别报告调参语料（权重照着它调，偏高）和留出语料（不参与调参）上的结果
+
+用法: python Discord_bot/bench_intent.py [--rounds 2000]
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.rag_system import IntentDetector
+from Discord_bot.test_intent_matcher import HELDOUT_PATH, load_corpus
+
+
+# 旧版关键词表：每个词算 1 分，同分时取字典里先出现的意图
+LEGACY_KEYWORDS = {
+    "player_recent_performance": ["最近", "表现", "战绩", "成绩", "近期"],
+    "player_stats_summary": ["统计", "数据", "总览", "概况", "信息"],
+    "player_elo_trend": ["elo", "分数", "趋势", "变化", "排名"],
+    "map_leaderboard": ["排行", "排名", "最好", "最强", "第一", "榜单"],
+    "recent_battles": ["战况", "战斗", "对局", "比赛"],
+    "weapon_analysis": ["武器", "装备", "导弹", "枪"],
+    "player_comparison": ["对比", "比较", "vs", "和"],
+    "battle_report": ["战报", "总结", "报告"],
+    "activity_analysis": ["活跃", "在线", "参与"],
+    "combat_style": ["风格", "打法", "特点", "习惯"],
+}
+LEGACY_MAP_TYPES = {
+    "BVR": ["bvr", "超视距", "远程"],
+    "BFM": ["bfm", "格斗", "近战", "狗斗"],
+    "PVE": ["pve", "ai", "电脑"],
+}
+LEGACY_TIME_WORDS = [("today", ["今天", "今日"]), ("yesterday", ["昨天"]), ("this_week", ["本周", "这周"]),
+                     ("last_week", ["上周"]), ("this_month", ["本月", "这个月"])]
+
+
+def legacy_detect(query: str) -> tuple:
+    """旧版：意图、地图类型、时间范围分别对每个关键词做一次子串查找"""
+    query = query.lower()
+    scores = {}
+    for intent, keywords in LEGACY_KEYWORDS.items():
+        score = sum(1 for keyword in keywords if keyword in query)
+        if score > 0:
+            scores[intent] = score
+    intent = max(scores, key=scores.get) if scores else "player_stats_summary"
+    map_type = next((m for m, words in LEGACY_MAP_TYPES.items() if any(w in query for w in words)), None)
+    time_range = next((t for t, words in LEGACY_TIME_WORDS if any(w in query for w in words)), None)
+    return intent, map_type, time_range
+
+
+def new_detect(detector: IntentDetector):
+    def detect(query: str) -> tuple:
+        hits = detector.matcher.find(query)
+        return detector._detect_intent_type(hits), detector._first_hit(hits, "map"), detector._first_hit(hits, "time")
+    return detect
+
+
+def accuracy(detect, corpus: list) -> float:
+    return sum(1 for query, expected in corpus if detect(query)[0] == expected) / len(corpus)
+
+
+def measure(name: str, detect, corpus: list, heldout: list, rounds: int) -> None:
+    queries = [query for query, _ in corpus]
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for query in queries:
+            detect(query)
+    elapsed = time.perf_counter() - start
+    total = rounds * len(queries)
+    print(f"{name:<10}{accuracy(detect, corpus):>8.1%}{accuracy(detect, heldout):>10.1%}"
+          f"{total / elapsed:>14,.0f}{elapsed / total * 1e6:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="意图识别基准")
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    heldout = load_corpus(HELDOUT_PATH)
+    detector = IntentDetector()
+    print(f"调参语料 {len(corpus)} 条，留出语料 {len(heldout)} 条，关键词 {len(detector.matcher)} 个，"
+          f"每种方法跑 {args.rounds} 轮（吞吐量用调参语料测）")
+    print(f"{'method':<10}{'tune':>8}{'held-out':>10}{'queries/s':>14}{'us/query':>12}")
+    measure("legacy", legacy_detect, corpus, heldout, args.rounds)
+    measure("automaton", new_detect(detector), corpus, heldout, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
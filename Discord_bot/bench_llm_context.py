@@ -0,0 +1,154 @@
+"""
+/ai 上下文体积基准
+用典型意图的模拟查询结果，对比旧的逐行 "key: value" 格式和紧凑 TSV 格式的 prompt token 数；
+指定 --ollama 时再分别请求模型，对比端到端耗时
+
+用法: python Discord_bot/bench_llm_context.py [--ollama http://localhost:11434] [--model qwen2.5:7b] [--runs 3]
+"""
+
+import sys
+import random
+import asyncio
+import argparse
+import statistics
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.chat_sessions import estimate_tokens
+from Discord_bot.rag_system import RAGExecutor
+
+
+WEAPONS = ["AIM-120D", "AIM-120C", "AIM-9X", "AIM-7", "GAU-8", "M61A1", "R-77", "R-73"]
+KILL_TYPES = ["4Gen-4Gen", "4Gen-5Gen", "5Gen-4Gen"]
+MAPS = ["MergeLarge", "BVR Bench", "Dogfight Valley"]
+
+
+def legacy_format(data, intent) -> str:
+    """旧版 format_for_llm：每条记录都重复一遍列名"""
+    context = f"查询意图：{intent.get('intent', '')}\n\n"
+    context += f"查询结果（共{len(data)}条记录）：\n\n"
+    for i, row in enumerate(data, 1):
+        context += f"记录 {i}:\n"
+        for key, value in row.items():
+            context += f"  {key}: {value}\n"
+        context += "\n"
+    context += "\n请根据以上数据，用简洁清晰的中文生成总结或战报。"
+    return context
+
+
+def make_datasets(rng: random.Random) -> dict:
+    """各意图的典型结果集（列和 SQLGenerator 生成的查询一致）"""
+    pilots = [f"Pilot{i}" for i in range(12)]
+    datasets = {}
+
+    datasets["weapon_analysis"] = [
+        {
+            "weapon": rng.choice(WEAPONS),
+            "usage_count": rng.randint(1, 400),
+            "unique_users": rng.randint(1, 12),
+            "kill_type": rng.choice(KILL_TYPES),
+            "avg_elo_change": rng.uniform(-3, 9),
+        }
+        for _ in range(50)
+    ]
+
+    elo = 2000.0
+    rows = []
+    for i in range(20):
+        delta = rng.uniform(-8, 8)
+        rows.append({
+            "steam_name": "Tobiichi",
+            "map_name": rng.choice(MAPS),
+            "played_at": f"202501{10 + i // 4:02d}_{i % 24:02d}0000",
+            "event_type": "BVR_KILL",
+            "weapon": rng.choice(WEAPONS),
+            "kill_type": rng.choice(KILL_TYPES),
+            "role": rng.choice(["killer", "victim"]),
+            "elo_before": elo,
+            "elo_after": elo + delta,
+            "elo_change": delta,
+        })
+        elo += delta
+    datasets["player_recent_performance"] = rows
+
+    datasets["combat_style"] = [
+        {
+            "steam_name": rng.choice(pilots),
+            "weapon": rng.choice(WEAPONS),
+            "weapon_usage": rng.randint(1, 80),
+            "kill_type": rng.choice(KILL_TYPES),
+            "maps_played": rng.randint(1, 3),
+            "avg_elo_per_kill": rng.uniform(0, 9),
+        }
+        for _ in range(50)
+    ]
+
+    datasets["recent_battles"] = [
+        {
+            "replay_id": 500 - i,
+            "map_name": rng.choice(MAPS),
+            "played_at": f"20250120_{i:02d}0000",
+            "total_events": rng.randint(10, 120),
+            "total_players": rng.randint(2, 12),
+            "players": ",".join(rng.sample(pilots, rng.randint(2, 8))),
+        }
+        for i in range(10)
+    ]
+    return datasets
+
+
+def measure_tokens(executor: RAGExecutor, datasets: dict) -> dict:
+    contexts = {}
+    print(f"{'intent':<28}{'rows':>6}{'legacy tok':>12}{'compact tok':>13}{'saved':>8}")
+    for intent_name, data in datasets.items():
+        intent = {"intent": intent_name}
+        legacy = legacy_format(data, intent)
+        compact = executor.format_for_llm(data, list(data[0].keys()), intent)
+        before, after = estimate_tokens(legacy), estimate_tokens(compact)
+        contexts[intent_name] = (legacy, compact)
+        print(f"{intent_name:<28}{len(data):>6}{before:>12}{after:>13}{1 - after / before:>8.0%}")
+    return contexts
+
+
+async def measure_latency(contexts: dict, url: str, model: str, runs: int) -> None:
+    """每种格式各请求 runs 次，取中位数（开启 keep_alive，第一次请求只用来加载模型）"""
+    from Discord_bot.bot_commands import RAG_SYSTEM_PROMPT
+    from Discord_bot.ollama_client import OllamaClient
+
+    client = OllamaClient(url, model, first_token_timeout=300, total_timeout=600, keep_alive="10m")
+    try:
+        await client.chat([{"role": "user", "content": "hi"}])
+        print(f"\n{'intent':<28}{'legacy p50':>12}{'compact p50':>13}")
+        for intent_name, (legacy, compact) in contexts.items():
+            timings = []
+            for context in (legacy, compact):
+                samples = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    await client.chat([
+                        {"role": "system", "content": RAG_SYSTEM_PROMPT},
+                        {"role": "user", "content": context},
+                    ])
+                    samples.append(time.perf_counter() - start)
+                timings.append(statistics.median(samples))
+            print(f"{intent_name:<28}{timings[0]:>11.2f}s{timings[1]:>12.2f}s")
+    finally:
+        await client.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/ai 上下文体积基准")
+    parser.add_argument("--ollama", help="Ollama 地址，不指定时只比较 token 数")
+    parser.add_argument("--model", default="qwen2.5:7b")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    contexts = measure_tokens(RAGExecutor(), make_datasets(random.Random(42)))
+    if args.ollama:
+        asyncio.run(measure_latency(contexts, args.ollama, args.model, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+/stats 资料查询延迟基准
+在临时数据库里灌入 10 万条事件，对比旧的三次往返查询和 get_player_profile 的耗时
+
+用法: python Discord_bot/bench_player_profile.py [--events 100000] [--players 200] [--runs 200]
+"""
+
+import sys
+import json
+import random
+import sqlite3
+import argparse
+import tempfile
+import statistics
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+from DB import flightlogDB, played_at_to_epoch
+
+from Discord_bot.bot_commands import PlayerStatsService
+
+
+EVENTS_PER_REPLAY = 50
+WEAPONS = ["AIM-120D", "AIM-9X", "AIM-7", "GAU-8", "M61A1"]
+
+
+def seed_db(db_path: Path, n_events: int, n_players: int) -> None:
+    """
+    按 save_global_event_history 的表结构直接批量写入数据
+    :param n_events: 事件总数
+    :param n_players: 玩家数量
+    """
+    db = flightlogDB(db_path)
+    rng = random.Random(42)
+    conn = db.get_conn()
+    cur = conn.cursor()
+
+    cur.executemany(
+        "INSERT INTO players (steam_id, steam_name) VALUES (?, ?)",
+        [(str(76561198000000000 + i), f"Pilot{i}") for i in range(n_players)]
+    )
+    cur.executemany(
+        "INSERT INTO player_names (player_id, name, name_casefold, first_seen_at, last_seen_at) VALUES (?, ?, ?, ?, ?)",
+        [(i + 1, f"Pilot{i}", f"pilot{i}", "2025-01-01 00:00:00", "2025-01-01 00:00:00") for i in range(n_players)]
+    )
+
+    elo = {pid: 2000.0 for pid in range(1, n_players + 1)}
+    event_id = 0
+    for replay_idx in range(n_events // EVENTS_PER_REPLAY):
+        day = 1 + replay_idx // 24
+        played_at = f"2025{1 + (day // 28) % 12:02d}{1 + day % 28:02d}_{replay_idx % 24:02d}0000"
+        cur.execute(
+            "INSERT INTO replays (file_name, map_name, map_type, played_at, played_at_epoch, meta_blob) VALUES (?, ?, ?, ?, ?, ?)",
+            (f"bench_{replay_idx}.zip", "BVR Bench", "BVR", played_at, played_at_to_epoch(played_at), b"")
+        )
+        replay_id = cur.lastrowid
+
+        events, player_events, elo_rows, details = [], [], [], []
+        for i in range(EVENTS_PER_REPLAY):
+            event_id += 1
+            killer, victim = rng.sample(range(1, n_players + 1), 2)
+            delta = round(rng.uniform(0.5, 8.0), 2)
+            event = {
+                "event_type": "BVR_KILL",
+                "datetime": f"2025-01-01 00:{i:02d}:00",
+                "killer_id": str(76561198000000000 + killer - 1),
+                "victim_id": str(76561198000000000 + victim - 1),
+                "weapon": rng.choice(WEAPONS),
+                "elo_delta": delta,
+            }
+            blob = json.dumps(event)
+            events.append((event_id, replay_id, "BVR_KILL", f"00:{i:02d}:00", 1, blob, event["weapon"], "4Gen-4Gen"))
+            details.append((event_id, blob))
+            player_events.append((killer, event_id, "killer"))
+            player_events.append((victim, event_id, "victim"))
+            elo_rows.append((killer, event_id, replay_id, event["datetime"], elo[killer], elo[killer] + delta))
+            elo_rows.append((victim, event_id, replay_id, event["datetime"], elo[victim], elo[victim] - delta))
+            elo[killer] += delta
+            elo[victim] -= delta
+
+        cur.executemany(
+            "INSERT INTO events (id, replay_id, event_type, time_local, is_valid, extra_data, weapon, kill_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            events
+        )
+        cur.executemany("INSERT INTO event_details (event_id, details) VALUES (?, ?)", details)
+        cur.executemany("INSERT INTO player_events (player_id, event_id, role) VALUES (?, ?, ?)", player_events)
+        cur.executemany(
+            "INSERT INTO player_elo_history (player_id, event_id, replay_id, at_time, elo_before, elo_after) VALUES (?, ?, ?, ?, ?, ?)",
+            elo_rows
+        )
+
+    conn.commit()
+    cur.execute("ANALYZE")
+    conn.close()
+
+
+def legacy_fetch(conn: sqlite3.Connection, player_id: int, limit: int = 20):
+    """改造前 /stats 的取数方式：玩家信息、事件（JOIN event_details 并全部解析 JSON）、ELO 历史三次往返"""
+    cur = conn.cursor()
+    player = dict(cur.execute("SELECT * FROM players WHERE id = ?", (player_id,)).fetchone())
+    player['name_history'] = [r['name'] for r in cur.execute(
+        "SELECT name FROM player_names WHERE player_id = ? ORDER BY first_seen_at, id", (player_id,)
+    ).fetchall()]
+    events = []
+    for row in cur.execute("""
+        SELECT e.*, pe.role, r.map_name, r.played_at, ed.details
+        FROM events e
+        JOIN player_events pe ON e.id = pe.event_id
+        JOIN replays r ON e.replay_id = r.id
+        LEFT JOIN event_details ed ON e.id = ed.event_id
+        WHERE pe.player_id = ?
+        ORDER BY r.played_at DESC
+        LIMIT ?
+    """, (player_id, limit)).fetchall():
+        event = dict(row)
+        if event.get('details'):
+            event['details'] = json.loads(event['details'])
+        events.append(event)
+    elo_history = [dict(r) for r in cur.execute("""
+        SELECT peh.*, e.event_type, e.weapon, r.map_name
+        FROM player_elo_history peh
+        LEFT JOIN events e ON peh.event_id = e.id
+        LEFT JOIN replays r ON peh.replay_id = r.id
+        WHERE peh.player_id = ?
+        ORDER BY peh.at_time DESC
+        LIMIT ?
+    """, (player_id, limit)).fetchall()]
+    return player, events, elo_history
+
+
+def timeit(func, player_ids: list) -> list:
+    """依次对每个玩家执行 func，返回每次的耗时（毫秒）"""
+    samples = []
+    for pid in player_ids:
+        start = time.perf_counter()
+        func(pid)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<22} p50={statistics.median(samples):7.3f} ms  p95={p95:7.3f} ms  max={samples[-1]:7.3f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="/stats 资料查询延迟基准")
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--players", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    db_path = Path(tempfile.mkdtemp()) / "bench.sqlite"
+    start = time.perf_counter()
+    seed_db(db_path, args.events, args.players)
+    print(f"[Bench] 已写入 {args.events} 条事件 / {args.players} 名玩家，用时 {time.perf_counter() - start:.1f}s")
+
+    service = PlayerStatsService(db_path)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+
+    rng = random.Random(7)
+    player_ids = [rng.randint(1, args.players) for _ in range(args.runs)]
+
+    # 玩家信息和 ELO 历史应当一致（事件排序键不同，不逐条比较）
+    player, events, elo_history = legacy_fetch(conn, player_ids[0])
+    profile = service.get_player_profile(player_ids[0], conn=conn)
+    assert profile['player'] == player
+    assert profile['elo_history'] == elo_history
+    assert len(profile['events']) == len(events)
+
+    timeit(lambda pid: legacy_fetch(conn, pid), player_ids[:20])
+    timeit(lambda pid: service.get_player_profile(pid, conn=conn), player_ids[:20])
+    report("legacy (3 round trips)", timeit(lambda pid: legacy_fetch(conn, pid), player_ids))
+    report("get_player_profile", timeit(lambda pid: service.get_player_profile(pid, conn=conn), player_ids))
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -179,7 +179,9 @@ async def help_command(ctx: commands.Context):
         value=(
             "`/stats NAME:玩家名` - 通过玩家名称查询\n"
             "`/stats ID:Steam_ID` - 通过Steam ID查询\n"
-            "例如：`/stats NAME:Tobiichi` 或 `/stats ID:76561198012345678`"
+            "例如：`/stats NAME:Tobiichi` 或 `/stats ID:76561198012345678`\n"
+            "`/leaderboard` - 查看排行榜（可选 BVR / BFM / PVE）\n"
+            "`/lastmatch` - 查看最近一局的战报"
         ),
         inline=False
     )
@@ -189,7 +191,7 @@ async def help_command(ctx: commands.Context):
         value=(
             "`/chatwithai 消息` - 与AI助手对话\n"
             "`/endaichat` - 结束当前AI对话\n"
-            "注意：同时只能有一个用户与AI对话，3分钟无活动自动结束"
+            "注意：每个用户有独立的对话，AI繁忙时请求会排队，3分钟无活动自动结束"
         ),
         inline=False
     )
@@ -198,7 +200,7 @@ async def help_command(ctx: commands.Context):
         name="💡 使用提示",
         value=(
             "• 斜杠命令输入 `/` 后会自动显示提示\n"
-            "• AI对话一次只能一个用户使用\n"
+            "• 每个用户的AI对话互不影响，繁忙时按顺序排队\n"
             "• 查询结果会显示最近20条记录"
         ),
         inline=False
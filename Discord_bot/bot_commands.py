@@ -7,10 +7,9 @@ import sys
 from pathlib import Path
 import sqlite3
 import json
-from typing import Optional, Dict, List, Union
+from contextlib import contextmanager, aclosing
+from typing import Optional, Dict, List, Tuple, Union
 import asyncio
-import time
-import requests
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
@@ -18,13 +17,127 @@ from discord.ext import commands, tasks
 # 添加父目录到路径以导入DB模块
 sys.path.append(str(Path(__file__).parent.parent))
 from DB import flightlogDB, FLIGHTLOG_DB_PATH, ELO_TYPE
+from MapCatalog import get_catalog
 
 # 导入配置
-from Discord_bot.config import OLLAMA_CONFIG, ALLOWED_CHANNELS_BOTCOMMAND, ALLOWED_CHANNELS_AI, MAX_DISPLAY_RECORDS
+from Discord_bot.config import OLLAMA_CONFIG, ALLOWED_CHANNELS_BOTCOMMAND, ALLOWED_CHANNELS_AI, MAX_DISPLAY_RECORDS, DB_READER_CONFIG, QUERY_CACHE_CONFIG, PUBLISHER_CONFIG, LLM_TOOLS_CONFIG, MATCH_INDEX_CONFIG, DEBUG_MODE
 
 # 导入RAG系统
 from Discord_bot.rag_system import RAGSystem
 
+# 异步数据库访问层
+from Discord_bot.async_db import AsyncDB, QueryTimeout
+
+# 查询结果缓存
+from Discord_bot.query_cache import QueryCache, content_digest
+
+# 排行榜 / 战报快照
+from Discord_bot.match_publisher import MatchPublisher
+
+# AI 聊天会话 / 请求排队
+from Discord_bot.chat_sessions import ChatSessionStore, estimate_tokens
+
+# Ollama 请求网关（优先级排队 / 并发上限 / 在途去重）
+from Discord_bot.llm_gateway import LLMGateway, PRIORITY_COMMAND, PRIORITY_CHAT, PRIORITY_BACKGROUND
+
+# 异步 Ollama 客户端
+from Discord_bot.ollama_client import OllamaClient, OllamaError, OllamaConnectionError, OllamaTimeout, OllamaToolsUnsupported
+
+# AI 工具调用（模型按需查询数据库）
+from Discord_bot.llm_tools import LLMToolbox, TOOL_SYSTEM_PROMPT
+
+# 比赛向量检索
+from Discord_bot.match_index import MatchRetriever, OllamaEmbedder, format_retrieved, trim_retrieved
+
+# 模型预热 / 健康检查
+from Discord_bot.ollama_lifecycle import ModelLifecycle
+
+# 流式输出到 Discord 消息
+from Discord_bot.streaming import ReplyBroadcast, StreamingReply
+
+
+RAG_SYSTEM_PROMPT = (
+    "你是ezServer游戏服务器的数据分析AI助手。"
+    "你会收到数据库查询结果，请根据这些数据生成简洁清晰的中文总结或战报。"
+    "要求：\n"
+    "1. 突出关键数据和趋势\n"
+    "2. 使用适当的emoji增强可读性\n"
+    "3. 保持专业和友好的语气\n"
+    "4. 如果是战报，要有叙事感\n"
+)
+
+CHAT_SYSTEM_PROMPT = (
+    "你是ezServer游戏服务器的AI助手。你可以帮助玩家查询统计数据、"
+    "回答游戏相关问题。请用简洁清晰的中文回答。"
+)
+
+# /stats name 自动补全选项的值：选中候选时直接按 Steam ID 定位，不再按昵称重新搜索
+STATS_CHOICE_PREFIX = "steam_id:"
+
+
+# /stats 资料查询语句（模块级常量，同一连接上重复执行时直接复用已编译的语句）
+PROFILE_PLAYER_SQL = "SELECT * FROM players WHERE id = ?"
+
+PROFILE_NAMES_SQL = "SELECT name FROM player_names WHERE player_id = ? ORDER BY first_seen_at, id"
+
+# 按 player_events 主键倒序扫描，只读取 LIMIT 条，不需要对玩家的全部事件排序
+PROFILE_EVENTS_SQL = """
+    SELECT
+        e.id, e.replay_id, e.event_type, e.time_local, e.is_valid,
+        e.extra_data, e.weapon, e.kill_type,
+        pe.role,
+        r.map_name,
+        r.played_at
+    FROM player_events pe
+    JOIN events e ON e.id = pe.event_id
+    JOIN replays r ON r.id = e.replay_id
+    WHERE pe.player_id = ?
+    ORDER BY pe.event_id DESC
+    LIMIT ?
+"""
+
+PROFILE_ELO_SQL = """
+    SELECT
+        peh.*,
+        e.event_type,
+        e.weapon,
+        r.map_name
+    FROM player_elo_history peh
+    LEFT JOIN events e ON peh.event_id = e.id
+    LEFT JOIN replays r ON peh.replay_id = r.id
+    WHERE peh.player_id = ?
+    ORDER BY peh.at_time DESC
+    LIMIT ?
+"""
+
+
+# /mapinfo：这张地图的对局统计（replays.map_name 存的是 FSM_MAPS 的 mapname，即 map_id）
+MAP_PLAYED_SQL = """
+    SELECT COUNT(*) AS matches, MAX(played_at) AS last_played, GROUP_CONCAT(DISTINCT map_type) AS map_types
+    FROM replays
+    WHERE map_name = ?
+"""
+
+
+class EventRecord(dict):
+    """
+    事件行；details 只在第一次被读取时才从 extra_data 解析 JSON
+    （/stats 的 Embed 只用到 event_type / weapon / map_name，大多数行永远不需要解析）
+    """
+    
+    def __missing__(self, key):
+        if key != 'details':
+            raise KeyError(key)
+        raw = dict.get(self, 'extra_data')
+        details = json.loads(raw) if raw else None
+        self['details'] = details
+        return details
+    
+    def get(self, key, default=None):
+        if key in self or key == 'details':
+            return self[key]
+        return default
+
 
 class PlayerStatsService:
     """玩家统计查询服务"""
@@ -32,135 +145,133 @@ class PlayerStatsService:
     def __init__(self, db_path=FLIGHTLOG_DB_PATH):
         self.db = flightlogDB(db_path)
     
-    def get_player_by_name(self, player_name: str) -> Optional[Dict]:
+    @contextmanager
+    def _reader(self, conn: Optional[sqlite3.Connection] = None):
         """
-        通过玩家名称查找玩家
-        :param player_name: 玩家名称
-        :return: 玩家信息字典或None
+        复用调用方传入的连接（AsyncDB 的只读连接），没有的话临时开一个并在结束时关闭
         """
+        if conn is not None:
+            yield conn
+            return
         conn = self.db.get_conn()
         conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        
         try:
-            # 在player_names表中搜索包含该名称的记录
-            cur.execute("""
-                SELECT p.*, pn.name as name_history
-                FROM players p
-                JOIN player_names pn ON p.id = pn.player_id
-                WHERE pn.name LIKE ?
-            """, (f'%{player_name}%',))
-            
-            row = cur.fetchone()
-            if row:
-                result = dict(row)
-                # 解析name_history JSON
-                if result.get('name_history'):
-                    result['name_history'] = json.loads(result['name_history'])
-                return result
-            return None
+            yield conn
         finally:
             conn.close()
     
-    def get_player_by_steam_id(self, steam_id: str) -> Optional[Dict]:
+    def get_player_by_name(self, player_name: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+        """
+        通过玩家名称查找玩家（取搜索排序后的第一名）
+        :param player_name: 玩家名称
+        :return: 玩家信息字典或None
+        """
+        with self._reader(conn) as conn:
+            matches = self.db.search_players(player_name, limit=1, conn=conn)
+            if not matches:
+                return None
+            return self.get_player_by_steam_id(matches[0]['steam_id'], conn=conn)
+    
+    def search_players(self, query: str, limit: int = 25, conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
+        """
+        模糊搜索玩家（用于 /stats 的自动补全）
+        :param query: 用户已输入的内容
+        :param limit: 返回数量（Discord 自动补全最多25条）
+        :return: 排序后的候选玩家列表
+        """
+        return self.db.search_players(query, limit=limit, conn=conn)
+    
+    def get_map_played(self, map_id: str, conn: Optional[sqlite3.Connection] = None) -> Dict:
+        """
+        地图在本服务器的对局统计
+        :param map_id: 地图ID（replays.map_name 存的就是它）
+        :return: {"matches", "last_played", "map_types"}
+        """
+        with self._reader(conn) as conn:
+            return dict(conn.execute(MAP_PLAYED_SQL, (map_id,)).fetchone())
+    
+    def _get_name_history(self, cur: sqlite3.Cursor, player_id: int) -> List[str]:
+        """按首次出现时间返回玩家的历史昵称"""
+        cur.execute(PROFILE_NAMES_SQL, (player_id,))
+        return [row['name'] for row in cur.fetchall()]
+    
+    def get_player_by_steam_id(self, steam_id: str, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
         """
         通过Steam ID查找玩家
         :param steam_id: Steam ID
         :return: 玩家信息字典或None
         """
-        conn = self.db.get_conn()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        
-        try:
+        with self._reader(conn) as conn:
+            cur = conn.cursor()
             cur.execute("SELECT * FROM players WHERE steam_id = ?", (steam_id,))
             row = cur.fetchone()
             
             if row:
                 result = dict(row)
                 # 获取历史昵称
-                cur.execute("""
-                    SELECT name FROM player_names WHERE player_id = ?
-                """, (result['id'],))
-                name_row = cur.fetchone()
-                if name_row:
-                    result['name_history'] = json.loads(name_row['name'])
-                else:
-                    result['name_history'] = []
+                result['name_history'] = self._get_name_history(cur, result['id'])
                 return result
             return None
-        finally:
-            conn.close()
     
-    def get_player_events(self, player_id: int, limit: int = 20) -> List[Dict]:
+    def get_player_events(self, player_id: int, limit: int = 20, conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
         """
-        获取玩家相关的事件记录
+        获取玩家相关的事件记录（按事件写入顺序倒序，details 在访问时才解析）
         :param player_id: 玩家ID
         :param limit: 返回记录数量限制
         :return: 事件列表
         """
-        conn = self.db.get_conn()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        
-        try:
-            cur.execute("""
-                SELECT 
-                    e.*,
-                    pe.role,
-                    r.map_name,
-                    r.played_at,
-                    ed.details
-                FROM events e
-                JOIN player_events pe ON e.id = pe.event_id
-                JOIN replays r ON e.replay_id = r.id
-                LEFT JOIN event_details ed ON e.id = ed.event_id
-                WHERE pe.player_id = ?
-                ORDER BY r.played_at DESC
-                LIMIT ?
-            """, (player_id, limit))
-            
-            events = []
-            for row in cur.fetchall():
-                event_dict = dict(row)
-                # 解析details JSON
-                if event_dict.get('details'):
-                    event_dict['details'] = json.loads(event_dict['details'])
-                events.append(event_dict)
-            
-            return events
-        finally:
-            conn.close()
+        with self._reader(conn) as conn:
+            cur = conn.execute(PROFILE_EVENTS_SQL, (player_id, limit))
+            return [EventRecord(row) for row in cur.fetchall()]
     
-    def get_player_elo_history(self, player_id: int, limit: int = 20) -> List[Dict]:
+    def get_player_elo_history(self, player_id: int, limit: int = 20, conn: Optional[sqlite3.Connection] = None) -> List[Dict]:
         """
         获取玩家ELO历史记录
         :param player_id: 玩家ID
         :param limit: 返回记录数量限制
         :return: ELO历史列表
         """
-        conn = self.db.get_conn()
-        conn.row_factory = sqlite3.Row
-        cur = conn.cursor()
-        
-        try:
-            cur.execute("""
-                SELECT 
-                    peh.*,
-                    e.event_type,
-                    e.weapon,
-                    r.map_name
-                FROM player_elo_history peh
-                LEFT JOIN events e ON peh.event_id = e.id
-                LEFT JOIN replays r ON peh.replay_id = r.id
-                WHERE peh.player_id = ?
-                ORDER BY peh.at_time DESC
-                LIMIT ?
-            """, (player_id, limit))
-            
+        with self._reader(conn) as conn:
+            cur = conn.execute(PROFILE_ELO_SQL, (player_id, limit))
             return [dict(row) for row in cur.fetchall()]
-        finally:
-            conn.close()
+    
+    def get_player_profile(self, player_id: int, limit: int = 20, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+        """
+        一次取齐 /stats 需要的全部数据：基本信息、历史昵称、最近事件、ELO 历史
+        所有语句在同一个连接上执行（SQL 是模块级常量，命中 sqlite3 的语句缓存）
+        :param player_id: 玩家ID
+        :param limit: 事件 / ELO 历史的条数上限
+        :return: {"player": ..., "events": [...], "elo_history": [...]}，玩家不存在时返回None
+        """
+        with self._reader(conn) as conn:
+            cur = conn.cursor()
+            row = cur.execute(PROFILE_PLAYER_SQL, (player_id,)).fetchone()
+            if row is None:
+                return None
+            player = dict(row)
+            player['name_history'] = self._get_name_history(cur, player_id)
+            events = [EventRecord(r) for r in cur.execute(PROFILE_EVENTS_SQL, (player_id, limit)).fetchall()]
+            elo_history = [dict(r) for r in cur.execute(PROFILE_ELO_SQL, (player_id, limit)).fetchall()]
+            return {"player": player, "events": events, "elo_history": elo_history}
+    
+    def find_player_profile(self, name: Optional[str] = None, steam_id: Optional[str] = None,
+                            limit: int = 20, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+        """
+        按昵称或 Steam ID 定位玩家并取回完整资料（查找和取数在同一个连接、同一次调度里完成）
+        :param name: 玩家名称
+        :param steam_id: Steam ID
+        :return: 同 get_player_profile，找不到玩家时返回None
+        """
+        with self._reader(conn) as conn:
+            if name is not None:
+                matches = self.db.search_players(name, limit=1, conn=conn)
+                player_id = matches[0]['player_id'] if matches else None
+            else:
+                row = conn.execute("SELECT id FROM players WHERE steam_id = ?", (steam_id,)).fetchone()
+                player_id = row[0] if row else None
+            if player_id is None:
+                return None
+            return self.get_player_profile(player_id, limit=limit, conn=conn)
     
     def format_player_stats(self, player_info: Dict, events: List[Dict], elo_history: List[Dict]) -> discord.Embed:
         """
@@ -249,18 +360,93 @@ class BotCommands(commands.Cog):
         self.bot = bot
         self.stats_service = PlayerStatsService()
         
+        # 只读连接池：所有查询都在这里执行，不阻塞事件循环
+        self.db_reader = AsyncDB(
+            FLIGHTLOG_DB_PATH,
+            max_workers=DB_READER_CONFIG["max_workers"],
+            timeout=DB_READER_CONFIG["query_timeout"],
+        )
+        
+        # 查询结果缓存：两局比赛之间直接从内存返回，generation 变化时失效
+        self.query_cache = QueryCache(
+            max_entries=QUERY_CACHE_CONFIG["max_entries"],
+            ttl=QUERY_CACHE_CONFIG["ttl"],
+        )
+        # /ai 总结缓存：键是数据上下文的哈希，和数据代数无关（数据没变就不用重新总结）
+        self.summary_cache = QueryCache(
+            max_entries=QUERY_CACHE_CONFIG["summary_max_entries"],
+            ttl=QUERY_CACHE_CONFIG["summary_ttl"],
+        )
+        
+        # 排行榜 / 战报快照：新比赛入库后预先生成，命令直接返回
+        self.publisher = MatchPublisher(
+            bot,
+            self.db_reader,
+            leaderboard_size=PUBLISHER_CONFIG["leaderboard_size"],
+            report_channel_id=PUBLISHER_CONFIG["match_report_channel_id"],
+        )
+        
+        # 地图目录（maplist.csv，/mapinfo 自动补全）
+        self.map_catalog = get_catalog()
+        
         # RAG系统初始化
         self.rag_system = RAGSystem()
         
-        # AI聊天相关状态管理
-        self.current_chat_user: Optional[int] = None  # 当前对话的用户ID
-        self.current_chat_channel: Optional[int] = None  # 当前对话的频道ID
-        self.chat_messages: List[Dict] = []  # 当前对话的消息历史
-        self.last_activity_time: float = 0  # 最后活动时间
-        self.chat_lock = asyncio.Lock()  # 对话锁
+        # AI聊天：每个用户一个会话，模型请求统一排队
+        self.chat_sessions = ChatSessionStore(
+            max_sessions=OLLAMA_CONFIG["max_sessions"],
+            idle_timeout=OLLAMA_CONFIG["chat_timeout"],
+            context_tokens=OLLAMA_CONFIG["context_tokens"],
+        )
+        self.llm_gateway = LLMGateway(OLLAMA_CONFIG["max_concurrent_requests"])
+        self.ollama = OllamaClient(
+            OLLAMA_CONFIG["url"],
+            OLLAMA_CONFIG["model"],
+            connect_timeout=OLLAMA_CONFIG["connect_timeout"],
+            first_token_timeout=OLLAMA_CONFIG["first_token_timeout"],
+            total_timeout=OLLAMA_CONFIG["timeout"],
+            pool_size=OLLAMA_CONFIG["max_concurrent_requests"] + 1,
+            keep_alive=OLLAMA_CONFIG["keep_alive"],
+            options={"num_ctx": OLLAMA_CONFIG["num_ctx"]},
+        )
+        self._background_tasks = set()  # 后台摘要任务（保留引用防止被回收）
+        self._summary_broadcasts: Dict[str, ReplyBroadcast] = {}  # 正在生成的 /ai 总结 -> 订阅它的回复
+        
+        # 比赛向量检索：索引离线构建，不存在时检索直接返回空
+        self.match_retriever = None
+        if MATCH_INDEX_CONFIG["enabled"]:
+            self.match_retriever = MatchRetriever(
+                MATCH_INDEX_CONFIG["path"],
+                OllamaEmbedder(self.ollama, MATCH_INDEX_CONFIG["embed_model"], gateway=self.llm_gateway),
+                top_k=MATCH_INDEX_CONFIG["top_k"],
+                min_score=MATCH_INDEX_CONFIG["min_score"],
+            )
+        
+        # 工具调用模式：/ai 和 /chatwithai 让模型通过只读查询函数自己取数据
+        self.toolbox = LLMToolbox(
+            self.db_reader,
+            self.stats_service.db,
+            timeout=LLM_TOOLS_CONFIG["timeout"],
+            max_rows=LLM_TOOLS_CONFIG["max_rows"],
+            retriever=self.match_retriever,
+        )
+        self.tools_enabled = LLM_TOOLS_CONFIG["enabled"]  # 模型不支持 tools 时自动关闭
+        
+        # 模型预热 / 健康检查：比赛索引已建好时连同向量模型一起预加载
+        use_embed = self.match_retriever is not None and self.match_retriever.refresh() is not None
+        self.model_lifecycle = ModelLifecycle(
+            self.ollama,
+            OLLAMA_CONFIG["model"],
+            embed_model=MATCH_INDEX_CONFIG["embed_model"] if use_embed else None,
+        )
         
         # 启动超时检查任务
         self.check_chat_timeout.start()
+        self.refresh_cache_generation.change_interval(seconds=QUERY_CACHE_CONFIG["generation_poll"])
+        self.refresh_cache_generation.start()
+        if OLLAMA_CONFIG["warmup"]:
+            self.check_ollama_health.change_interval(seconds=OLLAMA_CONFIG["health_interval"])
+            self.check_ollama_health.start()
     
     def check_channel_permission(self, channel_id: int, allowed_channels: List[int]) -> bool:
         """
@@ -297,9 +483,13 @@ class BotCommands(commands.Cog):
         await interaction.response.defer(thinking=True)
         
         try:
-            # 查询玩家信息
-            player_info = None
+            # 查询玩家资料（定位玩家 + 取数一次完成）
+            profile = None
             query_value = None
+            if name is not None and name.startswith(STATS_CHOICE_PREFIX) and steam_id is None:
+                # 从自动补全里选中的玩家
+                steam_id = name[len(STATS_CHOICE_PREFIX):]
+                name = None
             if name is not None:
                 if steam_id is not None:
                     await interaction.followup.send(
@@ -308,10 +498,18 @@ class BotCommands(commands.Cog):
                     )
                     return
                 else:
-                    player_info = self.stats_service.get_player_by_name(name)
+                    profile = await self.query_cache.get_or_load(
+                        "profile",
+                        lambda: self.db_reader.run(self.stats_service.find_player_profile, name=name),
+                        name=name,
+                    )
                     query_value = name
             elif steam_id is not None:
-                player_info = self.stats_service.get_player_by_steam_id(steam_id)
+                profile = await self.query_cache.get_or_load(
+                    "profile",
+                    lambda: self.db_reader.run(self.stats_service.find_player_profile, steam_id=steam_id),
+                    steam_id=steam_id,
+                )
                 query_value = steam_id
             else:
                 await interaction.followup.send(
@@ -320,24 +518,25 @@ class BotCommands(commands.Cog):
                 )
                 return
             # 检查是否找到玩家
-            if not player_info:
+            if not profile:
                 await interaction.followup.send(
                     f"❌ 未找到玩家：`{query_value}`",
                     ephemeral=True
                 )
                 return
             
-            # 获取玩家事件和ELO历史
-            player_id = player_info['id']
-            events = self.stats_service.get_player_events(player_id, limit=20)
-            elo_history = self.stats_service.get_player_elo_history(player_id, limit=20)
-            
             # 生成统计信息Embed
-            embed = self.stats_service.format_player_stats(player_info, events, elo_history)
+            embed = self.stats_service.format_player_stats(profile['player'], profile['events'], profile['elo_history'])
             
             # 发送结果
             await interaction.followup.send(embed=embed)
             
+        except QueryTimeout as e:
+            await interaction.followup.send(
+                "❌ 查询超时，请稍后再试",
+                ephemeral=True
+            )
+            print(f"[ERROR] Stats command timeout: {e}")
         except Exception as e:
             await interaction.followup.send(
                 f"❌ 查询出错：{str(e)}",
@@ -345,6 +544,136 @@ class BotCommands(commands.Cog):
             )
             print(f"[ERROR] Stats command error: {e}")
     
+    @stats.autocomplete("name")
+    async def stats_name_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        """
+        /stats name 参数的自动补全，直接查昵称索引
+        选项的值是 steam_id:<Steam ID>，同名或昵称相近的玩家不会被解析成搜索排第一的那个
+        """
+        if not current.strip():
+            return []
+        try:
+            matches = await self.query_cache.get_or_load(
+                "search",
+                lambda: self.db_reader.run(
+                    self.stats_service.search_players, current, limit=25,
+                    timeout=DB_READER_CONFIG["autocomplete_timeout"],
+                ),
+                query=current,
+            )
+        except Exception as e:
+            print(f"[ERROR] Stats autocomplete error: {e}")
+            return []
+        choices = []
+        for match in matches:
+            label = match['matched_name']
+            if match['steam_name'] and match['steam_name'] != label:
+                label = f"{label} ({match['steam_name']})"
+            choices.append(app_commands.Choice(name=label[:100], value=f"{STATS_CHOICE_PREFIX}{match['steam_id']}"))
+        return choices
+    
+    @app_commands.command(name="leaderboard", description="查看排行榜")
+    @app_commands.describe(map_type="地图类型")
+    @app_commands.choices(map_type=[
+        app_commands.Choice(name=map_type, value=map_type) for map_type in ELO_TYPE
+    ])
+    async def leaderboard(self, interaction: discord.Interaction, map_type: str = "BVR"):
+        """
+        排行榜（直接返回预先生成的快照）
+        用法: /leaderboard map_type:BVR
+        """
+        if not self.check_channel_permission(interaction.channel_id, ALLOWED_CHANNELS_BOTCOMMAND):
+            await interaction.response.send_message(
+                "❌ 此命令不能在当前频道使用！",
+                ephemeral=True
+            )
+            return
+        
+        embed = self.publisher.leaderboards.get(map_type)
+        if embed is None:
+            await interaction.response.send_message("⏳ 排行榜正在生成，请稍后再试", ephemeral=True)
+            return
+        await interaction.response.send_message(embed=embed)
+    
+    @app_commands.command(name="lastmatch", description="查看最近一局的战报")
+    async def lastmatch(self, interaction: discord.Interaction):
+        """
+        最近一局战报（直接返回预先生成的快照）
+        用法: /lastmatch
+        """
+        if not self.check_channel_permission(interaction.channel_id, ALLOWED_CHANNELS_BOTCOMMAND):
+            await interaction.response.send_message(
+                "❌ 此命令不能在当前频道使用！",
+                ephemeral=True
+            )
+            return
+        
+        if self.publisher.last_match is None:
+            message = "⏳ 战报正在生成，请稍后再试" if self.publisher.generation is None else "暂无比赛记录"
+            await interaction.response.send_message(message, ephemeral=True)
+            return
+        await interaction.response.send_message(embed=self.publisher.last_match)
+    
+    @app_commands.command(name="mapinfo", description="查看地图信息")
+    @app_commands.describe(name="地图名称或地图ID")
+    async def mapinfo(self, interaction: discord.Interaction, name: str):
+        """
+        地图信息：所在地图包、创意工坊链接和在本服务器的对局统计
+        用法: /mapinfo name:BVR Ethi5
+        """
+        if not self.check_channel_permission(interaction.channel_id, ALLOWED_CHANNELS_BOTCOMMAND):
+            await interaction.response.send_message(
+                "❌ 此命令不能在当前频道使用！",
+                ephemeral=True
+            )
+            return
+        
+        entry = self.map_catalog.find(name)
+        if entry is None:
+            await interaction.response.send_message(f"❌ 找不到地图：{name}", ephemeral=True)
+            return
+        try:
+            played = await self.query_cache.get_or_load(
+                "mapinfo",
+                lambda: self.db_reader.run(self.stats_service.get_map_played, entry.map_id),
+                map_id=entry.map_id,
+            )
+        except Exception as e:
+            print(f"[ERROR] Mapinfo query error: {e}")
+            played = None
+        
+        embed = discord.Embed(
+            title=f"🗺️ {entry.map_name}",
+            url=entry.workshop_url,
+            color=discord.Color.blue()
+        )
+        embed.add_field(name="地图ID", value=f"`{entry.map_id}`", inline=True)
+        embed.add_field(name="地图包", value=entry.package_name or entry.package_id, inline=True)
+        embed.add_field(name="创意工坊ID", value=f"`{entry.wsid}`", inline=True)
+        if played and played["matches"]:
+            embed.add_field(
+                name="📊 本服对局",
+                value=(
+                    f"场次: {played['matches']}\n"
+                    f"类型: {played['map_types'] or '-'}\n"
+                    f"最近: {played['last_played']}"
+                ),
+                inline=False
+            )
+        else:
+            embed.add_field(name="📊 本服对局", value="暂无记录", inline=False)
+        await interaction.response.send_message(embed=embed)
+    
+    @mapinfo.autocomplete("name")
+    async def mapinfo_name_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        """/mapinfo name 参数的自动补全，直接查内存里的地图目录"""
+        if not current.strip():
+            return []
+        return [
+            app_commands.Choice(name=f"{entry.map_name} ({entry.package_name})"[:100], value=entry.key[:100])
+            for entry in self.map_catalog.search(current, limit=25)
+        ]
+    
     @app_commands.command(name="ai", description="使用AI智能查询数据库")
     @app_commands.describe(
         query="你的自然语言查询，例如：查一下最近的BVR表现、谁在排行榜第一"
@@ -368,96 +697,165 @@ class BotCommands(commands.Cog):
             user_name = interaction.user.display_name
             print(f"[RAG Query] 用户 {user_name} 查询: {query}")
             
-            # 1. 使用RAG系统处理查询
-            rag_result = self.rag_system.process_query(query)
-            
-            if not rag_result["success"]:
-                await interaction.followup.send(
-                    "❌ 没有找到相关数据，请尝试其他查询方式",
-                    ephemeral=True
-                )
+            # 0. 工具调用模式：模型自己决定查什么（不支持 tools 或没有输出时退回下面的 RAG 流程）
+            if self.tools_enabled and await self._ai_query_with_tools(interaction, query, user_name):
                 return
             
-            # 2. 调用Ollama API生成自然语言总结
-            try:
-                # 构建AI提示词
-                system_prompt = (
-                    "你是ezServer游戏服务器的数据分析AI助手。"
-                    "你会收到数据库查询结果，请根据这些数据生成简洁清晰的中文总结或战报。"
-                    "要求：\n"
-                    "1. 突出关键数据和趋势\n"
-                    "2. 使用适当的emoji增强可读性\n"
-                    "3. 保持专业和友好的语气\n"
-                    "4. 如果是战报，要有叙事感\n"
-                )
-                
-                messages = [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": rag_result["llm_context"]}
-                ]
-                
-                ai_summary = await self._call_ollama_api(messages)
-                
-                if not ai_summary:
-                    # 如果AI总结失败，返回原始数据摘要
-                    ai_summary = self._format_data_fallback(rag_result["data"], rag_result["intent"])
-                
-            except Exception as e:
-                print(f"[ERROR] AI总结失败: {e}")
-                ai_summary = self._format_data_fallback(rag_result["data"], rag_result["intent"])
-            
-            # 3. 构建Discord响应
-            embed = discord.Embed(
-                title="🤖 AI 智能查询结果",
-                color=discord.Color.blue()
+            # 1. 意图识别，按 (意图, 玩家, 地图类型, 时间范围, 数量) 缓存SQL结果（新比赛入库后失效）
+            intent = self.rag_system.intent_detector.detect(query)
+            rag_result = await self.query_cache.get_or_load(
+                "rag",
+                lambda: self.db_reader.run(self.rag_system.run_intent, intent),
+                cache_if=lambda result: result["success"],
+                intent=intent["intent"],
+                players=tuple(intent["players"]),
+                tentative_players=tuple(intent["tentative_players"]),
+                map_type=intent["map_type"],
+                time_range=intent["time_range"],
+                limit=intent["limit"],
             )
             
-            # 显示用户查询
-            embed.add_field(
-                name="💬 你的查询",
-                value=f"`{query}`",
-                inline=False
-            )
+            # 向量检索和问题最相关的几局比赛：只在关键词意图没把握或者没有查到数据时补充
+            # （关键词意图覆盖不到的描述性问题靠它）
+            retrieved = []
+            if not intent["confident"] or not rag_result["success"]:
+                retrieved = await self._retrieve_matches(query)
             
-            # 显示识别的意图
-            intent_name = rag_result["intent"].get("intent", "未知")
-            embed.add_field(
-                name="🎯 识别意图",
-                value=f"`{intent_name}`",
-                inline=True
-            )
+            # 数据和检索到的比赛摘要共用同一个 token 预算：两者都有时各占一半，放不下的摘要截断或丢弃
+            llm_context = rag_result["llm_context"]
+            if retrieved:
+                executor = self.rag_system.rag_executor
+                budget = executor.CONTEXT_TOKEN_BUDGET
+                if rag_result["success"]:
+                    llm_context = executor.format_for_llm(
+                        rag_result["data"], rag_result["columns"], rag_result["intent"], max_tokens=budget // 2,
+                        unresolved_players=rag_result["unresolved_players"],
+                    )
+                retrieved = trim_retrieved(retrieved, budget - estimate_tokens(llm_context))
+                if retrieved:
+                    llm_context = f"{llm_context}\n\n{format_retrieved(retrieved)}"
             
-            # 显示数据条数
-            embed.add_field(
-                name="📊 数据条数",
-                value=f"`{len(rag_result['data'])}` 条",
-                inline=True
-            )
+            unresolved = rag_result["unresolved_players"]
+            if not rag_result["success"] and not retrieved:
+                message = "❌ 没有找到相关数据，请尝试其他查询方式"
+                if unresolved:
+                    message = f"❌ 未找到玩家：{'、'.join(f'`{name}`' for name in unresolved)}，请检查玩家名"
+                await interaction.followup.send(message, ephemeral=True)
+                return
+            
+            # 2. 构建Discord响应（AI总结流式写入 Embed 的 description）
+            intent_name = rag_result["intent"].get("intent", "未知")
             
-            # 显示AI总结（分段处理，避免超过Discord字段限制）
-            summary_chunks = self._split_text(ai_summary, 1024)
-            for i, chunk in enumerate(summary_chunks[:3], 1):  # 最多3段
-                field_name = "🔮 AI 分析" if i == 1 else f"🔮 AI 分析 (续{i-1})"
+            def render(text: str, final: bool, index: int) -> Dict:
+                if index > 0:
+                    embed = discord.Embed(
+                        title="🔮 AI 分析 (续)",
+                        description=text,
+                        color=discord.Color.blue()
+                    )
+                    if final:
+                        embed.set_footer(text=f"查询用户: {user_name} | RAG系统 v1.0")
+                    return {"embed": embed}
+                
+                embed = discord.Embed(
+                    title="🤖 AI 智能查询结果",
+                    description=text or "⏳ 正在生成分析…",
+                    color=discord.Color.blue()
+                )
+                
+                # 显示用户查询
                 embed.add_field(
-                    name=field_name,
-                    value=chunk,
+                    name="💬 你的查询",
+                    value=f"`{query}`",
                     inline=False
                 )
-            
-            # 显示生成的SQL（可选，调试用）
-            if len(rag_result["sql"]) < 500:
+                
+                # 显示识别的意图
                 embed.add_field(
-                    name="🔧 生成的SQL",
-                    value=f"```sql\n{rag_result['sql'][:500]}\n```",
-                    inline=False
+                    name="🎯 识别意图",
+                    value=f"`{intent_name}`",
+                    inline=True
+                )
+                
+                # 显示数据条数
+                embed.add_field(
+                    name="📊 数据条数",
+                    value=f"`{len(rag_result['data'])}` 条",
+                    inline=True
                 )
+                
+                # 没有匹配到的玩家名（结果没有按它们过滤）
+                if unresolved:
+                    embed.add_field(
+                        name="⚠️ 未找到玩家",
+                        value=" ".join(f"`{name}`" for name in unresolved)[:1024],
+                        inline=True
+                    )
+                
+                # 显示检索到的比赛
+                if retrieved:
+                    embed.add_field(
+                        name="🔎 相关比赛",
+                        value=" ".join(f"`#{replay_id}`" for replay_id, _, _ in retrieved),
+                        inline=True
+                    )
+                
+                # 显示生成的SQL（可选，调试用）
+                if len(rag_result["sql"]) < 500:
+                    embed.add_field(
+                        name="🔧 生成的SQL",
+                        value=f"```sql\n{rag_result['sql'][:500]}\n```",
+                        inline=False
+                    )
+                
+                embed.set_footer(text=f"查询用户: {user_name} | RAG系统 v1.0")
+                return {"embed": embed}
             
-            embed.set_footer(text=f"查询用户: {user_name} | RAG系统 v1.0")
+            reply = StreamingReply(
+                interaction.followup.send,
+                render=render,
+                max_length=3500,
+                edit_interval=OLLAMA_CONFIG["stream_edit_interval"],
+            )
+            
+            # 3. 流式调用Ollama API生成自然语言总结（相同的数据上下文只总结一次）
+            messages = [
+                {"role": "system", "content": RAG_SYSTEM_PROMPT},
+                {"role": "user", "content": llm_context}
+            ]
+            summary_key = content_digest(RAG_SYSTEM_PROMPT + llm_context)
+            try:
+                ai_summary = self.summary_cache.get("summary", digest=summary_key)
+                if ai_summary:
+                    await reply.feed(ai_summary)
+                else:
+                    async def notify_queued(position: int):
+                        await interaction.followup.send(
+                            f"⏳ AI正忙，你的请求排在第 {position} 位，请稍候…",
+                            ephemeral=True
+                        )
+                    
+                    ai_summary, complete = await self._stream_summary(
+                        messages, summary_key, reply, on_queued=notify_queued
+                    )
+                    if ai_summary and complete:
+                        self.summary_cache.set("summary", ai_summary, digest=summary_key)
+                
+            except Exception as e:
+                print(f"[ERROR] AI总结失败: {e}")
+                ai_summary = None
+            
+            if not ai_summary:
+                # 如果AI总结失败，返回原始数据摘要
+                if rag_result["data"] or not retrieved:
+                    await reply.feed(self._format_data_fallback(rag_result["data"], rag_result["intent"]))
+                else:
+                    await reply.feed(format_retrieved(retrieved))
+            await reply.finish()
             
-            await interaction.followup.send(embed=embed)
             print(f"[RAG Query] 查询完成，返回 {len(rag_result['data'])} 条数据")
             
-        except requests.exceptions.ConnectionError:
+        except OllamaConnectionError:
             await interaction.followup.send(
                 "❌ 无法连接到AI服务，请确保Ollama服务正在运行\n"
                 f"💡 Ollama地址: {OLLAMA_CONFIG['url']}",
@@ -474,6 +872,75 @@ class BotCommands(commands.Cog):
             import traceback
             traceback.print_exc()
     
+    async def _ai_query_with_tools(self, interaction: discord.Interaction, query: str, user_name: str) -> bool:
+        """
+        /ai 的工具调用模式：把问题直接交给模型，模型通过 LLMToolbox 按需查询
+        工具结果缓存在 query_cache 里（跟随数据代数失效），不同用户问到同样的数据时直接复用
+        :return: True 表示已经回复；False 表示模型不支持 tools 或没有任何输出，调用方应退回 RAG 流程
+        """
+        tools_used: List[str] = []
+        
+        def render(text: str, final: bool, index: int) -> Dict:
+            embed = discord.Embed(
+                title="🤖 AI 智能查询结果" if index == 0 else "🔮 AI 分析 (续)",
+                description=text or "⏳ 正在生成分析…",
+                color=discord.Color.blue()
+            )
+            if index == 0:
+                embed.add_field(name="💬 你的查询", value=f"`{query}`", inline=False)
+                if tools_used:
+                    embed.add_field(
+                        name="🧰 调用的工具",
+                        value=", ".join(f"`{name}`" for name in dict.fromkeys(tools_used))[:1024],
+                        inline=False
+                    )
+            embed.set_footer(text=f"查询用户: {user_name} | 工具调用模式")
+            return {"embed": embed}
+        
+        async def notify_queued(position: int):
+            await interaction.followup.send(
+                f"⏳ AI正忙，你的请求排在第 {position} 位，请稍候…",
+                ephemeral=True
+            )
+        
+        reply = StreamingReply(
+            interaction.followup.send,
+            render=render,
+            max_length=3500,
+            edit_interval=OLLAMA_CONFIG["stream_edit_interval"],
+        )
+        messages = [
+            {"role": "system", "content": f"{RAG_SYSTEM_PROMPT}\n{TOOL_SYSTEM_PROMPT}"},
+            {"role": "user", "content": query},
+        ]
+        try:
+            ai_response, _ = await self._stream_ollama(
+                messages, reply, on_queued=notify_queued, tool_cache=self.query_cache, tools_used=tools_used,
+                priority=PRIORITY_COMMAND,
+            )
+        except OllamaToolsUnsupported as e:
+            self.tools_enabled = False
+            print(f"[ERROR] {e}，关闭工具调用模式，改用RAG查询")
+            return False
+        if not ai_response:
+            return False
+        await reply.finish()
+        print(f"[RAG Query] 工具调用模式完成，调用工具: {tools_used}")
+        return True
+    
+    async def _retrieve_matches(self, query: str) -> List[Tuple[int, float, str]]:
+        """
+        向量检索相关比赛；索引不存在或向量模型不可用时返回空列表（不影响 /ai 的其他流程）
+        :return: [(replay_id, 相似度, 摘要), ...]
+        """
+        if self.match_retriever is None:
+            return []
+        try:
+            return await self.match_retriever.search(query)
+        except Exception as e:
+            print(f"[ERROR] 比赛检索失败: {e}")
+            return []
+    
     def _split_text(self, text: str, max_length: int) -> List[str]:
         """
         将长文本分割成多个段落
@@ -530,7 +997,7 @@ class BotCommands(commands.Cog):
     async def chat_with_ai(self, interaction: discord.Interaction, message: str):
         """
         与AI聊天功能
-        一次只能有一个用户对话，3分钟无活动自动结束
+        每个用户独立的对话上下文，模型请求按先来后到排队，3分钟无活动自动结束
         """
         # 检查频道权限
         if not self.check_channel_permission(interaction.channel_id, ALLOWED_CHANNELS_AI):
@@ -547,78 +1014,55 @@ class BotCommands(commands.Cog):
             user_name = interaction.user.display_name
             channel_id = interaction.channel_id
             
-            async with self.chat_lock:
-                # 检查是否有其他用户正在对话
-                if self.current_chat_user is not None and self.current_chat_user != user_id:
-                    current_user = await self.bot.fetch_user(self.current_chat_user)
-                    await interaction.followup.send(
-                        f"❌ AI当前正在与 {current_user.display_name} 对话中，请稍后再试！\n"
-                        f"💡 提示：使用 `/endaichat` 可以结束对话",
-                        ephemeral=True
-                    )
-                    return
-                
-                # 初始化对话（如果是新对话）
-                if self.current_chat_user != user_id:
-                    self.current_chat_user = user_id
-                    self.current_chat_channel = channel_id
-
-                    self.chat_messages = [
-                        {
-                            "role": "system",
-                            "content": (
-                                "你是ezServer游戏服务器的AI助手。你可以帮助玩家查询统计数据、"
-                                "回答游戏相关问题。请用简洁清晰的中文回答。"
-                            )
-                        }
-                    ] #preset system prompt
-                    print(f"[AI Chat] 开始与用户 {user_name} ({user_id}) 的新对话")
-                
-                # 更新活动时间
-                self.last_activity_time = time.time()
-                
-                # 添加用户消息到历史
-                self.chat_messages.append({
-                    "role": "user",
-                    "content": message
-                }) #add user message into context
+            session, created, evicted = self.chat_sessions.get_or_create(
+                user_id, channel_id, user_name, CHAT_SYSTEM_PROMPT
+            )
+            if created:
+                print(f"[AI Chat] 开始与用户 {user_name} ({user_id}) 的新对话")
+            for old in evicted:
+                print(f"[AI Chat] 会话数已满，移除最久未活动的对话: {old.user_name} ({old.user_id})")
+            
+            async def notify_queued(position: int):
+                await interaction.followup.send(
+                    f"⏳ AI正忙，你的请求排在第 {position} 位，请稍候…",
+                    ephemeral=True
+                )
+            
+            # 同一用户的消息按顺序处理
+            async with session.lock:
+                session.touch()
+                session.context.add("user", message) #add user message into context
                 
-                # call ollama api to get ai response
+                # call ollama api, stream the response into follow-up messages
                 try:
-                    ai_response = await self._call_ollama_api(self.chat_messages)
+                    reply = StreamingReply(
+                        interaction.followup.send,
+                        max_length=1900,
+                        edit_interval=OLLAMA_CONFIG["stream_edit_interval"],
+                    )
+                    ai_response = None
+                    if self.tools_enabled:
+                        # 工具调用的中间消息只存在于本次请求，不写入会话上下文
+                        messages = session.context.build()
+                        messages[0] = {"role": "system", "content": f"{messages[0]['content']}\n{TOOL_SYSTEM_PROMPT}"}
+                        try:
+                            ai_response, _ = await self._stream_ollama(
+                                messages, reply, on_queued=notify_queued, tool_cache=self._session_tool_cache(session)
+                            )
+                        except OllamaToolsUnsupported as e:
+                            self.tools_enabled = False
+                            print(f"[ERROR] {e}，关闭工具调用模式")
+                    if not self.tools_enabled:
+                        ai_response, _ = await self._stream_ollama(session.context.build(), reply, on_queued=notify_queued)
                     
                     if ai_response:
                         # add ai response into context
-                        self.chat_messages.append({
-                            "role": "assistant",
-                            "content": ai_response
-                        })
-                        
-                        # create response embed
-                        embed = discord.Embed(
-                            title="🤖 AI助手",
-                            color=discord.Color.green()
-                        )
-                        embed.add_field(
-                            name="💬 你的消息",
-                            value=message[:1024],  # discord field limit
-                            inline=False
-                        )
-                        if len(ai_response) > 1024:
-                            embed.add_field(
-                                name="🔮 AI回复",
-                                value=ai_response[:1024],  # discord field limit
-                                inline=False
-                            )
-                            embed.add_field(
-                                name="🔮 AI回复",
-                                value=ai_response[1024:2048],  # discord field limit
-                                inline=False
-                            )
-                        
-                        embed.set_footer(text=f"对话轮数: {(len(self.chat_messages) - 1) // 2} | 3分钟无活动将自动结束")
+                        session.context.add("assistant", ai_response)
+                        session.rounds += 1
+                        session.touch()
+                        self._maybe_summarize(session)
                         
-                        await interaction.followup.send(embed=embed)
+                        await reply.finish(f"-# 对话轮数: {session.rounds} | 3分钟无活动将自动结束")
                         print(f"[AI Chat] User {user_name}: {message[:50]}...")
                         print(f"[AI Chat] AI: {ai_response[:50]}...")
                     else:
@@ -626,15 +1070,15 @@ class BotCommands(commands.Cog):
                             "❌ AI未返回响应，请重试",
                             ephemeral=True
                         )
-                        self.chat_messages.pop()  # 移除用户消息
+                        session.context.pop()  # 移除用户消息
                         
-                except requests.exceptions.ConnectionError:
+                except OllamaConnectionError:
                     await interaction.followup.send(
                         "❌ 无法连接到AI服务，请确保Ollama服务正在运行\n"
                         f"💡 Ollama地址: {OLLAMA_CONFIG['url']}",
                         ephemeral=True
                     )
-                    self.chat_messages.pop()
+                    session.context.pop()
                     print(f"[ERROR] 无法连接到Ollama服务: {OLLAMA_CONFIG['url']}")
                     
                 except Exception as e:
@@ -642,7 +1086,7 @@ class BotCommands(commands.Cog):
                         f"❌ AI处理出错：{str(e)}",
                         ephemeral=True
                     )
-                    self.chat_messages.pop()
+                    session.context.pop()
                     print(f"[ERROR] AI处理错误: {e}")
                     
         except Exception as e:
@@ -652,10 +1096,10 @@ class BotCommands(commands.Cog):
             )
             print(f"[ERROR] Chat with AI error: {e}")
     
-    @app_commands.command(name="endaichat", description="结束当前AI对话")
+    @app_commands.command(name="endaichat", description="结束你的AI对话")
     async def end_ai_chat(self, interaction: discord.Interaction):
         """
-        手动结束AI对话，清理上下文
+        手动结束自己的AI对话，清理上下文
         """
         # 检查频道权限
         if not self.check_channel_permission(interaction.channel_id, ALLOWED_CHANNELS_AI):
@@ -671,43 +1115,28 @@ class BotCommands(commands.Cog):
             user_id = interaction.user.id
             user_name = interaction.user.display_name
             
-            async with self.chat_lock:
-                # 检查是否有正在进行的对话
-                if self.current_chat_user is None:
-                    await interaction.followup.send(
-                        "ℹ️ 当前没有进行中的AI对话",
-                        ephemeral=True
-                    )
-                    return
-                
-                # 检查是否是当前对话的用户
-                if self.current_chat_user != user_id:
-                    current_user = await self.bot.fetch_user(self.current_chat_user)
-                    await interaction.followup.send(
-                        f"❌ 只有 {current_user.display_name} 可以结束当前对话",
-                        ephemeral=True
-                    )
-                    return
-                
-                # 统计对话信息
-                rounds = (len(self.chat_messages) - 1) // 2
-                
-                # 清理对话状态
-                self._clear_chat_session()
-                
-                embed = discord.Embed(
-                    title="✅ AI对话已结束",
-                    description=f"与 {user_name} 的对话已结束并清理上下文",
-                    color=discord.Color.blue()
-                )
-                embed.add_field(
-                    name="📊 对话统计",
-                    value=f"对话轮数: {rounds}",
-                    inline=False
+            session = self.chat_sessions.end(user_id)
+            if session is None:
+                await interaction.followup.send(
+                    "ℹ️ 你当前没有进行中的AI对话",
+                    ephemeral=True
                 )
-                
-                await interaction.followup.send(embed=embed)
-                print(f"[AI Chat] 用户 {user_name} ({user_id}) 手动结束对话，共 {rounds} 轮")
+                return
+            
+            rounds = session.rounds
+            embed = discord.Embed(
+                title="✅ AI对话已结束",
+                description=f"与 {user_name} 的对话已结束并清理上下文",
+                color=discord.Color.blue()
+            )
+            embed.add_field(
+                name="📊 对话统计",
+                value=f"对话轮数: {rounds}",
+                inline=False
+            )
+            
+            await interaction.followup.send(embed=embed)
+            print(f"[AI Chat] 用户 {user_name} ({user_id}) 手动结束对话，共 {rounds} 轮")
                 
         except Exception as e:
             await interaction.followup.send(
@@ -716,100 +1145,254 @@ class BotCommands(commands.Cog):
             )
             print(f"[ERROR] End AI chat error: {e}")
     
-    async def _call_ollama_api(self, messages: List[Dict]) -> Optional[str]:
+    async def _call_ollama_api(self, messages: List[Dict], on_queued=None,
+                               priority: int = PRIORITY_CHAT) -> Optional[str]:
         """
-        调用Ollama API获取AI响应
+        调用Ollama API获取AI响应（经过 llm_gateway 按优先级排队，限制同时请求数）
+        完全相同的消息正在请求时直接等待那次的结果；
+        交互被放弃时（任务取消）会断开与 Ollama 的连接，不再占用模型
         :param messages: 消息历史
+        :param on_queued: 需要排队时的回调，参数为排队位置
+        :param priority: 排队优先级
         :return: AI响应文本
         """
-        url = f"{OLLAMA_CONFIG['url']}/api/chat"
-        payload = {
-            "model": OLLAMA_CONFIG["model"],
-            "messages": messages,
-            "stream": False,  # 使用非流式响应以简化处理
-        }
+        async def request():
+            async with self.llm_gateway.slot(priority):
+                return await self.ollama.chat(list(messages))
         
         try:
-            # 在异步环境中运行同步请求
-            loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: requests.post(
-                    url,
-                    json=payload,
-                    timeout=OLLAMA_CONFIG["timeout"]
-                )
-            )
-            
-            response.raise_for_status()
-            data = response.json()
-            
-            # 提取响应内容
-            message = data.get("message", {})
-            content = message.get("content", "")
-            
-            return content.strip() if content else None
+            key = content_digest(json.dumps(messages, ensure_ascii=False, sort_keys=True))
+            return await self.llm_gateway.run(key, request, on_queued=on_queued)
             
-        except requests.exceptions.Timeout:
-            print(f"[ERROR] Ollama API 超时")
+        except OllamaTimeout as e:
+            print(f"[ERROR] Ollama API 超时: {e}")
             return None
-        except requests.exceptions.RequestException as e:
+        except OllamaConnectionError as e:
             print(f"[ERROR] Ollama API 请求错误: {e}")
             raise
-        except Exception as e:
+        except OllamaError as e:
             print(f"[ERROR] 处理Ollama响应时出错: {e}")
             return None
     
-    def _clear_chat_session(self):
-        """清理对话会话状态"""
-        self.current_chat_user = None
-        self.current_chat_channel = None
-        self.chat_messages = []
-        self.last_activity_time = 0
-        print("[AI Chat] 对话会话已清理")
+    def _maybe_summarize(self, session):
+        """上下文超出预算时，在后台把较早的轮次总结进滚动摘要（不阻塞当前回复）"""
+        if not session.context.needs_compaction():
+            return
+        turns = session.context.take_for_summary()
+        if not turns:
+            return
+        task = asyncio.create_task(self._summarize_turns(session, turns))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+    
+    async def _summarize_turns(self, session, turns: List[Dict]):
+        """
+        生成新的滚动摘要 = 旧摘要 + 被折叠的轮次
+        失败时退化为截断拼接，保证摘要状态总能复位
+        """
+        transcript = "\n".join(
+            f"{'用户' if m['role'] == 'user' else 'AI'}: {m['content']}" for m in turns
+        )
+        previous = session.context.summary
+        messages = [
+            {
+                "role": "system",
+                "content": "把下面的对话压缩成简短的中文摘要，保留玩家名、数据和结论，不超过200字。只输出摘要。"
+            },
+            {
+                "role": "user",
+                "content": (f"已有摘要：\n{previous}\n\n" if previous else "") + f"新的对话：\n{transcript}"
+            },
+        ]
+        summary = None
+        try:
+            summary = await self._call_ollama_api(messages, priority=PRIORITY_BACKGROUND)
+        except Exception as e:
+            print(f"[ERROR] AI Chat summary failed: {e}")
+        if not summary:
+            summary = f"{previous}\n{transcript}".strip()[-600:]
+        session.context.apply_summary(summary)
+        if DEBUG_MODE:
+            print(f"[DEBUG] Session {session.user_id} summarized {len(turns)} messages -> {len(summary)} chars")
+    
+    def _session_tool_cache(self, session) -> QueryCache:
+        """对话的工具结果缓存，代数与全局查询缓存保持一致（新比赛入库后失效）"""
+        if session.tool_cache is None:
+            session.tool_cache = QueryCache(
+                max_entries=LLM_TOOLS_CONFIG["cache_entries"],
+                ttl=QUERY_CACHE_CONFIG["ttl"],
+            )
+        if self.query_cache.generation is not None:
+            session.tool_cache.set_generation(self.query_cache.generation)
+        return session.tool_cache
+    
+    async def _run_tool_rounds(self, messages: List[Dict], reply: StreamingReply, tool_cache: QueryCache,
+                               tools_used: Optional[List[str]] = None) -> None:
+        """
+        工具调用循环：模型返回 tool_calls 时执行工具、把结果作为 tool 消息追加后再请求一次，
+        直到模型直接回答；最后一轮不再提供工具，强制模型给出回答。
+        模型的直接回答也出现在提供工具的轮次里，所以文本边收边写入 reply；
+        一旦出现 tool_calls 就停止写入并撤回这一轮已经写出的文字（调用工具前的“思考”只留在消息历史里）
+        """
+        max_rounds = LLM_TOOLS_CONFIG["max_rounds"]
+        for round_no in range(max_rounds + 1):
+            last_round = round_no == max_rounds
+            extra = {} if last_round else {"tools": self.toolbox.schemas()}
+            content = ""
+            tool_calls = []
+            shown = len(reply.text)
+            async with aclosing(self.ollama.stream_messages(messages, **extra)) as stream:
+                async for message in stream:
+                    tool_calls.extend(message.get("tool_calls") or [])
+                    if message.get("content"):
+                        content += message["content"]
+                        if not tool_calls:
+                            await reply.feed(message["content"])
+            if not tool_calls:
+                return
+            await reply.retract(shown)
+            
+            messages.append({"role": "assistant", "content": content, "tool_calls": tool_calls})
+            for call in tool_calls:
+                function = call.get("function") or {}
+                name = function.get("name", "")
+                if tools_used is not None:
+                    tools_used.append(name)
+                result = await self.toolbox.call(name, function.get("arguments"), cache=tool_cache)
+                if DEBUG_MODE:
+                    print(f"[DEBUG] Tool {name}({function.get('arguments')}) -> {len(result)} chars")
+                messages.append({"role": "tool", "content": result, "tool_name": name})
+    
+    async def _stream_summary(self, messages: List[Dict], key: str, reply: StreamingReply,
+                              on_queued=None) -> Tuple[Optional[str], bool]:
+        """
+        流式生成 /ai 总结（调用方负责 reply.finish()）
+        相同 key 的总结正在生成时不再请求模型，而是订阅那次生成：
+        生成的文本经 ReplyBroadcast 同时写进每个调用方自己的 reply，去重的只是文本
+        :param messages: 消息历史
+        :param key: 去重键（数据上下文的摘要）
+        :param reply: 这个调用方的流式回复
+        :param on_queued: 这个调用方的排队提示
+        :return: (总结文本, 是否完整)，完全没有输出时文本为None
+        """
+        broadcast = self._summary_broadcasts.get(key) if self.llm_gateway.is_inflight(key) else None
+        if broadcast is None:
+            broadcast = ReplyBroadcast()
+            if not self.llm_gateway.is_inflight(key):
+                self._summary_broadcasts[key] = broadcast
+        await broadcast.subscribe(reply)
+        
+        async def generate():
+            try:
+                return await self._generate_text(messages, priority=PRIORITY_COMMAND, on_part=broadcast.feed)
+            finally:
+                if self._summary_broadcasts.get(key) is broadcast:
+                    del self._summary_broadcasts[key]
+        
+        try:
+            text, complete = await self.llm_gateway.run(key, generate, on_queued=on_queued)
+        finally:
+            broadcast.unsubscribe(reply)
+        if text and not reply.text:
+            # 加入时那次生成刚好结束，或者写入这个回复失败过：直接写完整文本
+            await reply.feed(text)
+        if text and not complete:
+            await reply.feed("\n⚠️ 回复超时或出错，内容可能不完整")
+        return text, complete
+    
+    async def _generate_text(self, messages: List[Dict], priority: int = PRIORITY_CHAT,
+                             on_part=None) -> Tuple[Optional[str], bool]:
+        """
+        生成回复，不写任何人的消息（结果可以通过 llm_gateway.run 交给多个等待方）
+        超时或出错时保留已经生成的部分
+        :param on_part: 可选，每收到一段文本时 await on_part(文本)（例如 ReplyBroadcast.feed）
+        :return: (回复文本, 是否完整)，完全没有输出时文本为None
+        :raises OllamaConnectionError: 连不上 Ollama 且没有任何输出
+        """
+        parts = []
+        try:
+            async with self.llm_gateway.slot(priority):
+                async with aclosing(self.ollama.stream_chat(list(messages))) as stream:
+                    async for part in stream:
+                        parts.append(part)
+                        if on_part is not None:
+                            await on_part(part)
+        except OllamaConnectionError as e:
+            print(f"[ERROR] Ollama API 请求错误: {e}")
+            if not "".join(parts).strip():
+                raise
+            return "".join(parts).strip(), False
+        except OllamaError as e:
+            print(f"[ERROR] Ollama API 出错: {e}")
+            return "".join(parts).strip() or None, False
+        return "".join(parts).strip() or None, True
+    
+    async def _stream_ollama(self, messages: List[Dict], reply: StreamingReply, on_queued=None,
+                             tool_cache: Optional[QueryCache] = None,
+                             tools_used: Optional[List[str]] = None,
+                             priority: int = PRIORITY_CHAT) -> Tuple[Optional[str], bool]:
+        """
+        流式调用Ollama，边生成边写入 reply（调用方负责 reply.finish()）
+        超时或出错时保留已经生成的部分并提示内容不完整
+        :param messages: 消息历史
+        :param reply: 流式回复对象
+        :param on_queued: 需要排队时的回调，参数为排队位置
+        :param tool_cache: 传入时启用工具调用，工具结果缓存在这里
+        :param tools_used: 可选，记录调用过的工具名
+        :param priority: 排队优先级（斜杠命令查询高于自由对话）
+        :return: (回复文本, 是否完整)，完全没有输出时文本为None
+        :raises OllamaToolsUnsupported: 启用工具调用但模型不支持 tools
+        """
+        try:
+            async with self.llm_gateway.slot(priority, on_queued):
+                if tool_cache is not None:
+                    await self._run_tool_rounds(list(messages), reply, tool_cache, tools_used)
+                else:
+                    async with aclosing(self.ollama.stream_chat(list(messages))) as stream:
+                        async for part in stream:
+                            await reply.feed(part)
+            
+        except OllamaToolsUnsupported:
+            raise
+        except OllamaConnectionError as e:
+            print(f"[ERROR] Ollama API 请求错误: {e}")
+            if not reply.text.strip():
+                raise
+            await reply.feed("\n⚠️ 与AI服务的连接中断，回复不完整")
+            return reply.text.strip(), False
+        except OllamaError as e:
+            print(f"[ERROR] Ollama API 出错: {e}")
+            if reply.text.strip():
+                await reply.feed("\n⚠️ 回复超时或出错，内容可能不完整")
+            return reply.text.strip() or None, False
+        
+        return reply.text.strip() or None, True
     
     @tasks.loop(seconds=30)
     async def check_chat_timeout(self):
         """定期检查对话超时（每30秒检查一次）"""
         try:
-            # 如果有正在进行的对话
-            if self.current_chat_user is not None and self.last_activity_time > 0:
-                idle_time = time.time() - self.last_activity_time
-                
-                # 如果超过设定的超时时间
-                if idle_time > OLLAMA_CONFIG["chat_timeout"]:
-                    async with self.chat_lock:
-                        if self.current_chat_user is not None:  # 再次检查
-                            user_id = self.current_chat_user
-                            channel_id = self.current_chat_channel
-                            rounds = (len(self.chat_messages) - 1) // 2
-                            
-                            try:
-                                # 获取用户和频道对象
-                                user = await self.bot.fetch_user(user_id)
-                                channel = self.bot.get_channel(channel_id)
-                                
-                                if channel:
-                                    embed = discord.Embed(
-                                        title="⏰ AI对话已自动结束",
-                                        description=f"由于3分钟无活动，与 {user.display_name} 的对话已自动结束",
-                                        color=discord.Color.orange()
-                                    )
-                                    embed.add_field(
-                                        name="📊 对话统计",
-                                        value=f"对话轮数: {rounds}",
-                                        inline=False
-                                    )
-                                    await channel.send(embed=embed)
-                                
-                                print(f"[AI Chat] 对话超时，自动结束与用户 {user.display_name} ({user_id}) 的对话")
-                                
-                            except Exception as e:
-                                print(f"[ERROR] 发送超时通知时出错: {e}")
-                            
-                            finally:
-                                # 清理会话
-                                self._clear_chat_session()
+            for session in self.chat_sessions.expire_idle():
+                try:
+                    channel = self.bot.get_channel(session.channel_id)
+                    
+                    if channel:
+                        embed = discord.Embed(
+                            title="⏰ AI对话已自动结束",
+                            description=f"由于3分钟无活动，与 {session.user_name} 的对话已自动结束",
+                            color=discord.Color.orange()
+                        )
+                        embed.add_field(
+                            name="📊 对话统计",
+                            value=f"对话轮数: {session.rounds}",
+                            inline=False
+                        )
+                        await channel.send(embed=embed)
+                    
+                    print(f"[AI Chat] 对话超时，自动结束与用户 {session.user_name} ({session.user_id}) 的对话")
+                    
+                except Exception as e:
+                    print(f"[ERROR] 发送超时通知时出错: {e}")
                                 
         except Exception as e:
             print(f"[ERROR] 检查对话超时时出错: {e}")
@@ -819,9 +1402,107 @@ class BotCommands(commands.Cog):
         """等待bot准备就绪"""
         await self.bot.wait_until_ready()
     
-    def cog_unload(self):
-        """卸载Cog时停止任务"""
+    @tasks.loop(seconds=5)
+    async def refresh_cache_generation(self):
+        """定期读取数据库 generation，有新比赛入库时清空查询缓存并刷新排行榜 / 战报快照"""
+        try:
+            generation = await self.db_reader.run(self.stats_service.db.get_generation)
+            if self.query_cache.set_generation(generation):
+                if DEBUG_MODE:
+                    print(f"[DEBUG] Query cache invalidated, generation={generation}")
+            # publisher.generation 只在快照全部生成后才更新，上次刷新失败时下一轮会重试
+            if self.publisher.generation != generation:
+                await self.publisher.refresh(generation)
+        except Exception as e:
+            print(f"[ERROR] Refresh cache generation error: {e}")
+    
+    @refresh_cache_generation.before_loop
+    async def before_refresh_cache_generation(self):
+        """等待bot准备就绪"""
+        await self.bot.wait_until_ready()
+    
+    @tasks.loop(seconds=60)
+    async def check_ollama_health(self):
+        """第一次运行时确认模型并预热，之后定期检查 Ollama 是否可用、模型是否仍在显存中"""
+        try:
+            # 预热请求和普通请求一样排队，不和用户请求抢 Ollama 的并发槽
+            async with self.llm_gateway.slot(PRIORITY_BACKGROUND):
+                if self.check_ollama_health.current_loop == 0:
+                    await self.model_lifecycle.start()
+                else:
+                    await self.model_lifecycle.check()
+        except Exception as e:
+            print(f"[ERROR] Ollama health check error: {e}")
+    
+    @check_ollama_health.before_loop
+    async def before_check_ollama_health(self):
+        """等待bot准备就绪"""
+        await self.bot.wait_until_ready()
+    
+    @app_commands.command(name="aistatus", description="查看AI模型状态")
+    async def ai_status(self, interaction: discord.Interaction):
+        """
+        显示 Ollama 健康状态、模型是否已加载、延迟和请求排队情况
+        """
+        if not self.check_channel_permission(interaction.channel_id, ALLOWED_CHANNELS_AI):
+            await interaction.response.send_message(
+                "❌ 此命令不能在当前频道使用！",
+                ephemeral=True
+            )
+            return
+        
+        stats = self.model_lifecycle.stats()
+        embed = discord.Embed(
+            title="🤖 AI模型状态",
+            color=discord.Color.green() if stats["healthy"] and not stats["missing"] else discord.Color.red()
+        )
+        models = [stats["model"]] + ([stats["embed_model"]] if stats["embed_model"] else [])
+        lines = []
+        for model in models:
+            if model in stats["missing"]:
+                state = "❌ 未下载"
+            elif self.model_lifecycle.is_loaded(model):
+                state = "✅ 已加载"
+            else:
+                state = "💤 未加载"
+            warmup = stats["warmup_ms"].get(model)
+            lines.append(f"`{model}` {state}" + (f"（预热 {warmup:.0f}ms）" if warmup is not None else ""))
+        embed.add_field(name="📦 模型", value="\n".join(lines), inline=False)
+        ping = f"{stats['ping_ms']:.0f}ms" if stats["ping_ms"] is not None else "-"
+        embed.add_field(
+            name="🩺 服务",
+            value=f"状态: {'在线' if stats['healthy'] else '离线'}\n延迟: {ping}",
+            inline=True
+        )
+        embed.add_field(
+            name="📊 统计",
+            value=f"健康检查: {stats['checks']} 次\n预热: {stats['warmups']} 次\n失败: {stats['failures']} 次",
+            inline=True
+        )
+        queue = self.llm_gateway.stats()
+        waits = "\n".join(
+            f"{name}: p50 {w['p50_ms']:.0f}ms / p95 {w['p95_ms']:.0f}ms（{w['count']} 次）"
+            for name, w in queue["waits"].items()
+        )
+        embed.add_field(
+            name="⏳ 请求队列",
+            value=(
+                f"执行中: {queue['active']}/{queue['max_concurrent']}  排队: {queue['queued']}  "
+                f"去重: {queue['deduped']} 次" + (f"\n{waits}" if waits else "")
+            ),
+            inline=False
+        )
+        if stats["last_error"]:
+            embed.add_field(name="⚠️ 最近错误", value=stats["last_error"][:1000], inline=False)
+        await interaction.response.send_message(embed=embed)
+    
+    async def cog_unload(self):
+        """卸载Cog时停止任务并关闭连接"""
         self.check_chat_timeout.cancel()
+        self.refresh_cache_generation.cancel()
+        self.check_ollama_health.cancel()
+        self.db_reader.close()
+        await self.ollama.close()
 
 
 async def setup(bot: commands.Bot):
@@ -0,0 +1,180 @@
+"""
+AI 聊天会话管理
+- ContextWindow: 按 token 预算管理对话上下文，较早的轮次折叠进滚动摘要
+- ChatSessionStore: 每个用户一个会话，数量有上限（LRU 淘汰），长时间无活动自动过期
+（模型请求的排队由 llm_gateway.LLMGateway 负责）
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+
+def estimate_tokens(text: str, overhead: int = 4) -> int:
+    """
+    粗略估算 token 数：中日韩字符约 1 字 1 token，其余约 4 字符 1 token
+    :param overhead: 额外的格式开销，默认按一条消息算 4 个
+    """
+    cjk = sum(1 for ch in text if "\u2e80" <= ch <= "\u9fff" or "\uac00" <= ch <= "\ud7af" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4 + overhead
+
+
+class ContextWindow:
+    """
+    按 token 预算管理的对话上下文
+    发给模型的消息 = system prompt + 滚动摘要 + 最近的对话轮次。
+    超出预算时一次性把较早的轮次折叠到低水位（而不是每轮滑动一条），
+    这样两次折叠之间消息前缀保持不变，Ollama 可以复用 KV cache
+    """
+
+    def __init__(self, system_prompt: str, max_tokens: int = 3000, low_watermark: float = 0.5):
+        """
+        :param system_prompt: 系统提示词（始终放在最前面）
+        :param max_tokens: 上下文 token 预算（不含模型回复）
+        :param low_watermark: 折叠后对话轮次占剩余预算的比例
+        """
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.low_watermark = low_watermark
+        self.summary = ""
+        self.turns: List[Dict] = []
+        self.summarizing = False
+
+    def add(self, role: str, content: str) -> None:
+        self.turns.append({"role": role, "content": content})
+
+    def pop(self) -> Optional[Dict]:
+        """撤销最后一条消息（请求失败时用）"""
+        return self.turns.pop() if self.turns else None
+
+    def _fixed_tokens(self) -> int:
+        tokens = estimate_tokens(self.system_prompt)
+        if self.summary:
+            tokens += estimate_tokens(self.summary) + 16
+        return tokens
+
+    def turn_tokens(self) -> int:
+        return sum(estimate_tokens(m["content"]) for m in self.turns)
+
+    def needs_compaction(self) -> bool:
+        """对话轮次超出预算且当前没有正在进行的摘要"""
+        return not self.summarizing and self._fixed_tokens() + self.turn_tokens() > self.max_tokens
+
+    def take_for_summary(self) -> List[Dict]:
+        """
+        取出最早的若干轮（按一问一答成对取），直到剩余轮次降到低水位；至少保留最后一轮
+        取出后 summarizing = True，直到 apply_summary 被调用
+        """
+        target = max(0, self.max_tokens - self._fixed_tokens()) * self.low_watermark
+        taken = []
+        while len(self.turns) > 2 and self.turn_tokens() > target:
+            taken.extend(self.turns[:2])
+            del self.turns[:2]
+        self.summarizing = bool(taken)
+        return taken
+
+    def apply_summary(self, summary: str) -> None:
+        """写入新的滚动摘要"""
+        if summary:
+            self.summary = summary.strip()
+        self.summarizing = False
+
+    def build(self) -> List[Dict]:
+        """
+        生成发给模型的消息列表；摘要还没生成出来时如果仍超预算，临时丢弃最早的轮次
+        """
+        messages = [{"role": "system", "content": self.system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"之前对话的摘要：\n{self.summary}"})
+        budget = self.max_tokens - self._fixed_tokens()
+        turns = list(self.turns)
+        while len(turns) > 1 and sum(estimate_tokens(m["content"]) for m in turns) > budget:
+            turns.pop(0)
+        return messages + turns
+
+
+class ChatSession:
+    """单个用户的对话上下文"""
+
+    def __init__(self, user_id: int, channel_id: int, user_name: str, system_prompt: str, max_tokens: int = 3000):
+        self.user_id = user_id
+        self.channel_id = channel_id
+        self.user_name = user_name
+        self.context = ContextWindow(system_prompt, max_tokens=max_tokens)
+        self.rounds = 0  # 已完成的对话轮数（一问一答算一轮）
+        self.last_activity = time.monotonic()
+        self.tool_cache = None  # 本对话的工具调用结果缓存（第一次调用工具时由 Bot 创建）
+        # 同一用户连续发消息时按顺序处理，保证上下文不会交错
+        self.lock = asyncio.Lock()
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+
+
+class ChatSessionStore:
+    """按用户ID保存对话，超过上限时淘汰最久未活动的会话"""
+
+    def __init__(self, max_sessions: int = 50, idle_timeout: float = 180.0, context_tokens: int = 3000):
+        """
+        :param max_sessions: 最多同时保留的会话数
+        :param idle_timeout: 无活动多久后过期（秒）
+        :param context_tokens: 每个会话的上下文 token 预算
+        """
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.context_tokens = context_tokens
+        self._sessions: "OrderedDict[int, ChatSession]" = OrderedDict()
+
+    def get(self, user_id: int) -> Optional[ChatSession]:
+        return self._sessions.get(user_id)
+
+    def get_or_create(self, user_id: int, channel_id: int, user_name: str, system_prompt: str) -> tuple:
+        """
+        取出用户的会话，没有则新建
+        :return: (session, created, evicted) evicted 是因容量不足被淘汰的会话列表
+        正在处理请求的会话（lock 被占用）不淘汰，全部都在处理时暂时超出容量
+        """
+        session = self._sessions.get(user_id)
+        created = session is None
+        if created:
+            session = ChatSession(user_id, channel_id, user_name, system_prompt, max_tokens=self.context_tokens)
+            self._sessions[user_id] = session
+        else:
+            session.channel_id = channel_id
+        session.touch()
+        self._sessions.move_to_end(user_id)
+
+        evicted = []
+        excess = len(self._sessions) - self.max_sessions
+        if excess > 0:
+            for old in list(self._sessions.values()):
+                if excess <= 0:
+                    break
+                if old is session or old.lock.locked():
+                    continue
+                del self._sessions[old.user_id]
+                evicted.append(old)
+                excess -= 1
+        return session, created, evicted
+
+    def end(self, user_id: int) -> Optional[ChatSession]:
+        """结束并移除用户的会话"""
+        return self._sessions.pop(user_id, None)
+
+    def expire_idle(self, now: Optional[float] = None) -> List[ChatSession]:
+        """
+        移除超时的会话（正在处理请求的会话不过期）
+        :return: 被移除的会话列表
+        """
+        now = time.monotonic() if now is None else now
+        expired = [
+            session for session in self._sessions.values()
+            if now - session.last_activity > self.idle_timeout and not session.lock.locked()
+        ]
+        for session in expired:
+            del self._sessions[session.user_id]
+        return expired
+
+    def __len__(self) -> int:
+        return len(self._sessions)
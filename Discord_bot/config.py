@@ -2,6 +2,7 @@
 Discord Bot 配置文件
 """
 import os
+from pathlib import Path
 from typing import Optional, List
 
 # ==================== Discord 配置 ====================
@@ -25,8 +26,36 @@ ALLOWED_CHANNELS_AI: List[int] = [
 OLLAMA_CONFIG = {
     "url": "http://127.0.0.1:11434",
     "model": "qwen3:4b-instruct-2507-q4_K_M",  # 使用的AI模型
-    "timeout": 300,  # API超时时间（秒）
+    "timeout": 300,  # API整体超时时间（秒）
+    "connect_timeout": 5,  # 建立连接超时（秒）
+    "first_token_timeout": 60,  # 等待第一个token的超时（秒），包含模型加载时间
+    "stream_edit_interval": 1.2,  # 流式输出时编辑消息的最小间隔（秒），避免触发Discord频率限制
+    "keep_alive": "30m",  # 模型在显存中保留的时间，保留期间可以复用 KV cache
+    "num_ctx": 4096,  # 上下文长度（所有请求保持一致，避免模型重新加载）
+    "context_tokens": 3000,  # 对话上下文预算（token），超出时较早的轮次会被总结成摘要
     "chat_timeout": 180,  # 对话无活动自动结束时间（秒）
+    "max_sessions": 50,  # 同时保留的对话数上限（超出时移除最久未活动的）
+    "max_concurrent_requests": int(os.getenv("OLLAMA_NUM_PARALLEL", "1")),  # 同时发给Ollama的请求数（与 Ollama 服务的 OLLAMA_NUM_PARALLEL 保持一致）
+    "warmup": True,  # Bot 启动时确认模型已下载并预热（第一个请求不用等模型加载）
+    "health_interval": 60,  # 健康检查间隔（秒），模型被卸载时重新预热
+}
+
+# AI 工具调用（模型通过 Ollama tools API 按需查询数据库；模型不支持 tools 时自动退回 RAG 模式）
+LLM_TOOLS_CONFIG = {
+    "enabled": os.getenv("LLM_TOOLS", "true").lower() == "true",
+    "max_rounds": 4,  # 一次回复里最多几轮工具调用
+    "timeout": 5,  # 单次工具查询超时（秒）
+    "max_rows": 25,  # 单次工具调用最多返回的行数
+    "cache_entries": 64,  # 每个对话的工具结果缓存条目数
+}
+
+# 比赛向量检索（索引由 python Discord_bot/match_index.py 离线构建，索引不存在时自动跳过）
+MATCH_INDEX_CONFIG = {
+    "enabled": True,
+    "path": Path(__file__).parent.parent / "DataBase" / "match_index",  # 索引目录
+    "embed_model": "nomic-embed-text",  # Ollama 向量模型（建索引和查询必须一致）
+    "top_k": 3,  # 放进 prompt 的比赛摘要数
+    "min_score": 0.3,  # 余弦相似度下限
 }
 
 # ==================== 数据库配置 ====================
@@ -34,6 +63,28 @@ OLLAMA_CONFIG = {
 # 数据库文件路径会从 DB.py 中自动导入
 # 如需修改，请在 DB.py 中修改 FLIGHTLOG_DB_PATH
 
+# Bot 只读连接池
+DB_READER_CONFIG = {
+    "max_workers": 4,  # 读连接（线程）数量
+    "query_timeout": 10,  # 单次查询超时（秒），超时会中断SQL
+    "autocomplete_timeout": 2,  # 自动补全查询超时（秒）
+}
+
+# Bot 查询结果缓存（数据库 generation 变化时整体失效）
+QUERY_CACHE_CONFIG = {
+    "max_entries": 512,  # 最多缓存条目数（LRU 淘汰）
+    "ttl": 600,  # 单条缓存最长存活时间（秒）
+    "generation_poll": 5,  # 检查数据库 generation 的间隔（秒）
+    "summary_max_entries": 256,  # /ai 总结缓存条目数（键为数据上下文的哈希）
+    "summary_ttl": 86400,  # /ai 总结缓存存活时间（秒）
+}
+
+# 比赛结算发布（排行榜 / 战报快照）
+PUBLISHER_CONFIG = {
+    "leaderboard_size": 10,  # 排行榜人数
+    "match_report_channel_id": None,  # 自动发送战报的频道ID（None 表示不发送）
+}
+
 # ==================== Bot 行为配置 ====================
 
 # 查询结果显示的最大记录数
@@ -0,0 +1,129 @@
+"""
+关键词多模式匹配（Aho–Corasick 自动机）
+所有关键词编译成一个自动机，对查询只扫描一遍就能找出全部命中，
+代替对每个意图、每个关键词分别做一次子串查找
+"""
+
+from collections import deque
+from typing import Any, Dict, Iterable, List, Tuple
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+class KeywordMatcher:
+    """
+    Aho–Corasick 关键词匹配器
+    - 关键词和文本都先 casefold，不区分大小写
+    - 英文关键词按整词匹配（"ai" 不会命中 "details"），中文关键词按子串匹配
+    - 每个关键词可以挂任意多个 payload，匹配结果里原样返回
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, Any]] = ()):
+        """
+        :param keywords: 可选，初始的 (关键词, payload) 列表
+        """
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        self._keywords: List[str] = []
+        self._payloads: List[List[Any]] = []
+        self._index: Dict[str, int] = {}
+        self._built = False
+        for keyword, payload in keywords:
+            self.add(keyword, payload)
+
+    def add(self, keyword: str, payload: Any) -> None:
+        """添加关键词（同一个关键词多次添加时 payload 累加）"""
+        keyword = keyword.casefold()
+        if not keyword:
+            raise ValueError("keyword must not be empty")
+        kid = self._index.get(keyword)
+        if kid is None:
+            kid = self._index[keyword] = len(self._keywords)
+            self._keywords.append(keyword)
+            self._payloads.append([])
+            state = 0
+            for ch in keyword:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                state = nxt
+            self._output[state].append(kid)
+            self._built = False
+        self._payloads[kid].append(payload)
+
+    def build(self) -> None:
+        """按 BFS 计算失败指针，并把后缀状态的输出合并进来"""
+        queue = deque()
+        for state in self._goto[0].values():
+            self._fail[state] = 0
+            queue.append(state)
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._output[nxt] = self._output[nxt] + self._output[self._fail[nxt]]
+        self._built = True
+
+    def find_all(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        找出所有命中（可以互相重叠）
+        :return: [(start, end, keyword), ...]，按 end 排序
+        """
+        if not self._built:
+            self.build()
+        text = text.casefold()
+        goto, fail, output = self._goto, self._fail, self._output
+        keywords = self._keywords
+        matches = []
+        state = 0
+        for end, ch in enumerate(text, 1):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not output[state]:
+                continue
+            for kid in output[state]:
+                keyword = keywords[kid]
+                start = end - len(keyword)
+                # 英文关键词要求整词：前后不能紧挨着英文字母 / 数字
+                if _is_word_char(keyword[0]) and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if _is_word_char(keyword[-1]) and end < len(text) and _is_word_char(text[end]):
+                    continue
+                matches.append((start, end, keyword))
+        return matches
+
+    def find(self, text: str) -> List[Tuple[str, List[Any]]]:
+        """
+        找出命中的关键词，被更长命中完全覆盖的短关键词丢弃（"战斗风格" 命中后不再单独算 "战斗"）
+        :return: [(keyword, payloads), ...]，每个关键词只出现一次，按首次出现位置排序
+        """
+        matches = self.find_all(text)
+        if len(matches) > 1:
+            matches = [
+                (start, end, keyword) for start, end, keyword in matches
+                if not any(
+                    s <= start and end <= e and (e - s) > (end - start)
+                    for s, e, _ in matches
+                )
+            ]
+            matches.sort()
+        seen = {}
+        for _, _, keyword in matches:
+            if keyword not in seen:
+                seen[keyword] = self._payloads[self._index[keyword]]
+        return list(seen.items())
+
+    def __len__(self) -> int:
+        return len(self._keywords)
@@ -0,0 +1,190 @@
+"""
+LLM 请求网关
+本地模型一次只能高效处理 OLLAMA_NUM_PARALLEL 个请求，比赛结束后一窝蜂的 /ai 会让模型来回切换上下文。
+Bot 发给 Ollama 的生成请求（/ai、自由对话、对话摘要）、问题向量（OllamaEmbedder）和模型预热 / 健康检查都经过这里：
+- 并发上限与 OLLAMA_NUM_PARALLEL 一致，超出的请求按优先级排队（斜杠命令 > 自由对话 > 后台任务），同优先级先来后到
+- 完全相同的请求正在生成时，后来的直接等待同一个结果，不再重复占用模型
+- 记录每个优先级的排队等待时间
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+PRIORITY_COMMAND = 0  # /ai 等斜杠命令查询（用户在等结果）
+PRIORITY_CHAT = 1  # /chatwithai 自由对话
+PRIORITY_BACKGROUND = 2  # 对话摘要、模型预热等后台请求
+
+PRIORITY_NAMES = {
+    PRIORITY_COMMAND: "command",
+    PRIORITY_CHAT: "chat",
+    PRIORITY_BACKGROUND: "background",
+}
+
+
+def _percentile(sorted_values, pct: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct))]
+
+
+class LLMGateway:
+    """
+    带优先级的并发受限调度器 + 在途请求去重
+    释放名额时直接交给等待队列里优先级最高、最早到达的请求（不会被后来的同级请求插队）。
+    slot() 可重入：已经占着名额的调用链（例如工具调用轮次之间执行 search_matches 时计算问题向量）
+    再次进入时直接执行，不重复排队，也就不会在 max_concurrent=1 时自己等自己
+    """
+
+    def __init__(self, max_concurrent: int = 1, window: int = 200):
+        """
+        :param max_concurrent: 同时发给 Ollama 的请求数（与 OLLAMA_NUM_PARALLEL 保持一致）
+        :param window: 每个优先级保留最近多少次等待时间用于统计
+        """
+        self.max_concurrent = max_concurrent
+        self._active = 0
+        self._heap = []  # (优先级, 序号, future)
+        self._seq = itertools.count()
+        self._inflight: Dict[Any, list] = {}  # key -> [task, 等待中的调用方数量]
+        self._waits = {priority: deque(maxlen=window) for priority in PRIORITY_NAMES}
+        self.completed = 0
+        self.deduped = 0
+        self._holding: ContextVar[bool] = ContextVar(f"llm_gateway_holding_{id(self)}", default=False)
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for _, _, future in self._heap if not future.done())
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_CHAT,
+                   on_queued: Optional[Callable[[int], Awaitable[None]]] = None):
+        """
+        占用一个执行名额
+        :param priority: 优先级，数字越小越先执行
+        :param on_queued: 需要排队时回调，参数为当前排在第几位（从1开始），用于给用户反馈
+        """
+        if self._holding.get():
+            yield
+            return
+        start = time.perf_counter()
+        if self._active < self.max_concurrent and not self.queued:
+            self._active += 1
+        else:
+            entry = (priority, next(self._seq), asyncio.get_running_loop().create_future())
+            heapq.heappush(self._heap, entry)
+            future = entry[2]
+            try:
+                if on_queued is not None:
+                    ahead = sum(1 for other in self._heap if other < entry and not other[2].done())
+                    await self._notify(on_queued, ahead + 1)
+                await future
+            except BaseException:
+                if not future.done():
+                    # 还在排队：标记取消，出队时跳过
+                    future.cancel()
+                elif not future.cancelled():
+                    # 名额已经交给我们了，但调用方放弃了，转交给下一个
+                    self._release()
+                raise
+        self._waits[priority].append(time.perf_counter() - start)
+        token = self._holding.set(True)
+        try:
+            yield
+        finally:
+            self._holding.reset(token)
+            self.completed += 1
+            self._release()
+
+    @staticmethod
+    async def _notify(on_queued: Callable[[int], Awaitable[None]], position: int) -> None:
+        try:
+            await on_queued(position)
+        except Exception as e:
+            # 排队提示发不出去（例如消息已被删除）不影响请求本身
+            print(f"[ERROR] Queue notification failed: {e}")
+
+    def _release(self) -> None:
+        while self._heap:
+            _, _, future = heapq.heappop(self._heap)
+            if not future.done():
+                future.set_result(None)
+                return
+        self._active -= 1
+
+    async def run(self, key: Any, factory: Callable[[], Awaitable[Any]],
+                  on_queued: Optional[Callable[[int], Awaitable[None]]] = None) -> Any:
+        """
+        执行一个可去重的请求：相同 key 的请求正在执行时，直接等待它的结果
+        请求在独立的任务里执行，只有所有等待它的调用方都放弃了才会被取消。
+        factory 的结果会交给所有等待方，所以它只能生成结果（不要在里面写某个调用方的回复或回调）；
+        排队提示按调用方各自发送
+        :param key: 去重键（例如消息内容的摘要），None 表示不去重
+        :param factory: 返回协程的函数，协程内部自己通过 slot() 排队
+        :param on_queued: 这个调用方的排队提示，名额已满时调用，参数为大致的排队位置
+        :return: 请求结果（异常同样会传给所有等待方）
+        """
+        busy = self._active >= self.max_concurrent or self.queued
+        if key is None:
+            if on_queued is not None and busy:
+                await self._notify(on_queued, self.queued + 1)
+            return await factory()
+        entry = self._inflight.get(key)
+        if entry is None:
+            task = asyncio.ensure_future(factory())
+            entry = self._inflight[key] = [task, 0]
+
+            def forget(_):
+                if self._inflight.get(key) is entry:
+                    del self._inflight[key]
+
+            task.add_done_callback(forget)
+        else:
+            self.deduped += 1
+        entry[1] += 1
+        try:
+            # 先登记在途请求再发排队提示，提示期间到达的相同请求直接等待这一个
+            if on_queued is not None and busy:
+                await self._notify(on_queued, self.queued + 1)
+            return await asyncio.shield(entry[0])
+        except asyncio.CancelledError:
+            if entry[0].done():
+                raise
+            entry[1] -= 1
+            if entry[1] == 0:
+                entry[0].cancel()
+            raise
+
+    def is_inflight(self, key: Any) -> bool:
+        """相同 key 的请求是否正在执行"""
+        return key in self._inflight
+
+    def stats(self) -> Dict:
+        """排队 / 去重 / 各优先级等待时间（毫秒）统计"""
+        waits = {}
+        for priority, samples in self._waits.items():
+            if not samples:
+                continue
+            values = sorted(samples)
+            waits[PRIORITY_NAMES[priority]] = {
+                "count": len(values),
+                "p50_ms": _percentile(values, 0.5) * 1000,
+                "p95_ms": _percentile(values, 0.95) * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return {
+            "max_concurrent": self.max_concurrent,
+            "active": self._active,
+            "queued": self.queued,
+            "completed": self.completed,
+            "deduped": self.deduped,
+            "inflight": len(self._inflight),
+            "waits": waits,
+        }
@@ -0,0 +1,313 @@
+"""
+LLM 工具调用（Ollama tools API）
+把几个带类型的只读查询函数暴露给模型，模型按需调用、只取自己需要的数据，
+代替 /ai 把一整份查询结果塞进 prompt；查询在 AsyncDB 只读连接池里执行，有行数上限和超时
+"""
+
+import sys
+import json
+import sqlite3
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# 添加父目录到路径以导入DB模块
+sys.path.append(str(Path(__file__).parent.parent))
+from DB import ELO_TYPE
+
+from Discord_bot.async_db import QueryTimeout
+from Discord_bot.ollama_client import OllamaError
+from Discord_bot.match_publisher import LEADERBOARD_SQL, load_match
+
+
+TOOL_SYSTEM_PROMPT = (
+    "你可以调用工具查询ezServer数据库（玩家资料、排行榜、战报、武器统计）。"
+    "需要数据时先调用工具，只根据工具返回的数据回答，不要编造数字；"
+    "工具返回 error 时如实告诉用户。"
+)
+
+PLAYER_STATS_SQL = """
+    SELECT map_type, kills, deaths, matches, last_played, best_elo
+    FROM player_stats
+    WHERE player_id = ?
+    ORDER BY matches DESC
+"""
+
+PLAYER_WEAPONS_SQL = """
+    SELECT weapon, SUM(kills) AS kills
+    FROM player_weapon_stats
+    WHERE player_id = ?
+    GROUP BY weapon
+    ORDER BY kills DESC
+    LIMIT ?
+"""
+
+WEAPON_STATS_SQL = """
+    SELECT weapon, SUM(kills) AS kills, COUNT(DISTINCT player_id) AS players
+    FROM player_weapon_stats
+    WHERE (:map_type IS NULL OR map_type = :map_type)
+      AND (:player_id IS NULL OR player_id = :player_id)
+    GROUP BY weapon
+    ORDER BY kills DESC
+    LIMIT :limit
+"""
+
+
+def _function(name: str, description: str, properties: Dict, required: List[str] = ()) -> Dict:
+    """Ollama tools API 的函数声明"""
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {"type": "object", "properties": properties, "required": list(required)},
+        },
+    }
+
+
+_MAP_TYPE = {"type": "string", "enum": list(ELO_TYPE), "description": "地图类型"}
+
+TOOL_SPECS = [
+    _function(
+        "get_player",
+        "查询一名玩家的资料：各地图类型的 ELO、击杀 / 死亡 / 场次和常用武器",
+        {"name": {"type": "string", "description": "玩家名称（支持历史昵称，不区分大小写）"}},
+        required=["name"],
+    ),
+    _function(
+        "leaderboard",
+        "查询某个地图类型的 ELO 排行榜",
+        {
+            "map_type": _MAP_TYPE,
+            "limit": {"type": "integer", "description": "人数，默认10"},
+        },
+        required=["map_type"],
+    ),
+    _function(
+        "match_report",
+        "查询一局比赛的战报：每名玩家的击杀 / 死亡 / ELO 变化和击杀记录",
+        {"replay_id": {"type": "integer", "description": "比赛ID，不填表示最近一局"}},
+    ),
+    _function(
+        "weapon_stats",
+        "按武器统计击杀数，可以限定玩家和地图类型",
+        {
+            "player": {"type": "string", "description": "玩家名称，不填表示所有玩家"},
+            "map_type": _MAP_TYPE,
+            "limit": {"type": "integer", "description": "武器数量，默认10"},
+        },
+    ),
+]
+
+# 比赛向量检索（只有建好了索引时才提供给模型）
+SEARCH_MATCHES_SPEC = _function(
+    "search_matches",
+    "按描述检索相关的比赛（例如“导弹对射后机炮击杀的比赛”），返回最相似的几局比赛摘要",
+    {
+        "query": {"type": "string", "description": "要找的比赛的描述"},
+        "limit": {"type": "integer", "description": "比赛数，默认3", "default": 3},
+    },
+    required=["query"],
+)
+
+
+class ToolError(ValueError):
+    """工具名或参数不合法（结果里以 error 字段返回给模型）"""
+
+
+def _compact(value: Any) -> Any:
+    """浮点数保留1位小数，减少返回给模型的 token"""
+    if isinstance(value, float):
+        return round(value, 1)
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    return value
+
+
+class LLMToolbox:
+    """
+    工具声明 + 执行
+    参数按 TOOL_SPECS 里的 JSON Schema 校验和转换类型，结果序列化成紧凑 JSON 字符串
+    """
+
+    DEFAULT_LIMIT = 10  # 模型没有给 limit 时的默认行数
+
+    def __init__(self, db_reader, db, timeout: float = 5.0, max_rows: int = 25, retriever=None):
+        """
+        :param db_reader: AsyncDB 只读连接池
+        :param db: flightlogDB 实例（只用它的 search_players 解析玩家名）
+        :param timeout: 单次工具查询的超时（秒）
+        :param max_rows: 每个工具最多返回的行数，模型传的 limit 会被截到这个值
+        :param retriever: 可选的 MatchRetriever，提供时额外开放 search_matches 工具
+        """
+        self.db_reader = db_reader
+        self.db = db
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.retriever = retriever
+        specs = TOOL_SPECS + ([SEARCH_MATCHES_SPEC] if retriever is not None else [])
+        self.specs = {spec["function"]["name"]: spec["function"] for spec in specs}
+        self.calls = 0  # 实际执行（未命中缓存）的工具调用次数
+        self._handlers = {
+            "get_player": self._get_player,
+            "leaderboard": self._leaderboard,
+            "match_report": self._match_report,
+            "weapon_stats": self._weapon_stats,
+        }
+
+    def schemas(self) -> List[Dict]:
+        """发给 Ollama 的 tools 字段（比赛索引建好之后才提供 search_matches）"""
+        if self.retriever is not None and self.retriever.refresh():
+            return TOOL_SPECS + [SEARCH_MATCHES_SPEC]
+        return TOOL_SPECS
+
+    def validate(self, name: str, arguments: Any) -> Dict:
+        """
+        按参数声明校验并转换类型，未声明的参数直接丢弃
+        :param arguments: 模型给的参数（dict，部分模型会给 JSON 字符串）
+        :return: 规范化后的参数
+        """
+        spec = self.specs.get(name)
+        if spec is None:
+            raise ToolError(f"未知工具: {name}")
+        if isinstance(arguments, str):
+            try:
+                arguments = json.loads(arguments) if arguments.strip() else {}
+            except json.JSONDecodeError:
+                raise ToolError("参数不是合法的 JSON")
+        if not isinstance(arguments, dict):
+            raise ToolError("参数必须是对象")
+
+        schema = spec["parameters"]
+        args = {}
+        for key, prop in schema["properties"].items():
+            value = arguments.get(key)
+            if value is None or value == "":
+                continue
+            if prop["type"] == "integer":
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    raise ToolError(f"{key} 必须是整数")
+            else:
+                value = str(value).strip()
+            if "enum" in prop:
+                value = value.upper()
+                if value not in prop["enum"]:
+                    raise ToolError(f"{key} 只能是 {', '.join(prop['enum'])}")
+            args[key] = value
+        missing = [key for key in schema["required"] if key not in args]
+        if missing:
+            raise ToolError(f"缺少参数: {', '.join(missing)}")
+        if "limit" in schema["properties"]:
+            default = schema["properties"]["limit"].get("default", self.DEFAULT_LIMIT)
+            args["limit"] = max(1, min(args.get("limit", default), self.max_rows))
+        return args
+
+    async def call(self, name: str, arguments: Any, cache=None) -> str:
+        """
+        执行一次工具调用
+        :param name: 工具名
+        :param arguments: 模型给的参数
+        :param cache: 可选的 QueryCache（按对话隔离），相同参数的调用直接返回缓存
+        :return: JSON 字符串（出错时为 {"error": ...}，让模型自己决定怎么处理）
+        """
+        try:
+            args = self.validate(name, arguments)
+            if cache is None:
+                result = await self._run(name, args)
+            else:
+                result = await cache.get_or_load(f"tool:{name}", lambda: self._run(name, args), **args)
+        except ToolError as e:
+            result = {"error": str(e)}
+        except QueryTimeout:
+            result = {"error": "查询超时"}
+        except (sqlite3.Error, OllamaError) as e:
+            print(f"[ERROR] Tool {name} failed: {e}")
+            result = {"error": "查询出错"}
+        except Exception as e:
+            # 工具出错不能中断整个回复，交给模型如实告诉用户
+            print(f"[ERROR] Tool {name} crashed: {e!r}")
+            result = {"error": "工具执行出错"}
+        return json.dumps(result, ensure_ascii=False, separators=(",", ":"), default=str)
+
+    async def _run(self, name: str, args: Dict) -> Any:
+        self.calls += 1
+        if name == "search_matches":
+            return await self._search_matches(**args)
+        return _compact(await self.db_reader.run(self._handlers[name], timeout=self.timeout, **args))
+
+    async def _search_matches(self, query: str, limit: int = 3) -> Dict:
+        results = await self.retriever.search(query, k=limit)
+        if not results:
+            return {"error": "没有找到相关比赛"}
+        return {
+            "matches": [
+                {"replay_id": replay_id, "score": round(score, 2), "summary": summary}
+                for replay_id, score, summary in results
+            ]
+        }
+
+    def _resolve_player(self, name: str, conn: sqlite3.Connection) -> Optional[Dict]:
+        matches = self.db.search_players(name, limit=1, conn=conn)
+        return matches[0] if matches else None
+
+    def _get_player(self, name: str, conn: sqlite3.Connection) -> Dict:
+        match = self._resolve_player(name, conn)
+        if match is None:
+            return {"error": f"找不到玩家: {name}"}
+        player_id = match["player_id"]
+        row = conn.execute("SELECT * FROM players WHERE id = ?", (player_id,)).fetchone()
+        return {
+            "steam_name": row["steam_name"],
+            "matched_name": match["matched_name"],
+            "elo": {map_type: row[field] for map_type, field in ELO_TYPE.items()},
+            "stats": [dict(r) for r in conn.execute(PLAYER_STATS_SQL, (player_id,)).fetchall()],
+            "top_weapons": [dict(r) for r in conn.execute(PLAYER_WEAPONS_SQL, (player_id, 5)).fetchall()],
+        }
+
+    def _leaderboard(self, map_type: str, limit: int = DEFAULT_LIMIT, conn: sqlite3.Connection = None) -> Dict:
+        rows = conn.execute(LEADERBOARD_SQL.format(elo_field=ELO_TYPE[map_type]), (map_type, limit)).fetchall()
+        return {
+            "map_type": map_type,
+            "players": [
+                {"rank": rank, **{k: row[k] for k in ("steam_name", "elo", "kills", "deaths", "matches")}}
+                for rank, row in enumerate(rows, 1)
+            ],
+        }
+
+    def _match_report(self, replay_id: Optional[int] = None, conn: sqlite3.Connection = None) -> Dict:
+        report = load_match(replay_id, conn=conn)
+        if report is None:
+            return {"error": "找不到比赛" if replay_id is not None else "还没有比赛记录"}
+        kills = report["kills"]
+        return {
+            "replay_id": report["replay"]["id"],
+            "map_name": report["replay"]["map_name"],
+            "played_at": report["replay"]["played_at"],
+            "map_type": report["map_type"],
+            "total_kills": len(kills),
+            "players": report["players"][:self.max_rows],
+            # 只保留最后 max_rows 条击杀记录
+            "kills": [
+                {k: kill[k] for k in ("time_local", "killer", "victim", "weapon")}
+                for kill in kills[-self.max_rows:]
+            ],
+        }
+
+    def _weapon_stats(self, player: Optional[str] = None, map_type: Optional[str] = None,
+                      limit: int = DEFAULT_LIMIT, conn: sqlite3.Connection = None) -> Dict:
+        player_id = None
+        result = {"map_type": map_type}
+        if player is not None:
+            match = self._resolve_player(player, conn)
+            if match is None:
+                return {"error": f"找不到玩家: {player}"}
+            player_id = match["player_id"]
+            result["player"] = match["steam_name"]
+        rows = conn.execute(
+            WEAPON_STATS_SQL, {"map_type": map_type, "player_id": player_id, "limit": limit}
+        ).fetchall()
+        result["weapons"] = [dict(row) for row in rows]
+        return result
@@ -0,0 +1,425 @@
+"""
+比赛向量检索
+离线把每局比赛的事件整理成一段文字摘要，用 Ollama 的向量模型编码，
+向量存成 float32 矩阵文件（np.memmap 只读映射，不整体读进内存）；
+/ai 查询时把问题编码后做暴力 top-k（单位向量点积 = 余弦相似度），只把最相关的几局摘要放进 prompt
+
+用法: python Discord_bot/match_index.py [--url http://127.0.0.1:11434] [--model nomic-embed-text] [--rebuild]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import sqlite3
+import argparse
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+
+# 添加父目录到路径以导入DB模块
+sys.path.append(str(Path(__file__).parent.parent))
+from DB import FLIGHTLOG_DB_PATH, ELO_TYPE
+
+from Discord_bot.chat_sessions import estimate_tokens
+from Discord_bot.llm_gateway import PRIORITY_COMMAND
+
+
+# 武器分类（按前缀匹配），写进摘要里方便按 "机炮击杀" / "远距导弹" 这类说法检索
+WEAPON_CLASSES = [
+    ("机炮", ("GAU-", "M61", "M230", "Vulcan", "GSh")),
+    ("中远距导弹", ("AIM-120", "AIM-54", "AIM-7", "R-77", "R-27")),
+    ("近距导弹", ("AIM-9", "AIRS-T", "R-73")),
+]
+
+MAX_SUMMARY_KILLS = 30  # 摘要里最多逐条列出的击杀数（控制向量模型的输入长度）
+
+SUMMARY_REPLAYS_SQL = """
+    SELECT id, map_name, map_type, played_at
+    FROM replays
+    WHERE id > ?
+    ORDER BY id
+"""
+
+SUMMARY_EVENTS_SQL = """
+    SELECT
+        e.id,
+        e.event_type,
+        e.time_local,
+        e.weapon,
+        d.details,
+        MAX(CASE WHEN pe.role = 'killer' THEN p.steam_name END) AS killer,
+        MAX(CASE WHEN pe.role = 'victim' THEN p.steam_name END) AS victim
+    FROM events e
+    LEFT JOIN event_details d ON d.event_id = e.id
+    LEFT JOIN player_events pe ON pe.event_id = e.id
+    LEFT JOIN players p ON p.id = pe.player_id
+    WHERE e.replay_id = ?
+    GROUP BY e.id
+    ORDER BY e.id
+"""
+
+
+def weapon_class(weapon: Optional[str]) -> Optional[str]:
+    """武器 -> 分类名，不认识的武器返回None"""
+    if not weapon:
+        return None
+    for name, prefixes in WEAPON_CLASSES:
+        if weapon.startswith(prefixes):
+            return name
+    return None
+
+
+def summarize_match(replay: Dict, events: List[Dict]) -> str:
+    """
+    把一局比赛整理成一段中文摘要（只由数据决定，重复构建得到相同文本）
+    :param replay: replays 行（id / map_name / map_type / played_at）
+    :param events: SUMMARY_EVENTS_SQL 的结果，按时间顺序
+    :return: 摘要文本
+    """
+    map_type = replay["map_type"]
+    if map_type is None and events:
+        prefix = (events[0]["event_type"] or "").split("_", 1)[0]
+        map_type = prefix if prefix in ELO_TYPE else None
+    lines = [f"比赛 #{replay['id']} 地图 {replay['map_name']}" + (f"（{map_type}）" if map_type else "")
+             + f"，时间 {replay['played_at']}"]
+
+    players = []
+    class_counts: Dict[str, int] = {}
+    kill_lines = []
+    missile_kills = 0
+    gun_after_missile = 0
+    for event in events:
+        details = json.loads(event["details"]) if event["details"] else {}
+        for name in (event["killer"], event["victim"]):
+            if name and name not in players:
+                players.append(name)
+        category = weapon_class(event["weapon"])
+        if category:
+            class_counts[category] = class_counts.get(category, 0) + 1
+        if category == "机炮" and missile_kills:
+            gun_after_missile += 1
+        elif category and category.endswith("导弹"):
+            missile_kills += 1
+
+        victim_aircraft = details.get("victim_aircraft")
+        kill_lines.append(
+            f"{event['time_local']} {event['killer'] or '?'} 用 {event['weapon'] or '未知武器'}"
+            + (f"（{category}）" if category else "")
+            + f" 击落 {event['victim'] or '?'}"
+            + (f"（{victim_aircraft}）" if victim_aircraft else "")
+        )
+
+    if players:
+        lines.append(f"参战玩家 {len(players)} 人：" + "、".join(players))
+    lines.append(f"击杀 {len(events)} 次" + (
+        "：" + "，".join(f"{name} {count} 次" for name, count in class_counts.items()) if class_counts else ""
+    ))
+    if gun_after_missile:
+        lines.append(f"导弹交战后出现 {gun_after_missile} 次机炮击杀（近距离缠斗）")
+    lines.extend(kill_lines[:MAX_SUMMARY_KILLS])
+    if len(kill_lines) > MAX_SUMMARY_KILLS:
+        lines.append(f"……其余 {len(kill_lines) - MAX_SUMMARY_KILLS} 次击杀省略")
+    return "\n".join(lines)
+
+
+def load_match_summaries(after_replay_id: int = 0, conn: Optional[sqlite3.Connection] = None) -> List[Tuple[int, str]]:
+    """
+    生成 id 大于 after_replay_id 的所有比赛摘要（在只读连接上执行）
+    :return: [(replay_id, 摘要), ...]，按 replay_id 升序
+    """
+    summaries = []
+    for replay in conn.execute(SUMMARY_REPLAYS_SQL, (after_replay_id,)).fetchall():
+        events = conn.execute(SUMMARY_EVENTS_SQL, (replay["id"],)).fetchall()
+        summaries.append((replay["id"], summarize_match(dict(replay), [dict(e) for e in events])))
+    return summaries
+
+
+class Embedder(Protocol):
+    """向量模型接口：批量把文本编码成向量"""
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        ...
+
+
+class OllamaEmbedder:
+    """用 OllamaClient.embed 调用本地向量模型"""
+
+    def __init__(self, client, model: str, gateway=None, priority: Optional[int] = None):
+        """
+        :param client: OllamaClient 实例（和聊天共用连接池）
+        :param model: 向量模型名，例如 nomic-embed-text
+        :param gateway: 可选的 LLMGateway，Bot 里传入，和聊天请求一起排队（离线建索引时不需要）
+        :param priority: 排队优先级，默认 PRIORITY_COMMAND（/ai 的用户在等结果）
+        """
+        self.client = client
+        self.model = model
+        self.gateway = gateway
+        self.priority = PRIORITY_COMMAND if priority is None else priority
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        if self.gateway is None:
+            return await self.client.embed(texts, model=self.model)
+        async with self.gateway.slot(self.priority):
+            return await self.client.embed(texts, model=self.model)
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """按行归一化成单位向量，点积即余弦相似度"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class MatchIndex:
+    """
+    比赛摘要的向量索引（目录里一个 meta.json + 一个 float32 矩阵文件）
+    矩阵以 np.memmap 只读映射；重建时先写新的矩阵文件，最后原子替换 meta.json，读者不会看到写了一半的索引
+    """
+
+    META_FILE = "meta.json"
+
+    def __init__(self, path: Path, model: str, replay_ids: List[int], summaries: List[str], vectors: np.ndarray):
+        self.path = Path(path)
+        self.model = model
+        self.replay_ids = replay_ids
+        self.summaries = summaries
+        self.vectors = vectors
+
+    @classmethod
+    def open(cls, path) -> Optional["MatchIndex"]:
+        """
+        打开已有索引
+        :param path: 索引目录
+        :return: MatchIndex，索引还没建立时返回None
+        """
+        path = Path(path)
+        meta_path = path / cls.META_FILE
+        if not meta_path.exists():
+            return None
+        meta = json.loads(meta_path.read_text(encoding="utf-8"))
+        count, dim = len(meta["replay_ids"]), meta["dim"]
+        if count:
+            vectors = np.memmap(path / meta["vectors_file"], dtype=np.float32, mode="r", shape=(count, dim))
+        else:
+            vectors = np.zeros((0, dim), dtype=np.float32)
+        return cls(path, meta["model"], meta["replay_ids"], meta["summaries"], vectors)
+
+    @classmethod
+    def write(cls, path, model: str, replay_ids: List[int], summaries: List[str], vectors: np.ndarray) -> "MatchIndex":
+        """
+        写入索引（vectors 需已归一化），meta.json 替换后删除旧的矩阵文件
+        :return: 新写入的索引
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        meta_path = path / cls.META_FILE
+
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        vectors_file = f"vectors-{time.time_ns()}.f32"
+        vectors.tofile(path / vectors_file)
+        meta = {
+            "model": model,
+            "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0,
+            "vectors_file": vectors_file,
+            "replay_ids": list(replay_ids),
+            "summaries": list(summaries),
+        }
+        tmp_path = meta_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp_path, meta_path)
+        for old_file in path.glob("vectors-*.f32"):
+            if old_file.name != vectors_file:
+                try:
+                    old_file.unlink()
+                except OSError:
+                    pass  # Windows 上仍被映射的旧文件删不掉，下次重建时再清理
+        return cls.open(path)
+
+    def __len__(self) -> int:
+        return len(self.replay_ids)
+
+    def search(self, query_vector: Sequence[float], k: int = 3, min_score: float = 0.0) -> List[Tuple[int, float, str]]:
+        """
+        暴力 top-k：一次矩阵-向量乘法算出全部相似度，argpartition 取前 k
+        :param query_vector: 查询向量（不要求归一化）
+        :param k: 返回数量
+        :param min_score: 相似度下限，低于它的结果丢弃
+        :return: [(replay_id, 相似度, 摘要), ...]，按相似度降序
+        """
+        if not len(self) or k <= 0:
+            return []
+        query = _normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        if query.shape[0] != self.vectors.shape[1]:
+            raise ValueError(f"query dim {query.shape[0]} != index dim {self.vectors.shape[1]}")
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (self.replay_ids[i], float(scores[i]), self.summaries[i])
+            for i in top if scores[i] >= min_score
+        ]
+
+
+async def build_index(index_path, embedder: Embedder, model: str, db_path=FLIGHTLOG_DB_PATH,
+                      rebuild: bool = False, batch_size: int = 32) -> MatchIndex:
+    """
+    增量构建索引：只编码上次之后新入库的比赛；模型变了或指定 rebuild 时全部重建
+    :param index_path: 索引目录
+    :param embedder: 向量模型
+    :param model: 向量模型名（记录在索引里，换模型后旧向量不可比）
+    :param db_path: 数据库路径（以只读方式打开）
+    :param batch_size: 每次请求编码的摘要数
+    :return: 构建后的索引
+    """
+    existing = None if rebuild else MatchIndex.open(index_path)
+    if existing is not None and existing.model != model:
+        existing = None
+    after = max(existing.replay_ids) if existing is not None and len(existing) else 0
+
+    conn = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True)
+    conn.row_factory = sqlite3.Row
+    try:
+        pending = load_match_summaries(after, conn=conn)
+    finally:
+        conn.close()
+    if not pending and existing is not None:
+        return existing
+
+    vectors = []
+    for start in range(0, len(pending), batch_size):
+        batch = [summary for _, summary in pending[start:start + batch_size]]
+        vectors.extend(await embedder.embed(batch))
+        print(f"[MatchIndex] 已编码 {min(start + batch_size, len(pending))}/{len(pending)} 局")
+
+    replay_ids = [replay_id for replay_id, _ in pending]
+    summaries = [summary for _, summary in pending]
+    new_vectors = _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(pending), -1)) \
+        if pending else np.zeros((0, 0), dtype=np.float32)
+    if existing is not None and len(existing):
+        replay_ids = existing.replay_ids + replay_ids
+        summaries = existing.summaries + summaries
+        new_vectors = np.concatenate([np.asarray(existing.vectors), new_vectors]) if pending else np.asarray(existing.vectors)
+    return MatchIndex.write(index_path, model, replay_ids, summaries, new_vectors)
+
+
+class MatchRetriever:
+    """
+    Bot 端的检索入口：索引文件被离线重建后（meta.json 修改时间变化）自动重新打开；
+    问题的向量按文本缓存（LRU），重复的问题不再调用向量模型
+    """
+
+    def __init__(self, index_path, embedder: Embedder, top_k: int = 3, min_score: float = 0.3,
+                 cache_size: int = 256):
+        """
+        :param index_path: 索引目录
+        :param embedder: 向量模型（必须和建索引时的一致）
+        :param top_k: 返回的比赛数
+        :param min_score: 相似度下限
+        :param cache_size: 最多缓存多少个问题的向量
+        """
+        self.index_path = Path(index_path)
+        self.embedder = embedder
+        self.top_k = top_k
+        self.min_score = min_score
+        self.cache_size = cache_size
+        self.index: Optional[MatchIndex] = None
+        self._mtime: Optional[float] = None
+        self._query_vectors: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def refresh(self) -> Optional[MatchIndex]:
+        """索引有更新时重新打开"""
+        try:
+            mtime = (self.index_path / MatchIndex.META_FILE).stat().st_mtime
+        except FileNotFoundError:
+            self.index, self._mtime = None, None
+            return None
+        if mtime != self._mtime:
+            self.index = MatchIndex.open(self.index_path)
+            self._mtime = mtime
+        return self.index
+
+    async def search(self, query: str, k: Optional[int] = None) -> List[Tuple[int, float, str]]:
+        """
+        检索和问题最相关的比赛摘要
+        :return: [(replay_id, 相似度, 摘要), ...]，索引不存在时返回空列表
+        """
+        index = self.refresh()
+        if index is None or not len(index):
+            return []
+        return index.search(await self.embed_query(query), k or self.top_k, self.min_score)
+
+    async def embed_query(self, query: str) -> List[float]:
+        """问题 -> 向量（命中缓存时不调用向量模型）"""
+        key = " ".join(query.split())
+        vector = self._query_vectors.get(key)
+        if vector is None:
+            vector = (await self.embedder.embed([key]))[0]
+            self._query_vectors[key] = vector
+            while len(self._query_vectors) > self.cache_size:
+                self._query_vectors.popitem(last=False)
+        else:
+            self._query_vectors.move_to_end(key)
+        return vector
+
+
+def trim_retrieved(results: List[Tuple[int, float, str]], max_tokens: int) -> List[Tuple[int, float, str]]:
+    """
+    让 format_retrieved 的输出不超过 max_tokens：按相似度顺序放入，放不下的那一局按行截断，之后的丢弃
+    :return: 截断后的检索结果（可能为空）
+    """
+    used = estimate_tokens("相关比赛（按相似度排序）：")
+    trimmed = []
+    for replay_id, score, summary in results:
+        header = f"[相似度 {score:.2f}]"
+        tokens = estimate_tokens(f"{header}\n{summary}", overhead=2)
+        if used + tokens <= max_tokens:
+            trimmed.append((replay_id, score, summary))
+            used += tokens
+            continue
+        lines = summary.splitlines()
+        while lines and used + estimate_tokens("\n".join([header, *lines, "…"]), overhead=2) > max_tokens:
+            lines.pop()
+        # 至少要留下摘要的第一行（地图 / 时间），否则整局丢弃
+        if lines:
+            trimmed.append((replay_id, score, "\n".join(lines + ["…"])))
+        break
+    return trimmed
+
+
+def format_retrieved(results: List[Tuple[int, float, str]]) -> str:
+    """检索结果 -> 追加到 LLM 上下文的文本"""
+    if not results:
+        return ""
+    blocks = [f"[相似度 {score:.2f}]\n{summary}" for _, score, summary in results]
+    return "相关比赛（按相似度排序）：\n" + "\n\n".join(blocks)
+
+
+def main():
+    from Discord_bot.config import MATCH_INDEX_CONFIG, OLLAMA_CONFIG
+    from Discord_bot.ollama_client import OllamaClient
+
+    parser = argparse.ArgumentParser(description="构建比赛向量索引")
+    parser.add_argument("--url", default=OLLAMA_CONFIG["url"])
+    parser.add_argument("--model", default=MATCH_INDEX_CONFIG["embed_model"])
+    parser.add_argument("--rebuild", action="store_true", help="丢弃已有索引，全部重新编码")
+    args = parser.parse_args()
+
+    async def run():
+        client = OllamaClient(args.url, args.model, total_timeout=600)
+        try:
+            index = await build_index(MATCH_INDEX_CONFIG["path"], OllamaEmbedder(client, args.model),
+                                      args.model, rebuild=args.rebuild)
+        finally:
+            await client.close()
+        print(f"[MatchIndex] 索引共 {len(index)} 局比赛，保存在 {MATCH_INDEX_CONFIG['path']}")
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
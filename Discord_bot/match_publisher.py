@@ -0,0 +1,252 @@
+"""
+比赛结算发布器
+每次有新比赛入库（数据库 generation 变化）时，预先生成各 map_type 的排行榜和最近一局的战报 Embed，
+/leaderboard 和 /lastmatch 直接返回现成的 Embed；可选把战报自动发到指定频道
+"""
+
+import sys
+import sqlite3
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import discord
+
+# 添加父目录到路径以导入DB模块
+sys.path.append(str(Path(__file__).parent.parent))
+from DB import ELO_TYPE
+
+
+LEADERBOARD_SQL = """
+    SELECT
+        p.id,
+        p.steam_name,
+        p.{elo_field} AS elo,
+        COALESCE(ps.kills, 0) AS kills,
+        COALESCE(ps.deaths, 0) AS deaths,
+        COALESCE(ps.matches, 0) AS matches
+    FROM players p
+    LEFT JOIN player_stats ps ON ps.player_id = p.id AND ps.map_type = ?
+    WHERE p.is_archived = 0 AND p.is_banned = 0
+    ORDER BY p.{elo_field} DESC
+    LIMIT ?
+"""
+
+LAST_REPLAY_SQL = "SELECT id, file_name, map_name, played_at FROM replays ORDER BY id DESC LIMIT 1"
+
+REPLAY_SQL = "SELECT id, file_name, map_name, played_at FROM replays WHERE id = ?"
+
+MATCH_KILLS_SQL = """
+    SELECT
+        e.id,
+        e.event_type,
+        e.time_local,
+        e.weapon,
+        MAX(CASE WHEN pe.role = 'killer' THEN p.id END) AS killer_id,
+        MAX(CASE WHEN pe.role = 'killer' THEN p.steam_name END) AS killer,
+        MAX(CASE WHEN pe.role = 'victim' THEN p.id END) AS victim_id,
+        MAX(CASE WHEN pe.role = 'victim' THEN p.steam_name END) AS victim
+    FROM events e
+    JOIN player_events pe ON pe.event_id = e.id
+    JOIN players p ON p.id = pe.player_id
+    WHERE e.replay_id = ?
+    GROUP BY e.id
+    ORDER BY e.id
+"""
+
+MATCH_ELO_SQL = """
+    SELECT h.player_id, p.steam_name, h.elo_before, h.elo_after
+    FROM player_elo_history h
+    JOIN players p ON p.id = h.player_id
+    WHERE h.replay_id = ?
+    ORDER BY h.id
+"""
+
+
+def load_leaderboards(limit: int = 10, conn: Optional[sqlite3.Connection] = None) -> Dict[str, List[Dict]]:
+    """
+    读取每个 map_type 的排行榜（在 AsyncDB 的只读连接上执行）
+    :param limit: 每个榜单的人数
+    :return: {map_type: [玩家行, ...]}
+    """
+    boards = {}
+    for map_type, elo_field in ELO_TYPE.items():
+        rows = conn.execute(LEADERBOARD_SQL.format(elo_field=elo_field), (map_type, limit)).fetchall()
+        boards[map_type] = [dict(row) for row in rows]
+    return boards
+
+
+def load_last_match(conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+    """
+    读取最近一局比赛的战报数据
+    :return: {"replay": ..., "map_type": ..., "kills": [...], "players": [...]}，没有比赛时返回None
+    """
+    return load_match(None, conn=conn)
+
+
+def load_match(replay_id: Optional[int] = None, conn: Optional[sqlite3.Connection] = None) -> Optional[Dict]:
+    """
+    读取指定比赛的战报数据
+    :param replay_id: 比赛ID，None 表示最近一局
+    :return: 同 load_last_match，比赛不存在时返回None
+    """
+    if replay_id is None:
+        replay = conn.execute(LAST_REPLAY_SQL).fetchone()
+    else:
+        replay = conn.execute(REPLAY_SQL, (replay_id,)).fetchone()
+    if replay is None:
+        return None
+    replay = dict(replay)
+    kills = [dict(row) for row in conn.execute(MATCH_KILLS_SQL, (replay["id"],)).fetchall()]
+
+    # 每名玩家：本局第一条记录的 elo_before → 最后一条记录的 elo_after
+    players: Dict[int, Dict] = {}
+    for row in conn.execute(MATCH_ELO_SQL, (replay["id"],)).fetchall():
+        player = players.setdefault(row["player_id"], {
+            "steam_name": row["steam_name"],
+            "elo_before": row["elo_before"] if row["elo_before"] is not None else row["elo_after"],
+            "kills": 0,
+            "deaths": 0,
+        })
+        player["elo_after"] = row["elo_after"]
+    for kill in kills:
+        if kill["killer_id"] in players:
+            players[kill["killer_id"]]["kills"] += 1
+        if kill["victim_id"] in players:
+            players[kill["victim_id"]]["deaths"] += 1
+
+    map_type = None
+    if kills:
+        prefix = (kills[0]["event_type"] or "").split("_", 1)[0]
+        map_type = prefix if prefix in ELO_TYPE else None
+
+    return {
+        "replay": replay,
+        "map_type": map_type,
+        "kills": kills,
+        "players": sorted(players.values(), key=lambda p: p["elo_after"] - p["elo_before"], reverse=True),
+    }
+
+
+def build_leaderboard_embed(map_type: str, rows: List[Dict]) -> discord.Embed:
+    """
+    生成排行榜 Embed
+    :param map_type: BVR / BFM / PVE
+    :param rows: load_leaderboards 返回的玩家行
+    """
+    embed = discord.Embed(
+        title=f"🏆 {map_type} 排行榜",
+        color=discord.Color.gold()
+    )
+    if not rows:
+        embed.description = "暂无数据"
+    else:
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        lines = []
+        for rank, row in enumerate(rows, 1):
+            kd = row["kills"] / row["deaths"] if row["deaths"] else row["kills"]
+            lines.append(
+                f"{medals.get(rank, f'`#{rank:>2}`')} **{row['steam_name']}** — "
+                f"{row['elo']:.1f}  ({row['kills']}/{row['deaths']}, K/D {kd:.2f})"
+            )
+        embed.description = "\n".join(lines)
+    embed.set_footer(text="数据来源: ezServer Flight Log Database")
+    return embed
+
+
+def build_match_report_embed(report: Dict) -> discord.Embed:
+    """
+    生成最近一局的战报 Embed
+    :param report: load_last_match 的返回值
+    """
+    replay = report["replay"]
+    title = f"🛩️ 战报 - {replay['map_name']}"
+    if report["map_type"]:
+        title += f" [{report['map_type']}]"
+    embed = discord.Embed(
+        title=title,
+        description=f"**时间:** {replay['played_at']}\n**击杀数:** {len(report['kills'])}",
+        color=discord.Color.dark_teal()
+    )
+
+    if report["players"]:
+        lines = []
+        for player in report["players"][:15]:
+            change = player["elo_after"] - player["elo_before"]
+            emoji = "📈" if change > 0 else "📉" if change < 0 else "➖"
+            lines.append(
+                f"{emoji} **{player['steam_name']}** {player['kills']}/{player['deaths']} "
+                f"{player['elo_after']:.1f} ({change:+.1f})"
+            )
+        embed.add_field(name="👥 玩家", value="\n".join(lines)[:1024], inline=False)
+
+    if report["kills"]:
+        lines = [
+            f"`{kill['time_local']}` {kill['killer'] or '?'} ➜ {kill['victim'] or '?'} ({kill['weapon'] or 'N/A'})"
+            for kill in report["kills"][-10:]
+        ]
+        embed.add_field(name="⚔️ 击杀记录 (最后10条)", value="\n".join(lines)[:1024], inline=False)
+
+    embed.set_footer(text=f"Replay #{replay['id']} | 数据来源: ezServer Flight Log Database")
+    return embed
+
+
+class MatchPublisher:
+    """
+    保存最新的排行榜 / 战报 Embed 快照
+    refresh() 由 Bot 在检测到数据库 generation 变化时调用
+    """
+
+    def __init__(self, bot, db_reader, leaderboard_size: int = 10, report_channel_id: Optional[int] = None):
+        """
+        :param bot: discord Bot 实例（用于发送战报）
+        :param db_reader: AsyncDB 只读连接池
+        :param leaderboard_size: 排行榜人数
+        :param report_channel_id: 自动发送战报的频道ID，None 表示不发送
+        """
+        self.bot = bot
+        self.db_reader = db_reader
+        self.leaderboard_size = leaderboard_size
+        self.report_channel_id = report_channel_id
+
+        self.generation: Optional[int] = None
+        self.leaderboards: Dict[str, discord.Embed] = {}
+        self.last_match: Optional[discord.Embed] = None
+        self.last_replay_id: Optional[int] = None
+
+    async def refresh(self, generation: int) -> None:
+        """
+        重新生成所有快照；最近一局有变化时发送战报（Bot 启动后的第一次刷新不发送，避免重复刷屏）
+        :param generation: 本次数据对应的数据库 generation
+        """
+        boards = await self.db_reader.run(load_leaderboards, self.leaderboard_size)
+        report = await self.db_reader.run(load_last_match)
+
+        self.leaderboards = {
+            map_type: build_leaderboard_embed(map_type, rows) for map_type, rows in boards.items()
+        }
+        first_refresh = self.generation is None
+        self.generation = generation
+
+        if report is None:
+            self.last_match = None
+            return
+        replay_id = report["replay"]["id"]
+        if replay_id == self.last_replay_id and self.last_match is not None:
+            return
+        self.last_match = build_match_report_embed(report)
+        self.last_replay_id = replay_id
+        if not first_refresh:
+            await self._post_report(self.last_match)
+
+    async def _post_report(self, embed: discord.Embed) -> None:
+        """把战报发送到配置的频道"""
+        if not self.report_channel_id:
+            return
+        channel = self.bot.get_channel(self.report_channel_id)
+        if channel is None:
+            print(f"[ERROR] Match report channel {self.report_channel_id} not found")
+            return
+        try:
+            await channel.send(embed=embed)
+        except Exception as e:
+            print(f"[ERROR] Failed to post match report: {e}")
@@ -0,0 +1,215 @@
+"""
+异步 Ollama 客户端
+复用同一个 aiohttp.ClientSession（连接池 + keep-alive），
+超时分为三段：建立连接 / 首个 token / 整体，调用方的任务被取消时会断开连接让 Ollama 停止生成
+"""
+
+import asyncio
+import json
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiohttp
+
+
+class OllamaError(Exception):
+    """Ollama 返回错误或响应无法解析"""
+
+
+class OllamaConnectionError(OllamaError):
+    """无法连接到 Ollama 服务"""
+
+
+class OllamaTimeout(OllamaError):
+    """连接 / 首个 token / 整体超时"""
+
+
+class OllamaToolsUnsupported(OllamaError):
+    """当前模型不支持 tools（工具调用）"""
+
+
+class OllamaClient:
+    """Ollama /api/chat 的异步客户端，一个 Bot 进程共用一个实例"""
+
+    def __init__(self, base_url: str, model: str, connect_timeout: float = 5.0,
+                 first_token_timeout: float = 60.0, total_timeout: float = 300.0, pool_size: int = 4,
+                 keep_alive: Optional[str] = None, options: Optional[Dict] = None):
+        """
+        :param base_url: Ollama 地址，例如 http://127.0.0.1:11434
+        :param model: 默认模型
+        :param connect_timeout: 建立 TCP 连接的超时（秒）
+        :param first_token_timeout: 从发出请求到收到第一个 token 的超时（秒），包含模型加载时间
+        :param total_timeout: 整个请求的超时（秒）
+        :param pool_size: 连接池大小
+        :param keep_alive: 每次请求带上的 keep_alive（例如 "30m"），让模型和 KV cache 常驻显存
+        :param options: 每次请求带上的默认 options（例如固定 num_ctx，避免不同请求触发模型重新加载）
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.connect_timeout = connect_timeout
+        self.first_token_timeout = first_token_timeout
+        self.total_timeout = total_timeout
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.options = options or {}
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """懒创建 ClientSession（必须在事件循环里创建）"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size),
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout),
+            )
+        return self._session
+
+    async def stream_messages(self, messages: List[Dict], model: Optional[str] = None,
+                              **extra) -> AsyncIterator[Dict]:
+        """
+        流式对话，逐条产出响应里的 message（可能带 content，也可能带 tool_calls）
+        :param messages: 消息历史
+        :param model: 模型名，默认使用构造时的 model
+        :param extra: 其他请求字段（options / keep_alive / tools 等）
+        """
+        payload = {
+            "model": model or self.model,
+            "messages": messages,
+            "stream": True,
+        }
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        if self.options:
+            payload["options"] = dict(self.options)
+        if "options" in extra:
+            payload["options"] = {**payload.get("options", {}), **extra.pop("options")}
+        payload.update(extra)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.total_timeout
+        first_deadline = min(deadline, loop.time() + self.first_token_timeout)
+        got_first = False
+        finished = False
+        resp = None
+        # 超时只作用在每次等待网络数据上，不包住 yield，避免把调用方的任务取消掉
+        try:
+            resp = await asyncio.wait_for(
+                self._get_session().post(f"{self.base_url}/api/chat", json=payload),
+                first_deadline - loop.time()
+            )
+            if resp.status != 200:
+                body = await resp.text()
+                if payload.get("tools") and "does not support tools" in body:
+                    raise OllamaToolsUnsupported(f"{payload['model']} does not support tools")
+                raise OllamaError(f"HTTP {resp.status}: {body[:200]}")
+            while True:
+                line = await asyncio.wait_for(
+                    resp.content.readline(),
+                    (deadline if got_first else first_deadline) - loop.time()
+                )
+                if not line:
+                    raise OllamaError("Ollama closed the stream before done")
+                if not line.strip():
+                    continue
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise OllamaError(f"Invalid response line: {line[:100]!r}") from e
+                if data.get("error"):
+                    raise OllamaError(data["error"])
+                if data.get("done"):
+                    finished = True
+                message = data.get("message") or {}
+                if message.get("content") or message.get("tool_calls"):
+                    # 首个 token 到了，之后只受整体超时限制
+                    got_first = True
+                    yield message
+                if finished:
+                    return
+        except asyncio.TimeoutError as e:
+            if resp is None and isinstance(e, aiohttp.ServerTimeoutError):
+                stage = "connect"
+            else:
+                stage = "total" if got_first else "first token"
+            raise OllamaTimeout(f"Ollama {stage} timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            raise OllamaConnectionError(f"Cannot reach Ollama at {self.base_url}: {e}") from e
+        finally:
+            if resp is not None:
+                if finished:
+                    resp.release()  # 读完了，连接放回连接池
+                else:
+                    resp.close()  # 中途放弃（取消 / 超时 / 出错），断开连接让 Ollama 停止生成
+
+    async def stream_chat(self, messages: List[Dict], model: Optional[str] = None,
+                          **extra) -> AsyncIterator[str]:
+        """
+        流式对话，逐段产出模型生成的文本
+        :param messages: 消息历史
+        :param model: 模型名，默认使用构造时的 model
+        :param extra: 其他请求字段（options / keep_alive 等）
+        """
+        async with aclosing(self.stream_messages(messages, model=model, **extra)) as stream:
+            async for message in stream:
+                if message.get("content"):
+                    yield message["content"]
+
+    async def chat(self, messages: List[Dict], model: Optional[str] = None, **extra) -> Optional[str]:
+        """
+        非流式调用：收集完整回复
+        :return: 去掉首尾空白的回复文本，模型没有输出时返回None
+        """
+        parts = [part async for part in self.stream_chat(messages, model=model, **extra)]
+        content = "".join(parts).strip()
+        return content or None
+
+    async def get_json(self, path: str, timeout: Optional[float] = None) -> Dict:
+        """
+        GET 一个管理接口（/api/tags、/api/ps 等）
+        :param path: 接口路径，例如 /api/tags
+        :param timeout: 超时（秒），默认 connect_timeout
+        :return: 解析后的 JSON
+        """
+        try:
+            async with asyncio.timeout(timeout or self.connect_timeout):
+                async with self._get_session().get(f"{self.base_url}{path}") as resp:
+                    if resp.status != 200:
+                        body = await resp.text()
+                        raise OllamaError(f"HTTP {resp.status}: {body[:200]}")
+                    return await resp.json(content_type=None)
+        except asyncio.TimeoutError as e:
+            raise OllamaTimeout(f"Ollama {path} timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            raise OllamaConnectionError(f"Cannot reach Ollama at {self.base_url}: {e}") from e
+
+    async def embed(self, texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+        """
+        调用 /api/embed 批量计算向量（非流式，只受整体超时限制）
+        :param texts: 文本列表
+        :param model: 向量模型名，默认使用构造时的 model
+        :return: 与 texts 一一对应的向量
+        """
+        payload = {"model": model or self.model, "input": list(texts)}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        try:
+            async with asyncio.timeout(self.total_timeout):
+                async with self._get_session().post(f"{self.base_url}/api/embed", json=payload) as resp:
+                    if resp.status != 200:
+                        body = await resp.text()
+                        raise OllamaError(f"HTTP {resp.status}: {body[:200]}")
+                    data = await resp.json(content_type=None)
+        except asyncio.TimeoutError as e:
+            raise OllamaTimeout("Ollama embed timeout") from e
+        except aiohttp.ClientConnectionError as e:
+            raise OllamaConnectionError(f"Cannot reach Ollama at {self.base_url}: {e}") from e
+        if data.get("error"):
+            raise OllamaError(data["error"])
+        embeddings = data.get("embeddings") or []
+        if len(embeddings) != len(texts):
+            raise OllamaError(f"Expected {len(texts)} embeddings, got {len(embeddings)}")
+        return embeddings
+
+    async def close(self) -> None:
+        """关闭连接池（Cog 卸载时调用）"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
@@ -0,0 +1,165 @@
+"""
+Ollama 模型生命周期管理
+Bot 启动时通过 /api/tags 确认模型已下载，用一个极短的请求把模型加载进显存并用 keep_alive 常驻，
+（用到向量检索时）同时预加载向量模型；之后定期检查服务健康和模型是否仍在显存里，被卸载了就重新预热，
+第一个 /ai 请求不用再等模型加载
+"""
+
+import time
+from typing import Dict, List, Optional
+
+from Discord_bot.ollama_client import OllamaClient, OllamaError
+
+
+def _same_model(name: str, wanted: str) -> bool:
+    """模型名比较：不带 tag 的名字等同于 :latest"""
+    if ":" not in wanted:
+        wanted += ":latest"
+    if ":" not in name:
+        name += ":latest"
+    return name == wanted
+
+
+class ModelLifecycle:
+    """
+    聊天模型（和可选的向量模型）的预热 / 保活 / 健康检查
+    所有方法都不抛异常：失败记录在 stats() 里，Bot 照常运行，等下次检查再重试
+    """
+
+    WARMUP_MESSAGES = [{"role": "user", "content": "hi"}]
+
+    def __init__(self, client: OllamaClient, model: str, embed_model: Optional[str] = None):
+        """
+        :param client: OllamaClient（keep_alive 由客户端统一带上）
+        :param model: 聊天模型
+        :param embed_model: 向量模型，None 表示不用向量检索
+        """
+        self.client = client
+        self.model = model
+        self.embed_model = embed_model
+
+        self.healthy = False
+        self.available: List[str] = []  # /api/tags 里已下载的模型
+        self.loaded: List[str] = []  # /api/ps 里已在显存中的模型
+        self.missing: List[str] = []  # 配置了但没有下载的模型
+        self.ping_ms: Optional[float] = None  # 最近一次 /api/tags 的耗时
+        self.warmup_ms: Dict[str, float] = {}  # 每个模型最近一次预热耗时（包含加载时间）
+        self.warmups = 0
+        self.checks = 0
+        self.failures = 0
+        self.last_check: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _models(self) -> List[str]:
+        return [self.model] + ([self.embed_model] if self.embed_model else [])
+
+    def _fail(self, error: Exception) -> None:
+        self.healthy = False
+        self.failures += 1
+        self.last_error = str(error)
+        print(f"[ERROR] Ollama 健康检查失败: {error}")
+
+    async def verify_models(self) -> bool:
+        """
+        通过 /api/tags 确认服务可用、模型已下载
+        :return: True 表示服务可用且所有模型都已下载
+        """
+        start = time.perf_counter()
+        try:
+            data = await self.client.get_json("/api/tags")
+        except OllamaError as e:
+            self._fail(e)
+            return False
+        self.ping_ms = (time.perf_counter() - start) * 1000
+        self.available = [m.get("name") or m.get("model", "") for m in data.get("models", [])]
+        self.missing = [
+            wanted for wanted in self._models()
+            if not any(_same_model(name, wanted) for name in self.available)
+        ]
+        self.healthy = True
+        if self.missing:
+            self.last_error = f"模型未下载: {', '.join(self.missing)}（请先执行 ollama pull）"
+            print(f"[ERROR] {self.last_error}")
+        return not self.missing
+
+    async def refresh_loaded(self) -> List[str]:
+        """通过 /api/ps 读取当前在显存里的模型"""
+        try:
+            data = await self.client.get_json("/api/ps")
+        except OllamaError as e:
+            self._fail(e)
+            return self.loaded
+        self.loaded = [m.get("name") or m.get("model", "") for m in data.get("models", [])]
+        return self.loaded
+
+    def is_loaded(self, model: str) -> bool:
+        return any(_same_model(name, model) for name in self.loaded)
+
+    async def warm_up(self, model: Optional[str] = None) -> bool:
+        """
+        预热一个模型：聊天模型发一个只生成1个 token 的请求，向量模型编码一个短文本
+        请求带着客户端的 keep_alive，加载之后模型常驻显存
+        :param model: 要预热的模型，None 表示聊天模型
+        :return: 是否成功
+        """
+        model = model or self.model
+        start = time.perf_counter()
+        try:
+            if model == self.embed_model:
+                await self.client.embed(["warmup"], model=model)
+            else:
+                await self.client.chat(list(self.WARMUP_MESSAGES), model=model, options={"num_predict": 1})
+        except OllamaError as e:
+            self._fail(e)
+            return False
+        self.warmup_ms[model] = (time.perf_counter() - start) * 1000
+        self.warmups += 1
+        print(f"[Ollama] 模型 {model} 已预热，耗时 {self.warmup_ms[model]:.0f}ms")
+        return True
+
+    async def start(self) -> bool:
+        """
+        Bot 启动时调用：确认模型 -> 预热聊天模型 -> 预加载向量模型
+        :return: 所有模型都预热成功时为 True
+        """
+        if not await self.verify_models():
+            return False
+        ok = True
+        for model in self._models():
+            ok = await self.warm_up(model) and ok
+        await self.refresh_loaded()
+        return ok
+
+    async def check(self) -> bool:
+        """
+        定期健康检查：服务是否可用，模型是否还在显存里（keep_alive 过期或被别的模型挤掉时重新预热）
+        :return: 检查后服务是否健康
+        """
+        self.checks += 1
+        self.last_check = time.time()
+        if not await self.verify_models():
+            return self.healthy
+        await self.refresh_loaded()
+        for model in self._models():
+            if not self.is_loaded(model):
+                print(f"[Ollama] 模型 {model} 不在显存中，重新预热")
+                await self.warm_up(model)
+        await self.refresh_loaded()
+        return self.healthy
+
+    def stats(self) -> Dict:
+        """健康 / 延迟统计"""
+        return {
+            "healthy": self.healthy,
+            "model": self.model,
+            "embed_model": self.embed_model,
+            "missing": list(self.missing),
+            "loaded": list(self.loaded),
+            "ping_ms": self.ping_ms,
+            "warmup_ms": dict(self.warmup_ms),
+            "warmups": self.warmups,
+            "checks": self.checks,
+            "failures": self.failures,
+            "last_check": self.last_check,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,121 @@
+"""
+Bot 查询结果缓存
+LRU + TTL，键为 (查询类型, 规范化后的参数)；
+数据库每次写入比赛数据都会让 db_meta.generation +1，代数变化时整个缓存失效
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional, Tuple
+
+
+def content_digest(text: str) -> str:
+    """文本内容的 sha256，用作“相同内容”类缓存的键"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class QueryCache:
+    """
+    进程内查询结果缓存（只在事件循环线程里使用，不需要加锁）
+    两局比赛之间数据不会变，热门命令直接从内存返回
+    """
+
+    def __init__(self, max_entries: int = 512, ttl: float = 600.0):
+        """
+        :param max_entries: 最多缓存的条目数，超出时淘汰最久未使用的
+        :param ttl: 单条缓存的最长存活时间（秒），兜底防止代数漏更新
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+
+    @staticmethod
+    def make_key(kind: str, **params) -> Tuple:
+        """
+        规范化参数：字符串去首尾空格并 casefold，按参数名排序
+        这样 `/stats name:Alpha ` 和 `/stats name:alpha` 命中同一条缓存
+        """
+        normalized = []
+        for name, value in sorted(params.items()):
+            if isinstance(value, str):
+                value = value.strip().casefold()
+            elif not isinstance(value, Hashable):
+                value = repr(value)
+            normalized.append((name, value))
+        return (kind, tuple(normalized))
+
+    def set_generation(self, generation: int) -> bool:
+        """
+        更新当前数据代数，代数变化时清空缓存
+        :return: True 表示代数发生了变化
+        """
+        if generation == self.generation:
+            return False
+        self.generation = generation
+        self._entries.clear()
+        return True
+
+    def get(self, kind: str, default: Any = None, **params) -> Any:
+        """
+        取缓存；不存在或已过期返回 default
+        """
+        key = self.make_key(kind, **params)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, kind: str, value: Any, **params) -> None:
+        """写入缓存，超出容量时淘汰最久未使用的条目"""
+        key = self.make_key(kind, **params)
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_load(self, kind: str, loader: Callable[[], Awaitable[Any]],
+                          cache_if: Optional[Callable[[Any], bool]] = None, **params) -> Any:
+        """
+        命中直接返回，否则 await loader() 并写入缓存
+        加载期间代数变了（刚好有一局比赛入库）就不缓存这次的结果
+        :param cache_if: 判断结果是否值得缓存（例如查询失败的结果不缓存），None 表示总是缓存
+        """
+        missing = object()
+        value = self.get(kind, missing, **params)
+        if value is not missing:
+            return value
+        generation = self.generation
+        value = await loader()
+        if generation == self.generation and (cache_if is None or cache_if(value)):
+            self.set(kind, value, **params)
+        return value
+
+    def invalidate(self) -> None:
+        """手动清空缓存"""
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        """命中率统计（调试用）"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "generation": self.generation,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
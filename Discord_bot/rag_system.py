@@ -6,13 +6,23 @@ RAG (Retrieval-Augmented Generation) 系统
 import sqlite3
 import json
 import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional, Tuple, Any
 from pathlib import Path
 import sys
 
 # 添加父目录到路径
 sys.path.append(str(Path(__file__).parent.parent))
-from DB import FLIGHTLOG_DB_PATH, ELO_TYPE
+from DB import FLIGHTLOG_DB_PATH, ELO_TYPE, flightlogDB
+
+from MapCatalog import get_catalog
+
+from Discord_bot.async_db import install_cancel_handler, job_cancelled
+from Discord_bot.chat_sessions import estimate_tokens
+from Discord_bot.intent_matcher import KeywordMatcher
 
 
 class IntentDetector:
@@ -32,20 +42,58 @@ class IntentDetector:
         "combat_style": "战斗风格分析",
     }
     
-    # 关键词映射
+    # 关键词权重：越能单独说明意图的词权重越高，"最近"、"和" 这类到处出现的词只给很低的分
     KEYWORDS = {
-        "player_recent_performance": ["最近", "表现", "战绩", "成绩", "近期"],
-        "player_stats_summary": ["统计", "数据", "总览", "概况", "信息"],
-        "player_elo_trend": ["elo", "分数", "趋势", "变化", "排名"],
-        "map_leaderboard": ["排行", "排名", "最好", "最强", "第一", "榜单"],
-        "recent_battles": ["战况", "战斗", "对局", "比赛"],
-        "weapon_analysis": ["武器", "装备", "导弹", "枪"],
-        "player_comparison": ["对比", "比较", "vs", "和"],
-        "battle_report": ["战报", "总结", "报告"],
-        "activity_analysis": ["活跃", "在线", "参与"],
-        "combat_style": ["风格", "打法", "特点", "习惯"],
+        "player_recent_performance": {
+            "表现": 2, "战绩": 2.5, "成绩": 2, "近期": 1, "最近": 0.5, "这几天": 0.5, "打得怎么样": 1.5,
+        },
+        "player_stats_summary": {
+            "统计": 1.5, "数据": 1, "总览": 2.5, "概况": 2.5, "信息": 1.5, "kd": 2,
+            "击杀": 0.5, "死亡": 1, "总共": 1.5, "多少场": 1.5,
+        },
+        "player_elo_trend": {
+            "elo": 1.5, "分数": 1, "趋势": 3, "走势": 3, "变化": 2, "涨分": 2.5, "掉分": 2.5, "上分": 2.5,
+        },
+        "map_leaderboard": {
+            "排行": 3, "排名": 2, "榜": 2, "榜单": 2.5, "最强": 2, "第一": 2, "最高": 2, "最好": 1,
+            "top": 2, "前十": 1.5, "前几": 1.5,
+        },
+        "recent_battles": {
+            "战况": 2.5, "战斗": 1, "对局": 2, "比赛": 1.5, "几局": 1.5,
+        },
+        "weapon_analysis": {
+            "武器": 3, "导弹": 3, "装备": 2.5, "机炮": 2.5, "aim-": 2.5, "枪": 1,
+        },
+        "player_comparison": {
+            "对比": 3, "比较": 3, "vs": 3, "谁更": 2, "和": 0.5, "跟": 0.5,
+        },
+        "battle_report": {
+            "战报": 3, "总结": 2, "报告": 2.5, "复盘": 3, "这局": 2, "那局": 2, "上一局": 2, "刚才": 1,
+        },
+        "activity_analysis": {
+            "活跃": 3, "在线": 2.5, "参与": 2, "玩得最多": 3, "打得最多": 3, "最多": 1.5,
+        },
+        "combat_style": {
+            "风格": 3, "打法": 3, "特点": 2.5, "习惯": 2.5, "擅长": 2.5, "作战": 1,
+        },
+    }
+    
+    # 反向关键词：出现时扣分（"总结一下我的数据" 是统计不是战报，"战斗风格" 不是查最近战斗）
+    NEGATIVE_KEYWORDS = {
+        "battle_report": {"数据": 1.5},
+        "recent_battles": {"风格": 2, "报告": 1},
+        "player_elo_trend": {"最高": 1},
     }
     
+    # 同分时的优先级（越具体的意图越靠前）
+    INTENT_PRIORITY = [
+        "battle_report", "combat_style", "weapon_analysis", "player_comparison", "player_elo_trend",
+        "activity_analysis", "map_leaderboard", "recent_battles", "player_recent_performance",
+        "player_stats_summary",
+    ]
+    MIN_INTENT_SCORE = 1.0  # 最高分低于这个值时用默认意图
+    DEFAULT_INTENT = "player_stats_summary"
+    
     # 地图类型关键词
     MAP_TYPES = {
         "BVR": ["bvr", "超视距", "远程"],
@@ -53,77 +101,193 @@ class IntentDetector:
         "PVE": ["pve", "ai", "电脑"],
     }
     
+    # 时间范围关键词
+    TIME_RANGES = {
+        "today": ["今天", "今日"],
+        "yesterday": ["昨天"],
+        "this_week": ["本周", "这周"],
+        "last_week": ["上周"],
+        "this_month": ["本月", "这个月"],
+        "last_7_days": ["最近一周", "近一周", "过去一周", "最近7天", "近7天"],
+        "last_30_days": ["最近一个月", "近一个月", "过去一个月", "最近30天", "近30天"],
+    }
+    
+    # 玩家名候选：引号括起来的任意内容，或 2 个字符以上的英文/数字串
+    QUOTED_NAME = re.compile(r'["“「『](.+?)["”」』]')
+    NAME_TOKEN = re.compile(r"[A-Za-z0-9_\-\.\[\]]{2,}")
+    # 出现在查询里但不是玩家名的英文词
+    NON_PLAYER_WORDS = {
+        word for keywords in list(KEYWORDS.values()) + list(MAP_TYPES.values())
+        for word in keywords if word.isascii()
+    }
+    MAX_PLAYER_NAMES = 5
+    # 武器名的前缀（"AIM-120 击杀排行" 里的 AIM-120 不是玩家）
+    WEAPON_PREFIXES = ("aim-", "agm-", "gbu-", "gau-", "r-", "pl-", "sd-", "kh-", "m61", "mica", "meteor")
+    # 型号一样的串（F-16、J20、R77）：可能是玩家名，查得到就用，查不到不提示“未找到玩家”
+    DESIGNATOR = re.compile(r"[A-Za-z]{1,3}-?\d+[A-Za-z]?")
+    TOP_N = re.compile(r"top\d+", re.IGNORECASE)
+    
+    def __init__(self, map_names: Optional[List[str]] = None):
+        """
+        :param map_names: 地图名 / 地图ID（查询里出现时不当作玩家名），None 时取 maplist.csv 里的全部地图
+        """
+        # 意图 / 反向 / 地图类型 / 时间范围关键词编译进同一个自动机，每次查询只扫描一遍
+        self.matcher = KeywordMatcher()
+        for intent, keywords in self.KEYWORDS.items():
+            for keyword, weight in keywords.items():
+                self.matcher.add(keyword, ("intent", intent, weight))
+        for intent, keywords in self.NEGATIVE_KEYWORDS.items():
+            for keyword, weight in keywords.items():
+                self.matcher.add(keyword, ("intent", intent, -weight))
+        for map_type, keywords in self.MAP_TYPES.items():
+            for keyword in keywords:
+                self.matcher.add(keyword, ("map", map_type))
+        for time_range, keywords in self.TIME_RANGES.items():
+            for keyword in keywords:
+                self.matcher.add(keyword, ("time", time_range))
+        self.matcher.build()
+        # 地图名单独一个自动机：只用来把查询里的地图名遮掉，不参与意图打分
+        self.map_matcher = KeywordMatcher()
+        for name in self._map_names(map_names):
+            self.map_matcher.add(name, "map_name")
+        self.map_matcher.build()
+        self._priority_rank = {intent: rank for rank, intent in enumerate(self.INTENT_PRIORITY)}
+    
     def detect(self, query: str) -> Dict[str, Any]:
         """
         检测用户查询的意图
         :param query: 用户的自然语言查询
         :return: 结构化的意图字典
         """
-        query_lower = query.lower()
+        hits = self.matcher.find(query)
         
-        # 提取玩家名称（简单实现，可以改进）
-        player_names = self._extract_player_names(query)
+        # 提取玩家名称候选（武器名、地图名不算）
+        player_names, tentative = self._extract_player_names(query)
         
         # 提取地图类型
-        map_type = self._extract_map_type(query_lower)
+        map_type = self._first_hit(hits, "map")
         
         # 提取时间范围
-        time_range = self._extract_time_range(query_lower)
+        time_range = self._first_hit(hits, "time")
         
-        # 提取数量限制
-        limit = self._extract_limit(query_lower)
+        # 提取数量限制（AIM-120、Ethi5 这类串里的数字不算）
+        limit = self._extract_limit(self._mask_tokens(query).lower())
         
-        # 检测意图类型
-        intent_type = self._detect_intent_type(query_lower)
+        # 检测意图类型（最高分达到 MIN_INTENT_SCORE 才算有把握，否则是兜底的默认意图）
+        intent_type = self._detect_intent_type(hits)
+        scores = self._score(hits)
+        confident = bool(scores) and max(scores.values()) >= self.MIN_INTENT_SCORE
         
         return {
             "intent": intent_type,
+            "confident": confident,
             "players": player_names,
+            "tentative_players": tentative,
             "map_type": map_type,
             "time_range": time_range,
             "limit": limit,
             "original_query": query,
         }
     
-    def _detect_intent_type(self, query: str) -> str:
-        """检测意图类型"""
-        scores = {}
-        for intent, keywords in self.KEYWORDS.items():
-            score = sum(1 for keyword in keywords if keyword in query)
-            if score > 0:
-                scores[intent] = score
-        
-        if scores:
-            return max(scores, key=scores.get)
-        return "player_stats_summary"  # 默认意图
-    
-    def _extract_player_names(self, query: str) -> List[str]:
-        """提取玩家名称（简单实现）"""
-        # 这里可以改进为更智能的NER
-        # 暂时返回空，由SQL生成器处理
-        return []
-    
-    def _extract_map_type(self, query: str) -> Optional[str]:
-        """提取地图类型"""
-        for map_type, keywords in self.MAP_TYPES.items():
-            if any(keyword in query for keyword in keywords):
-                return map_type
-        return None
+    def score_intents(self, query: str) -> Dict[str, float]:
+        """各意图的得分（调试 / 调权重用）"""
+        return self._score(self.matcher.find(query))
+    
+    @staticmethod
+    def _score(hits: List[Tuple[str, List[tuple]]]) -> Dict[str, float]:
+        scores: Dict[str, float] = {}
+        for _, payloads in hits:
+            for payload in payloads:
+                if payload[0] == "intent":
+                    scores[payload[1]] = scores.get(payload[1], 0.0) + payload[2]
+        return scores
+    
+    def _detect_intent_type(self, hits: List[Tuple[str, List[tuple]]]) -> str:
+        """按加权得分选意图，同分按 INTENT_PRIORITY，最高分太低时用默认意图"""
+        scores = self._score(hits)
+        if not scores:
+            return self.DEFAULT_INTENT
+        rank = self._priority_rank
+        best = max(scores, key=lambda intent: (scores[intent], -rank[intent]))
+        if scores[best] < self.MIN_INTENT_SCORE:
+            return self.DEFAULT_INTENT
+        return best
     
-    def _extract_time_range(self, query: str) -> Optional[str]:
-        """提取时间范围"""
-        if "今天" in query or "今日" in query:
-            return "today"
-        elif "昨天" in query:
-            return "yesterday"
-        elif "本周" in query or "这周" in query:
-            return "this_week"
-        elif "上周" in query:
-            return "last_week"
-        elif "本月" in query or "这个月" in query:
-            return "this_month"
+    @staticmethod
+    def _first_hit(hits: List[Tuple[str, List[tuple]]], kind: str) -> Optional[str]:
+        """查询里最先出现的某类关键词（地图类型 / 时间范围）"""
+        for _, payloads in hits:
+            for payload in payloads:
+                if payload[0] == kind:
+                    return payload[1]
         return None
     
+    @staticmethod
+    def _map_names(map_names: Optional[List[str]]) -> List[str]:
+        """
+        地图名 / 地图ID，以及去掉开头地图类型后的名字（"BVR Ethi5" -> "Ethi5"）
+        只保留含字母、3 个字符以上的（maplist.csv 里有 "10" 这样的地图ID，不能把 "前10名" 遮掉）
+        """
+        if map_names is None:
+            try:
+                catalog = get_catalog()
+            except OSError as e:
+                print(f"[ERROR] 读取地图目录失败，不过滤地图名: {e}")
+                return []
+            map_names = [name for entry in catalog.entries for name in (entry.map_id, entry.map_name)]
+        names = set()
+        for name in map_names:
+            name = name.strip()
+            prefix, _, rest = name.partition(" ")
+            for variant in (name, rest if prefix.upper() in ELO_TYPE else ""):
+                if len(variant) >= 3 and re.search(r"[A-Za-z]", variant):
+                    names.add(variant)
+        return sorted(names)
+    
+    def _is_weapon(self, token: str) -> bool:
+        return token.casefold().startswith(self.WEAPON_PREFIXES)
+    
+    def _mask_maps(self, query: str) -> str:
+        """把查询里的地图名换成等长的空格"""
+        chars = list(query)
+        for start, end, _ in self.map_matcher.find_all(query):
+            chars[start:end] = " " * (end - start)
+        return "".join(chars)
+    
+    def _mask_tokens(self, query: str) -> str:
+        """再把含字母的英文/数字串（武器、玩家名，top10 除外）换成空格，剩下的数字才可能是数量"""
+        def mask(match):
+            token = match.group(0)
+            if self.TOP_N.fullmatch(token) or not re.search(r"[A-Za-z]", token):
+                return token
+            return " " * len(token)
+        return self.NAME_TOKEN.sub(mask, self._mask_maps(query))
+    
+    def _extract_player_names(self, query: str) -> Tuple[List[str], List[str]]:
+        """
+        提取可能是玩家名的片段：引号里的内容，以及夹在中文里的英文/数字串（例如 "查一下Tobiichi最近" 里的 Tobiichi）
+        武器名（AIM-120）和地图名（MergeLarge、BVR Ethi5）不算；这里只是候选，由 RAGExecutor.resolve_players 对照昵称索引确认
+        :return: (候选名字, 其中不太像玩家名的（型号一样的串），查不到时不提示)
+        """
+        candidates = [name.strip() for name in self.QUOTED_NAME.findall(query)]
+        tentative = []
+        for token in self.NAME_TOKEN.findall(self._mask_maps(query)):
+            if token.casefold() in self.NON_PLAYER_WORDS or not re.search(r"[A-Za-z]", token) \
+                    or self._is_weapon(token) or self.TOP_N.fullmatch(token):
+                continue
+            candidates.append(token)
+            if self.DESIGNATOR.fullmatch(token):
+                tentative.append(token)
+        
+        names = []
+        for name in candidates:
+            if name and name not in names:
+                names.append(name)
+        names = names[:self.MAX_PLAYER_NAMES]
+        # 引号里的名字是用户明确指定的，总是提示
+        quoted = {name.strip() for name in self.QUOTED_NAME.findall(query)}
+        return names, [name for name in tentative if name in names and name not in quoted]
+    
     def _extract_limit(self, query: str) -> int:
         """提取数量限制"""
         # 查找数字
@@ -134,16 +298,23 @@ class IntentDetector:
 
 
 class SQLGenerator:
-    """SQL 生成器 - 根据意图生成 SQL 查询"""
+    """
+    SQL 生成器 - 根据意图生成参数化 SQL 查询
+    返回 (sql, params)，所有值都通过参数绑定；SQL 文本只取决于意图和有哪些过滤条件，
+    bot 的只读连接是长期复用的，sqlite3 的语句缓存可以直接复用编译好的语句
+    """
+    
+    BATTLE_REPORT_EVENTS = 100  # 战报最多取这一局的前多少条事件
     
     def __init__(self, db_path=FLIGHTLOG_DB_PATH):
         self.db_path = db_path
     
-    def generate(self, intent: Dict[str, Any]) -> str:
+    def generate(self, intent: Dict[str, Any], player_ids: Optional[List[int]] = None) -> Tuple[str, List[Any]]:
         """
         根据意图生成SQL查询
         :param intent: 意图字典
-        :return: SQL查询字符串
+        :param player_ids: 已解析出的玩家ID，非空时查询只限定在这些玩家上
+        :return: (SQL查询字符串, 参数列表)
         """
         intent_type = intent.get("intent", "player_stats_summary")
         
@@ -162,14 +333,91 @@ class SQLGenerator:
         }
         
         generator = generators.get(intent_type, self._gen_stats_summary)
-        return generator(intent)
+        return generator(intent, player_ids or [])
+    
+    @staticmethod
+    def _map_type(intent: Dict) -> Optional[str]:
+        """意图里的地图类型（只接受 ELO_TYPE 里有的）"""
+        map_type = (intent.get("map_type") or "").upper()
+        return map_type if map_type in ELO_TYPE else None
     
-    def _gen_recent_performance(self, intent: Dict) -> str:
+    @staticmethod
+    def time_bounds(time_range: Optional[str], now: Optional[datetime] = None) -> Optional[Tuple[datetime, datetime]]:
+        """
+        时间范围 -> [开始, 结束)，按 UTC 自然日 / 周（周一开始）/ 月计算（和 replays.played_at 一致）
+        :param time_range: IntentDetector 识别出的 today / yesterday / this_week / last_week / this_month /
+                           last_7_days / last_30_days（都包含今天）
+        :return: (开始, 结束)，无法识别时返回 None
+        """
+        now = now or datetime.now(timezone.utc)
+        today = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        tomorrow = today + timedelta(days=1)
+        this_week = today - timedelta(days=today.weekday())
+        bounds = {
+            "today": (today, tomorrow),
+            "yesterday": (today - timedelta(days=1), today),
+            "this_week": (this_week, tomorrow),
+            "last_week": (this_week - timedelta(days=7), this_week),
+            "this_month": (today.replace(day=1), tomorrow),
+            "last_7_days": (today - timedelta(days=6), tomorrow),
+            "last_30_days": (today - timedelta(days=29), tomorrow),
+        }
+        return bounds.get(time_range)
+    
+    def _filters(self, intent: Dict, player_ids: List[int], player_col: Optional[str] = None,
+                 map_col: Optional[str] = None, time_col: Optional[str] = None,
+                 date_col: Optional[str] = None, bucket: str = "day") -> Tuple[str, List[Any]]:
+        """
+        生成 WHERE 里的过滤条件
+        :param player_col: 按玩家过滤的列，例如 pe.player_id
+        :param map_col: 按地图类型过滤的列，例如 r.map_type
+        :param time_col: 按时间范围过滤的时间戳列，例如 r.played_at_epoch
+        :param date_col: 按时间范围过滤的 ISO 日期列，例如 player_elo_rollup.bucket_start
+        :param bucket: date_col 所在汇总桶的粒度，开始日期向下取整到桶的起始日（本周的趋势要包含本周一开始的周桶）
+        :return: ("AND ..." 片段, 参数列表)
+        """
+        clauses, params = [], []
+        if player_col and player_ids:
+            # 玩家ID整体作为一个 JSON 参数绑定，玩家数不同时 SQL 文本也不变
+            clauses.append(f"{player_col} IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps(player_ids))
+        map_type = self._map_type(intent)
+        if map_col and map_type:
+            clauses.append(f"{map_col} = ?")
+            params.append(map_type)
+        bounds = self.time_bounds(intent.get("time_range"))
+        if bounds and time_col:
+            # 半开区间的范围条件，可以直接走 played_at_epoch 上的索引
+            clauses.append(f"{time_col} >= ? AND {time_col} < ?")
+            params.extend(int(bound.timestamp()) for bound in bounds)
+        elif bounds and date_col:
+            clauses.append(f"{date_col} >= ? AND {date_col} < ?")
+            params.extend([
+                flightlogDB.elo_bucket_start(bounds[0].date(), bucket).isoformat(),
+                bounds[1].date().isoformat(),
+            ])
+        return "".join(f"\n        AND {clause}" for clause in clauses), params
+    
+    def _replay_filters(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """对 replays r 的过滤：地图类型 + 时间范围 + 指定玩家参加过的对局"""
+        where, params = self._filters(intent, [], map_col="r.map_type", time_col="r.played_at_epoch")
+        if player_ids:
+            where += """
+        AND r.id IN (
+            SELECT e2.replay_id FROM player_events pe2
+            JOIN events e2 ON e2.id = pe2.event_id
+            WHERE pe2.player_id IN (SELECT value FROM json_each(?))
+        )"""
+            params.append(json.dumps(player_ids))
+        return where, params
+    
+    def _gen_recent_performance(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
         """生成最近表现查询"""
         limit = intent.get("limit", 20)
-        map_type = intent.get("map_type")
+        where, params = self._filters(intent, player_ids, player_col="pe.player_id", map_col="r.map_type",
+                                      time_col="r.played_at_epoch")
         
-        sql = """
+        sql = f"""
         SELECT 
             p.steam_name,
             r.map_name,
@@ -186,100 +434,179 @@ class SQLGenerator:
         JOIN replays r ON e.replay_id = r.id
         JOIN players p ON pe.player_id = p.id
         LEFT JOIN player_elo_history eh ON eh.event_id = e.id AND eh.player_id = p.id
-        WHERE 1=1
+        WHERE 1=1{where}
+        ORDER BY r.played_at_epoch DESC
+        LIMIT ?
         """
         
-        # 添加地图类型过滤（需要在replays表中添加map_type字段）
-        # if map_type:
-        #     sql += f" AND r.map_type = '{map_type}'"
-        
-        sql += f"""
-        ORDER BY r.played_at DESC
-        LIMIT {limit}
+        return sql, params + [limit]
+    
+    def _window_stats(self, intent: Dict) -> Tuple[str, List[Any]]:
         """
-        
-        return sql
+        时间范围内每个玩家的击杀 / 死亡 / 场次（player_stats 是全量汇总，有时间范围时用这个代替）
+        按 played_at_epoch 的范围条件过滤，统计口径和 DB._rebuild_player_stats 一致
+        :return: (子查询 SQL, 参数列表)
+        """
+        where, params = self._filters(intent, [], map_col="r.map_type", time_col="r.played_at_epoch")
+        sql = f"""
+            SELECT
+                pe.player_id,
+                SUM(pe.role = 'killer') as kills,
+                SUM(pe.role = 'victim') as deaths,
+                COUNT(DISTINCT e.replay_id) as matches,
+                MAX(r.played_at) as last_played
+            FROM player_events pe
+            JOIN events e ON e.id = pe.event_id
+            JOIN replays r ON r.id = e.replay_id
+            WHERE instr(e.event_type, '_') > 0{where}
+            GROUP BY pe.player_id"""
+        return sql, params
     
-    def _gen_stats_summary(self, intent: Dict) -> str:
-        """生成统计摘要查询"""
+    def _gen_stats_summary(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """
+        生成统计摘要查询（读 player_stats 汇总表，只聚合前 limit 名玩家）
+        有时间范围时改为统计这段时间内打过比赛的玩家
+        """
         limit = intent.get("limit", 20)
+        map_type = self._map_type(intent)
+        elo_field = ELO_TYPE[map_type or "BVR"]
+        if self.time_bounds(intent.get("time_range")):
+            stats_sql, stats_params = self._window_stats(intent)
+            where, params = self._filters(intent, player_ids, player_col="p.id")
+            sql = f"""
+        SELECT 
+            p.id,
+            p.steam_name,
+            p.current_elo_BVR,
+            p.current_elo_BFM,
+            p.current_elo_PVE,
+            ps.kills as total_kills,
+            ps.deaths as total_deaths,
+            ps.matches as total_matches,
+            ps.last_played as last_played
+        FROM ({stats_sql}
+        ) ps
+        JOIN players p ON p.id = ps.player_id
+        WHERE 1=1{where}
+        ORDER BY p.{elo_field} DESC
+        LIMIT ?
+        """
+            return sql, stats_params + params + [limit]
+        where, params = self._filters(intent, player_ids, player_col="id")
+        stats_where, stats_params = self._filters(intent, [], map_col="ps.map_type")
         
-        sql = """
+        sql = f"""
         SELECT 
             p.id,
             p.steam_name,
             p.current_elo_BVR,
             p.current_elo_BFM,
             p.current_elo_PVE,
-            COUNT(DISTINCT CASE WHEN pe.role = 'killer' THEN e.id END) as total_kills,
-            COUNT(DISTINCT CASE WHEN pe.role = 'victim' THEN e.id END) as total_deaths,
-            COUNT(DISTINCT r.id) as total_matches,
-            MAX(r.played_at) as last_played
-        FROM players p
-        LEFT JOIN player_events pe ON p.id = pe.player_id
-        LEFT JOIN events e ON pe.event_id = e.id
-        LEFT JOIN replays r ON e.replay_id = r.id
+            COALESCE(SUM(ps.kills), 0) as total_kills,
+            COALESCE(SUM(ps.deaths), 0) as total_deaths,
+            COALESCE(SUM(ps.matches), 0) as total_matches,
+            MAX(ps.last_played) as last_played
+        FROM (
+            SELECT * FROM players
+            WHERE 1=1{where}
+            ORDER BY {elo_field} DESC
+            LIMIT ?
+        ) p
+        LEFT JOIN player_stats ps ON ps.player_id = p.id{stats_where}
         GROUP BY p.id
-        ORDER BY p.current_elo_BVR DESC
-        LIMIT {limit}
+        ORDER BY p.{elo_field} DESC
         """
         
-        return sql
+        return sql, params + [limit] + stats_params
     
-    def _gen_elo_trend(self, intent: Dict) -> str:
-        """生成Elo趋势查询"""
+    @staticmethod
+    def elo_trend_bucket(intent: Dict) -> str:
+        """
+        Elo趋势读哪种汇总桶：时间范围的跨度平均分给 limit 个点，取满足这个精度的最粗的桶
+        没有时间范围时看最近的 limit 天；要求的精度小于一天时也只能用天桶（这里不读逐条事件）
+        """
+        bounds = SQLGenerator.time_bounds(intent.get("time_range"))
+        if not bounds:
+            return flightlogDB.pick_elo_bucket(None)
+        span = (bounds[1] - bounds[0]).total_seconds()
+        return flightlogDB.pick_elo_bucket(span / max(intent.get("limit") or 50, 1)) or "day"
+    
+    def _gen_elo_trend(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """生成Elo趋势查询（读 player_elo_rollup 汇总桶，而不是逐条事件；桶的粒度见 elo_trend_bucket）"""
         limit = intent.get("limit", 50)
+        bucket = self.elo_trend_bucket(intent)
+        where, params = self._filters(intent, player_ids, player_col="r.player_id", map_col="r.map_type",
+                                      date_col="r.bucket_start", bucket=bucket)
         
         sql = f"""
         SELECT 
             p.steam_name,
-            eh.at_time,
-            eh.elo_before,
-            eh.elo_after,
-            (eh.elo_after - eh.elo_before) as elo_change,
-            e.event_type,
-            r.map_name
-        FROM player_elo_history eh
-        JOIN players p ON eh.player_id = p.id
-        LEFT JOIN events e ON eh.event_id = e.id
-        LEFT JOIN replays r ON r.id = COALESCE(eh.replay_id, e.replay_id)
-        ORDER BY eh.at_time DESC
-        LIMIT {limit}
+            r.map_type,
+            r.bucket,
+            r.bucket_start,
+            r.open_elo,
+            r.close_elo,
+            r.min_elo,
+            r.max_elo,
+            (r.close_elo - r.open_elo) as elo_change,
+            r.kills,
+            r.deaths
+        FROM player_elo_rollup r
+        JOIN players p ON r.player_id = p.id
+        WHERE r.bucket = ?{where}
+        ORDER BY r.bucket_start DESC
+        LIMIT ?
         """
         
-        return sql
+        return sql, [bucket] + params + [limit]
     
-    def _gen_leaderboard(self, intent: Dict) -> str:
-        """生成排行榜查询"""
+    def _gen_leaderboard(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """
+        生成排行榜查询（读 player_stats 汇总表）
+        有时间范围时只排这段时间内打过比赛的玩家，击杀 / 死亡也只算这段时间（Elo 仍是当前值）
+        """
         limit = intent.get("limit", 10)
-        map_type = (intent.get("map_type") or "BVR").upper()
-        elo_field = ELO_TYPE.get(map_type, ELO_TYPE["BVR"])
+        map_type = self._map_type(intent) or "BVR"
+        # 列名不能绑定参数，elo_field 只会是 ELO_TYPE 里的固定列名
+        elo_field = ELO_TYPE[map_type]
+        if self.time_bounds(intent.get("time_range")):
+            stats_sql, stats_params = self._window_stats(dict(intent, map_type=map_type))
+            sql = f"""
+        SELECT 
+            p.steam_name,
+            p.{elo_field} as elo,
+            ps.kills as kills,
+            ps.deaths as deaths,
+            ROUND(CAST(ps.kills AS FLOAT) / NULLIF(ps.deaths, 0), 2) as kd_ratio
+        FROM ({stats_sql}
+        ) ps
+        JOIN players p ON p.id = ps.player_id
+        WHERE p.is_archived = 0
+        ORDER BY p.{elo_field} DESC
+        LIMIT ?
+        """
+            return sql, stats_params + [limit]
         
         sql = f"""
         SELECT 
             p.steam_name,
             p.{elo_field} as elo,
-            COUNT(DISTINCT CASE WHEN pe.role = 'killer' THEN e.id END) as kills,
-            COUNT(DISTINCT CASE WHEN pe.role = 'victim' THEN e.id END) as deaths,
-            ROUND(
-                CAST(COUNT(DISTINCT CASE WHEN pe.role = 'killer' THEN e.id END) AS FLOAT) / 
-                NULLIF(COUNT(DISTINCT CASE WHEN pe.role = 'victim' THEN e.id END), 0),
-                2
-            ) as kd_ratio
+            COALESCE(ps.kills, 0) as kills,
+            COALESCE(ps.deaths, 0) as deaths,
+            ROUND(CAST(ps.kills AS FLOAT) / NULLIF(ps.deaths, 0), 2) as kd_ratio
         FROM players p
-        LEFT JOIN player_events pe ON p.id = pe.player_id
-        LEFT JOIN events e ON pe.event_id = e.id
+        LEFT JOIN player_stats ps ON ps.player_id = p.id AND ps.map_type = ?
         WHERE p.is_archived = 0
-        GROUP BY p.id
         ORDER BY p.{elo_field} DESC
-        LIMIT {limit}
+        LIMIT ?
         """
         
-        return sql
+        return sql, [map_type, limit]
     
-    def _gen_recent_battles(self, intent: Dict) -> str:
-        """生成最近战斗查询"""
+    def _gen_recent_battles(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """生成最近战斗查询（先取最近的 limit 局，再只聚合这几局的事件）"""
         limit = intent.get("limit", 10)
+        where, params = self._replay_filters(intent, player_ids)
         
         sql = f"""
         SELECT 
@@ -289,20 +616,26 @@ class SQLGenerator:
             COUNT(DISTINCT e.id) as total_events,
             COUNT(DISTINCT pe.player_id) as total_players,
             GROUP_CONCAT(DISTINCT p.steam_name) as players
-        FROM replays r
+        FROM (
+            SELECT * FROM replays r
+            WHERE 1=1{where}
+            ORDER BY r.played_at_epoch DESC
+            LIMIT ?
+        ) r
         LEFT JOIN events e ON r.id = e.replay_id
         LEFT JOIN player_events pe ON e.id = pe.event_id
         LEFT JOIN players p ON pe.player_id = p.id
         GROUP BY r.id
-        ORDER BY r.played_at DESC
-        LIMIT {limit}
+        ORDER BY r.played_at_epoch DESC
         """
         
-        return sql
+        return sql, params + [limit]
     
-    def _gen_weapon_analysis(self, intent: Dict) -> str:
+    def _gen_weapon_analysis(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
         """生成武器分析查询"""
         limit = intent.get("limit", 20)
+        where, params = self._filters(intent, player_ids, player_col="pe.player_id", map_col="r.map_type",
+                                      time_col="r.played_at_epoch")
         
         sql = f"""
         SELECT 
@@ -313,23 +646,25 @@ class SQLGenerator:
             AVG(eh.elo_after - eh.elo_before) as avg_elo_change
         FROM events e
         JOIN player_events pe ON e.id = pe.event_id AND pe.role = 'killer'
+        JOIN replays r ON e.replay_id = r.id
         LEFT JOIN player_elo_history eh ON e.id = eh.event_id AND pe.player_id = eh.player_id
-        WHERE e.weapon IS NOT NULL AND e.weapon != ''
+        WHERE e.weapon IS NOT NULL AND e.weapon != ''{where}
         GROUP BY e.weapon, e.kill_type
         ORDER BY usage_count DESC
-        LIMIT {limit}
+        LIMIT ?
         """
         
-        return sql
+        return sql, params + [limit]
     
-    def _gen_player_comparison(self, intent: Dict) -> str:
-        """生成玩家对比查询"""
-        # 这个需要特殊处理，暂时返回基础统计
-        return self._gen_stats_summary(intent)
+    def _gen_player_comparison(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """生成玩家对比查询（指定了玩家时只对比这些玩家，时间范围的处理同统计摘要）"""
+        return self._gen_stats_summary(intent, player_ids)
     
-    def _gen_battle_report(self, intent: Dict) -> str:
-        """生成战报查询"""
-        sql = """
+    def _gen_battle_report(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
+        """生成战报查询（最近一局的事件，按时间顺序）"""
+        where, params = self._replay_filters(intent, player_ids)
+        
+        sql = f"""
         SELECT 
             r.id,
             r.map_name,
@@ -348,38 +683,50 @@ class SQLGenerator:
         LEFT JOIN players p_killer ON pe_killer.player_id = p_killer.id
         LEFT JOIN players p_victim ON pe_victim.player_id = p_victim.id
         LEFT JOIN event_details ed ON e.id = ed.event_id
-        ORDER BY r.played_at DESC, e.time_local ASC
-        LIMIT 1
+        WHERE r.id = (
+            SELECT r.id FROM replays r
+            WHERE 1=1{where}
+            ORDER BY r.played_at_epoch DESC
+            LIMIT 1
+        )
+        ORDER BY e.time_local ASC
+        LIMIT ?
         """
         
-        return sql
+        return sql, params + [self.BATTLE_REPORT_EVENTS]
     
-    def _gen_activity_analysis(self, intent: Dict) -> str:
+    def _gen_activity_analysis(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
         """生成活跃度分析查询"""
         limit = intent.get("limit", 10)
+        where, params = self._filters(intent, player_ids, player_col="pe.player_id", map_col="r.map_type",
+                                      time_col="r.played_at_epoch")
         
         sql = f"""
         SELECT 
             p.steam_name,
             COUNT(DISTINCT r.id) as matches_played,
-            COUNT(DISTINCT DATE(r.played_at)) as active_days,
-            MIN(r.played_at) as first_match,
-            MAX(r.played_at) as last_match,
+            COUNT(DISTINCT DATE(r.played_at_epoch, 'unixepoch')) as active_days,
+            DATETIME(MIN(r.played_at_epoch), 'unixepoch') as first_match,
+            DATETIME(MAX(r.played_at_epoch), 'unixepoch') as last_match,
             COUNT(DISTINCT e.id) as total_events
         FROM players p
         JOIN player_events pe ON p.id = pe.player_id
         JOIN events e ON pe.event_id = e.id
         JOIN replays r ON e.replay_id = r.id
+        WHERE 1=1{where}
         GROUP BY p.id
         ORDER BY matches_played DESC
-        LIMIT {limit}
+        LIMIT ?
         """
         
-        return sql
+        return sql, params + [limit]
     
-    def _gen_combat_style(self, intent: Dict) -> str:
+    def _gen_combat_style(self, intent: Dict, player_ids: List[int]) -> Tuple[str, List[Any]]:
         """生成战斗风格分析查询"""
-        sql = """
+        where, params = self._filters(intent, player_ids, player_col="pe.player_id", map_col="r.map_type",
+                                      time_col="r.played_at_epoch")
+        
+        sql = f"""
         SELECT 
             p.steam_name,
             e.weapon,
@@ -392,85 +739,362 @@ class SQLGenerator:
         JOIN events e ON pe.event_id = e.id
         JOIN replays r ON e.replay_id = r.id
         LEFT JOIN player_elo_history eh ON e.id = eh.event_id AND p.id = eh.player_id
+        WHERE 1=1{where}
         GROUP BY p.id, e.weapon, e.kill_type
         ORDER BY weapon_usage DESC
-        LIMIT 50
+        LIMIT ?
         """
         
-        return sql
+        return sql, params + [50]
+
+
+class ExecutionMetrics:
+    """
+    每次 SQL 执行的耗时 / 行数记录（execute 在 AsyncDB 的多个工作线程里调用，需要加锁）
+    累计计数 + 最近 window 次的耗时样本，用于看 p50 / p95
+    """
+    
+    def __init__(self, window: int = 256):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)  # (label, 耗时ms, 行数, 结果)
+        self.count = 0
+        self.rows = 0
+        self.outcomes = Counter()  # ok / truncated / timeout / denied / error
+    
+    def record(self, label: str, elapsed_ms: float, rows: int, outcome: str) -> None:
+        with self._lock:
+            self.count += 1
+            self.rows += rows
+            self.outcomes[outcome] += 1
+            self._samples.append((label, elapsed_ms, rows, outcome))
+    
+    def recent(self) -> List[Tuple[str, float, int, str]]:
+        """最近的执行记录（旧的在前）"""
+        with self._lock:
+            return list(self._samples)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """汇总统计（调试用）"""
+        with self._lock:
+            timings = sorted(sample[1] for sample in self._samples)
+            outcomes = dict(self.outcomes)
+            count, rows = self.count, self.rows
+        
+        def percentile(q: float) -> float:
+            return timings[min(len(timings) - 1, int(q * len(timings)))] if timings else 0.0
+        
+        return {
+            "count": count,
+            "rows": rows,
+            "outcomes": outcomes,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "max_ms": timings[-1] if timings else 0.0,
+        }
 
 
 class RAGExecutor:
-    """RAG 执行器 - 执行 SQL 并准备数据供 AI 总结"""
+    """
+    RAG 执行器 - 执行 SQL 并准备数据供 AI 总结
+    SQL 在沙箱里执行：mode=ro 连接 + 授权回调白名单（只允许 SELECT 读指定的表）+
+    progress handler 截止时间 + fetchmany 行数上限，防止失控的查询长时间占用 CPU 和读锁
+    """
+    
+    # 发给模型时各意图去掉的列（内部ID、能由其他列推出的值）
+    CONTEXT_DROP_COLUMNS = {
+        "player_recent_performance": {"elo_before"},
+        "player_stats_summary": {"id"},
+        "player_comparison": {"id"},
+        "recent_battles": {"replay_id"},
+        "battle_report": {"id"},
+    }
+    CONTEXT_TOKEN_BUDGET = 1500  # 数据上下文的 token 上限（模型上下文 4096，留出回复空间）
+    MAX_VALUE_CHARS = 80  # 单个值的最大长度
+    SUMMARY_THRESHOLD = 20  # 超过这么多条记录时附加整体统计
+    
+    QUERY_TIMEOUT = 3.0  # 单条 SQL 的执行时限（秒），到点由 progress handler 中断
+    PROGRESS_STEPS = 10000  # 每执行这么多条虚拟机指令检查一次时限
+    MAX_ROWS = 500  # 最多读取的行数，超出的部分不再从游标取
+    FETCH_BATCH = 100  # fetchmany 每批行数
+    # 授权白名单：只允许读取这些表（json_each 用于绑定玩家ID列表），其他操作一律拒绝
+    ALLOWED_TABLES = frozenset({
+        "players", "player_names", "replays", "events", "event_details", "player_events",
+        "player_elo_history", "player_stats", "player_weapon_stats", "player_elo_rollup", "json_each",
+    })
+    ALLOWED_ACTIONS = frozenset({sqlite3.SQLITE_SELECT, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE})
     
     def __init__(self, db_path=FLIGHTLOG_DB_PATH):
         self.db_path = db_path
+        self.metrics = ExecutionMetrics()
+    
+    def connect(self) -> sqlite3.Connection:
+        """打开只读连接（mode=ro，连写事务都开不了）"""
+        uri = f"{Path(self.db_path).resolve().as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True)
+        conn.row_factory = sqlite3.Row
+        return conn
+    
+    def _authorize(self, action: int, arg1: Optional[str], arg2: Optional[str],
+                   db_name: Optional[str], source: Optional[str]) -> int:
+        """sqlite3 授权回调：语句编译时对每个操作调用一次"""
+        if action in self.ALLOWED_ACTIONS:
+            return sqlite3.SQLITE_OK
+        # 读列：表必须在白名单里；列名为空表示不读任何列（COUNT(*)、CTE 自身），不泄露数据
+        if action == sqlite3.SQLITE_READ and (arg1 in self.ALLOWED_TABLES or arg2 == ""):
+            return sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_DENY
+    
+    def resolve_players(self, names: List[str], conn: Optional[sqlite3.Connection] = None) -> Tuple[List[int], List[str]]:
+        """
+        玩家名 -> player_id：先查历史昵称（idx_player_names_casefold），查不到再比对 Steam 名称
+        :param names: IntentDetector 提取的候选名字
+        :return: (匹配到的玩家ID（去重，保持顺序）, 没有匹配到任何玩家的名字)
+        """
+        if not names:
+            return [], []
+        own_conn = conn is None
+        if own_conn:
+            conn = self.connect()
+        try:
+            player_ids = []
+            unresolved = []
+            for name in names:
+                rows = conn.execute(
+                    "SELECT DISTINCT player_id FROM player_names WHERE name_casefold = ?",
+                    (name.casefold(),)
+                ).fetchall()
+                if not rows:
+                    rows = conn.execute(
+                        "SELECT id FROM players WHERE steam_name = ? COLLATE NOCASE",
+                        (name,)
+                    ).fetchall()
+                if not rows:
+                    unresolved.append(name)
+                for row in rows:
+                    if row[0] not in player_ids:
+                        player_ids.append(row[0])
+            return player_ids, unresolved
+        finally:
+            if own_conn:
+                conn.close()
     
-    def execute(self, sql: str) -> Tuple[List[Dict], List[str]]:
+    def execute(self, sql: str, params: Optional[List[Any]] = None,
+                conn: Optional[sqlite3.Connection] = None, label: str = "",
+                timeout: Optional[float] = None, max_rows: Optional[int] = None) -> Tuple[List[Dict], List[str]]:
         """
-        执行SQL查询
+        在沙箱里执行SQL查询（授权白名单 + 执行时限 + 行数上限），并记录耗时
         :param sql: SQL查询字符串
-        :return: (数据列表, 列名列表)
+        :param params: 绑定参数
+        :param conn: 复用已有连接（bot 的只读连接池），None 时自己开一个；授权回调和时限只在本次执行期间生效
+        :param label: 记录到 metrics 里的名字（一般是意图名）
+        :param timeout: 执行时限（秒），None 使用 QUERY_TIMEOUT
+        :param max_rows: 行数上限，None 使用 MAX_ROWS
+        :return: (数据列表, 列名列表)，被拒绝 / 超时 / 出错时返回空结果
         """
         sql_to_run = sql.strip()
-        # 只允许只读查询，避免执行非 SELECT 语句
-        if not sql_to_run.lower().startswith("select"):
+        # 只允许查询语句（真正的限制由授权回调保证）
+        if not sql_to_run.lower().startswith(("select", "with")):
             print(f"[ERROR] 仅允许执行SELECT查询，收到: {sql_to_run[:50]}...")
+            self.metrics.record(label, 0.0, 0, "denied")
             return [], []
-
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        
+        max_rows = max_rows or self.MAX_ROWS
+        deadline = time.monotonic() + (timeout or self.QUERY_TIMEOUT)
+        own_conn = conn is None
+        if own_conn:
+            conn = self.connect()
+        # json_each 第一次使用时内部要声明虚拟表（会触发对 sqlite_master 的授权检查），先在授权回调外连上
+        conn.execute("SELECT 1 FROM json_each('[]')")
+        conn.set_authorizer(self._authorize)
+        # 在 AsyncDB 的读连接上执行时，调用方超时放弃后同样要中止
+        conn.set_progress_handler(lambda: time.monotonic() > deadline or job_cancelled(), self.PROGRESS_STEPS)
         cur = conn.cursor()
+        start = time.perf_counter()
+        results: List[Dict] = []
+        columns: List[str] = []
+        outcome = "ok"
         
         try:
-            cur.execute(sql)
-            rows = cur.fetchall()
+            cur.execute(sql_to_run, params or [])
+            if cur.description:
+                columns = [description[0] for description in cur.description]
+            # 分批取，到达行数上限就停止，剩下的行不再计算
+            while len(results) < max_rows:
+                batch = cur.fetchmany(min(self.FETCH_BATCH, max_rows - len(results)))
+                if not batch:
+                    break
+                results.extend(dict(row) for row in batch)
+            if len(results) >= max_rows and cur.fetchone() is not None:
+                outcome = "truncated"
+                print(f"[RAG] 查询结果超过 {max_rows} 行，已截断")
             
-            if not rows:
+            if not results:
                 return [], []
-            
-            # 获取列名
-            columns = [description[0] for description in cur.description]
-            
-            # 转换为字典列表
-            results = [dict(row) for row in rows]
-            
             return results, columns
             
-        except Exception as e:
-            print(f"[ERROR] SQL执行错误: {e}")
+        except sqlite3.Error as e:
+            if time.monotonic() > deadline or job_cancelled():
+                outcome = "timeout"
+                print(f"[ERROR] SQL执行超时（>{timeout or self.QUERY_TIMEOUT}s），已中断")
+            elif e.sqlite_errorcode == sqlite3.SQLITE_AUTH:
+                outcome = "denied"
+                print(f"[ERROR] SQL包含不允许的操作: {e}")
+            else:
+                outcome = "error"
+                print(f"[ERROR] SQL执行错误: {e}")
             print(f"[ERROR] SQL: {sql}")
+            print(f"[ERROR] 参数: {params}")
+            results = []
             return [], []
         finally:
-            conn.close()
+            cur.close()
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.metrics.record(label, elapsed_ms, len(results), outcome)
+            if own_conn:
+                conn.close()
+            else:
+                # 共享连接：撤掉授权回调和时限，不影响连接池里的其他查询（装回 AsyncDB 的取消检查）
+                conn.set_authorizer(None)
+                install_cancel_handler(conn)
     
-    def format_for_llm(self, data: List[Dict], columns: List[str], intent: Dict) -> str:
+    def format_for_llm(self, data: List[Dict], columns: List[str], intent: Dict,
+                       max_tokens: Optional[int] = None, unresolved_players: Optional[List[str]] = None) -> str:
         """
-        将查询结果格式化为适合LLM处理的文本
+        将查询结果格式化为适合LLM处理的紧凑文本
+        表头只写一次（TSV），去掉无用列，数值取整，长文本截断；
+        结果太多放不进预算时附上整体统计，再按顺序列出放得下的记录
         :param data: 查询结果数据
         :param columns: 列名
         :param intent: 原始意图
+        :param max_tokens: 上下文 token 上限，None 时用 CONTEXT_TOKEN_BUDGET
+        :param unresolved_players: 没有匹配到玩家的名字，写进上下文提醒模型结果没有按它们过滤
         :return: 格式化的文本
         """
+        note = ""
+        if unresolved_players:
+            note = f"注意：没有找到名为 {'、'.join(unresolved_players)} 的玩家，以下结果没有按这些名字过滤。"
         if not data:
-            return "没有找到相关数据。"
+            return "\n".join(filter(None, [note, "没有找到相关数据。"]))
+        
+        budget = max_tokens or self.CONTEXT_TOKEN_BUDGET
+        drop = self.CONTEXT_DROP_COLUMNS.get(intent.get("intent"), set())
+        cells = {
+            col: [self._format_value(row.get(col)) for row in data]
+            for col in (columns or list(data[0].keys())) if col not in drop
+        }
         
-        # 构建上下文
-        context = f"用户查询：{intent.get('original_query', '')}\n\n"
-        context += f"查询意图：{intent.get('intent', '')}\n\n"
-        context += f"查询结果（共{len(data)}条记录）：\n\n"
+        # 全部为空的列去掉；所有记录都相同的列只写一次
+        table_cols, constants = [], []
+        for col, values in cells.items():
+            distinct = set(values)
+            if distinct == {"-"}:
+                continue
+            if len(data) > 1 and len(distinct) == 1:
+                constants.append(f"{col}={values[0]}")
+            else:
+                table_cols.append(col)
         
-        # 格式化数据
-        for i, row in enumerate(data, 1):
-            context += f"记录 {i}:\n"
-            for key, value in row.items():
-                context += f"  {key}: {value}\n"
-            context += "\n"
+        # 构建上下文：规范化后的查询条件 + 数据（不含用户原话，换个问法得到相同文本，便于缓存总结结果）
+        head = [f"查询意图：{intent.get('intent', '')}"]
+        conditions = self._describe_conditions(intent)
+        if conditions:
+            head.append(f"查询条件：{conditions}")
+        if note:
+            head.append(note)
+        head.append(f"查询结果：共{len(data)}条记录")
+        if constants:
+            head.append("所有记录相同：" + "，".join(constants))
+        footer = "请根据以上数据，用简洁清晰的中文生成总结或战报。"
         
-        # 添加总结指令
-        context += "\n请根据以上数据，用简洁清晰的中文生成总结或战报。"
+        rows = ["\t".join(cells[col][i] for col in table_cols) for i in range(len(data))]
+        header = "\t".join(table_cols)
+        used = estimate_tokens("\n".join(head + [header, footer]))
+        row_tokens = [estimate_tokens(row, overhead=1) for row in rows]
         
-        return context
+        # 记录多或者放不下时先给出整体统计，模型不用自己逐行去算
+        truncated = used + sum(row_tokens) > budget
+        if truncated:
+            used += estimate_tokens("（仅列出前000条，其余000条已省略）", overhead=2)
+        if len(data) > self.SUMMARY_THRESHOLD or truncated:
+            summary = self._summarize_columns(data, table_cols)
+            if summary:
+                head.append("整体统计：")
+                head.extend(summary)
+                used += estimate_tokens("\n".join(summary), overhead=len(summary) + 1)
+        
+        shown = 0
+        for tokens in row_tokens:
+            if used + tokens > budget:
+                break
+            used += tokens
+            shown += 1
+        
+        lines = head + ["", header] + rows[:shown]
+        if shown < len(rows):
+            lines.append(f"（仅列出前{shown}条，其余{len(rows) - shown}条已省略）")
+        lines += ["", footer]
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _describe_conditions(intent: Dict) -> str:
+        """意图里的玩家 / 地图类型 / 时间范围 / 数量，告诉模型这些数据是按什么条件查出来的"""
+        parts = []
+        if intent.get("players"):
+            parts.append(f"玩家={'、'.join(intent['players'])}")
+        if intent.get("map_type"):
+            parts.append(f"地图类型={intent['map_type']}")
+        if intent.get("time_range"):
+            if intent.get("intent") in ("player_stats_summary", "map_leaderboard", "player_comparison"):
+                # 击杀 / 死亡 / 场次按时间范围统计，Elo 没有历史快照，只能是当前值
+                parts.append(f"时间范围={intent['time_range']}（击杀、死亡、场次只统计这段时间，Elo 为当前值）")
+            else:
+                parts.append(f"时间范围={intent['time_range']}")
+        if intent.get("limit"):
+            parts.append(f"数量={intent['limit']}")
+        return "，".join(parts)
+    
+    def _format_value(self, value: Any) -> str:
+        """单个值转成紧凑文本：空值写 -，小数保留 1~2 位，长文本截断"""
+        if value is None:
+            return "-"
+        if isinstance(value, float):
+            if value.is_integer():
+                return str(int(value))
+            text = f"{value:.{1 if abs(value) >= 100 else 2}f}".rstrip("0").rstrip(".")
+            return "0" if text == "-0" else text
+        if isinstance(value, bytes):
+            return f"<{len(value)} bytes>"
+        text = " ".join(str(value).split())
+        if not text:
+            return "-"
+        if len(text) > self.MAX_VALUE_CHARS:
+            text = text[:self.MAX_VALUE_CHARS - 1] + "…"
+        return text
+    
+    def _summarize_columns(self, data: List[Dict], columns: List[str]) -> List[str]:
+        """
+        预聚合统计：数值列给出平均/最小/最大（整数列另给合计），重复出现的文本列给出最常见的值
+        """
+        summary = []
+        for col in columns:
+            values = [row.get(col) for row in data if row.get(col) is not None]
+            if not values:
+                continue
+            if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+                parts = [
+                    f"平均 {self._format_value(sum(values) / len(values))}",
+                    f"最小 {self._format_value(min(values))}",
+                    f"最大 {self._format_value(max(values))}",
+                ]
+                if all(isinstance(v, int) for v in values):
+                    parts.insert(0, f"合计 {sum(values)}")
+                summary.append(f"- {col}: " + "，".join(parts))
+            else:
+                counts = Counter(self._format_value(v) for v in values)
+                if len(counts) < len(values):
+                    top = "，".join(f"{value}×{n}" for value, n in counts.most_common(3))
+                    summary.append(f"- {col}: {len(counts)}种，最常见 {top}")
+        return summary
 
 
 class RAGSystem:
@@ -481,32 +1105,63 @@ class RAGSystem:
         self.sql_generator = SQLGenerator(db_path)
         self.rag_executor = RAGExecutor(db_path)
     
-    def process_query(self, query: str) -> Dict[str, Any]:
+    def process_query(self, query: str, conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
         """
         处理用户查询的完整流程
         :param query: 用户的自然语言查询
+        :param conn: 执行SQL用的连接，None 时自己开一个
         :return: 包含所有中间结果和最终数据的字典
         """
         # 1. 意图识别
         intent = self.intent_detector.detect(query)
         print(f"[RAG] 检测到意图: {intent}")
         
-        # 2. 生成SQL
-        sql = self.sql_generator.generate(intent)
-        print(f"[RAG] 生成SQL: {sql[:100]}...")
-        
-        # 3. 执行SQL
-        data, columns = self.rag_executor.execute(sql)
-        print(f"[RAG] 查询到 {len(data)} 条记录")
+        return self.run_intent(intent, conn=conn)
+    
+    def run_intent(self, intent: Dict[str, Any], conn: Optional[sqlite3.Connection] = None) -> Dict[str, Any]:
+        """
+        根据已识别的意图生成并执行SQL（bot 先在事件循环里做意图识别，用意图作缓存键，未命中时再调用这里）
+        :param intent: IntentDetector.detect 的返回值
+        :param conn: 执行SQL用的连接，None 时自己开一个
+        :return: 同 process_query
+        """
+        own_conn = conn is None
+        if own_conn:
+            conn = self.rag_executor.connect()
+        try:
+            # 2. 玩家名 -> player_id，查询只限定在这些玩家上
+            player_ids, unresolved = self.rag_executor.resolve_players(intent.get("players", []), conn=conn)
+            # 型号一样的串（F-16）查不到多半本来就不是玩家名：不提示，也不写进查询条件
+            tentative = set(intent.get("tentative_players") or ())
+            dropped = {name for name in unresolved if name in tentative}
+            unresolved = [name for name in unresolved if name not in tentative]
+            
+            # 3. 生成SQL
+            sql, params = self.sql_generator.generate(intent, player_ids)
+            print(f"[RAG] 生成SQL: {sql[:100]}... 参数: {params}")
+            
+            # 4. 执行SQL
+            start = time.perf_counter()
+            data, columns = self.rag_executor.execute(sql, params, conn=conn, label=intent.get("intent", ""))
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            print(f"[RAG] 查询到 {len(data)} 条记录，耗时 {elapsed_ms:.1f}ms")
+        finally:
+            if own_conn:
+                conn.close()
         
-        # 4. 格式化为LLM上下文
-        llm_context = self.rag_executor.format_for_llm(data, columns, intent)
+        # 5. 格式化为LLM上下文
+        described = dict(intent, players=[name for name in intent.get("players", []) if name not in dropped])
+        llm_context = self.rag_executor.format_for_llm(data, columns, described, unresolved_players=unresolved)
         
         return {
             "intent": intent,
+            "player_ids": player_ids,
+            "unresolved_players": unresolved,
             "sql": sql,
+            "params": params,
             "data": data,
             "columns": columns,
+            "elapsed_ms": elapsed_ms,
             "llm_context": llm_context,
             "success": len(data) > 0,
         }
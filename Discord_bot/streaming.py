@@ -0,0 +1,181 @@
+"""
+把模型的流式输出逐步写进 Discord 消息
+- IncrementalSplitter: 增量版的 _split_text，文本超过单条消息上限时按行切出完整的一段
+- StreamingReply: 限频编辑 follow-up 消息，一条写满后自动开下一条
+- ReplyBroadcast: 一次生成写进多个 StreamingReply（相同的 /ai 请求共用一次生成，各自的回复都在流式更新）
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+
+# 生成过程中显示在末尾的光标
+CURSOR = " ▌"
+
+
+class IncrementalSplitter:
+    """
+    按 max_length 增量切分文本，切分规则和 BotCommands._split_text 一致：
+    尽量在换行处切，单行超长时硬切
+    """
+
+    def __init__(self, max_length: int):
+        self.max_length = max_length
+        self.pending = ""
+
+    def feed(self, text: str) -> List[str]:
+        """
+        追加文本
+        :return: 本次新切出的完整段落（可能为空）
+        """
+        self.pending += text
+        chunks = []
+        while len(self.pending) > self.max_length:
+            cut = self.pending.rfind("\n", 0, self.max_length + 1)
+            if cut <= 0:
+                cut = self.max_length
+            chunk = self.pending[:cut].strip()
+            self.pending = self.pending[cut:].lstrip("\n")
+            if chunk:
+                chunks.append(chunk)
+        return chunks
+
+
+def render_plain(text: str, final: bool, index: int) -> Dict:
+    """默认渲染：纯文本消息"""
+    return {"content": text or "…"}
+
+
+class StreamingReply:
+    """
+    流式回复
+    feed() 只在距离上次编辑超过 edit_interval 且没有编辑正在进行时才触发编辑（后台执行，不阻塞读取模型输出）；
+    某条消息写满时立即定稿并开始下一条
+    """
+
+    def __init__(self, send: Callable[..., Awaitable], render: Callable[[str, bool, int], Dict] = render_plain,
+                 max_length: int = 1900, edit_interval: float = 1.2):
+        """
+        :param send: 发送新消息的协程函数（例如 interaction.followup.send），需返回可 edit 的消息对象
+        :param render: (文本, 是否定稿, 第几条消息) -> send/edit 的参数
+        :param max_length: 单条消息的文本上限（普通消息 2000，Embed description 4096）
+        :param edit_interval: 两次编辑的最小间隔（秒），Discord 对同一条消息的编辑有频率限制
+        """
+        self.send = send
+        self.render = render
+        self.edit_interval = edit_interval
+        self.splitter = IncrementalSplitter(max_length)
+        self.text = ""
+        self.messages: List = []
+        self._current = None
+        self._last_edit = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+
+    async def feed(self, text: str) -> None:
+        """追加模型输出的一段文本"""
+        self.text += text
+        for chunk in self.splitter.feed(text):
+            await self._write(chunk, final=True)
+            self._current = None
+        if (self._edit_task is None or self._edit_task.done()) \
+                and time.monotonic() - self._last_edit >= self.edit_interval:
+            self._edit_task = asyncio.create_task(self._write(self.splitter.pending + CURSOR, final=False))
+
+    async def retract(self, length: int) -> None:
+        """
+        撤回 length 之后写入的文本（例如模型先输出了几句话，随后又决定调用工具）
+        已经定稿的消息如果包含被撤回的文本，会被删除或改写
+        :param length: 保留的文本长度（撤回前记下的 len(reply.text)）
+        """
+        if length >= len(self.text):
+            return
+        if self._edit_task is not None and not self._edit_task.done():
+            await self._edit_task
+        self.text = self.text[:length]
+        # 切分只取决于已写入的文本，所以重新切一遍保留的部分，前面的定稿消息不受影响
+        splitter = IncrementalSplitter(self.splitter.max_length)
+        kept = len(splitter.feed(self.text))
+        self.splitter = splitter
+        extra = self.messages[kept:]
+        self.messages = self.messages[:kept]
+        self._current = None
+        if extra:
+            self._current = extra[0]
+            self.messages.append(self._current)
+            for message in extra[1:]:
+                try:
+                    await message.delete()
+                except Exception as e:
+                    print(f"[ERROR] Streaming retract failed: {e}")
+            await self._write(self.splitter.pending + CURSOR, final=False)
+
+    async def finish(self, suffix: str = "") -> str:
+        """
+        定稿：写入剩余文本（去掉光标）
+        :param suffix: 追加在最后一条消息末尾的文字（例如提示信息）
+        :return: 完整的回复文本
+        """
+        pending = self.splitter.pending.strip()
+        if suffix:
+            pending = f"{pending}\n{suffix}" if pending else suffix
+        if pending or self._current is not None or not self.messages:
+            await self._write(pending, final=True)
+        return self.text
+
+    async def _write(self, text: str, final: bool) -> None:
+        """写当前这条消息：还没有就发送，有就编辑；定稿写入会等待进行中的编辑完成，保证顺序"""
+        if final and self._edit_task is not None and not self._edit_task.done():
+            await self._edit_task
+        kwargs = self.render(text, final, len(self.messages) - (1 if self._current is not None else 0))
+        self._last_edit = time.monotonic()
+        try:
+            if self._current is None:
+                self._current = await self.send(**kwargs)
+                self.messages.append(self._current)
+            else:
+                await self._current.edit(**kwargs)
+        except Exception as e:
+            if final:
+                raise
+            # 中间态的编辑失败无所谓，下次编辑或定稿会覆盖
+            print(f"[ERROR] Streaming edit failed: {e}")
+
+
+class ReplyBroadcast:
+    """
+    把一次生成同时写进多个 StreamingReply
+    生成方调用 feed()，订阅的回复都收到同样的文本；晚加入的订阅者先补上已经生成的部分。
+    某个回复写入失败（例如交互已失效）只会把它移出订阅，不影响生成和其他回复
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.replies: List[StreamingReply] = []
+        # 补写已生成的部分期间不能插入新的文本，否则顺序会乱
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, reply: StreamingReply) -> None:
+        """加入订阅，先写入已经生成的文本"""
+        async with self._lock:
+            self.replies.append(reply)
+            if self.text:
+                await self._feed_one(reply, self.text)
+
+    def unsubscribe(self, reply: StreamingReply) -> None:
+        if reply in self.replies:
+            self.replies.remove(reply)
+
+    async def feed(self, text: str) -> None:
+        """追加一段生成的文本，写进所有订阅的回复"""
+        async with self._lock:
+            self.text += text
+            for reply in list(self.replies):
+                await self._feed_one(reply, text)
+
+    async def _feed_one(self, reply: StreamingReply, text: str) -> None:
+        try:
+            await reply.feed(text)
+        except Exception as e:
+            print(f"[ERROR] Broadcast to reply failed: {e}")
+            self.unsubscribe(reply)
@@ -0,0 +1,170 @@
+"""
+异步数据库访问层测试脚本
+验证只读连接池的并发执行、超时中断（包括查询函数里超时之后才开始的语句）和只读限制
+"""
+
+import asyncio
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.async_db import AsyncDB, QueryTimeout
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def make_db() -> Path:
+    """创建一个带少量数据的临时数据库"""
+    db_path = Path(tempfile.mkdtemp()) / "async_db_test.sqlite"
+    conn = sqlite3.connect(db_path)
+    conn.execute("CREATE TABLE numbers (n INTEGER)")
+    conn.executemany("INSERT INTO numbers VALUES (?)", [(i,) for i in range(100)])
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def count_numbers(conn=None, delay: float = 0.0):
+    time.sleep(delay)
+    return conn.execute("SELECT COUNT(*) FROM numbers").fetchone()[0]
+
+
+def endless_query(conn=None):
+    # 递归 CTE，不中断的话会一直跑
+    return conn.execute(
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT MAX(x) FROM c"
+    ).fetchone()
+
+
+def insert_number(conn=None):
+    conn.execute("INSERT INTO numbers VALUES (1000)")
+
+
+def test_concurrent_queries():
+    """测试多个查询在连接池里并发执行"""
+    print_separator("测试 1: 并发查询")
+
+    async def run():
+        db = AsyncDB(make_db(), max_workers=3, timeout=5)
+        try:
+            t0 = time.perf_counter()
+            results = await asyncio.gather(*[db.run(count_numbers, delay=0.2) for _ in range(3)])
+            return results, time.perf_counter() - t0
+        finally:
+            db.close()
+
+    results, elapsed = asyncio.run(run())
+    print(f"结果: {results}, 耗时: {elapsed:.2f}s")
+    assert results == [100, 100, 100]
+    assert elapsed < 0.5
+    print("✓ 查询并发执行")
+
+
+def test_timeout_interrupts_query():
+    """测试超时的查询会被中断，连接还能继续使用"""
+    print_separator("测试 2: 查询超时中断")
+
+    async def run():
+        db = AsyncDB(make_db(), max_workers=1, timeout=5)
+        try:
+            t0 = time.perf_counter()
+            try:
+                await db.run(endless_query, timeout=0.2)
+                raise AssertionError("应该超时")
+            except QueryTimeout as e:
+                print(f"超时: {e}")
+            # 同一个工作线程/连接应当马上可用
+            count = await db.run(count_numbers)
+            return count, time.perf_counter() - t0
+        finally:
+            db.close()
+
+    count, elapsed = asyncio.run(run())
+    assert count == 100
+    assert elapsed < 2
+    print("✓ 超时查询已中断")
+
+
+def test_timeout_cancels_later_statements():
+    """测试超时后查询函数里后面的语句一开始执行就失败，不会继续占着工作线程"""
+    print_separator("测试 3: 超时后的后续语句")
+
+    log = []
+
+    def two_statements(conn=None):
+        # 第一条语句很快，之后的处理耗时超过时限，这时 interrupt() 没有可中断的语句
+        log.append(conn.execute("SELECT COUNT(*) FROM numbers").fetchone()[0])
+        time.sleep(0.3)
+        try:
+            # 第二条语句不被取消的话会一直跑下去
+            endless_query(conn=conn)
+            log.append("finished")
+        except sqlite3.OperationalError as e:
+            log.append(f"aborted: {e}")
+            raise
+
+    async def run():
+        db = AsyncDB(make_db(), max_workers=1, timeout=5)
+        try:
+            try:
+                await db.run(two_statements, timeout=0.1)
+                raise AssertionError("应该超时")
+            except QueryTimeout as e:
+                print(f"超时: {e}")
+            # 唯一的工作线程应当在第二条语句开始时就被释放
+            t0 = time.perf_counter()
+            count = await db.run(count_numbers, timeout=2)
+            return count, time.perf_counter() - t0
+        finally:
+            db.close()
+
+    count, elapsed = asyncio.run(run())
+    print(f"log={log} 等待 {elapsed:.2f}s")
+    assert count == 100 and elapsed < 1
+    assert log[0] == 100 and log[1].startswith("aborted")
+    print("✓ 后续语句已中止")
+
+
+def test_reader_is_read_only():
+    """测试读连接不能写入"""
+    print_separator("测试 4: 只读连接")
+
+    async def run():
+        db = AsyncDB(make_db(), max_workers=1)
+        try:
+            await db.run(insert_number)
+        finally:
+            db.close()
+
+    try:
+        asyncio.run(run())
+        raise AssertionError("只读连接不应该能写入")
+    except sqlite3.OperationalError as e:
+        print(f"写入被拒绝: {e}")
+    print("✓ 读连接是只读的")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("异步数据库访问层测试套件")
+    test_concurrent_queries()
+    test_timeout_interrupts_query()
+    test_timeout_cancels_later_statements()
+    test_reader_is_read_only()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+AI 聊天会话管理测试脚本
+验证会话 LRU 淘汰 / 空闲过期，以及上下文的 token 预算和滚动摘要
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.chat_sessions import ChatSessionStore, ContextWindow, estimate_tokens
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def test_session_store():
+    """测试每个用户独立会话、LRU 淘汰和空闲过期"""
+    print_separator("测试 1: 会话存储")
+
+    store = ChatSessionStore(max_sessions=2, idle_timeout=60)
+    alpha, created, _ = store.get_or_create(1, 10, "Alpha", "system")
+    assert created
+    alpha.context.add("user", "hi")
+    store.get_or_create(2, 10, "Bravo", "system")
+    again, created, _ = store.get_or_create(1, 11, "Alpha", "system")
+    assert again is alpha and not created and alpha.channel_id == 11
+
+    # Bravo 最久未活动，被淘汰
+    _, _, evicted = store.get_or_create(3, 10, "Charlie", "system")
+    assert [s.user_name for s in evicted] == ["Bravo"]
+    assert store.get(2) is None
+
+    expired = store.expire_idle(now=alpha.last_activity + 61)
+    assert {s.user_id for s in expired} == {1, 3}
+    assert len(store) == 0
+
+    # 正在处理请求的会话不被淘汰，淘汰下一个空闲的
+    async def evict_while_busy():
+        busy, _, _ = store.get_or_create(1, 10, "Alpha", "system")
+        store.get_or_create(2, 10, "Bravo", "system")
+        async with busy.lock:
+            _, _, evicted = store.get_or_create(3, 10, "Charlie", "system")
+            assert [s.user_name for s in evicted] == ["Bravo"]
+            _, _, evicted = store.get_or_create(4, 10, "Delta", "system")
+            assert [s.user_name for s in evicted] == ["Charlie"]
+        assert store.get(1) is busy and len(store) == 2
+
+    asyncio.run(evict_while_busy())
+    print("✓ 会话存储正确")
+
+
+def test_context_window():
+    """测试 token 预算：超预算时成对折叠最早的轮次，摘要写入后前缀稳定"""
+    print_separator("测试 2: 上下文预算")
+
+    assert estimate_tokens("你好") == 2 + 4
+    assert estimate_tokens("abcdefgh") == 2 + 4
+
+    window = ContextWindow("system", max_tokens=200)
+    for i in range(10):
+        window.add("user", f"问题{i} " + "x" * 40)
+        window.add("assistant", f"回答{i} " + "y" * 40)
+    assert window.needs_compaction()
+
+    taken = window.take_for_summary()
+    print(f"taken={len(taken)} remaining={len(window.turns)} tokens={window.turn_tokens()}")
+    assert taken[0]["content"].startswith("问题0") and len(taken) % 2 == 0
+    assert window.turns[0]["role"] == "user"
+    assert window.turn_tokens() <= (200 - estimate_tokens("system")) * 0.5
+    assert window.summarizing and not window.needs_compaction()
+
+    window.apply_summary("玩家问了前几个问题")
+    built = window.build()
+    assert built[0] == {"role": "system", "content": "system"}
+    assert built[1]["content"].endswith("玩家问了前几个问题")
+    assert built[2:] == window.turns
+
+    # 下一轮只在末尾追加，前缀不变（可以复用 KV cache）
+    window.add("user", "新问题")
+    assert window.build()[:len(built)] == built
+    print("✓ 上下文预算正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("AI 聊天会话管理测试套件")
+    test_session_store()
+    test_context_window()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
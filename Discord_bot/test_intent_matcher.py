@@ -0,0 +1,144 @@
+"""
+意图识别测试脚本
+验证 Aho–Corasick 匹配器和留出语料上的意图识别准确率
+"""
+
+import random
+import sys
+from pathlib import Path
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.intent_matcher import KeywordMatcher
+from Discord_bot.rag_system import IntentDetector
+
+
+CORPUS_PATH = Path(__file__).parent / "intent_corpus.tsv"  # 调权重用
+HELDOUT_PATH = Path(__file__).parent / "intent_heldout.tsv"  # 不参与调参，只用来评估
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def load_corpus(path: Path = CORPUS_PATH) -> list:
+    """读取标注语料：[(查询, 期望意图), ...]"""
+    corpus = []
+    for line in path.read_text(encoding="utf-8").splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        query, intent = line.split("\t")
+        corpus.append((query, intent))
+    return corpus
+
+
+def test_matcher_matches_naive_search():
+    """测试自动机和逐个关键词子串查找的结果一致（随机用例）"""
+    print_separator("测试 1: 自动机正确性")
+
+    rng = random.Random(7)
+    for _ in range(300):
+        keywords = {"".join(rng.choice("ab战报") for _ in range(rng.randint(1, 4))) for _ in range(8)}
+        matcher = KeywordMatcher((keyword, keyword) for keyword in keywords)
+        text = "".join(rng.choice("ab战报 ") for _ in range(40))
+
+        expected = []
+        for keyword in keywords:
+            start = text.find(keyword)
+            while start != -1:
+                end = start + len(keyword)
+                before = text[start - 1] if start > 0 else " "
+                after = text[end] if end < len(text) else " "
+                # 英文关键词要求整词
+                if not ((keyword[0] in "ab" and before in "ab") or (keyword[-1] in "ab" and after in "ab")):
+                    expected.append((start, end, keyword))
+                start = text.find(keyword, start + 1)
+        assert sorted(matcher.find_all(text)) == sorted(expected), (keywords, text)
+    print("✓ 300 组随机用例一致")
+
+
+def test_matcher_longest_and_boundaries():
+    """测试整词匹配、大小写和长词覆盖短词"""
+    print_separator("测试 2: 整词 / 长词优先")
+
+    matcher = KeywordMatcher([("ai", "PVE"), ("战斗", "battle"), ("战斗风格", "style"), ("BVR", "BVR")])
+    assert matcher.find("details of the AI match") == [("ai", ["PVE"])]
+    assert matcher.find("查一下Alpha的bvr战斗风格") == [("bvr", ["BVR"]), ("战斗风格", ["style"])]
+    assert matcher.find("BVRX") == []
+    print("✓ 匹配规则正确")
+
+
+def corpus_accuracy(detector: IntentDetector, corpus: list) -> float:
+    """语料上的准确率，并打印识别错的查询"""
+    misses = []
+    for query, expected in corpus:
+        intent = detector.detect(query)["intent"]
+        if intent != expected:
+            misses.append((query, expected, intent, detector.score_intents(query)))
+    for miss in misses:
+        print(f"✗ {miss}")
+    accuracy = 1 - len(misses) / len(corpus)
+    print(f"准确率: {accuracy:.1%} ({len(corpus) - len(misses)}/{len(corpus)})")
+    return accuracy
+
+
+def test_corpus_accuracy():
+    """测试留出语料上的准确率（调参语料上的结果只作参考，权重就是照着它调的）"""
+    print_separator("测试 3: 语料准确率")
+
+    detector = IntentDetector()
+    print("调参语料：")
+    corpus_accuracy(detector, load_corpus())
+    print("留出语料：")
+    accuracy = corpus_accuracy(detector, load_corpus(HELDOUT_PATH))
+    assert accuracy >= 0.85
+    print("✓ 留出语料准确率达标")
+
+
+def test_detect_fields():
+    """测试地图类型 / 时间范围和意图在同一遍扫描里提取"""
+    print_separator("测试 4: 字段提取")
+
+    detector = IntentDetector()
+    intent = detector.detect("最近一周Tobiichi在BVR的elo走势")
+    print(intent)
+    assert intent["intent"] == "player_elo_trend"
+    assert intent["map_type"] == "BVR"
+    assert intent["time_range"] == "last_7_days"
+    assert intent["players"] == ["Tobiichi"]
+    assert intent["confident"]
+    # 得分太低（只有 "最近"）时用默认意图，并标记为没把握（/ai 这时才做向量检索）
+    fallback = detector.detect("Tobiichi最近")
+    assert fallback["intent"] == IntentDetector.DEFAULT_INTENT and not fallback["confident"]
+    # 武器名、地图名不是玩家，里面的数字也不是数量
+    for query in ["AIM-120 击杀排行", "MergeLarge 排行榜", "BVR Ethi5 最近的比赛", "GAU-8 用得最多的人"]:
+        intent = detector.detect(query)
+        print(query, intent["players"], intent["limit"])
+        assert intent["players"] == [] and intent["limit"] == 20
+    assert detector.detect("前10名排行")["limit"] == 10
+    assert detector.detect("top5 排行")["players"] == []
+    # 型号一样的串可能是玩家名：照样去查，但查不到时不提示；加了引号就按玩家名处理
+    intent = detector.detect("F-16 谁最强")
+    assert intent["players"] == ["F-16"] and intent["tentative_players"] == ["F-16"]
+    assert detector.detect("“F-16” 的数据")["tentative_players"] == []
+    print("✓ 字段提取正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("意图识别测试套件")
+    test_matcher_matches_naive_search()
+    test_matcher_longest_and_boundaries()
+    test_corpus_accuracy()
+    test_detect_fields()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+LLM 请求网关测试脚本
+验证并发上限、按优先级出队、排队位置、取消、在途请求去重和等待时间统计
+"""
+
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.llm_gateway import LLMGateway, PRIORITY_BACKGROUND, PRIORITY_CHAT, PRIORITY_COMMAND
+from Discord_bot.match_index import OllamaEmbedder
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def test_priority_order():
+    """测试并发上限和出队顺序：斜杠命令 > 自由对话 > 后台任务，同优先级先来后到"""
+    print_separator("测试 1: 优先级排队")
+
+    gateway = LLMGateway(max_concurrent=1)
+    order = []
+    positions = {}
+    peak = 0
+
+    async def request(name: str, priority: int):
+        nonlocal peak
+
+        async def on_queued(position: int):
+            positions[name] = position
+
+        async with gateway.slot(priority, on_queued):
+            peak = max(peak, gateway.active)
+            order.append(name)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        tasks = []
+        for name, priority in [("first", PRIORITY_CHAT), ("bg", PRIORITY_BACKGROUND), ("chat1", PRIORITY_CHAT),
+                               ("cmd1", PRIORITY_COMMAND), ("chat2", PRIORITY_CHAT), ("cmd2", PRIORITY_COMMAND)]:
+            tasks.append(asyncio.create_task(request(name, priority)))
+            await asyncio.sleep(0)  # 保证按顺序入队
+        # 取消一个排队中的请求，不应影响其他人
+        tasks[4].cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    asyncio.run(run())
+    print(f"order={order} positions={positions}")
+    assert peak == 1
+    assert order == ["first", "cmd1", "cmd2", "chat1", "bg"]
+    # 入队时前面有几个更优先的请求
+    assert positions == {"bg": 1, "chat1": 1, "cmd1": 1, "chat2": 3, "cmd2": 2}
+    assert gateway.active == 0 and gateway.queued == 0
+
+    stats = gateway.stats()
+    print(stats)
+    assert stats["completed"] == 5
+    assert stats["waits"]["command"]["count"] == 2 and stats["waits"]["background"]["count"] == 1
+    assert stats["waits"]["background"]["max_ms"] >= stats["waits"]["command"]["max_ms"]
+    print("✓ 优先级排队正确")
+
+
+def test_concurrency_limit():
+    """测试并发上限与 OLLAMA_NUM_PARALLEL 一致时同时执行的请求数"""
+    print_separator("测试 2: 并发上限")
+
+    gateway = LLMGateway(max_concurrent=3)
+    peak = 0
+    done = 0
+
+    async def broken_notice(position: int):
+        raise RuntimeError("message deleted")
+
+    async def request():
+        nonlocal peak, done
+        # 排队提示发送失败不影响请求本身
+        async with gateway.slot(PRIORITY_CHAT, broken_notice):
+            peak = max(peak, gateway.active)
+            await asyncio.sleep(0.01)
+        done += 1
+
+    async def run():
+        await asyncio.gather(*(request() for _ in range(10)))
+
+    asyncio.run(run())
+    print(f"peak={peak}")
+    assert peak == 3 and gateway.active == 0 and done == 10
+    print("✓ 并发上限正确")
+
+
+def test_dedupe_inflight():
+    """测试相同 key 的在途请求只执行一次；只有所有等待方都放弃时才取消"""
+    print_separator("测试 3: 在途去重")
+
+    gateway = LLMGateway(max_concurrent=1)
+    calls = []
+
+    async def generate(prompt: str):
+        async with gateway.slot(PRIORITY_COMMAND):
+            calls.append(prompt)
+            await asyncio.sleep(0.02)
+            return prompt.upper()
+
+    async def run():
+        same = await asyncio.gather(*(gateway.run("k", lambda: generate("hello")) for _ in range(3)))
+        other = await gateway.run("k2", lambda: generate("world"))
+
+        # 一个等待方放弃，另一个仍然拿到结果
+        first = asyncio.create_task(gateway.run("k3", lambda: generate("again")))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(gateway.run("k3", lambda: generate("again")))
+        await asyncio.sleep(0)
+        first.cancel()
+        survived = await second
+
+        # 所有等待方都放弃：请求被取消
+        lonely = asyncio.create_task(gateway.run("k4", lambda: generate("gone")))
+        await asyncio.sleep(0.005)
+        lonely.cancel()
+        await asyncio.gather(lonely, return_exceptions=True)
+        await asyncio.sleep(0.03)
+
+        # 排队提示按调用方各自发送，不随去重的请求共享
+        async def busy():
+            async with gateway.slot(PRIORITY_COMMAND):
+                await asyncio.sleep(0.02)
+
+        def notifier(name):
+            async def on_queued(position: int):
+                notified.append(name)
+            return on_queued
+
+        blocker = asyncio.create_task(busy())
+        await asyncio.sleep(0)
+        shared = await asyncio.gather(*(gateway.run("k5", lambda: generate("shared"), on_queued=notifier(name))
+                                        for name in ("x", "y")))
+        await blocker
+        return same, other, survived, shared
+
+    notified = []
+    same, other, survived, shared = asyncio.run(run())
+    print(f"same={same} calls={calls} notified={notified} stats={gateway.stats()}")
+    assert same == ["HELLO"] * 3 and other == "WORLD" and survived == "AGAIN"
+    assert shared == ["SHARED"] * 2 and sorted(notified) == ["x", "y"]
+    assert calls == ["hello", "world", "again", "gone", "shared"]
+    assert gateway.deduped == 4
+    assert not gateway.is_inflight("k4") and gateway.active == 0
+    print("✓ 在途去重正确")
+
+
+class FakeEmbedClient:
+    """记录 embed 调用时网关的占用情况"""
+
+    def __init__(self, gateway: LLMGateway):
+        self.gateway = gateway
+        self.active_during_embed = []
+
+    async def embed(self, texts, model=None):
+        self.active_during_embed.append(self.gateway.active)
+        await asyncio.sleep(0.01)
+        return [[1.0, 0.0] for _ in texts]
+
+
+def test_embed_through_gateway():
+    """测试问题向量经过网关排队，以及持有名额时（工具调用里）再计算向量不会自己等自己"""
+    print_separator("测试 4: 向量请求排队")
+
+    gateway = LLMGateway(max_concurrent=1)
+    client = FakeEmbedClient(gateway)
+    embedder = OllamaEmbedder(client, "embed-model", gateway=gateway)
+    order = []
+
+    async def chat():
+        async with gateway.slot(PRIORITY_CHAT):
+            order.append("chat")
+            await asyncio.sleep(0.02)
+            # 工具调用轮次之间执行 search_matches：已经占着名额，直接计算
+            await asyncio.wait_for(embedder.embed(["tool query"]), timeout=1)
+
+    async def command():
+        await embedder.embed(["/ai query"])
+        order.append("embed")
+
+    async def run():
+        first = asyncio.create_task(chat())
+        await asyncio.sleep(0)
+        await asyncio.gather(first, command())
+
+    asyncio.run(run())
+    print(f"order={order} active={client.active_during_embed} stats={gateway.stats()}")
+    # /ai 的向量请求等聊天请求释放名额后才执行，执行时只占一个名额
+    assert order == ["chat", "embed"]
+    assert client.active_during_embed == [1, 1]
+    assert gateway.stats()["waits"]["command"]["count"] == 1
+    assert gateway.active == 0 and gateway.queued == 0
+    print("✓ 向量请求排队正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("LLM 请求网关测试套件")
+    test_priority_order()
+    test_concurrency_limit()
+    test_dedupe_inflight()
+    test_embed_through_gateway()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
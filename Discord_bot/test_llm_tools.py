@@ -0,0 +1,247 @@
+"""
+AI 工具调用测试脚本
+验证工具参数校验、只读查询结果、按对话缓存，以及模拟 Ollama 返回 tool_calls 时的工具调用循环
+"""
+
+import asyncio
+import json
+import sys
+import tempfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from aiohttp import web
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from DB import flightlogDB
+from Discord_bot.async_db import AsyncDB
+from Discord_bot.bot_commands import BotCommands
+from Discord_bot.llm_tools import LLMToolbox, ToolError
+from Discord_bot.ollama_client import OllamaClient, OllamaError, OllamaToolsUnsupported
+from Discord_bot.query_cache import QueryCache
+from Discord_bot.test_match_publisher import kill, save_match
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def make_db() -> tuple:
+    db_path = Path(tempfile.mkdtemp()) / "llm_tools_test.sqlite"
+    db = flightlogDB(db_path)
+    a, b = ("1", "Alpha"), ("2", "Bravo")
+    save_match(db, [kill(a, b, "AIM-120D", 5.0), kill(a, b, "AIM-9X", 4.0)], "20251120_201000")
+    save_match(db, [kill(b, a, "AIM-120D", 3.0)], "20251120_211000")
+    return db_path, db
+
+
+def test_validate_arguments():
+    """测试按参数声明校验：类型转换、枚举、必填、limit 截断"""
+    print_separator("测试 1: 参数校验")
+
+    toolbox = LLMToolbox(None, None, max_rows=25)
+    assert toolbox.validate("leaderboard", {"map_type": "bvr", "limit": "500"}) == {"map_type": "BVR", "limit": 25}
+    assert toolbox.validate("match_report", '{"replay_id": "7"}') == {"replay_id": 7}
+    assert toolbox.validate("weapon_stats", {"player": " Alpha ", "unknown": 1}) == {"player": "Alpha", "limit": 10}
+    for name, args in [("drop_table", {}), ("leaderboard", {}), ("leaderboard", {"map_type": "XYZ"}),
+                       ("match_report", {"replay_id": "abc"}), ("get_player", "not json")]:
+        try:
+            toolbox.validate(name, args)
+            raise AssertionError(f"应当拒绝 {name} {args}")
+        except ToolError as e:
+            print(f"✓ {name} {args!r}: {e}")
+
+
+def test_tool_queries_and_cache():
+    """测试四个工具的查询结果，以及相同参数的调用命中对话缓存"""
+    print_separator("测试 2: 工具查询 / 缓存")
+
+    db_path, db = make_db()
+
+    async def run():
+        reader = AsyncDB(db_path, max_workers=2)
+        toolbox = LLMToolbox(reader, db, max_rows=1)
+        cache = QueryCache()
+        cache.set_generation(db.get_generation())
+        try:
+            results = {
+                "get_player": await toolbox.call("get_player", {"name": "alpha"}, cache),
+                "leaderboard": await toolbox.call("leaderboard", {"map_type": "BVR", "limit": 10}, cache),
+                "match_report": await toolbox.call("match_report", {}, cache),
+                "weapon_stats": await toolbox.call("weapon_stats", {"player": "Alpha"}, cache),
+                "missing": await toolbox.call("get_player", {"name": "Nobody"}, cache),
+                "bad": await toolbox.call("leaderboard", {"map_type": "XYZ"}, cache),
+            }
+            calls = toolbox.calls
+            again = await toolbox.call("get_player", {"name": "ALPHA "}, cache)
+
+            # 数据库 / 向量服务出错时返回 error 给模型，不中断回复
+            empty = AsyncDB(Path(tempfile.mkdtemp()) / "empty.sqlite", max_workers=1)
+            broken = LLMToolbox(empty, db, retriever=BrokenRetriever())
+            try:
+                failures = [
+                    await broken.call("leaderboard", {"map_type": "BVR"}),
+                    await broken.call("search_matches", {"query": "导弹"}),
+                ]
+            finally:
+                empty.close()
+            return results, calls, toolbox.calls, again, failures
+        finally:
+            reader.close()
+
+    results, calls, calls_after, again, failures = asyncio.run(run())
+    for name, result in results.items():
+        print(f"{name}: {result}")
+    parsed = {name: json.loads(result) for name, result in results.items()}
+
+    assert parsed["get_player"]["steam_name"] == "Alpha"
+    assert parsed["get_player"]["stats"][0]["kills"] == 2
+    assert parsed["get_player"]["top_weapons"][0]["weapon"] in ("AIM-120D", "AIM-9X")
+    # max_rows=1：limit 被截断，战报只保留最后一条击杀
+    assert len(parsed["leaderboard"]["players"]) == 1
+    assert parsed["match_report"]["total_kills"] == 1
+    assert parsed["match_report"]["kills"] == [
+        {"time_local": parsed["match_report"]["kills"][0]["time_local"], "killer": "Bravo", "victim": "Alpha", "weapon": "AIM-120D"}
+    ]
+    assert parsed["weapon_stats"]["player"] == "Alpha" and len(parsed["weapon_stats"]["weapons"]) == 1
+    assert "error" in parsed["missing"] and "error" in parsed["bad"]
+    # 规范化后参数相同（大小写 / 空白），命中缓存，不再查库
+    assert again == results["get_player"]
+    assert calls == calls_after == 5
+    assert [json.loads(result) for result in failures] == [{"error": "查询出错"}, {"error": "查询出错"}]
+    print("✓ 查询结果和缓存正确")
+
+
+class BrokenRetriever:
+    """向量服务不可用的检索器"""
+
+    def refresh(self):
+        return 1
+
+    async def search(self, query: str, k: int = 3):
+        raise OllamaError("embed model not loaded")
+
+
+class MockToolOllama:
+    """
+    模拟支持 tools 的 /api/chat：
+    第一次请求先输出一句话、再在单独的块里返回 get_player 的 tool_call（和 Ollama 一样 tool_calls 不带文字），
+    收到 tool 消息后分两段根据工具结果回答；model 为 "old-model" 时模拟不支持 tools 的模型
+    """
+
+    def __init__(self):
+        self.payloads = []
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.payloads.append(payload)
+        if payload["model"] == "old-model" and payload.get("tools"):
+            return web.json_response({"error": "old-model does not support tools"}, status=400)
+
+        last = payload["messages"][-1]
+        if last["role"] == "tool":
+            chunks = [{"role": "assistant", "content": "Alpha 的数据："},
+                      {"role": "assistant", "content": last["content"][:20]}]
+        else:
+            chunks = [{"role": "assistant", "content": "让我先查一下。"},
+                      {"role": "assistant", "content": "", "tool_calls": [
+                          {"function": {"name": "get_player", "arguments": {"name": "Alpha"}}}
+                      ]}]
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        for message in chunks:
+            await resp.write(json.dumps({"message": message, "done": False}).encode() + b"\n")
+        await resp.write(json.dumps({"message": {"role": "assistant", "content": ""}, "done": True}).encode() + b"\n")
+        await resp.write_eof()
+        return resp
+
+
+class FakeReply:
+    """记录每次写入和撤回"""
+
+    def __init__(self):
+        self.text = ""
+        self.feeds = []
+        self.retracted = []
+
+    async def feed(self, text: str):
+        self.text += text
+        self.feeds.append(text)
+
+    async def retract(self, length: int):
+        self.retracted.append(self.text[length:])
+        self.text = self.text[:length]
+
+
+def test_tool_call_loop():
+    """测试工具调用循环：tool_calls -> 执行工具 -> tool 消息 -> 最终回答；不支持 tools 的模型抛出专门的异常"""
+    print_separator("测试 3: 工具调用循环")
+
+    db_path, db = make_db()
+
+    async def run():
+        mock = MockToolOllama()
+        app = web.Application()
+        app.router.add_post("/api/chat", mock.chat)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+        reader = AsyncDB(db_path, max_workers=2)
+        client = OllamaClient(url, "test-model")
+        fake_bot = SimpleNamespace(ollama=client, toolbox=LLMToolbox(reader, db))
+        try:
+            messages = [{"role": "user", "content": "Alpha 怎么样"}]
+            reply, used = FakeReply(), []
+            await BotCommands._run_tool_rounds(fake_bot, messages, reply, QueryCache(), used)
+
+            unsupported = None
+            client.model = "old-model"
+            try:
+                await BotCommands._run_tool_rounds(fake_bot, list(messages), FakeReply(), QueryCache())
+            except OllamaToolsUnsupported as e:
+                unsupported = e
+            return mock.payloads, messages, reply, used, unsupported
+        finally:
+            await client.close()
+            reader.close()
+            await runner.cleanup()
+
+    payloads, messages, reply, used, unsupported = asyncio.run(run())
+    text = reply.text
+    print(f"reply={text!r} feeds={reply.feeds} retracted={reply.retracted} used={used} unsupported={unsupported}")
+    assert used == ["get_player"]
+    assert [t["function"]["name"] for t in payloads[0]["tools"]] == ["get_player", "leaderboard", "match_report", "weapon_stats"]
+    assert [m["role"] for m in payloads[1]["messages"]] == ["user", "assistant", "tool"]
+    assert json.loads(payloads[1]["messages"][-1]["content"])["steam_name"] == "Alpha"
+    # 调用工具前的文字先流式写出，出现 tool_calls 后被撤回；最终回答逐块写入
+    assert reply.feeds[0] == "让我先查一下。" and reply.retracted == ["让我先查一下。"]
+    assert reply.feeds[1:] == ["Alpha 的数据：", text[len("Alpha 的数据："):]]
+    assert text.startswith("Alpha 的数据：") and "让我先查一下" not in text
+    assert payloads[1]["messages"][1]["content"] == "让我先查一下。"
+    # 调用方的消息列表同样带上了工具往返（bot 里传入的是副本，不会写进会话上下文）
+    assert len(messages) == 3
+    assert isinstance(unsupported, OllamaToolsUnsupported)
+    print("✓ 工具调用循环正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("AI 工具调用测试套件")
+    test_validate_arguments()
+    test_tool_queries_and_cache()
+    test_tool_call_loop()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""
+比赛向量检索测试脚本
+用确定性的哈希向量模型代替 Ollama，验证比赛摘要、索引增量构建、top-k 检索和 /api/embed 客户端
+"""
+
+import asyncio
+import hashlib
+import json
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from aiohttp import web
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from DB import flightlogDB
+from Discord_bot.async_db import AsyncDB
+from Discord_bot.llm_tools import LLMToolbox
+from Discord_bot.chat_sessions import estimate_tokens
+from Discord_bot.match_index import MatchIndex, MatchRetriever, build_index, format_retrieved, trim_retrieved, weapon_class
+from Discord_bot.ollama_client import OllamaClient
+from Discord_bot.test_match_publisher import kill
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+class StubEmbedder:
+    """确定性的向量模型：字符二元组哈希到固定维度（相同文本得到相同向量，字面越像越相近）"""
+
+    def __init__(self, dim: int = 128):
+        self.dim = dim
+        self.texts = []
+
+    async def embed(self, texts):
+        self.texts.extend(texts)
+        vectors = []
+        for text in texts:
+            vector = np.zeros(self.dim, dtype=np.float32)
+            for a, b in zip(text, text[1:]):
+                digest = hashlib.md5((a + b).encode("utf-8")).digest()
+                vector[int.from_bytes(digest[:4], "little") % self.dim] += 1.0
+            vectors.append(vector.tolist())
+        return vectors
+
+
+def save_match(db: flightlogDB, events: list, played_at: str, map_name: str, map_type: str = "BVR"):
+    replay_info = {
+        "file_name": f"test_{played_at}.zip",
+        "map_name": map_name,
+        "played_at": played_at,
+        "meta_blob": b"",
+        "map_type": map_type,
+    }
+    assert db.save_global_event_history(events, replay_info, [])
+
+
+A, B, C = ("1", "Alpha"), ("2", "Bravo"), ("3", "Charlie")
+
+
+def make_db() -> tuple:
+    db_path = Path(tempfile.mkdtemp()) / "match_index_test.sqlite"
+    db = flightlogDB(db_path)
+    save_match(db, [kill(A, B, "AIM-120D", 5.0), kill(C, A, "AIM-120C", 4.0)], "20251120_201000", "BVR Bench")
+    save_match(db, [kill(A, B, "AIM-120D", 5.0), kill(B, C, "AIM-9X", 3.0), kill(A, C, "GAU-8", 6.0)],
+               "20251121_201000", "MergeLarge")
+    save_match(db, [kill(C, B, "M61A1", 2.0)], "20251122_201000", "Dogfight Valley", "BFM")
+    return db_path, db
+
+
+def test_summary():
+    """测试武器分类和比赛摘要"""
+    print_separator("测试 1: 比赛摘要")
+
+    assert weapon_class("GAU-8") == "机炮" and weapon_class("AIM-120D") == "中远距导弹"
+    assert weapon_class("AIM-9X") == "近距导弹" and weapon_class("Laser") is None
+
+    db_path, db = make_db()
+    index_dir = Path(tempfile.mkdtemp())
+    index = asyncio.run(build_index(index_dir, StubEmbedder(), "stub", db_path=db_path))
+    summary = index.summaries[1]
+    print(summary)
+    assert summary.startswith("比赛 #2 地图 MergeLarge（BVR）")
+    assert "参战玩家 3 人：Alpha、Bravo、Charlie" in summary
+    assert "导弹交战后出现 1 次机炮击杀" in summary
+    assert "Alpha 用 GAU-8（机炮） 击落 Charlie" in summary
+    assert "机炮击杀" not in index.summaries[0]
+    print("✓ 摘要正确")
+
+
+def test_build_and_search():
+    """测试索引构建、memmap 打开、top-k 检索和增量构建"""
+    print_separator("测试 2: 构建 / 检索 / 增量")
+
+    db_path, db = make_db()
+    index_dir = Path(tempfile.mkdtemp())
+    embedder = StubEmbedder()
+
+    async def run():
+        index = await build_index(index_dir, embedder, "stub", db_path=db_path)
+        first_texts = len(embedder.texts)
+        query = (await embedder.embed(["导弹交战后出现机炮击杀的比赛"]))[0]
+        hits = index.search(query, k=2)
+
+        # 新比赛入库后只编码新的那一局
+        save_match(db, [kill(B, A, "AIM-54", 8.0)], "20251123_201000", "BVR Bench")
+        embedder.texts.clear()
+        index = await build_index(index_dir, embedder, "stub", db_path=db_path)
+        incremental = list(embedder.texts)
+
+        # 换了向量模型：全部重新编码
+        embedder.texts.clear()
+        rebuilt = await build_index(index_dir, embedder, "stub-v2", db_path=db_path)
+        return first_texts, hits, index, incremental, rebuilt, len(embedder.texts)
+
+    first_texts, hits, index, incremental, rebuilt, rebuilt_texts = asyncio.run(run())
+    for replay_id, score, summary in hits:
+        print(f"#{replay_id} {score:.3f} {summary.splitlines()[0]}")
+
+    assert first_texts == 3
+    assert hits[0][0] == 2 and hits[0][1] >= hits[1][1]
+    assert len(incremental) == 1 and incremental[0].startswith("比赛 #4")
+    assert index.replay_ids == [1, 2, 3, 4]
+
+    reopened = MatchIndex.open(index_dir)
+    assert isinstance(reopened.vectors, np.memmap)
+    assert reopened.model == "stub-v2" and rebuilt_texts == 4 and len(rebuilt) == 4
+    assert np.allclose(np.linalg.norm(np.asarray(reopened.vectors), axis=1), 1.0, atol=1e-5)
+    # 只保留当前的矩阵文件
+    assert len(list(index_dir.glob("vectors-*.f32"))) == 1
+    # 相似度下限
+    assert reopened.search(np.ones(128), k=4, min_score=1.01) == []
+    print("✓ 构建和检索正确")
+
+
+def test_retriever_and_tool():
+    """测试 MatchRetriever 在索引建好后自动打开、问题向量缓存，以及 search_matches 工具"""
+    print_separator("测试 3: 检索器 / search_matches 工具")
+
+    db_path, db = make_db()
+    index_dir = Path(tempfile.mkdtemp())
+    embedder = StubEmbedder()
+    retriever = MatchRetriever(index_dir, embedder, top_k=1, min_score=0.0)
+
+    async def run():
+        reader = AsyncDB(db_path, max_workers=1)
+        toolbox = LLMToolbox(reader, db, retriever=retriever)
+        try:
+            before = await retriever.search("机炮击杀")
+            names_before = [spec["function"]["name"] for spec in toolbox.schemas()]
+            await build_index(index_dir, embedder, "stub", db_path=db_path)
+            after = await retriever.search("导弹交战后出现机炮击杀")
+            embedded = len(embedder.texts)
+            # 同一个问题（空白不同）再问一次，不再调用向量模型
+            again = await retriever.search(" 导弹交战后出现机炮击杀 ")
+            assert again == after and len(embedder.texts) == embedded
+            names_after = [spec["function"]["name"] for spec in toolbox.schemas()]
+            tool_result = await toolbox.call("search_matches", {"query": "导弹交战后出现机炮击杀"})
+            return before, after, names_before, names_after, tool_result
+        finally:
+            reader.close()
+
+    before, after, names_before, names_after, tool_result = asyncio.run(run())
+    print(tool_result[:200])
+    assert before == [] and "search_matches" not in names_before
+    assert [replay_id for replay_id, _, _ in after] == [2]
+    assert names_after[-1] == "search_matches"
+    matches = json.loads(tool_result)["matches"]
+    assert len(matches) == 3 and matches[0]["replay_id"] == 2
+    print("✓ 检索器和工具正确")
+
+
+def test_trim_retrieved():
+    """测试检索结果按 token 预算截断：整局放得下就放，放不下的那局按行截断，之后的丢弃"""
+    print_separator("测试 4: 检索结果预算")
+
+    lines = [f"比赛 #{i} 地图 BVR Bench，时间 20251120_201000" for i in range(3)]
+    kills = "\n".join(f"20:0{j} Alpha 用 AIM-120D（中远距导弹） 击落 Bravo" for j in range(30))
+    results = [(i, 0.9 - i / 10, f"{lines[i]}\n{kills}") for i in range(3)]
+
+    full = trim_retrieved(results, 100000)
+    assert full == results
+    one = estimate_tokens(format_retrieved(results[:1]))
+    budget = one + 60
+    trimmed = trim_retrieved(results, budget)
+    text = format_retrieved(trimmed)
+    print(f"预算 {budget}: {len(trimmed)} 局 {estimate_tokens(text)} tokens")
+    assert [replay_id for replay_id, _, _ in trimmed] == [0, 1]
+    assert trimmed[0] == results[0]
+    assert trimmed[1][2].startswith(lines[1]) and trimmed[1][2].endswith("…")
+    assert estimate_tokens(text) <= budget
+    assert trim_retrieved(results, 10) == []
+    print("✓ 检索结果预算正确")
+
+
+def test_ollama_embed():
+    """测试 OllamaClient.embed 调用 /api/embed"""
+    print_separator("测试 5: /api/embed 客户端")
+
+    payloads = []
+
+    async def embed(request: web.Request) -> web.Response:
+        payload = await request.json()
+        payloads.append(payload)
+        return web.json_response({"embeddings": [[float(len(text)), 1.0] for text in payload["input"]]})
+
+    async def run():
+        app = web.Application()
+        app.router.add_post("/api/embed", embed)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        client = OllamaClient(f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}", "chat-model")
+        try:
+            return await client.embed(["ab", "abcd"], model="embed-model")
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    vectors = asyncio.run(run())
+    print(f"vectors={vectors} payload={payloads[0]}")
+    assert vectors == [[2.0, 1.0], [4.0, 1.0]]
+    assert payloads[0] == {"model": "embed-model", "input": ["ab", "abcd"]}
+    print("✓ /api/embed 调用正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("比赛向量检索测试套件")
+    test_summary()
+    test_build_and_search()
+    test_retriever_and_tool()
+    test_trim_retrieved()
+    test_ollama_embed()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
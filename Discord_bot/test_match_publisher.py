@@ -0,0 +1,117 @@
+"""
+比赛结算发布器测试脚本
+验证排行榜 / 战报快照的生成和战报自动发送
+"""
+
+import asyncio
+import sys
+import tempfile
+from pathlib import Path
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from DB import flightlogDB
+from Discord_bot.async_db import AsyncDB
+from Discord_bot.match_publisher import MatchPublisher
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def kill(killer: tuple, victim: tuple, weapon: str, delta: float) -> dict:
+    """构造一条 BVR 击杀事件，killer/victim = (steam_id, name)"""
+    return {
+        "event_type": "BVR_KILL",
+        "datetime": "2025-11-20 20:00:00",
+        "killer_id": killer[0],
+        "killer_name": killer[1],
+        "victim_id": victim[0],
+        "victim_name": victim[1],
+        "weapon": weapon,
+        "elo_delta": delta,
+    }
+
+
+def save_match(db: flightlogDB, events: list, played_at: str):
+    replay_info = {
+        "file_name": f"test_{played_at}.zip",
+        "map_name": "BVR Test",
+        "played_at": played_at,
+        "meta_blob": b"",
+        "map_type": "BVR",
+    }
+    assert db.save_global_event_history(events, replay_info, [])
+
+
+class FakeChannel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, embed=None):
+        self.sent.append(embed)
+
+
+class FakeBot:
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get_channel(self, channel_id):
+        return self.channel
+
+
+def test_publisher_snapshots():
+    """测试快照生成、第一次刷新不发送、新比赛入库后发送战报"""
+    print_separator("测试 1: 排行榜 / 战报快照")
+
+    db_path = Path(tempfile.mkdtemp()) / "publisher_test.sqlite"
+    db = flightlogDB(db_path)
+    a, b = ("1", "Alpha"), ("2", "Bravo")
+    save_match(db, [kill(a, b, "AIM-120D", 5.0)], "20251120_201000")
+
+    channel = FakeChannel()
+
+    async def run():
+        reader = AsyncDB(db_path, max_workers=2)
+        publisher = MatchPublisher(FakeBot(channel), reader, leaderboard_size=5, report_channel_id=123)
+        try:
+            await publisher.refresh(db.get_generation())
+            first = publisher.last_match
+            assert channel.sent == []
+
+            save_match(db, [kill(b, a, "AIM-9X", 3.0), kill(b, a, "GAU-8", 2.0)], "20251120_211000")
+            await publisher.refresh(db.get_generation())
+            return publisher, first
+        finally:
+            reader.close()
+
+    publisher, first = asyncio.run(run())
+    board = publisher.leaderboards["BVR"]
+    report = publisher.last_match
+    print(board.description)
+    print(report.fields[0].value)
+
+    assert set(publisher.leaderboards) == {"BVR", "BFM", "PVE"}
+    assert "Alpha" in board.description and "Bravo" in board.description
+    assert first is not report
+    assert report.title == "🛩️ 战报 - BVR Test [BVR]"
+    assert "**Bravo** 2/0" in report.fields[0].value
+    assert channel.sent == [report]
+    print("✓ 快照和战报发送正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("比赛结算发布器测试套件")
+    test_publisher_snapshots()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
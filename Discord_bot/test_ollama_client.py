@@ -0,0 +1,184 @@
+"""
+异步 Ollama 客户端测试脚本
+在本地起一个模拟 Ollama 的 aiohttp 服务，验证流式读取、连接复用、首 token 超时和取消
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.ollama_client import OllamaClient, OllamaConnectionError, OllamaError, OllamaTimeout
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+class MockOllama:
+    """
+    模拟 /api/chat 的流式接口
+    最后一条用户消息决定行为：slow = 首 token 前等待，hang = 发出一个 token 后一直不结束，error = 返回错误
+    """
+
+    def __init__(self):
+        self.peers = []
+        self.payloads = []
+        self.cancelled = asyncio.Event()
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.peers.append(request.transport.get_extra_info("peername"))
+        payload = await request.json()
+        self.payloads.append(payload)
+        prompt = payload["messages"][-1]["content"]
+        if prompt == "error":
+            return web.json_response({"error": "model not found"}, status=404)
+
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        try:
+            if prompt == "slow":
+                await asyncio.sleep(1)
+            for word in ["Hello", ", ", "pilot"]:
+                line = {"message": {"role": "assistant", "content": word}, "done": False}
+                await resp.write(json.dumps(line).encode() + b"\n")
+                if prompt == "hang":
+                    await asyncio.sleep(30)
+            await resp.write(json.dumps({"message": {"role": "assistant", "content": ""}, "done": True}).encode() + b"\n")
+        except (asyncio.CancelledError, ConnectionResetError):
+            self.cancelled.set()
+            raise
+        await resp.write_eof()
+        return resp
+
+
+async def start_mock():
+    mock = MockOllama()
+    app = web.Application()
+    app.router.add_post("/api/chat", mock.chat)
+    runner = web.AppRunner(app, handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return mock, runner, f"http://127.0.0.1:{port}"
+
+
+def test_chat_and_connection_reuse():
+    """测试完整回复拼接，以及两次请求复用同一个连接"""
+    print_separator("测试 1: 对话 / 连接复用")
+
+    async def run():
+        mock, runner, url = await start_mock()
+        client = OllamaClient(url, "test-model", keep_alive="30m", options={"num_ctx": 4096})
+        try:
+            first = await client.chat([{"role": "user", "content": "hi"}])
+            second = await client.chat([{"role": "user", "content": "hi again"}])
+            try:
+                await client.chat([{"role": "user", "content": "error"}])
+                raise AssertionError("应当抛出 OllamaError")
+            except OllamaError as e:
+                print(f"错误响应: {e}")
+            assert mock.payloads[0]["keep_alive"] == "30m"
+            assert mock.payloads[0]["options"] == {"num_ctx": 4096}
+            return first, second, mock.peers
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    first, second, peers = asyncio.run(run())
+    print(f"replies={first!r}, {second!r} peers={peers}")
+    assert first == second == "Hello, pilot"
+    assert peers[0] == peers[1]
+    print("✓ 回复正确且连接被复用")
+
+
+def test_first_token_timeout():
+    """测试首 token 超时"""
+    print_separator("测试 2: 首 token 超时")
+
+    async def run():
+        mock, runner, url = await start_mock()
+        client = OllamaClient(url, "test-model", first_token_timeout=0.2)
+        try:
+            await client.chat([{"role": "user", "content": "slow"}])
+            raise AssertionError("应当超时")
+        except OllamaTimeout as e:
+            return str(e)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    message = asyncio.run(run())
+    print(message)
+    assert "first token" in message
+    print("✓ 首 token 超时生效")
+
+
+def test_cancel_closes_stream():
+    """测试调用方取消后断开连接，服务端能感知到"""
+    print_separator("测试 3: 取消请求")
+
+    async def run():
+        mock, runner, url = await start_mock()
+        client = OllamaClient(url, "test-model")
+        try:
+            task = asyncio.create_task(client.chat([{"role": "user", "content": "hang"}]))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+            await asyncio.wait_for(mock.cancelled.wait(), 2)
+            # 取消之后客户端仍然可用
+            return await client.chat([{"role": "user", "content": "hi"}])
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    reply = asyncio.run(run())
+    assert reply == "Hello, pilot"
+    print("✓ 取消后服务端停止生成，客户端仍可继续使用")
+
+
+def test_connection_refused():
+    """测试连接不上时抛出 OllamaConnectionError"""
+    print_separator("测试 4: 连接失败")
+
+    async def run():
+        client = OllamaClient("http://127.0.0.1:1", "test-model", connect_timeout=1)
+        try:
+            await client.chat([{"role": "user", "content": "hi"}])
+            raise AssertionError("应当连接失败")
+        except OllamaConnectionError as e:
+            print(e)
+        finally:
+            await client.close()
+
+    asyncio.run(run())
+    print("✓ 连接失败被正确识别")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("异步 Ollama 客户端测试套件")
+    test_chat_and_connection_reuse()
+    test_first_token_timeout()
+    test_cancel_closes_stream()
+    test_connection_refused()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,211 @@
+"""
+Ollama 模型生命周期测试脚本
+用本地 aiohttp 桩服务模拟 /api/tags、/api/ps、/api/chat、/api/embed，
+验证模型检查、预热（带 keep_alive）、向量模型预加载、模型被卸载后重新预热和服务离线时的状态
+"""
+
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+from aiohttp import web
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.ollama_client import OllamaClient
+from Discord_bot.ollama_lifecycle import ModelLifecycle
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+class StubOllama:
+    """
+    模拟 Ollama 管理接口：tags 为已下载的模型，loaded 为当前在显存里的模型；
+    chat / embed 请求会把对应模型加入 loaded
+    """
+
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.loaded = []
+        self.requests = []
+
+    async def api_tags(self, request: web.Request) -> web.Response:
+        self.requests.append(("tags", None))
+        return web.json_response({"models": [{"name": name, "model": name} for name in self.tags]})
+
+    async def api_ps(self, request: web.Request) -> web.Response:
+        self.requests.append(("ps", None))
+        return web.json_response({"models": [{"name": name, "model": name} for name in self.loaded]})
+
+    async def api_chat(self, request: web.Request) -> web.StreamResponse:
+        payload = await request.json()
+        self.requests.append(("chat", payload))
+        self._load(payload["model"])
+        resp = web.StreamResponse()
+        await resp.prepare(request)
+        await resp.write(json.dumps({"message": {"role": "assistant", "content": "hi"}, "done": True}).encode() + b"\n")
+        await resp.write_eof()
+        return resp
+
+    async def api_embed(self, request: web.Request) -> web.Response:
+        payload = await request.json()
+        self.requests.append(("embed", payload))
+        self._load(payload["model"])
+        return web.json_response({"embeddings": [[0.0, 1.0] for _ in payload["input"]]})
+
+    def _load(self, model: str):
+        model = model if ":" in model else model + ":latest"
+        if model not in self.loaded:
+            self.loaded.append(model)
+
+    def kinds(self):
+        return [kind for kind, _ in self.requests]
+
+
+async def serve(stub: StubOllama):
+    app = web.Application()
+    app.router.add_get("/api/tags", stub.api_tags)
+    app.router.add_get("/api/ps", stub.api_ps)
+    app.router.add_post("/api/chat", stub.api_chat)
+    app.router.add_post("/api/embed", stub.api_embed)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+def test_start_and_warmup():
+    """测试启动流程：/api/tags 检查模型 -> 预热聊天模型 -> 预加载向量模型，请求带 keep_alive"""
+    print_separator("测试 1: 启动预热")
+
+    stub = StubOllama(["chat-model:q4", "embed-model:latest"])
+
+    async def run():
+        runner, url = await serve(stub)
+        client = OllamaClient(url, "chat-model:q4", keep_alive="30m")
+        lifecycle = ModelLifecycle(client, "chat-model:q4", embed_model="embed-model")
+        try:
+            ok = await lifecycle.start()
+            return ok, lifecycle.stats()
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    ok, stats = asyncio.run(run())
+    print(f"kinds={stub.kinds()} stats={stats}")
+    assert ok and stats["healthy"] and stats["missing"] == []
+    assert stub.kinds() == ["tags", "chat", "embed", "ps"]
+    chat = stub.requests[1][1]
+    assert chat["model"] == "chat-model:q4" and chat["keep_alive"] == "30m"
+    assert chat["options"]["num_predict"] == 1
+    assert stub.requests[2][1]["keep_alive"] == "30m"
+    assert set(stats["warmup_ms"]) == {"chat-model:q4", "embed-model"}
+    assert stats["loaded"] == ["chat-model:q4", "embed-model:latest"]
+    assert stats["ping_ms"] is not None and stats["warmups"] == 2
+    print("✓ 启动预热正确")
+
+
+def test_missing_model():
+    """测试模型没有下载时不发预热请求，并在状态里给出提示"""
+    print_separator("测试 2: 模型未下载")
+
+    stub = StubOllama(["other-model:latest"])
+
+    async def run():
+        runner, url = await serve(stub)
+        client = OllamaClient(url, "chat-model")
+        lifecycle = ModelLifecycle(client, "chat-model")
+        try:
+            ok = await lifecycle.start()
+            return ok, lifecycle.stats()
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    ok, stats = asyncio.run(run())
+    print(f"stats={stats}")
+    assert not ok and stats["healthy"]
+    assert stats["missing"] == ["chat-model"] and "ollama pull" in stats["last_error"]
+    assert stub.kinds() == ["tags"]
+    print("✓ 未下载的模型被识别")
+
+
+def test_check_rewarms_unloaded_model():
+    """测试健康检查：模型还在显存里时不重复预热，被卸载后重新预热"""
+    print_separator("测试 3: 健康检查 / 重新预热")
+
+    stub = StubOllama(["chat-model:latest"])
+
+    async def run():
+        runner, url = await serve(stub)
+        client = OllamaClient(url, "chat-model")
+        lifecycle = ModelLifecycle(client, "chat-model")
+        try:
+            await lifecycle.start()
+            stub.requests.clear()
+            await lifecycle.check()
+            steady = stub.kinds()
+
+            stub.loaded.clear()  # keep_alive 过期 / 被别的模型挤出显存
+            stub.requests.clear()
+            healthy = await lifecycle.check()
+            return steady, stub.kinds(), healthy, lifecycle.stats()
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    steady, rewarm, healthy, stats = asyncio.run(run())
+    print(f"steady={steady} rewarm={rewarm}")
+    assert steady == ["tags", "ps", "ps"]
+    assert rewarm == ["tags", "ps", "chat", "ps"]
+    assert healthy and stats["checks"] == 2 and stats["warmups"] == 2
+    assert stats["loaded"] == ["chat-model:latest"]
+    print("✓ 被卸载的模型重新预热")
+
+
+def test_offline():
+    """测试 Ollama 离线时记录失败而不抛出异常"""
+    print_separator("测试 4: 服务离线")
+
+    async def run():
+        # 先占一个端口再关掉，保证连接被拒绝
+        runner, url = await serve(StubOllama([]))
+        await runner.cleanup()
+        client = OllamaClient(url, "chat-model", connect_timeout=1)
+        lifecycle = ModelLifecycle(client, "chat-model")
+        try:
+            ok = await lifecycle.start()
+            healthy = await lifecycle.check()
+            return ok, healthy, lifecycle.stats()
+        finally:
+            await client.close()
+
+    ok, healthy, stats = asyncio.run(run())
+    print(f"stats={stats}")
+    assert not ok and not healthy and not stats["healthy"]
+    assert stats["failures"] == 2 and stats["last_error"]
+    print("✓ 离线状态正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("Ollama 模型生命周期测试套件")
+    test_start_and_warmup()
+    test_missing_model()
+    test_check_rewarms_unloaded_model()
+    test_offline()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+查询结果缓存测试脚本
+验证参数规范化、LRU 淘汰、TTL 过期、generation 失效和内容哈希键
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.query_cache import QueryCache, content_digest
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def test_key_normalization_and_lru():
+    """测试参数规范化和 LRU 淘汰"""
+    print_separator("测试 1: 键规范化 / LRU")
+
+    cache = QueryCache(max_entries=2, ttl=60)
+    cache.set("profile", "alpha", name=" Alpha ")
+    assert cache.get("profile", name="ALPHA") == "alpha"
+    assert cache.get("search", name="alpha") is None
+
+    cache.set("profile", "bravo", name="bravo")
+    cache.get("profile", name="alpha")  # alpha 变成最近使用
+    cache.set("profile", "charlie", name="charlie")
+    assert cache.get("profile", name="bravo") is None
+    assert cache.get("profile", name="alpha") == "alpha"
+    print(cache.stats())
+    print("✓ 规范化和淘汰正确")
+
+
+def test_ttl_and_generation():
+    """测试 TTL 过期和 generation 变化时失效"""
+    print_separator("测试 2: TTL / generation")
+
+    cache = QueryCache(ttl=0.05)
+    assert cache.set_generation(1) is True
+    cache.set("leaderboard", [1, 2, 3], map_type="BVR")
+    assert cache.set_generation(1) is False
+    assert cache.get("leaderboard", map_type="BVR") == [1, 2, 3]
+    time.sleep(0.06)
+    assert cache.get("leaderboard", map_type="BVR") is None
+
+    cache.ttl = 60
+    cache.set("leaderboard", [1, 2, 3], map_type="BVR")
+    assert cache.set_generation(2) is True
+    assert len(cache) == 0
+    print("✓ 过期和失效正确")
+
+
+def test_get_or_load():
+    """测试 get_or_load 只加载一次，加载期间代数变化或 cache_if 不通过时不写缓存"""
+    print_separator("测试 3: get_or_load")
+
+    cache = QueryCache()
+    cache.set_generation(1)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        return len(calls)
+
+    async def racing_loader():
+        cache.set_generation(2)
+        return "stale"
+
+    async def run():
+        first = await cache.get_or_load("profile", loader, steam_id="1")
+        second = await cache.get_or_load("profile", loader, steam_id="1")
+        stale = await cache.get_or_load("profile", racing_loader, steam_id="2")
+        failed = [await cache.get_or_load("rag", loader, cache_if=lambda n: n > 3, q="x") for _ in range(3)]
+        return first, second, stale, failed
+
+    first, second, stale, failed = asyncio.run(run())
+    assert (first, second, stale) == (1, 1, "stale")
+    assert cache.get("profile", steam_id="2") is None
+    # 不满足 cache_if 的结果每次都重新加载，满足后才缓存
+    assert failed == [2, 3, 4]
+    assert cache.get("rag", q="x") == 4 and len(calls) == 4
+    print("✓ 加载逻辑正确")
+
+
+def test_content_digest():
+    """测试内容哈希键：相同上下文命中同一条总结，不受 generation 影响"""
+    print_separator("测试 4: 内容哈希")
+
+    context = "查询意图: map_leaderboard\n数据条数: 2"
+    assert content_digest(context) == content_digest(str(context))
+    assert content_digest(context) != content_digest(context + " ")
+
+    summaries = QueryCache(ttl=60)
+    summaries.set("summary", "总结", digest=content_digest(context))
+    assert summaries.get("summary", digest=content_digest(context)) == "总结"
+    assert summaries.get("summary", digest=content_digest("其他数据")) is None
+    print("✓ 内容哈希正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("查询结果缓存测试套件")
+    test_key_normalization_and_lru()
+    test_ttl_and_generation()
+    test_get_or_load()
+    test_content_digest()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,14 @@ RAG系统测试脚本
 """
 
 import sys
+import time
 from pathlib import Path
 
 # 添加父目录到路径
 sys.path.append(str(Path(__file__).parent.parent))
 
 from Discord_bot.rag_system import RAGSystem, IntentDetector, SQLGenerator, RAGExecutor
+from Discord_bot.chat_sessions import estimate_tokens
 
 
 def print_separator(title=""):
@@ -73,11 +75,19 @@ def test_sql_generation():
     ]
     
     for intent in test_intents:
-        sql = generator.generate(intent)
+        sql, params = generator.generate(intent)
         print(f"意图: {intent['intent']}")
         print(f"查询: {intent['original_query']}")
         print(f"SQL:\n{sql}")
+        print(f"参数: {params}")
         print()
+        assert sql.count("?") == len(params)
+    
+    # 地图类型和玩家都作为参数绑定，玩家数不同 SQL 文本不变（可以复用语句缓存）
+    one, one_params = generator.generate(test_intents[0], [1])
+    two, two_params = generator.generate(test_intents[0], [1, 2])
+    assert one == two and "r.map_type = ?" in one
+    assert one_params == ["[1]", "BVR", 10] and two_params == ["[1, 2]", "BVR", 10]
 
 
 def test_sql_execution():
@@ -186,11 +196,185 @@ def test_llm_context_formatting():
     print(llm_context[:500])
     print("...")
     print(f"\n总长度: {len(llm_context)} 字符")
+    
+    # 上下文只取决于意图和数据，不同问法得到相同文本（/ai 总结缓存依赖这一点）
+    reworded = dict(mock_intent, original_query="最近打得怎么样")
+    assert executor.format_for_llm(mock_data, list(mock_data[0].keys()), reworded) == llm_context
+    # 查询条件（玩家 / 地图类型 / 时间范围）会写进上下文，条件不同的查询不会共用一条总结
+    scoped = dict(mock_intent, players=["PlayerA"], map_type="BFM", time_range="last_7_days")
+    scoped_context = executor.format_for_llm(mock_data, list(mock_data[0].keys()), scoped)
+    assert "查询条件：玩家=PlayerA，地图类型=BFM，时间范围=last_7_days" in scoped_context
+    assert scoped_context != llm_context
+    print("✓ 上下文与原始问法无关，包含查询条件")
+
+
+def test_compact_context():
+    """测试紧凑上下文：表头只出现一次、去掉无用列、不超过 token 预算"""
+    print_separator("测试 6: 紧凑上下文")
+    
+    executor = RAGExecutor()
+    data = [
+        {
+            "replay_id": i,
+            "map_name": "MergeLarge",
+            "played_at": f"20250120_{i:02d}0000",
+            "total_events": 10 + i,
+            "notes": None,
+            "players": f"Tobiichi,Player{i % 3}\tPlayerB",
+        }
+        for i in range(60)
+    ]
+    intent = {"intent": "recent_battles"}
+    
+    full = executor.format_for_llm(data, list(data[0].keys()), intent, max_tokens=100000)
+    lines = full.splitlines()
+    print("\n".join(lines[:12]))
+    assert lines.count("played_at\ttotal_events\tplayers") == 1
+    assert "replay_id" not in full and "notes" not in full
+    assert "map_name=MergeLarge" in full and full.count("MergeLarge") == 1
+    assert "- total_events: 合计 2370" in full
+    assert "20250120_590000\t69\tTobiichi,Player2 PlayerB" in full
+    assert "- players: 3种" in full
+    
+    budget = 300
+    small = executor.format_for_llm(data, list(data[0].keys()), intent, max_tokens=budget)
+    print(f"\n完整: {estimate_tokens(full)} tokens, 预算 {budget}: {estimate_tokens(small)} tokens")
+    assert estimate_tokens(small) <= budget
+    assert "条已省略" in small and "20250120_000000" in small
+    
+    assert executor._format_value(2034.04) == "2034"
+    assert executor._format_value(1.235) == "1.24"
+    assert executor._format_value(-0.001) == "0"
+    assert len(executor._format_value("x" * 500)) == executor.MAX_VALUE_CHARS
+    print("✓ 紧凑上下文正确")
+
+
+def test_player_scoped_query():
+    """测试玩家名解析和按玩家 / 地图类型过滤（临时数据库）"""
+    print_separator("测试 7: 按玩家过滤")
+    
+    from DB import flightlogDB
+    from test_db import make_kill_event, make_temp_db_path, save_match
+    
+    db_path = make_temp_db_path()
+    db = flightlogDB(db_path)
+    a, b, c = ("1", "Alpha"), ("2", "Bravo"), ("3", "Charlie")
+    save_match(db, [
+        make_kill_event(a, b, "AIM-120D", "2025-11-20 20:01:00", 2.0),
+        make_kill_event(c, b, "AIM-9X", "2025-11-20 20:02:00", 2.0),
+    ], "20251120_201000")
+    save_match(db, [
+        make_kill_event(a, c, "GAU-8", "2025-11-21 20:01:00", 2.0, "BFM"),
+    ], "20251121_201000", "BFM")
+    db.player_join("1", "Alpha", "Tobiichi")
+    
+    rag = RAGSystem(db_path)
+    assert rag.rag_executor.resolve_players(["tobiichi", "charlie", "Nobody"]) == ([1, 3], ["Nobody"])
+    
+    result = rag.process_query("查一下Tobiichi最近BVR的表现")
+    print(f"players={result['intent']['players']} ids={result['player_ids']} params={result['params']}")
+    for row in result["data"]:
+        print(row)
+    assert result["player_ids"] == [1] and result["unresolved_players"] == []
+    assert "没有找到名为" not in result["llm_context"]
+    assert {row["steam_name"] for row in result["data"]} == {"Alpha"}
+    assert {row["map_name"] for row in result["data"]} == {"BVR Test"}
+    assert [row["event_type"] for row in result["data"]] == ["BVR_KILL"]
+    
+    # 不认识的名字不参与过滤，但会在上下文里说明，模型不会把全服数据当成这个玩家的
+    result = rag.process_query("AIM-120D 武器统计")
+    assert result["player_ids"] == [] and result["success"]
+    assert result["intent"]["players"] == [] and result["unresolved_players"] == []
+    assert "玩家=" not in result["llm_context"] and "没有找到名为" not in result["llm_context"]
+    result = rag.process_query("F-16 谁最强")
+    assert result["unresolved_players"] == [] and "F-16" not in result["llm_context"]
+    result = rag.process_query("查一下Nobody最近BVR的表现")
+    assert result["player_ids"] == [] and result["unresolved_players"] == ["Nobody"]
+    assert "没有找到名为 Nobody 的玩家" in result["llm_context"]
+    
+    report = rag.process_query("Charlie那局的战报总结")
+    assert [row["killer_name"] for row in report["data"]] == ["Alpha"]
+    print("✓ 玩家过滤正确")
+
+
+def test_time_range():
+    """测试时间范围：边界计算、按 played_at_epoch 的范围过滤，以及排行 / 统计在时间范围内重新汇总"""
+    print_separator("测试 8: 时间范围")
+    
+    from datetime import datetime, timedelta, timezone
+    from DB import flightlogDB
+    from test_db import make_kill_event, make_temp_db_path, save_match
+    
+    # 2025-11-20 是周四
+    now = datetime(2025, 11, 20, 15, 30, tzinfo=timezone.utc)
+    day = lambda d: datetime(2025, 11, d, tzinfo=timezone.utc)
+    assert SQLGenerator.time_bounds("today", now) == (day(20), day(21))
+    assert SQLGenerator.time_bounds("yesterday", now) == (day(19), day(20))
+    assert SQLGenerator.time_bounds("this_week", now) == (day(17), day(21))
+    assert SQLGenerator.time_bounds("last_week", now) == (day(10), day(17))
+    assert SQLGenerator.time_bounds("this_month", now) == (day(1), day(21))
+    assert SQLGenerator.time_bounds("last_7_days", now) == (day(14), day(21))
+    assert SQLGenerator.time_bounds(None, now) is None
+    
+    detector = IntentDetector()
+    assert detector.detect("本周谁最活跃")["time_range"] == "this_week"
+    assert detector.detect("最近一周谁最活跃？")["time_range"] == "last_7_days"
+    
+    db_path = make_temp_db_path()
+    db = flightlogDB(db_path)
+    today = datetime.now(timezone.utc)
+    old = today - timedelta(days=40)
+    save_match(db, [
+        make_kill_event(("1", "Alpha"), ("2", "Bravo"), "AIM-120D", today.strftime("%Y-%m-%d 00:00:01"), 2.0),
+    ], today.replace(hour=0, minute=0, second=1).strftime("%Y%m%d_%H%M%S"))
+    save_match(db, [
+        make_kill_event(("3", "Charlie"), ("4", "Delta"), "AIM-120D", old.strftime("%Y-%m-%d %H:%M:%S"), 2.0),
+    ], old.strftime("%Y%m%d_%H%M%S"))
+    
+    rag = RAGSystem(db_path)
+    result = rag.process_query("今天谁最活跃")
+    print(f"params={result['params']}")
+    for row in result["data"]:
+        print(row)
+    assert result["intent"]["time_range"] == "today"
+    assert {row["steam_name"] for row in result["data"]} == {"Alpha", "Bravo"}
+    assert result["data"][0]["active_days"] == 1
+    
+    everyone = rag.process_query("谁最活跃")
+    assert {row["steam_name"] for row in everyone["data"]} == {"Alpha", "Bravo", "Charlie", "Delta"}
+    
+    # 排行 / 统计摘要读的 player_stats 是全量汇总，有时间范围时按这段时间的比赛重新统计
+    board = rag.process_query("今天BVR排行榜")
+    assert board["intent"]["intent"] == "map_leaderboard" and board["intent"]["time_range"] == "today"
+    assert {row["steam_name"]: (row["kills"], row["deaths"]) for row in board["data"]} == {"Alpha": (1, 0), "Bravo": (0, 1)}
+    assert "Elo 为当前值" in board["llm_context"]
+    all_time = rag.process_query("BVR排行榜")
+    assert {row["steam_name"] for row in all_time["data"]} == {"Alpha", "Bravo", "Charlie", "Delta"}
+    summary = rag.process_query("今天的统计数据")
+    assert summary["intent"]["intent"] == "player_stats_summary"
+    assert {row["steam_name"]: row["total_matches"] for row in summary["data"]} == {"Alpha": 1, "Bravo": 1}
+    
+    # Elo趋势按跨度和点数选最粗的汇总桶：30天里取2个点用周桶，取50个点用天桶
+    trend = {"intent": "player_elo_trend", "players": ["Alpha"], "map_type": "BVR", "time_range": "last_30_days"}
+    assert SQLGenerator.elo_trend_bucket(dict(trend, limit=2)) == "week"
+    assert SQLGenerator.elo_trend_bucket(dict(trend, limit=50)) == "day"
+    assert SQLGenerator.elo_trend_bucket(dict(trend, time_range="today", limit=1)) == "day"
+    assert SQLGenerator.elo_trend_bucket(dict(trend, time_range=None, limit=50)) == "day"
+    weekly = rag.run_intent(dict(trend, limit=2))
+    monday = today.date() - timedelta(days=today.weekday())
+    assert [(row["bucket"], row["bucket_start"]) for row in weekly["data"]] == [("week", monday.isoformat())]
+    # 用周桶时开始日期向下取整到周一，范围开头那一周的周桶也包含在内
+    start = today.date() - timedelta(days=29)
+    assert weekly["params"][0] == "week"
+    assert (start - timedelta(days=start.weekday())).isoformat() in weekly["params"]
+    daily = rag.run_intent(dict(trend, limit=50))
+    assert [(row["bucket"], row["bucket_start"]) for row in daily["data"]] == [("day", today.date().isoformat())]
+    print("✓ 时间范围过滤正确")
 
 
 def test_safety_checks():
     """测试安全性检查"""
-    print_separator("测试 6: SQL安全性检查")
+    print_separator("测试 9: SQL安全性检查")
     
     generator = SQLGenerator()
     
@@ -205,7 +389,7 @@ def test_safety_checks():
     all_safe = True
     
     for intent in test_intents:
-        sql = generator.generate(intent)
+        sql, params = generator.generate(intent)
         sql_upper = sql.upper()
         
         # 检查是否包含危险关键词
@@ -236,6 +420,56 @@ def test_safety_checks():
         print("❌ 发现不安全的SQL查询！")
 
 
+def test_sandboxed_execution():
+    """测试沙箱执行：授权白名单、执行时限、行数上限和耗时统计"""
+    print_separator("测试 10: 沙箱执行")
+    
+    from DB import flightlogDB
+    from test_db import make_kill_event, make_temp_db_path, save_match
+    
+    db_path = make_temp_db_path()
+    db = flightlogDB(db_path)
+    save_match(db, [
+        make_kill_event(("1", "Alpha"), ("2", "Bravo"), "AIM-120D", "2025-11-20 20:01:00", 2.0),
+    ], "20251120_201000")
+    
+    rag = RAGSystem(db_path)
+    executor = rag.rag_executor
+    
+    # 所有意图生成的SQL都能通过授权白名单
+    for intent_name in IntentDetector.KEYWORDS:
+        rag.run_intent({"intent": intent_name, "players": ["Alpha"], "map_type": None, "time_range": None, "limit": 10})
+    assert "denied" not in executor.metrics.outcomes and "error" not in executor.metrics.outcomes
+    
+    # 写操作、读系统表、PRAGMA 都被拒绝（共享连接上用完后撤掉授权回调）
+    conn = executor.connect()
+    for sql in ["SELECT sql FROM sqlite_master", "SELECT * FROM db_meta",
+                "WITH x AS (SELECT 1) DELETE FROM players", "PRAGMA table_info(players)"]:
+        assert executor.execute(sql, conn=conn) == ([], []), sql
+    assert conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] > 0
+    assert executor.metrics.outcomes["denied"] == 4
+    
+    # 失控的递归查询到点被中断
+    runaway = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT COUNT(*) FROM c"
+    start = time.perf_counter()
+    assert executor.execute(runaway, conn=conn, label="runaway", timeout=0.2) == ([], [])
+    elapsed = time.perf_counter() - start
+    print(f"失控查询 {elapsed:.2f}s 后被中断")
+    assert elapsed < 2 and executor.metrics.outcomes["timeout"] == 1
+    
+    # 行数上限：只取前 max_rows 行
+    data, columns = executor.execute(
+        "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) SELECT x FROM c",
+        conn=conn, label="many_rows", max_rows=250,
+    )
+    assert columns == ["x"] and [row["x"] for row in data] == list(range(1, 251))
+    assert executor.metrics.recent()[-1][2:] == (250, "truncated")
+    conn.close()
+    
+    print(executor.metrics.snapshot())
+    print("✓ 沙箱执行正确")
+
+
 def main():
     """运行所有测试"""
     print_separator("RAG系统测试套件")
@@ -248,7 +482,11 @@ def main():
         test_sql_execution()
         test_full_rag_system()
         test_llm_context_formatting()
+        test_compact_context()
+        test_player_scoped_query()
+        test_time_range()
         test_safety_checks()
+        test_sandboxed_execution()
         
         print_separator("测试完成")
         print("✓ 所有测试通过！")
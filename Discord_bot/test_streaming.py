@@ -0,0 +1,307 @@
+"""
+流式回复测试脚本
+验证增量切分、限频编辑、撤回，相同的 /ai 总结共用一次生成时各自的回复都在流式更新，
+以及默认配置（开启工具）下回复在生成结束前就开始显示
+"""
+
+import asyncio
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+# 添加父目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from Discord_bot.bot_commands import BotCommands
+from Discord_bot.llm_gateway import LLMGateway
+from Discord_bot.query_cache import QueryCache
+from Discord_bot.streaming import CURSOR, IncrementalSplitter, ReplyBroadcast, StreamingReply
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+class FakeMessage:
+    def __init__(self, content: str):
+        self.history = [content]
+
+    @property
+    def content(self) -> str:
+        return self.history[-1]
+
+    async def edit(self, content: str):
+        await asyncio.sleep(0.001)
+        self.history.append(content)
+
+    async def delete(self):
+        self.history.append(None)
+
+
+class FakeChannel:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, content: str):
+        await asyncio.sleep(0.001)
+        message = FakeMessage(content)
+        self.messages.append(message)
+        return message
+
+
+def test_incremental_splitter():
+    """测试增量切分：按换行切，单行超长硬切"""
+    print_separator("测试 1: 增量切分")
+
+    splitter = IncrementalSplitter(10)
+    chunks = []
+    for part in ["abc\n", "defg\nhij", "klmnopqrstuvwxyz"]:
+        chunks += splitter.feed(part)
+    print(chunks, repr(splitter.pending))
+    assert chunks == ["abc\ndefg", "hijklmnopq"]
+    assert splitter.pending == "rstuvwxyz"
+    print("✓ 切分正确")
+
+
+def test_streaming_reply():
+    """测试流式回复：限频编辑、写满换下一条、定稿去掉光标"""
+    print_separator("测试 2: 流式回复")
+
+    channel = FakeChannel()
+    text = "".join(f"line {i}\n" for i in range(40))
+
+    async def run():
+        reply = StreamingReply(channel.send, max_length=100, edit_interval=0.05)
+        for i in range(0, len(text), 5):
+            await reply.feed(text[i:i + 5])
+            await asyncio.sleep(0.005)
+        return await reply.finish("-# done")
+
+    full = asyncio.run(run())
+    contents = [m.content for m in channel.messages]
+    for content in contents:
+        print(repr(content))
+
+    assert full == text
+    assert all(len(c) <= 100 for c in contents[:-1])
+    assert not any(c.endswith(CURSOR) for c in contents)
+    assert "\n".join(contents).replace("\n-# done", "") == text.strip()
+    assert contents[-1].endswith("-# done")
+    # 限频：总编辑次数远少于 feed 次数
+    edits = sum(len(m.history) for m in channel.messages)
+    print(f"feeds={len(text) // 5} edits={edits}")
+    assert edits < len(text) // 5
+    print("✓ 流式回复正确")
+
+
+def test_retract():
+    """测试撤回：跨消息的文本被撤回时多出的消息被删除，当前消息改写成保留的部分"""
+    print_separator("测试 3: 撤回")
+
+    channel = FakeChannel()
+
+    async def run():
+        reply = StreamingReply(channel.send, max_length=20, edit_interval=0)
+        await reply.feed("第一行内容\n")
+        kept = len(reply.text)
+        await reply.feed("先查一下数据库里的记录\n然后再回答这个问题\n再补充一点")
+        await reply.retract(kept)
+        await reply.feed("最终回答")
+        return await reply.finish()
+
+    full = asyncio.run(run())
+    histories = [m.history for m in channel.messages]
+    print(repr(full), histories)
+    assert full == "第一行内容\n最终回答"
+    live = [m for m in channel.messages if m.history[-1] is not None]
+    assert [m.content for m in live] == ["第一行内容\n最终回答"]
+    assert all(m.history[-1] is None for m in channel.messages[1:])
+    print("✓ 撤回正确")
+
+
+class BrokenReply:
+    """交互已失效的回复：写入总是失败"""
+
+    async def feed(self, text: str):
+        raise RuntimeError("Unknown interaction")
+
+
+class SlowStreamOllama:
+    """逐段输出的模拟模型，记录被请求了几次"""
+
+    def __init__(self, parts, delay: float = 0.01):
+        self.parts = parts
+        self.delay = delay
+        self.calls = 0
+
+    async def stream_chat(self, messages):
+        self.calls += 1
+        for part in self.parts:
+            await asyncio.sleep(self.delay)
+            yield part
+
+
+def make_summary_bot(ollama) -> SimpleNamespace:
+    bot = SimpleNamespace(ollama=ollama, llm_gateway=LLMGateway(max_concurrent=1), _summary_broadcasts={})
+    bot._generate_text = lambda *args, **kwargs: BotCommands._generate_text(bot, *args, **kwargs)
+    return bot
+
+
+def test_reply_broadcast():
+    """测试广播：晚加入的订阅者补上已生成的部分，写入失败的回复被移出订阅"""
+    print_separator("测试 4: 广播到多个回复")
+
+    first, late = FakeChannel(), FakeChannel()
+
+    async def run():
+        broadcast = ReplyBroadcast()
+        replies = [StreamingReply(first.send, edit_interval=0), BrokenReply()]
+        for reply in replies:
+            await broadcast.subscribe(reply)
+        await broadcast.feed("abc")
+        await asyncio.sleep(0.01)
+        late_reply = StreamingReply(late.send, edit_interval=0)
+        await broadcast.subscribe(late_reply)
+        await broadcast.feed("def")
+        return broadcast, [await r.finish() for r in (replies[0], late_reply)]
+
+    broadcast, texts = asyncio.run(run())
+    print(texts, len(broadcast.replies))
+    assert texts == ["abcdef", "abcdef"]
+    assert first.messages[0].content == late.messages[0].content == "abcdef"
+    # 失效的回复在第一次写入时就被移出订阅
+    assert not any(isinstance(r, BrokenReply) for r in broadcast.replies)
+    print("✓ 广播正确")
+
+
+def test_shared_summary_streams():
+    """测试相同的 /ai 总结只请求一次模型，两个调用方的回复都在生成过程中更新"""
+    print_separator("测试 5: 共用一次生成的流式总结")
+
+    ollama = SlowStreamOllama([f"第{i}段。" for i in range(6)])
+    bot = make_summary_bot(ollama)
+    channels = [FakeChannel(), FakeChannel()]
+    seen_midway = []
+
+    async def ask(channel: FakeChannel):
+        reply = StreamingReply(channel.send, edit_interval=0)
+        result = await BotCommands._stream_summary(bot, [{"role": "user", "content": "q"}], "key", reply)
+        await reply.finish()
+        return result
+
+    async def watch():
+        # 生成进行到一半时两个回复都已经有内容
+        await asyncio.sleep(0.035)
+        seen_midway.extend(bool(channel.messages) for channel in channels)
+
+    async def run():
+        first = asyncio.create_task(ask(channels[0]))
+        await asyncio.sleep(0.015)
+        results = await asyncio.gather(first, ask(channels[1]), watch())
+        return results[:2]
+
+    results = asyncio.run(run())
+    full = "".join(ollama.parts)
+    print(results, seen_midway, [c.messages[0].history for c in channels])
+    assert ollama.calls == 1
+    assert results == [(full, True), (full, True)]
+    assert seen_midway == [True, True]
+    assert all(c.messages[0].content == full for c in channels)
+    assert bot._summary_broadcasts == {}
+    print("✓ 共用生成的流式总结正确")
+
+
+class SlowToolOllama:
+    """
+    模拟开启工具时的 /api/chat：整段回答分多块慢慢输出，不调用工具
+    记录每一块发出的时间，用来检查回复是不是边生成边显示
+    """
+
+    def __init__(self, parts, delay: float = 0.02):
+        self.parts = parts
+        self.delay = delay
+        self.sent_at = []
+
+    async def stream_messages(self, messages, tools=None):
+        assert tools, "工具模式下应当提供 tools"
+        for part in self.parts:
+            await asyncio.sleep(self.delay)
+            self.sent_at.append(time.monotonic())
+            yield {"role": "assistant", "content": part}
+
+
+class TimedChannel(FakeChannel):
+    """记录第一条消息发出的时间"""
+
+    def __init__(self):
+        super().__init__()
+        self.first_at = None
+
+    async def send(self, content: str):
+        if self.first_at is None:
+            self.first_at = time.monotonic()
+        return await super().send(content)
+
+
+def test_first_content_before_generation_ends():
+    """测试默认配置（开启工具）下 /chatwithai 和 /ai 的回复在生成结束前就出现"""
+    print_separator("测试 6: 首个内容的时间")
+
+    parts = [f"第{i}段。" for i in range(8)]
+
+    async def chat():
+        ollama = SlowToolOllama(parts)
+        bot = SimpleNamespace(ollama=ollama, llm_gateway=LLMGateway(max_concurrent=1),
+                              toolbox=SimpleNamespace(schemas=lambda: [{"type": "function"}]))
+        bot._run_tool_rounds = lambda *args, **kwargs: BotCommands._run_tool_rounds(bot, *args, **kwargs)
+        channel = TimedChannel()
+        reply = StreamingReply(channel.send, edit_interval=0.01)
+        text, complete = await BotCommands._stream_ollama(bot, [{"role": "user", "content": "q"}], reply,
+                                                          tool_cache=QueryCache())
+        await reply.finish()
+        return channel, ollama.sent_at, text, complete
+
+    async def summary():
+        ollama = SlowStreamOllama(parts, delay=0.02)
+        bot = make_summary_bot(ollama)
+        channel = TimedChannel()
+        reply = StreamingReply(channel.send, edit_interval=0.01)
+        started = time.monotonic()
+        text, complete = await BotCommands._stream_summary(bot, [{"role": "user", "content": "q"}], "k", reply)
+        finished = time.monotonic()
+        await reply.finish()
+        return channel, started, finished, text, complete
+
+    channel, sent_at, text, complete = asyncio.run(chat())
+    print(f"工具模式: 首条消息 {channel.first_at - sent_at[0]:+.3f}s，最后一块 {sent_at[-1] - sent_at[0]:.3f}s")
+    assert complete and text == "".join(parts)
+    assert channel.first_at < sent_at[-1]
+    assert channel.messages[0].content == "".join(parts)
+
+    channel, started, finished, text, complete = asyncio.run(summary())
+    print(f"/ai 总结: 首条消息 {channel.first_at - started:.3f}s，生成结束 {finished - started:.3f}s")
+    assert complete and text == "".join(parts)
+    assert channel.first_at - started < (finished - started) / 2
+    print("✓ 回复边生成边显示")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("流式回复测试套件")
+    test_incremental_splitter()
+    test_streaming_reply()
+    test_retract()
+    test_reply_broadcast()
+    test_shared_summary_streams()
+    test_first_content_before_generation_ends()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
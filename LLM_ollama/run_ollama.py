@@ -14,6 +14,10 @@ CONFIG = {
     "OLLAMA_GPU_MEM": "2048",
     "OLLAMA_PORT": "11434",
     "OLLAMA_URL": "http://127.0.0.1:11434",
+    # 同时处理的请求数：Discord Bot 的请求网关按同一个环境变量限制并发，两边保持一致
+    "OLLAMA_NUM_PARALLEL": os.getenv("OLLAMA_NUM_PARALLEL", "1"),
+    # 服务端排队上限，超出时直接返回 503 而不是无限堆积
+    "OLLAMA_MAX_QUEUE": "32",
 }
 
 MODEL_MAP = {
@@ -53,6 +57,8 @@ def start_ollama_server():
     env["OLLAMA_HOME"] = CONFIG["OLLAMA_HOME"]
     env["OLLAMA_GPU_MEM"] = CONFIG["OLLAMA_GPU_MEM"]
     env["OLLAMA_PORT"] = CONFIG["OLLAMA_PORT"]
+    env["OLLAMA_NUM_PARALLEL"] = CONFIG["OLLAMA_NUM_PARALLEL"]
+    env["OLLAMA_MAX_QUEUE"] = CONFIG["OLLAMA_MAX_QUEUE"]
 
     print("🚀 正在启动 Ollama 服务...")
     _ollama_process = subprocess.Popen(
@@ -136,10 +142,11 @@ def ensure_model(env, model_name: str):
 
 # ========== 对话功能 ==========
 
-def chat_stream(model_name: str, messages: list[dict]):
+def chat_stream(model_name: str, messages: list[dict], stats: Optional[dict] = None):
     """
     使用 /api/chat 进行流式对话
     messages: [{"role": "system"/"user"/"assistant", "content": "..."}]
+    stats: 可选，写入 wait_ms（发出请求到第一个 token 的时间，包含在服务端排队和模型加载的时间）
     """
     url = f"{CONFIG['OLLAMA_URL']}/api/chat"
     payload = {
@@ -148,7 +155,10 @@ def chat_stream(model_name: str, messages: list[dict]):
         "stream": True,
     }
 
+    t0 = time.perf_counter()
     with requests.post(url, json=payload, stream=True, timeout=300) as resp:
+        if resp.status_code == 503:
+            raise requests.exceptions.RequestException("Ollama 排队已满（Bot 正忙），请稍后再试")
         resp.raise_for_status()
         for line in resp.iter_lines():
             if not line:
@@ -157,6 +167,8 @@ def chat_stream(model_name: str, messages: list[dict]):
             msg = data.get("message", {})
             chunk = msg.get("content", "")
             if chunk:
+                if stats is not None and "wait_ms" not in stats:
+                    stats["wait_ms"] = (time.perf_counter() - t0) * 1000
                 yield chunk
             if data.get("done"):
                 break
@@ -242,13 +254,17 @@ def interactive_chat(model_name: str):
             
             print("🤖 模型: ", end="", flush=True)
             assistant_reply = ""
+            stats = {}
             
             try:
-                for chunk in chat_stream(model_name, messages):
+                for chunk in chat_stream(model_name, messages, stats):
                     print(chunk, end="", flush=True)
                     assistant_reply += chunk
                 
                 print()  # 换行
+                if stats.get("wait_ms", 0) > 1000:
+                    # 和 Bot 共用同一个模型，Bot 忙时这里会在服务端排队
+                    print(f"⏱ 等待首个 token {stats['wait_ms'] / 1000:.1f}s")
                 
                 if assistant_reply:
                     messages.append({"role": "assistant", "content": assistant_reply})
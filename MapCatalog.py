@@ -0,0 +1,202 @@
+"""
+地图目录
+启动时把 maplist.csv（约600张地图）一次性读进内存并建立索引：
+按创意工坊ID（wsid）、按地图ID（map_id，也就是 sethost mission 用的名字）、按不区分大小写的地图名，
+以及一个排好序的键列表用于前缀搜索（二分查找）。
+ezServer 启动时用它校验 FSM_MAPS（拼错的 mapname 不用再等 config 超时三分钟才发现），
+Discord Bot 用它做地图名的自动补全
+"""
+
+import csv
+import difflib
+from bisect import bisect_left
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+MAPLIST_PATH = Path(__file__).parent / "maplist.csv"
+WORKSHOP_URL = "https://steamcommunity.com/sharedfiles/filedetails/?id={wsid}"
+
+
+@dataclass(frozen=True, slots=True)
+class MapEntry:
+    """maplist.csv 的一行"""
+    package_name: str
+    package_id: str
+    wsid: str  # 创意工坊ID（对应 FSM_MAPS 的 campaign_id），内置地图为包名
+    map_name: str  # 显示名
+    map_id: str  # 地图ID（对应 FSM_MAPS 的 mapname）
+
+    @property
+    def key(self) -> str:
+        """目录内唯一的键 wsid:map_id（用作自动补全的值）"""
+        return f"{self.wsid}:{self.map_id}"
+
+    @property
+    def workshop_url(self) -> Optional[str]:
+        return WORKSHOP_URL.format(wsid=self.wsid) if self.wsid.isdigit() else None
+
+
+class MapCatalog:
+    """
+    只读的地图目录
+    所有索引在构造时建好，查询不再遍历整个列表
+    """
+
+    def __init__(self, entries: Iterable[MapEntry]):
+        """
+        :param entries: 地图条目（(wsid, map_id) 重复的只保留第一条）
+        """
+        self.entries: List[MapEntry] = []
+        self._by_key: Dict[Tuple[str, str], MapEntry] = {}
+        self._by_wsid: Dict[str, List[MapEntry]] = {}
+        self._by_map_id: Dict[str, List[MapEntry]] = {}
+        self._by_name: Dict[str, List[MapEntry]] = {}
+        prefix_index = []
+        for entry in entries:
+            if (entry.wsid, entry.map_id) in self._by_key:
+                continue
+            self.entries.append(entry)
+            self._by_key[(entry.wsid, entry.map_id)] = entry
+            self._by_wsid.setdefault(entry.wsid, []).append(entry)
+            self._by_map_id.setdefault(entry.map_id, []).append(entry)
+            self._by_name.setdefault(entry.map_name.casefold(), []).append(entry)
+            position = len(self.entries) - 1
+            prefix_index.append((entry.map_name.casefold(), position))
+            if entry.map_id.casefold() != entry.map_name.casefold():
+                prefix_index.append((entry.map_id.casefold(), position))
+        # 前缀搜索：按键排序后，以某个前缀开头的键在列表里是连续的一段
+        prefix_index.sort()
+        self._prefix_keys = [k for k, _ in prefix_index]
+        self._prefix_entries = [position for _, position in prefix_index]
+
+    @classmethod
+    def load(cls, path: Union[Path, str] = MAPLIST_PATH) -> "MapCatalog":
+        """
+        从 maplist.csv 读取
+        :param path: CSV 路径（表头 package_name,package_id,wsid,map_name,map_id）
+        """
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            rows = list(csv.DictReader(f))
+        return cls(
+            MapEntry(
+                package_name=row["package_name"].strip(),
+                package_id=row["package_id"].strip(),
+                wsid=row["wsid"].strip(),
+                map_name=row["map_name"].strip(),
+                map_id=row["map_id"].strip(),
+            )
+            for row in rows
+            if row.get("wsid") and row.get("map_id")
+        )
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, wsid: str, map_id: str) -> Optional[MapEntry]:
+        """按 (创意工坊ID, 地图ID) 精确查找"""
+        return self._by_key.get((str(wsid), map_id))
+
+    def by_wsid(self, wsid: str) -> List[MapEntry]:
+        """同一个创意工坊条目里的所有地图"""
+        return list(self._by_wsid.get(str(wsid), ()))
+
+    def by_map_id(self, map_id: str) -> List[MapEntry]:
+        """地图ID相同的条目（不同地图包可能重名）"""
+        return list(self._by_map_id.get(map_id, ()))
+
+    def by_name(self, name: str) -> List[MapEntry]:
+        """按显示名查找（不区分大小写）"""
+        return list(self._by_name.get(name.strip().casefold(), ()))
+
+    def find(self, text: str) -> Optional[MapEntry]:
+        """
+        把用户输入解析成一张地图：wsid:map_id 键 -> 地图ID -> 显示名
+        :return: 第一条匹配，找不到时为 None
+        """
+        text = text.strip()
+        wsid, sep, map_id = text.partition(":")
+        if sep and (wsid, map_id) in self._by_key:
+            return self._by_key[(wsid, map_id)]
+        matches = self._by_map_id.get(text) or self._by_name.get(text.casefold())
+        return matches[0] if matches else None
+
+    def search_prefix(self, prefix: str, limit: int = 25) -> List[MapEntry]:
+        """
+        地图名或地图ID以 prefix 开头的地图（不区分大小写，按键的字典序）
+        :param limit: 最多返回多少条（Discord 自动补全最多25条）
+        """
+        prefix = prefix.strip().casefold()
+        results = []
+        seen = set()
+        i = bisect_left(self._prefix_keys, prefix)
+        while i < len(self._prefix_keys) and len(results) < limit and self._prefix_keys[i].startswith(prefix):
+            position = self._prefix_entries[i]
+            if position not in seen:
+                seen.add(position)
+                results.append(self.entries[position])
+            i += 1
+        return results
+
+    def search(self, query: str, limit: int = 25) -> List[MapEntry]:
+        """
+        自动补全用的搜索：先取前缀匹配，不够时再补上名字中间包含 query 的地图
+        """
+        results = self.search_prefix(query, limit)
+        needle = query.strip().casefold()
+        if len(results) < limit and needle:
+            seen = set(results)
+            for entry in self.entries:
+                if entry in seen:
+                    continue
+                if needle in entry.map_name.casefold() or needle in entry.map_id.casefold():
+                    results.append(entry)
+                    if len(results) >= limit:
+                        break
+        return results
+
+    def suggest(self, wsid: str, map_id: str, n: int = 3) -> List[str]:
+        """拼错的地图ID的候选（优先在同一个创意工坊条目里找）"""
+        candidates = [e.map_id for e in self._by_wsid.get(str(wsid), ())] or list(self._by_map_id)
+        return difflib.get_close_matches(map_id, candidates, n=n, cutoff=0.5)
+
+    def validate_rotation(self, rotation: Dict[str, Dict],
+                          map_types: Optional[Iterable[str]] = None) -> Tuple[List[str], List[str]]:
+        """
+        校验地图轮换配置（ezServer 的 FSM_MAPS）
+        maplist.csv 是手动维护的，新发布的创意工坊地图可能还没收录，所以整个 campaign_id 都不在目录里只算警告；
+        campaign_id 已收录但里面没有这个地图ID（拼错或放错条目）和 map_type 不对才算错误
+        :param rotation: {state: {"campaign_id": ..., "mapname": ..., "map_type": ...}}
+        :param map_types: 允许的 map_type（例如 ELO_TYPE），None 表示不检查
+        :return: (错误信息列表, 警告信息列表)，错误为空表示可以启动
+        """
+        allowed = set(map_types) if map_types is not None else None
+        errors, warnings = [], []
+        for state, config in rotation.items():
+            wsid = str(config.get("campaign_id", ""))
+            map_id = config.get("mapname", "")
+            if allowed is not None and config.get("map_type") not in allowed:
+                errors.append(f"{state}: map_type {config.get('map_type')!r} 不是 {'/'.join(sorted(allowed))} 之一")
+            if self.get(wsid, map_id) is not None:
+                continue
+            known = wsid in self._by_wsid
+            if not known:
+                message = f"{state}: campaign_id {wsid} 不在 maplist.csv 中，无法校验地图 {map_id!r}"
+            else:
+                message = f"{state}: 创意工坊条目 {wsid} 里没有地图 {map_id!r}"
+            elsewhere = [e.wsid for e in self._by_map_id.get(map_id, ())]
+            if elsewhere:
+                message += f"（这张地图在 {', '.join(elsewhere)} 里）"
+            else:
+                suggestions = self.suggest(wsid, map_id)
+                if suggestions:
+                    message += f"（是不是 {' / '.join(suggestions)}？）"
+            (errors if known else warnings).append(message)
+        return errors, warnings
+
+
+@lru_cache(maxsize=None)
+def get_catalog(path: Union[Path, str] = MAPLIST_PATH) -> MapCatalog:
+    """进程内共享的地图目录（只读一次 CSV）"""
+    return MapCatalog.load(path)
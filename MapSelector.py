@@ -0,0 +1,263 @@
+"""
+按历史人数选图
+RAND_MODE 原来是均匀随机，冷门时段随到一张没人玩的地图，大厅很快就空了。
+这里用 replays / player_events 的历史，按地图和一周中的小时（UTC）统计每局平均人数和留存率
+（多少玩家留到了下一局），选下一张地图时让预期在线人数最大，同时用 UCB 给少玩过的地图一些探索机会。
+统计每晚全量重建一次写进 map_population_stats，轮换时只读内存里的结果，不查库
+"""
+
+import math
+import random
+import sqlite3
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from DB import FLIGHTLOG_DB_PATH
+
+ALL_HOURS = -1  # hour_of_week = -1 的行是该地图所有时段的汇总
+
+# 统计窗口内有时间戳的比赛，按时间排序（played_at 是比赛结束时间）
+POPULATION_REPLAYS_SQL = """
+    SELECT id, map_name, played_at_epoch
+    FROM replays
+    WHERE played_at_epoch >= ? AND played_at_epoch <= ?
+    ORDER BY played_at_epoch, id
+"""
+
+# 每局的参战玩家（在击杀事件里出现过的玩家）
+POPULATION_PLAYERS_SQL = """
+    SELECT DISTINCT e.replay_id, pe.player_id
+    FROM replays r
+    JOIN events e ON e.replay_id = r.id
+    JOIN player_events pe ON pe.event_id = e.id
+    WHERE r.played_at_epoch >= ? AND r.played_at_epoch <= ?
+"""
+
+
+def hour_of_week(epoch: float) -> int:
+    """UTC 时间戳 -> 一周中的小时（周一 0 点为 0）"""
+    moment = datetime.fromtimestamp(epoch, timezone.utc)
+    return moment.weekday() * 24 + moment.hour
+
+
+def rebuild_population_stats(conn: sqlite3.Connection, window_days: int = 90, max_gap: int = 2 * 3600,
+                             now: Optional[float] = None) -> int:
+    """
+    全量重建 map_population_stats（调用方负责提交）
+    留存率 = 这一局的玩家里有多少也出现在下一局；下一局在 max_gap 秒内没有开始说明大厅空了，留存记为0。
+    最近 max_gap 秒内结束的比赛还不知道下一局的情况，留到下次重建再统计。
+    注意：replays 里没有大厅人数，"人数"只算在 player_events 里出现过的击杀者和被击杀者，
+    只观战、没有交火的玩家不计入，人多但交火少的地图会被低估
+    :param conn: 数据库连接
+    :param window_days: 只统计最近多少天的比赛
+    :param max_gap: 两局结束时间相差超过这个秒数就不算同一批玩家连续游玩
+    :param now: 当前时间戳（测试用）
+    :return: 写入的行数
+    """
+    now = time.time() if now is None else now
+    start, end = int(now - window_days * 86400), int(now)
+    replays = conn.execute(POPULATION_REPLAYS_SQL, (start, end)).fetchall()
+    players: Dict[int, set] = {}
+    for replay_id, player_id in conn.execute(POPULATION_PLAYERS_SQL, (start, end)):
+        players.setdefault(replay_id, set()).add(player_id)
+
+    # (地图, 小时) -> [局数, 人数合计, 留存合计]
+    totals: Dict[Tuple[str, int], List[float]] = {}
+    for i, (replay_id, map_name, epoch) in enumerate(replays):
+        if epoch > now - max_gap:
+            break
+        present = players.get(replay_id, set())
+        retention = 0.0
+        if i + 1 < len(replays) and replays[i + 1][2] - epoch <= max_gap and present:
+            retention = len(present & players.get(replays[i + 1][0], set())) / len(present)
+        for key in ((map_name, hour_of_week(epoch)), (map_name, ALL_HOURS)):
+            bucket = totals.setdefault(key, [0, 0.0, 0.0])
+            bucket[0] += 1
+            bucket[1] += len(present)
+            bucket[2] += retention
+
+    conn.execute("DELETE FROM map_population_stats")
+    conn.executemany(
+        """
+        INSERT INTO map_population_stats (map_name, hour_of_week, matches, avg_players, retention, computed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (map_name, hour, n, total_players / n, total_retention / n, end)
+            for (map_name, hour), (n, total_players, total_retention) in totals.items()
+        ],
+    )
+    return len(totals)
+
+
+@dataclass(frozen=True, slots=True)
+class MapPopulation:
+    """一个（地图, 时段）的统计"""
+    matches: int
+    avg_players: float
+    retention: float
+
+    @property
+    def occupancy(self) -> float:
+        """一局里的平均在线人数：开局人数按留存率线性减少到下一局开始"""
+        return self.avg_players * (1 + self.retention) / 2
+
+
+class MapSelector:
+    """
+    UCB 选图：得分 = 预期在线人数 + 探索加成
+    预期在线人数把该时段的统计向地图整体水平收缩（样本少的时段不至于被一两局左右），
+    没玩过的地图用所有地图的平均水平；探索加成随该时段的局数增加而减小。
+    统计每晚才更新，一整天的得分都不变，取最大值的话轮换会在得分最高的两张地图之间来回切换，
+    所以按得分做 softmax 抽样，并且把上次重建以来每张地图被选中的次数也计入局数
+    """
+
+    PRIOR_WEIGHT = 2.0  # 地图整体水平相当于多少局该时段的样本
+
+    def __init__(self, db_path: Union[Path, str] = FLIGHTLOG_DB_PATH, exploration: float = 0.5,
+                 temperature: float = 0.5, window_days: int = 90, max_gap: int = 2 * 3600,
+                 rng: Optional[random.Random] = None):
+        """
+        :param db_path: 数据库路径
+        :param exploration: UCB 探索系数
+        :param temperature: 抽样温度（乘以全局平均人数），0 表示总是选得分最高的地图
+        :param window_days: 统计最近多少天的比赛
+        :param max_gap: 判断连续游玩的最大间隔（秒）
+        :param rng: 抽样用的随机数生成器（测试时传入固定种子）
+        """
+        self.db_path = db_path
+        self.exploration = exploration
+        self.temperature = temperature
+        self.window_days = window_days
+        self.max_gap = max_gap
+        self.rng = rng or random.Random()
+        self._stats: Dict[Tuple[str, int], MapPopulation] = {}
+        self._picks: Counter = Counter()  # 上次载入统计以来每张地图被选中的次数
+        self.computed_at: Optional[int] = None
+
+    def refresh(self, now: Optional[float] = None) -> int:
+        """
+        重建统计表并重新载入内存（每晚执行一次）
+        :return: 统计行数
+        """
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = rebuild_population_stats(conn, self.window_days, self.max_gap, now)
+            conn.commit()
+            self.load(conn)
+        finally:
+            conn.close()
+        # 窗口内没有比赛时表是空的，同样记录这次重建的时间
+        self.computed_at = int(time.time() if now is None else now)
+        print(f"[MapSelector] 地图人气统计已更新，{rows} 行")
+        return rows
+
+    def load(self, conn: Optional[sqlite3.Connection] = None) -> None:
+        """从 map_population_stats 载入内存（启动时调用，不重新统计）"""
+        own_conn = conn is None
+        if own_conn:
+            conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute(
+                "SELECT map_name, hour_of_week, matches, avg_players, retention, computed_at FROM map_population_stats"
+            ).fetchall()
+        finally:
+            if own_conn:
+                conn.close()
+        # 整体替换，轮换线程读到的总是完整的一份
+        self._stats = {(m, h): MapPopulation(n, players, retention) for m, h, n, players, retention, _ in rows}
+        # 新统计已经包含了这些选择的结果
+        self._picks = Counter()
+        self.computed_at = max((row[5] for row in rows), default=None)
+
+    def _global_occupancy(self) -> float:
+        """所有地图按局数加权的平均在线人数（没玩过的地图的先验）"""
+        overall = [s for (_, h), s in self._stats.items() if h == ALL_HOURS]
+        matches = sum(s.matches for s in overall)
+        return sum(s.occupancy * s.matches for s in overall) / matches if matches else 0.0
+
+    def estimate(self, map_name: str, hour: int, prior: Optional[float] = None) -> Tuple[float, int]:
+        """
+        地图在某个时段的预期在线人数
+        :return: (预期人数, 该时段的局数)
+        """
+        if prior is None:
+            prior = self._global_occupancy()
+        overall = self._stats.get((map_name, ALL_HOURS))
+        if overall is not None:
+            # 地图整体水平本身也向全局平均收缩
+            prior = (overall.matches * overall.occupancy + self.PRIOR_WEIGHT * prior) / (overall.matches + self.PRIOR_WEIGHT)
+        stats = self._stats.get((map_name, hour))
+        if stats is None:
+            return prior, 0
+        return (stats.matches * stats.occupancy + self.PRIOR_WEIGHT * prior) / (stats.matches + self.PRIOR_WEIGHT), stats.matches
+
+    def scores(self, candidates: Iterable[str], now: Optional[float] = None) -> Dict[str, Tuple[float, float]]:
+        """
+        每张候选地图的 (预期人数, 探索加成)
+        探索加成的局数 = 该时段的历史局数 + 上次重建以来被选中的次数
+        :param now: 当前 UTC 时间戳（默认现在），决定用哪个时段的统计
+        """
+        hour = hour_of_week(time.time() if now is None else now)
+        prior = self._global_occupancy()
+        estimates = {}
+        for name in candidates:
+            value, n = self.estimate(name, hour, prior)
+            estimates[name] = (value, n + self._picks[name])
+        total = sum(n for _, n in estimates.values())
+        # 加成和人数同一量纲：按全局平均人数缩放
+        scale = max(prior, 1.0)
+        return {
+            name: (value, self.exploration * scale * math.sqrt(math.log(total + 1) / (n + 1)))
+            for name, (value, n) in estimates.items()
+        }
+
+    def choose(self, candidates: Sequence[str], now: Optional[float] = None, exclude: Iterable[str] = ()) -> str:
+        """
+        选下一张地图（只读内存里的统计）
+        :param candidates: 候选地图（FSM_MAPS 的 mapname）
+        :param exclude: 不要选的地图（例如刚玩过的），排除后没有候选时忽略
+        :return: 按得分抽到的地图（温度为0时取得分最高的，并列时随机选一张），记入选中次数
+        """
+        excluded = set(exclude)
+        pool = [name for name in candidates if name not in excluded] or list(candidates)
+        if not pool:
+            raise ValueError("没有候选地图")
+        scores = {name: value + bonus for name, (value, bonus) in self.scores(pool, now).items()}
+        best = max(scores.values())
+        temperature = self.temperature * max(self._global_occupancy(), 1.0)
+        if temperature > 0:
+            weights = [math.exp((scores[name] - best) / temperature) for name in pool]
+            choice = self.rng.choices(pool, weights)[0]
+        else:
+            choice = self.rng.choice([name for name in pool if scores[name] >= best - 1e-9])
+        self._picks[choice] += 1
+        return choice
+
+
+def seconds_until(hour: int, now: Optional[datetime] = None) -> float:
+    """距离下一次本地时间 hour 点整的秒数"""
+    now = now or datetime.now()
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
+
+
+def schedule_nightly(selector: MapSelector, timer_manager, hour: int = 4, name: str = "map_population_stats") -> None:
+    """
+    用 TimerManager 每天 hour 点重建一次统计（单次定时器，执行完重新预约下一天）
+    :param timer_manager: Timer.tm
+    """
+    def run():
+        try:
+            selector.refresh()
+        except Exception as e:
+            print(f"[ERROR] 地图人气统计失败: {e}")
+        schedule_nightly(selector, timer_manager, hour, name)
+
+    timer_manager.start_timer(name, int(seconds_until(hour) * 1000), run, single_shot=True)
@@ -11,10 +11,11 @@ from collections import deque
 from dataclasses import dataclass, field
 from typing import Callable, Dict, Set, Union
 from Timer import tm
-import random
 import re #using re to filter message
 from EloSystem import EloSystem
-from DB import db_flightlog
+from DB import db_flightlog, ELO_TYPE
+from MapCatalog import get_catalog
+from MapSelector import MapSelector, schedule_nightly
 
 # 设置控制台输出为 UTF-8 编码
 if sys.platform == 'win32':
@@ -639,7 +640,10 @@ def end_state(state:str):
         #save global event history
         if server.global_event_history:
             db_flightlog.save_global_event_history(server.global_event_history, replay_info, msg_new)
-            db_flightlog.update_player_elo(online_players, FSM_MAPS[state]['map_type'])
+            elo_result = db_flightlog.update_player_elo(online_players, FSM_MAPS[state]['map_type'])
+            if not elo_result["success"]:
+                failed = [p for p in elo_result["players"] if p["status"] in ("missing", "mismatch", "conflict")]
+                print(f"[ERROR] Elo 更新失败，本局未写入任何玩家的 Elo: {failed}")
             
         server.global_event_history.clear()
         server.online_players.clear()
@@ -861,6 +865,16 @@ def _state8():
 
 def main():
     FSM_Nodes = [_state1, _state2, _state3, _state4, _state5, _state6, _state7, _state8]
+    # 连接服务器之前先校验地图配置，拼错的 mapname 否则要等 config 超时三分钟才会发现
+    # 轮换仍以 FSM_MAPS 为准，maplist.csv 还没收录的创意工坊地图只警告、照常加载
+    catalog = get_catalog()
+    map_errors, map_warnings = catalog.validate_rotation(FSM_MAPS, ELO_TYPE)
+    for warning in map_warnings:
+        print(f"[WARNING] 地图配置未校验 {warning}")
+    if map_errors:
+        for error in map_errors:
+            print(f"[ERROR] 地图配置错误 {error}")
+        return
     if not server.start_server():
         print("无法连接到服务器，程序退出")
         return
@@ -868,15 +882,29 @@ def main():
     print("--------------------------------")
     print("已加载的FSM状态:")
     for k, v in FSM_MAPS.items():
-        print(k, "=>", v["mapname"])
+        entry = catalog.get(v["campaign_id"], v["mapname"])
+        detail = f"({entry.map_name} / {entry.package_name})" if entry else "(maplist.csv 未收录)"
+        print(k, "=>", v["mapname"], detail)
     print("--------------------------------")
     start_index = input("请输入起始状态(从0开始): ")
     start_index = int(start_index)
     if RAND_MODE:
+        # 按历史人数选图：启动时统计一次，之后每晚重建，轮换时只读内存里的结果
+        selector = MapSelector()
+        try:
+            selector.refresh()
+        except Exception as e:
+            print(f"[ERROR] 地图人气统计失败，先按均匀随机选图: {e}")
+        schedule_nightly(selector, tm)
+        node_by_state = dict(zip(FSM_MAPS, FSM_Nodes))
+        state_by_map = {v["mapname"]: k for k, v in FSM_MAPS.items()}
+        last_map = None
         while True:
-            random.choice(FSM_Nodes)()
+            mapname = selector.choose(list(state_by_map), exclude=[last_map] if last_map else ())
+            node_by_state[state_by_map[mapname]]()
             server._state_complete.wait()
             server._state_complete.clear()
+            last_map = mapname
             continue
     for func in FSM_Nodes[start_index:]:
         func()
@@ -0,0 +1,419 @@
+"""
+数据库测试脚本
+用于验证建表迁移、玩家昵称记录等功能（使用临时数据库，不会动到 DataBase/ 下的文件）
+"""
+
+import json
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from DB import flightlogDB
+from Discord_bot.bot_commands import PlayerStatsService
+
+
+LEGACY_SCHEMA = """
+CREATE TABLE players (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    steam_id    TEXT NOT NULL UNIQUE,
+    steam_name  TEXT NOT NULL,
+    current_elo_BVR REAL NOT NULL DEFAULT 2000,
+    current_elo_BFM REAL NOT NULL DEFAULT 50,
+    current_elo_PVE REAL NOT NULL DEFAULT 2000,
+    created_at  TEXT DEFAULT (datetime('now')),
+    is_banned   INTEGER NOT NULL DEFAULT 0,
+    is_archived INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE player_names (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    player_id     INTEGER NOT NULL,
+    name          TEXT NOT NULL,
+    first_seen_at TEXT,
+    last_seen_at  TEXT,
+    FOREIGN KEY (player_id) REFERENCES players(id)
+);
+"""
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+def make_temp_db_path() -> Path:
+    """返回一个临时目录下的数据库路径"""
+    return Path(tempfile.mkdtemp()) / "flightlogDB.sqlite"
+
+
+def make_legacy_db() -> Path:
+    """创建旧版（player_names 存 JSON 数组）的数据库"""
+    db_path = make_temp_db_path()
+    conn = sqlite3.connect(db_path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.execute(
+        "INSERT INTO players (steam_id, steam_name, created_at) VALUES ('1', 'Alpha', '2025-11-01 10:00:00')"
+    )
+    conn.execute(
+        "INSERT INTO players (steam_id, steam_name, created_at) VALUES ('2', 'Bravo', '2025-11-02 10:00:00')"
+    )
+    conn.execute(
+        "INSERT INTO player_names (player_id, name) VALUES (1, ?)",
+        (json.dumps(["Tobiichi", "Tobi", "Tobiichi"]),)
+    )
+    conn.execute(
+        "INSERT INTO player_names (player_id, name) VALUES (2, ?)",
+        (json.dumps(["Crimson"]),)
+    )
+    conn.commit()
+    conn.close()
+    return db_path
+
+
+def make_kill_event(killer: tuple, victim: tuple, weapon: str, when: str, delta: float, map_type: str = "BVR") -> dict:
+    """构造一条和 ezServer 里格式一致的击杀事件，killer/victim = (steam_id, name)"""
+    return {
+        "event_type": f"{map_type}_KILL",
+        "datetime": when,
+        "killer_id": killer[0],
+        "killer_name": killer[1],
+        "killer_aircraft": "",
+        "victim_id": victim[0],
+        "victim_name": victim[1],
+        "victim_aircraft": "F-45A",
+        "weapon": weapon,
+        "elo_delta": delta,
+    }
+
+
+def save_match(db: flightlogDB, events: list, played_at: str, map_type: str = "BVR") -> bool:
+    """保存一局比赛"""
+    replay_info = {
+        "file_name": f"test_{played_at}.zip",
+        "map_name": "BVR Test",
+        "played_at": played_at,
+        "meta_blob": b"",
+        "map_type": map_type,
+    }
+    return db.save_global_event_history(events, replay_info, [])
+
+
+def read_player_stats(db: flightlogDB) -> tuple:
+    conn = db.get_conn()
+    stats = conn.execute("SELECT * FROM player_stats ORDER BY player_id, map_type").fetchall()
+    weapons = conn.execute("SELECT * FROM player_weapon_stats ORDER BY player_id, map_type, weapon").fetchall()
+    conn.close()
+    return stats, weapons
+
+
+def test_player_names_migration():
+    """测试旧 JSON 昵称数组迁移为每个昵称一行"""
+    print_separator("测试 1: player_names 迁移")
+
+    db = flightlogDB(make_legacy_db())
+    conn = db.get_conn()
+    rows = conn.execute(
+        "SELECT player_id, name, name_casefold, first_seen_at, last_seen_at FROM player_names ORDER BY id"
+    ).fetchall()
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.close()
+
+    for row in rows:
+        print(row)
+
+    assert [(r[0], r[1]) for r in rows] == [(1, "Tobiichi"), (1, "Tobi"), (2, "Crimson")]
+    assert rows[0][2] == "tobiichi"
+    assert rows[0][3] == "2025-11-01 10:00:00"
+    assert version >= 1
+
+    # 再次初始化不应重复迁移
+    db.init_db()
+    conn = db.get_conn()
+    assert conn.execute("SELECT COUNT(*) FROM player_names").fetchone()[0] == 3
+    conn.close()
+    print("✓ 迁移完成且可重复执行")
+
+
+def test_player_join_upsert_alias():
+    """测试玩家加入时昵称 upsert 并更新 last_seen_at"""
+    print_separator("测试 2: 玩家昵称 upsert")
+
+    db = flightlogDB(make_temp_db_path())
+    first = db.player_join("42", "SteamName", "Pilot")
+    conn = db.get_conn()
+    conn.execute("UPDATE player_names SET last_seen_at = '2000-01-01 00:00:00'")
+    conn.commit()
+    conn.close()
+
+    again = db.player_join("42", "SteamName", "Pilot")
+    renamed = db.player_join("42", "SteamName", "NewPilot")
+
+    conn = db.get_conn()
+    rows = conn.execute(
+        "SELECT name, last_seen_at FROM player_names WHERE player_id = ? ORDER BY id", (first["id"],)
+    ).fetchall()
+    conn.close()
+
+    print(f"name_history: {renamed['name_history']}")
+    assert first["id"] == again["id"] == renamed["id"]
+    assert renamed["name_history"] == ["Pilot", "NewPilot"]
+    assert len(rows) == 2
+    assert rows[0][1] != "2000-01-01 00:00:00"
+    print("✓ 昵称 upsert 正常")
+
+
+def test_search_players_ranking():
+    """测试昵称搜索排序：完全匹配 > 前缀 > 子串"""
+    print_separator("测试 3: 玩家搜索")
+
+    db = flightlogDB(make_temp_db_path())
+    db.player_join("1", "Steam1", "Grace")
+    db.player_join("2", "Steam2", "ace")
+    db.player_join("3", "Steam3", "Ace Combat")
+    db.player_join("4", "Racer", "Nobody")
+
+    results = db.search_players("ACE", limit=10)
+    for r in results:
+        print(r)
+
+    names = [r["matched_name"] for r in results]
+    assert names[:2] == ["ace", "Ace Combat"]
+    assert set(names[2:]) == {"Grace", "Racer"}
+    assert results[0]["match"] == "exact"
+    assert results[1]["match"] == "prefix"
+    assert db.search_players("ac", limit=10)[0]["matched_name"] in {"ace", "Ace Combat"}
+    assert db.search_players("   ") == []
+    print("✓ 搜索排序正确")
+
+
+def test_player_stats_incremental_matches_rebuild():
+    """测试每局增量更新的 player_stats 和全量重建结果一致"""
+    print_separator("测试 4: player_stats 增量更新")
+
+    db = flightlogDB(make_temp_db_path())
+    a, b, c = ("1", "Alpha"), ("2", "Bravo"), ("3", "Charlie")
+    assert save_match(db, [
+        make_kill_event(a, b, "AIM-120D", "2025-11-20 20:01:00", 1.0),
+        make_kill_event(a, c, "AIM-9", "2025-11-20 20:05:00", 4.0),
+        make_kill_event(b, a, "AIM-120D", "2025-11-20 20:09:00", 1.0),
+    ], "20251120_201000")
+    assert save_match(db, [
+        make_kill_event(c, a, "GAU-8", "2025-11-21 20:01:00", 1.0, "BFM"),
+    ], "20251121_201000", "BFM")
+
+    incremental = read_player_stats(db)
+    for row in incremental[0]:
+        print(row)
+
+    stats = {(row[0], row[1]): row for row in incremental[0]}
+    # player 1 = Alpha：BVR 2杀1死，最高 Elo 2000 + 1 + 4
+    assert stats[(1, "BVR")][2:5] == (2, 1, 1)
+    assert stats[(1, "BVR")][6] == 2005.0
+    assert stats[(1, "BFM")][2:5] == (0, 1, 1)
+
+    db.rebuild_player_stats()
+    assert read_player_stats(db) == incremental
+    print("✓ 增量结果与重建结果一致")
+
+
+def test_elo_rollups():
+    """测试 Elo 按天/按周汇总以及趋势查询的桶选择"""
+    print_separator("测试 5: Elo 汇总")
+
+    db = flightlogDB(make_temp_db_path())
+    a, b = ("1", "Alpha"), ("2", "Bravo")
+    # 2025-11-17 是周一，2025-11-19 是周三
+    assert save_match(db, [
+        make_kill_event(a, b, "AIM-120D", "2025-11-17 20:00:00", 10.0),
+        make_kill_event(b, a, "AIM-120D", "2025-11-17 21:00:00", 4.0),
+    ], "20251117_220000")
+    assert save_match(db, [
+        make_kill_event(a, b, "AIM-9", "2025-11-19 20:00:00", 6.0),
+    ], "20251119_220000")
+
+    days = db.get_elo_trend(1, "BVR", resolution_seconds=24 * 3600)
+    weeks = db.get_elo_trend(1, "BVR", resolution_seconds=30 * 24 * 3600)
+    raw = db.get_elo_trend(1, "BVR", resolution_seconds=60)
+    for row in days + weeks:
+        print(row)
+
+    assert [d["bucket_start"] for d in days] == ["2025-11-17", "2025-11-19"]
+    assert (days[0]["open_elo"], days[0]["close_elo"], days[0]["max_elo"]) == (2000.0, 2006.0, 2010.0)
+    assert (days[0]["kills"], days[0]["deaths"]) == (1, 1)
+    assert len(weeks) == 1
+    assert (weeks[0]["bucket_start"], weeks[0]["open_elo"], weeks[0]["close_elo"]) == ("2025-11-17", 2000.0, 2006.0)
+    assert weeks[0]["kills"] == 2
+    assert len(raw) == 3
+    assert db.pick_elo_bucket(3 * 24 * 3600) == "day"
+    assert db.pick_elo_bucket(3600) is None
+
+    # 起止时间落在桶中间：第一个不完整的周、end 当天的桶都要包含
+    partial = db.get_elo_trend(1, "BVR", start="2025-11-18 12:00:00", end="2025-11-20", resolution_seconds=7 * 24 * 3600)
+    assert [w["bucket_start"] for w in partial] == ["2025-11-17"]
+    partial = db.get_elo_trend(1, "BVR", start="2025-11-18", end="2025-11-19 08:00:00", resolution_seconds=24 * 3600)
+    assert [d["bucket_start"] for d in partial] == ["2025-11-19"]
+    assert db.get_elo_trend(1, "BVR", start="2025-11-18", end="2025-11-19 00:00:00", resolution_seconds=24 * 3600) == []
+
+    before = db.get_elo_trend(1, "BVR", resolution_seconds=24 * 3600)
+    db.rebuild_elo_rollups()
+    assert db.get_elo_trend(1, "BVR", resolution_seconds=24 * 3600) == before
+    print("✓ Elo 汇总正确")
+
+
+def test_update_player_elo_all_or_nothing():
+    """测试 Elo 结算：有一个玩家校验失败时整局都不写入"""
+    print_separator("测试 6: Elo 批量结算")
+
+    db = flightlogDB(make_temp_db_path())
+    db.player_join("1", "Alpha", "Alpha")
+    db.player_join("2", "Bravo", "Bravo")
+    online_players = [
+        {"steam_id": "1", "playername": "Alpha", "in_game_elo": 2000.0, "ingame_elo_history": [4.0, 1.0]},
+        {"steam_id": "2", "playername": "Bravo", "in_game_elo": 1990.0, "ingame_elo_history": [-4.0]},
+    ]
+
+    result = db.update_player_elo(online_players, "BVR")
+    print(result)
+    assert result["success"] is False
+    assert [p["status"] for p in result["players"]] == ["updated", "mismatch"]
+
+    conn = db.get_conn()
+    assert conn.execute("SELECT current_elo_BVR FROM players ORDER BY id").fetchall() == [(2000.0,), (2000.0,)]
+    conn.close()
+
+    online_players[1]["in_game_elo"] = 2000
+    result = db.update_player_elo(online_players, "BVR")
+    print(result)
+    assert result["success"] is True
+    assert [p["new_elo"] for p in result["players"]] == [2005.0, 1996.0]
+
+    conn = db.get_conn()
+    assert conn.execute("SELECT current_elo_BVR FROM players ORDER BY id").fetchall() == [(2005.0,), (1996.0,)]
+    conn.close()
+    print("✓ Elo 结算是原子的")
+
+
+def test_player_profile():
+    """测试 /stats 资料一次取齐，details 按需解析"""
+    print_separator("测试 7: 玩家资料查询")
+
+    db_path = make_temp_db_path()
+    db = flightlogDB(db_path)
+    a, b = ("1", "Alpha"), ("2", "Bravo")
+    assert save_match(db, [
+        make_kill_event(a, b, "AIM-120D", "2025-11-20 20:01:00", 3.0),
+        make_kill_event(b, a, "AIM-9", "2025-11-20 20:05:00", 2.0),
+    ], "20251120_201000")
+
+    service = PlayerStatsService(db_path)
+    profile = service.find_player_profile(name="alpha", limit=10)
+    events = profile["events"]
+    print(profile["player"])
+
+    assert profile["player"]["steam_id"] == "1"
+    assert profile["player"]["name_history"] == ["Alpha"]
+    assert [(e["role"], e["weapon"]) for e in events] == [("victim", "AIM-9"), ("killer", "AIM-120D")]
+    assert len(profile["elo_history"]) == 2
+    assert "details" not in events[0]
+    assert events[0].get("details")["killer_id"] == "2"
+    assert service.find_player_profile(steam_id="2")["player"]["steam_name"] == "Bravo"
+    assert service.find_player_profile(steam_id="404") is None
+    print("✓ 资料查询正确")
+
+
+def test_generation_counter():
+    """测试写入比赛数据 / 新玩家或新昵称加入时 generation 递增，老玩家重新进服不变"""
+    print_separator("测试 8: 数据代数")
+
+    db = flightlogDB(make_temp_db_path())
+    start = db.get_generation()
+    db.player_join("1", "Alpha", "Alpha")
+    assert db.get_generation() == start + 1
+    db.player_join("1", "Alpha", "Alpha")
+    assert db.get_generation() == start + 1
+    db.player_join("1", "Alpha", "Alpha2")
+    assert db.get_generation() == start + 2
+    assert save_match(db, [
+        make_kill_event(("1", "Alpha"), ("2", "Bravo"), "AIM-120D", "2025-11-20 20:01:00", 3.0),
+    ], "20251120_201000")
+    assert db.get_generation() == start + 3
+    print(f"generation: {start} -> {db.get_generation()}")
+    print("✓ generation 递增正确")
+
+
+def test_replay_map_type_backfill():
+    """测试 replays.map_type：新比赛直接写入，旧数据由迁移按事件类型回填"""
+    print_separator("测试 9: replays.map_type 回填")
+
+    db_path = make_temp_db_path()
+    db = flightlogDB(db_path)
+    a, b = ("1", "Alpha"), ("2", "Bravo")
+    assert save_match(db, [make_kill_event(a, b, "AIM-120D", "2025-11-20 20:01:00", 1.0)], "20251120_201000")
+    assert save_match(db, [make_kill_event(b, a, "GAU-8", "2025-11-21 20:01:00", 1.0, "BFM")], "20251121_201000", "BFM")
+
+    conn = db.get_conn()
+    assert conn.execute("SELECT map_type FROM replays ORDER BY id").fetchall() == [("BVR",), ("BFM",)]
+    # 模拟迁移之前的旧数据
+    conn.execute("UPDATE replays SET map_type = NULL")
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    conn.close()
+
+    db = flightlogDB(db_path)
+    conn = db.get_conn()
+    rows = conn.execute("SELECT map_type FROM replays ORDER BY id").fetchall()
+    conn.close()
+    print(rows)
+    assert rows == [("BVR",), ("BFM",)]
+    print("✓ map_type 回填正确")
+
+
+def test_played_at_epoch_backfill():
+    """测试 replays.played_at_epoch：新比赛直接写入，旧数据由迁移解析 played_at 回填"""
+    print_separator("测试 10: played_at_epoch 回填")
+
+    db_path = make_temp_db_path()
+    db = flightlogDB(db_path)
+    a, b = ("1", "Alpha"), ("2", "Bravo")
+    assert save_match(db, [make_kill_event(a, b, "AIM-120D", "2025-11-20 20:01:00", 1.0)], "20251120_201000")
+    assert save_match(db, [make_kill_event(b, a, "AIM-120D", "2025-11-21 20:01:00", 1.0)], "2025-11-21T08:00:00")
+    assert save_match(db, [make_kill_event(b, a, "AIM-120D", "2025-11-22 20:01:00", 1.0)], "garbage")
+
+    conn = db.get_conn()
+    expected = conn.execute("SELECT played_at_epoch FROM replays ORDER BY id").fetchall()
+    assert expected == [(1763669400,), (1763712000,), (None,)]
+    conn.execute("UPDATE replays SET played_at_epoch = NULL")
+    conn.execute("PRAGMA user_version = 4")
+    conn.commit()
+    conn.close()
+
+    db = flightlogDB(db_path)
+    conn = db.get_conn()
+    rows = conn.execute("SELECT played_at_epoch FROM replays ORDER BY id").fetchall()
+    conn.close()
+    print(rows)
+    assert rows == expected
+    print("✓ played_at_epoch 回填正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("数据库测试套件")
+    test_player_names_migration()
+    test_player_join_upsert_alias()
+    test_search_players_ranking()
+    test_player_stats_incremental_matches_rebuild()
+    test_elo_rollups()
+    test_update_player_elo_all_or_nothing()
+    test_player_profile()
+    test_generation_counter()
+    test_replay_map_type_backfill()
+    test_played_at_epoch_backfill()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+地图目录测试脚本
+验证 maplist.csv 的读取和索引、前缀搜索、用户输入解析和 FSM_MAPS 校验
+"""
+
+import tempfile
+from pathlib import Path
+
+from MapCatalog import MapCatalog, MapEntry, get_catalog
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+SAMPLE_CSV = "\ufeff" + """package_name,package_id,wsid,map_name,map_id
+Headless Server,Headless Server,2860956181,BVR Ethi5,BVR Ethi5
+Headless Server,Headless Server,2860956181,BVR Archipel,BVR Archipel
+Headless Server,Headless Server,2860956181,BVR Crack,BVR Crack
+Training/Fighting Arena ,Pilot training camp,3355613749,"1vs1 Merge Dogfight Arena(Guns Only)",MergeLarge
+8v8 BVR PACK,MP TEST,3583755382,Dragon's Valley,Dragon's Valley
+Other Pack,Other,3468735890,BVR Ethi5,BVR Ethi5
+Coop/Freeflight,quickMPFlights,Coop/Freeflight,"F/A-26B Naval Strike Mission, Night",mp_navalMission
+Headless Server,Headless Server,2860956181,BVR Crack,BVR Crack
+"""
+
+
+def make_catalog() -> MapCatalog:
+    """用示例 CSV（带 BOM、引号里的逗号、重复行）构造目录"""
+    path = Path(tempfile.mkdtemp()) / "maplist.csv"
+    path.write_text(SAMPLE_CSV, encoding="utf-8")
+    return MapCatalog.load(path)
+
+
+def test_load_and_index():
+    """测试读取（BOM / 引号 / 重复行）和各个索引"""
+    print_separator("测试 1: 读取 / 索引")
+
+    catalog = make_catalog()
+    print(f"{len(catalog)} 张地图")
+    assert len(catalog) == 7  # 重复的 BVR Crack 只保留一条
+
+    entry = catalog.get("3355613749", "MergeLarge")
+    assert entry.map_name == "1vs1 Merge Dogfight Arena(Guns Only)"
+    assert entry.package_name == "Training/Fighting Arena"
+    assert entry.key == "3355613749:MergeLarge"
+    assert entry.workshop_url.endswith("id=3355613749")
+    assert catalog.get("Coop/Freeflight", "mp_navalMission").workshop_url is None
+    assert catalog.get("Coop/Freeflight", "mp_navalMission").map_name == "F/A-26B Naval Strike Mission, Night"
+
+    assert [e.map_id for e in catalog.by_wsid("2860956181")] == ["BVR Ethi5", "BVR Archipel", "BVR Crack"]
+    assert [e.wsid for e in catalog.by_map_id("BVR Ethi5")] == ["2860956181", "3468735890"]
+    assert [e.map_id for e in catalog.by_name("dragon's VALLEY ")] == ["Dragon's Valley"]
+    # 条目不可修改且没有 __dict__
+    assert not hasattr(entry, "__dict__")
+    print("✓ 索引正确")
+
+
+def test_search_and_find():
+    """测试前缀搜索、包含搜索和用户输入解析"""
+    print_separator("测试 2: 搜索 / 解析")
+
+    catalog = make_catalog()
+    prefix = [e.key for e in catalog.search_prefix("bvr")]
+    print(f"prefix bvr -> {prefix}")
+    assert prefix == ["2860956181:BVR Archipel", "2860956181:BVR Crack", "2860956181:BVR Ethi5", "3468735890:BVR Ethi5"]
+    assert len(catalog.search_prefix("bvr", limit=2)) == 2
+    # 地图ID也能前缀匹配，同一张地图只出现一次
+    assert [e.key for e in catalog.search_prefix("merge")] == ["3355613749:MergeLarge"]
+    assert [e.key for e in catalog.search_prefix("1vs1")] == ["3355613749:MergeLarge"]
+    assert catalog.search_prefix("zzz") == []
+
+    # 前缀匹配在前，包含匹配补在后面
+    assert [e.key for e in catalog.search("dog")] == ["3355613749:MergeLarge"]
+    assert [e.key for e in catalog.search("valley")] == ["3583755382:Dragon's Valley"]
+
+    assert catalog.find("3468735890:BVR Ethi5").wsid == "3468735890"
+    assert catalog.find("MergeLarge").wsid == "3355613749"
+    assert catalog.find("bvr archipel").map_id == "BVR Archipel"
+    assert catalog.find("Nowhere") is None
+    print("✓ 搜索和解析正确")
+
+
+def test_validate_rotation():
+    """测试 FSM_MAPS 校验：拼错的地图、放错创意工坊条目的地图和 map_type 是错误，未收录的创意工坊条目只是警告"""
+    print_separator("测试 3: 轮换配置校验")
+
+    catalog = make_catalog()
+    rotation = {
+        "state1": {"campaign_id": "2860956181", "mapname": "BVR Ethi5", "map_type": "BVR"},
+        "state2": {"campaign_id": "3355613749", "mapname": "MergeLarge", "map_type": "BFM"},
+        "state3": {"campaign_id": "2860956181", "mapname": "BVR Archipell", "map_type": "BVR"},
+        "state4": {"campaign_id": "2860956181", "mapname": "Dragon's Valley", "map_type": "BVR"},
+        "state5": {"campaign_id": "1234", "mapname": "Fjord Coast", "map_type": "BVR"},
+        "state6": {"campaign_id": "2860956181", "mapname": "BVR Crack", "map_type": "XYZ"},
+    }
+    errors, warnings = catalog.validate_rotation(rotation, ["BVR", "BFM", "PVE"])
+    for error in errors:
+        print("错误:", error)
+    for warning in warnings:
+        print("警告:", warning)
+    assert len(errors) == 3
+    assert errors[0].startswith("state3") and "是不是 BVR Archipel /" in errors[0]
+    assert errors[1].startswith("state4") and "3583755382" in errors[1]
+    assert errors[2].startswith("state6") and "map_type" in errors[2]
+    # 未收录的创意工坊条目（例如刚发布的地图）不阻止启动
+    assert len(warnings) == 1
+    assert warnings[0].startswith("state5") and "不在 maplist.csv 中" in warnings[0]
+    # 未收录的条目 map_type 错了仍然是错误
+    bad_type = dict(rotation["state5"], map_type="XYZ")
+    assert len(catalog.validate_rotation({"s": bad_type}, ["BVR"])[0]) == 1
+    assert catalog.validate_rotation({"s": rotation["state1"]}) == ([], [])
+    print("✓ 校验正确")
+
+
+def test_shipped_maplist():
+    """测试仓库里的 maplist.csv 能读取且只读一次"""
+    print_separator("测试 4: maplist.csv")
+
+    catalog = get_catalog()
+    print(f"{len(catalog)} 张地图")
+    assert len(catalog) > 500
+    assert get_catalog() is catalog
+    assert isinstance(catalog.get("2860956181", "BVR Ethi5"), MapEntry)
+    assert catalog.get("3583755382", "Fjord Coast") is not None
+    print("✓ maplist.csv 正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("地图目录测试套件")
+    test_load_and_index()
+    test_search_and_find()
+    test_validate_rotation()
+    test_shipped_maplist()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+按历史人数选图测试脚本
+验证 map_population_stats 的统计（人数 / 留存 / 时段）、UCB 选图和每晚重建的定时预约
+"""
+
+import random
+import sqlite3
+import tempfile
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from DB import flightlogDB, played_at_to_epoch
+from MapSelector import ALL_HOURS, MapPopulation, MapSelector, hour_of_week, schedule_nightly, seconds_until
+from Discord_bot.test_match_publisher import kill
+
+
+def print_separator(title=""):
+    """打印分隔线"""
+    print("\n" + "="*70)
+    if title:
+        print(f"  {title}")
+        print("="*70)
+    print()
+
+
+A, B, C, D = ("1", "Alpha"), ("2", "Bravo"), ("3", "Charlie"), ("4", "Delta")
+NOW = played_at_to_epoch("20251201_000000")
+MONDAY_2030 = played_at_to_epoch("20251124_203000")
+
+
+def save_match(db: flightlogDB, map_name: str, played_at: str, events: list):
+    replay_info = {
+        "file_name": f"{map_name}_{played_at}.zip",
+        "map_name": map_name,
+        "played_at": played_at,
+        "meta_blob": b"",
+        "map_type": "BVR",
+    }
+    assert db.save_global_event_history(events, replay_info, [])
+
+
+def make_db() -> Path:
+    """
+    两周的周一晚上：
+    第1周 20:10 Busy(ABCD) -> 21:10 Quiet(AB) -> 之后没人
+    第2周 20:10 Busy(ABCD) -> 21:10 Busy(ABCD) -> 之后没人
+    另有一局刚结束的 Quiet（还不知道下一局的情况，不参与统计）
+    """
+    db_path = Path(tempfile.mkdtemp()) / "map_selector_test.sqlite"
+    db = flightlogDB(db_path)
+    four = [kill(A, B, "AIM-120D", 5.0), kill(C, D, "AIM-120C", 5.0)]
+    two = [kill(A, B, "AIM-120D", 5.0)]
+    save_match(db, "Busy", "20251117_201000", four)
+    save_match(db, "Quiet", "20251117_211000", two)
+    save_match(db, "Busy", "20251124_201000", four)
+    save_match(db, "Busy", "20251124_211000", four)
+    save_match(db, "Quiet", "20251130_231000", [kill(A, C, "AIM-9X", 3.0)])
+    return db_path
+
+
+def test_hour_of_week():
+    """测试一周中的小时（UTC，周一 0 点起算）"""
+    print_separator("测试 1: 时段")
+
+    assert hour_of_week(played_at_to_epoch("20251117_000000")) == 0  # 周一
+    assert hour_of_week(played_at_to_epoch("20251117_201000")) == 20
+    assert hour_of_week(played_at_to_epoch("20251123_235959")) == 167  # 周日
+    print("✓ 时段正确")
+
+
+def test_population_stats():
+    """测试按地图和时段统计平均人数和留存率"""
+    print_separator("测试 2: 人气统计")
+
+    selector = MapSelector(make_db())
+    rows = selector.refresh(now=NOW)
+    stats = selector._stats
+    for key, value in sorted(stats.items()):
+        print(key, value)
+
+    assert rows == 5
+    busy_20 = stats[("Busy", 20)]
+    # 第1周一半人留到 Quiet，第2周全员留下
+    assert busy_20.matches == 2 and busy_20.avg_players == 4 and busy_20.retention == 0.75
+    assert stats[("Busy", 21)].retention == 0.0  # 之后没有下一局：大厅空了
+    assert stats[("Busy", ALL_HOURS)].matches == 3 and abs(stats[("Busy", ALL_HOURS)].retention - 0.5) < 1e-9
+    # 刚结束的那局 Quiet 不参与统计
+    assert stats[("Quiet", ALL_HOURS)].matches == 1 and stats[("Quiet", ALL_HOURS)].avg_players == 2
+    assert selector.computed_at == NOW
+
+    # 新的选择器直接载入表里的结果，不重新统计
+    loaded = MapSelector(selector.db_path)
+    loaded.load()
+    assert loaded._stats == stats
+    print("✓ 统计正确")
+
+
+def test_choose():
+    """测试选图：人多的地图优先，没玩过的地图靠探索加成得到机会，排除刚玩过的地图"""
+    print_separator("测试 3: 选图")
+
+    selector = MapSelector(make_db(), exploration=0.0, temperature=0.0, rng=random.Random(1))
+    selector.refresh(now=NOW)
+    scores = selector.scores(["Busy", "Quiet", "New"], now=MONDAY_2030)
+    for name, (value, bonus) in scores.items():
+        print(f"{name}: 预期 {value:.2f} 加成 {bonus:.2f}")
+
+    assert scores["Busy"][0] > scores["New"][0] > scores["Quiet"][0]
+    assert selector.choose(["Busy", "Quiet", "New"], now=MONDAY_2030) == "Busy"
+    assert selector.choose(["Busy", "Quiet"], now=MONDAY_2030, exclude=["Busy"]) == "Quiet"
+    assert selector.choose(["Busy"], now=MONDAY_2030, exclude=["Busy"]) == "Busy"
+
+    # 探索系数大时，从没在这个时段玩过的地图会被尝试
+    selector.exploration = 3.0
+    assert selector.choose(["Busy", "Quiet", "New"], now=MONDAY_2030) in ("Quiet", "New")
+
+    # 没有任何统计时退化成均匀随机
+    empty = MapSelector(selector.db_path, rng=random.Random(0))
+    picks = {empty.choose(["x", "y", "z"], now=MONDAY_2030) for _ in range(50)}
+    assert picks == {"x", "y", "z"}
+    print("✓ 选图正确")
+
+
+def test_rotation_spread():
+    """测试统计不变时连续选图不会只在得分最高的两张地图之间来回切换"""
+    print_separator("测试 4: 连续选图")
+
+    selector = MapSelector(":memory:", rng=random.Random(0))
+    hour = hour_of_week(MONDAY_2030)
+    maps = ["Ethi5", "MergeLarge", "Archipel", "Ocixem", "Crack", "Hills", "Dragon", "Fjord"]
+    for name, players in zip(maps, [8, 7.5, 5, 4, 3.5, 3, 2.5, 2]):
+        selector._stats[(name, hour)] = MapPopulation(6, players, 0.6)
+        selector._stats[(name, ALL_HOURS)] = MapPopulation(60, players, 0.6)
+
+    picks = []
+    for _ in range(24):
+        picks.append(selector.choose(maps, now=MONDAY_2030, exclude=picks[-1:]))
+    counts = Counter(picks)
+    print(counts)
+    assert len(counts) > 2
+    assert all(a != b for a, b in zip(picks, picks[1:]))
+    # 人多的地图仍然选得更多
+    assert counts["Ethi5"] + counts["MergeLarge"] > counts["Dragon"] + counts["Fjord"]
+    assert sum(selector._picks.values()) == 24
+
+    # 重新载入统计后选中次数清零
+    selector._stats = {}
+    selector.load(sqlite3.connect(make_db()))
+    assert not selector._picks
+    print("✓ 连续选图正确")
+
+
+class FakeTimerManager:
+    def __init__(self):
+        self.timers = {}
+
+    def start_timer(self, name, interval_ms, callback, single_shot=False):
+        self.timers[name] = (interval_ms, callback, single_shot)
+
+
+def test_nightly_schedule():
+    """测试每晚重建的定时预约：执行后重新预约下一天"""
+    print_separator("测试 5: 每晚重建")
+
+    assert seconds_until(4, datetime(2025, 11, 24, 3, 30)) == 30 * 60
+    assert seconds_until(4, datetime(2025, 11, 24, 4, 0)) == 24 * 3600
+
+    selector = MapSelector(make_db())
+    timers = FakeTimerManager()
+    schedule_nightly(selector, timers, hour=4)
+    interval_ms, callback, single_shot = timers.timers["map_population_stats"]
+    assert single_shot and 0 < interval_ms <= 24 * 3600 * 1000
+
+    timers.timers.clear()
+    callback()
+    assert "map_population_stats" in timers.timers
+    assert selector.computed_at is not None
+    print("✓ 定时预约正确")
+
+
+def main():
+    """运行所有测试"""
+    print_separator("按历史人数选图测试套件")
+    test_hour_of_week()
+    test_population_stats()
+    test_choose()
+    test_rotation_spread()
+    test_nightly_schedule()
+    print_separator("测试完成")
+
+
+if __name__ == "__main__":
+    main()